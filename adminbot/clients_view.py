@@ -26,6 +26,7 @@ from telegram.ext import (
     filters,
 )
 
+from booking.availability_cache import cached_available_slots, invalidate as invalidate_slot_cache
 from repositories.client_repository import (
     count_clients,
     get_client,
@@ -35,6 +36,7 @@ from repositories.client_repository import (
     update_client_fields,
 )
 from repositories.client_link_repository import link_user_to_client, get_link_by_client
+from repositories.activity_analytics_repository import get_client_ftp_estimate
 from repositories.vk_client_link_repository import get_link_by_client as get_vk_link_by_client
 from repositories.link_requests_repository import get_link_request, delete_link_request
 from repositories.admin_repository import (
@@ -67,7 +69,6 @@ from repositories.schedule_repository import (
     book_available_reservation,
     get_reservation,
     get_slot_with_reservations,
-    list_available_slots,
     list_future_reservations_for_client,
     update_reservation,
 )
@@ -81,8 +82,8 @@ from repositories.layout_repository import (
 from wattattack_activities import WattAttackClient
 from wattattack_profiles import apply_client_profile as apply_wattattack_profile
 from wattattack_workouts import (
+    analyze_workout,
     build_workout_payload,
-    calculate_workout_metrics,
     parse_zwo_workout,
     zwo_to_chart_data,
 )
@@ -127,6 +128,10 @@ WEEKDAY_SHORT = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
 BOOKING_DAY_LIMIT = max(1, int(os.environ.get("ADMINBOT_BOOKING_DAY_LIMIT", "7")))
 BOOKING_REASSIGN_LIMIT = max(3, int(os.environ.get("ADMINBOT_REASSIGN_OPTIONS", "12")))
 CLIENT_BOOKINGS_LIMIT = max(5, int(os.environ.get("ADMINBOT_CLIENT_BOOKINGS_LIMIT", "10")))
+FTP_ESTIMATE_METHODS = {
+    "20min": "95% лучших 20 мин",
+    "cp": "модель CP",
+}
 _CLIENT_BOT = None
 _CLIENT_BOT_WARNED = False
 START_MESSAGE = (
@@ -818,6 +823,7 @@ async def cancel_client_reservation(
         LOGGER.exception("Failed to cancel reservation %s", reservation_id)
         await query.edit_message_text(f"❌ Не удалось отменить бронь: {exc}")
         return
+    invalidate_slot_cache()
 
     notice = f"Бронь на {summary} отменена."
     await show_client_bookings(query, context, client_id, notice=notice)
@@ -1558,7 +1564,7 @@ async def upload_workout_to_account(
         except Exception as exc:  # noqa: BLE001
             LOGGER.warning("Failed to fetch FTP for %s: %s", account_id, exc)
 
-        metrics = calculate_workout_metrics(workout, ftp)
+        metrics = analyze_workout(workout).metrics(ftp)
         payload = build_workout_payload(workout, chart_data, metrics)
         return client.upload_workout(payload, timeout=DEFAULT_TIMEOUT)
 
@@ -2384,10 +2390,38 @@ def format_client_summary(client_record: Dict[str, Any]) -> str:
             lines.append(f"⚡ FTP: {int(float(ftp))} Вт")
         except (TypeError, ValueError):
             pass
+    suggested_ftp = client_record.get("suggested_ftp")
+    if suggested_ftp:
+        method = FTP_ESTIMATE_METHODS.get(client_record.get("suggested_ftp_method"), "по заездам")
+        lines.append(f"💡 FTP по заездам: {int(suggested_ftp)} Вт ({method})")
     if client_record.get("goal"):
         lines.append(f"🎯 Цель: {client_record['goal']}")
     return "\n".join(lines)
 
+
+def _with_ftp_estimate(client_record: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    if not client_record or not client_record.get("id"):
+        return client_record
+    try:
+        estimate = get_client_ftp_estimate(int(client_record["id"]))
+    except Exception:  # noqa: BLE001
+        LOGGER.warning("Failed to load FTP estimate for client %s", client_record.get("id"))
+        return client_record
+    if not estimate:
+        return client_record
+    return {
+        **client_record,
+        "suggested_ftp": estimate.get("estimated_ftp"),
+        "suggested_ftp_method": estimate.get("method"),
+    }
+
+
+def get_client_card(client_id: int) -> Optional[Dict[str, Any]]:
+    """Client record with the FTP suggested from rides, for the client card."""
+
+    return _with_ftp_estimate(get_client(client_id))
+
+
 def format_client_button_label(client_record: Dict[str, Any]) -> str:
     first_name = client_record.get("first_name") or ""
     last_name = client_record.get("last_name") or ""
@@ -2735,7 +2769,7 @@ async def render_client_favorite_bike_picker(
     page: int = 0,
 ) -> None:
     try:
-        record = await asyncio.to_thread(get_client, client_id)
+        record = await asyncio.to_thread(get_client_card, client_id)
     except Exception as exc:  # noqa: BLE001
         LOGGER.exception("Failed to load client %s", client_id)
         await context.bot.edit_message_text(
@@ -2942,7 +2976,7 @@ async def render_client_gender_picker(
     client_id: int,
 ) -> None:
     try:
-        record = await asyncio.to_thread(get_client, client_id)
+        record = await asyncio.to_thread(get_client_card, client_id)
     except Exception as exc:  # noqa: BLE001
         LOGGER.exception("Failed to load client %s", client_id)
         await context.bot.edit_message_text(
@@ -2997,7 +3031,7 @@ async def render_client_pedals_picker(
     client_id: int,
 ) -> None:
     try:
-        record = await asyncio.to_thread(get_client, client_id)
+        record = await asyncio.to_thread(get_client_card, client_id)
     except Exception as exc:  # noqa: BLE001
         LOGGER.exception("Failed to load client %s", client_id)
         await context.bot.edit_message_text(
@@ -3360,7 +3394,7 @@ async def render_client_info_message(
     reply_markup: Optional[InlineKeyboardMarkup] = None,
 ) -> None:
     try:
-        record = await asyncio.to_thread(get_client, client_id)
+        record = await asyncio.to_thread(get_client_card, client_id)
     except Exception as exc:  # noqa: BLE001
         LOGGER.exception("Failed to load client %s", client_id)
         await context.bot.edit_message_text(
@@ -3447,7 +3481,7 @@ async def show_client_booking_days(
 
     try:
         slots_raw = await asyncio.to_thread(
-            list_available_slots,
+            cached_available_slots,
             _to_local_naive(search_start),
             _to_local_naive(search_end),
             BOOKING_SLOTS_LIMIT,
@@ -3542,7 +3576,7 @@ async def show_client_booking_slots(
 
     try:
         slots_raw = await asyncio.to_thread(
-            list_available_slots,
+            cached_available_slots,
             _to_local_naive(start_dt_local),
             _to_local_naive(end_dt_local),
             BOOKING_SLOTS_LIMIT,
@@ -3701,6 +3735,7 @@ async def book_client_on_slot(
     except Exception as exc:  # noqa: BLE001
         LOGGER.exception("Booking attempt failed for reservation %s", reservation.get("id"))
         booked = None
+    invalidate_slot_cache()
 
     slot_date = _parse_date_value(slot_details.get("slot_date"))
     date_token = slot_date.isoformat() if slot_date else None
@@ -4069,6 +4104,7 @@ async def set_client_reservation_stand(
         )
     except Exception as exc:  # noqa: BLE001
         LOGGER.warning("Failed to release old reservation %s: %s", reservation_id, exc)
+    invalidate_slot_cache()
 
     if target_stand:
         stand_label = _format_stand_label_for_booking(target_stand, booked)
@@ -4179,7 +4215,7 @@ async def start_client_edit(
         return
 
     try:
-        record = await asyncio.to_thread(get_client, client_id)
+        record = await asyncio.to_thread(get_client_card, client_id)
     except Exception as exc:  # noqa: BLE001
         LOGGER.exception("Failed to load client %s", client_id)
         await query.edit_message_text(f"❌ Ошибка получения данных клиента: {exc}")
@@ -4980,7 +5016,7 @@ async def process_client_search(message: Message, term: str) -> None:
         return
 
     if len(results) == 1:
-        record = results[0]
+        record = await asyncio.to_thread(_with_ftp_estimate, results[0])
         bike_suggestions, height_cm, trainer_inventory = await get_bike_suggestions_for_client(record)
         trainer_map = (
             _build_trainer_suggestions(bike_suggestions, trainer_inventory)
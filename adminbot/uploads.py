@@ -27,9 +27,11 @@ from scripts.import_schedule_from_xlsx import (
     run_schedule_import_from_bytes,
     format_import_report as format_schedule_import_report,
 )
+from wattattack_profiles import fetch_account_ftp
 from wattattack_workouts import (
+    WorkoutAnalysis,
+    analyze_workout,
     build_workout_payload,
-    calculate_workout_metrics,
     parse_zwo_workout,
     zwo_to_chart_data,
 )
@@ -422,7 +424,7 @@ async def process_workout_bytes(
     account_ids: List[str],
     reply_func: Callable[[str], Awaitable[Any]],
 ) -> Tuple[bool, str]:
-    def worker() -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    def worker() -> Tuple[Optional[Tuple[Dict[str, Any], List[Dict[str, Any]], WorkoutAnalysis]], Optional[str]]:
         xml_text: str
         if isinstance(raw_bytes, bytes):
             try:
@@ -438,25 +440,22 @@ async def process_workout_bytes(
             return None, "⚠️ Не удалось разобрать ZWO файл."
 
         chart_data = zwo_to_chart_data(workout)
-        ftp = workout.get("ftp")
-        if ftp is None:
-            ftp = None
-        metrics = calculate_workout_metrics(workout, ftp)
-        payload = build_workout_payload(workout, chart_data, metrics)
-        return payload, None
-
-    payload, error = await asyncio.to_thread(worker)
+        # Analysed once; every account only scales it to its own FTP.
+        return (workout, chart_data, analyze_workout(workout)), None
+
+    prepared, error = await asyncio.to_thread(worker)
     if error:
         await reply_func(error)
         return False, "parse-error"
-    if not payload:
+    if not prepared:
         await reply_func("⚠️ Не удалось обработать файл.")
         return False, "parse-error"
+    workout, chart_data, analysis = prepared
 
     results: List[str] = []
     success_any = False
     for account_id in account_ids:
-        ok, message = await upload_workout_for_account(account_id, payload)
+        ok, message = await upload_workout_for_account(account_id, workout, chart_data, analysis)
         success_any = success_any or ok
         status = "✅" if ok else "⚠️"
         results.append(f"{status} {account_id}: {message}")
@@ -465,7 +464,12 @@ async def process_workout_bytes(
     return success_any, "\n".join(results)
 
 
-async def upload_workout_for_account(account_id: str, payload: Dict[str, Any]) -> Tuple[bool, str]:
+async def upload_workout_for_account(
+    account_id: str,
+    workout: Dict[str, Any],
+    chart_data: List[Dict[str, Any]],
+    analysis: Optional[WorkoutAnalysis] = None,
+) -> Tuple[bool, str]:
     from wattattack_activities import WattAttackClient  # local import to avoid cycles
 
     account = _account_registry.get(account_id)
@@ -477,6 +481,8 @@ async def upload_workout_for_account(account_id: str, payload: Dict[str, Any]) -
         try:
             client = WattAttackClient()
             client.login(account.email, account.password, timeout=_default_timeout)
+            metrics = (analysis or analyze_workout(workout)).metrics(fetch_account_ftp(client, timeout=_default_timeout))
+            payload = build_workout_payload(workout, chart_data, metrics)
             response = client.upload_workout(payload, timeout=_default_timeout)
             if isinstance(response, dict):
                 message = response.get("message") or "Загружено"
@@ -44,6 +44,8 @@ WIZARD_SEATING_ENABLED = str(os.environ.get("ADMINBOT_WIZARD_SEATING_ENABLED", "
     "yes",
     "on",
 }
+WIZARD_APPLY_CONCURRENCY = max(1, int(os.environ.get("ADMINBOT_WIZARD_APPLY_CONCURRENCY", "6")))
+WIZARD_PROGRESS_INTERVAL_SECONDS = float(os.environ.get("ADMINBOT_WIZARD_PROGRESS_INTERVAL", "1.5"))
 
 PEDAL_CODE_TO_LABEL = {
     "platform": "топталки (под кроссовки)",
@@ -883,6 +885,15 @@ def _swap_reservations_slot_stands(slot_id: int, stand_a: int, stand_b: int) ->
     return str(client_a or ""), ""
 
 
+async def _edit_apply_progress(query, slot: Dict[str, Any], statuses: Mapping[Any, str]) -> None:
+    lines: List[str] = [f"🧙‍♂️ Посадка на {html.escape(_format_slot_summary(slot))}", ""]
+    lines.extend(html.escape(status) for status in statuses.values())
+    try:
+        await query.edit_message_text("\n".join(lines), parse_mode=ParseMode.HTML)
+    except Exception as exc:  # noqa: BLE001
+        LOGGER.debug("Failed to update wizard apply progress: %s", exc)
+
+
 async def _apply_slot_accounts(
     *,
     query,
@@ -926,6 +937,7 @@ async def _apply_slot_accounts(
     successes: List[str] = []
     failures: List[str] = []
     skipped: List[str] = []
+    jobs: List[Tuple[Dict[str, Any], AccountConfig, Dict[str, Any]]] = []
 
     for reservation in reservations:
         reservation_id = reservation.get("id")
@@ -942,9 +954,8 @@ async def _apply_slot_accounts(
             skipped.append(f"{_format_stand_label(reservation, trainers)} — нет клиента")
             continue
 
-        account_id = account.identifier
         already_applied = await asyncio.to_thread(
-            was_account_assignment_done, reservation_id, account_id
+            was_account_assignment_done, reservation_id, account.identifier
         )
         if already_applied:
             skipped.append(
@@ -958,9 +969,35 @@ async def _apply_slot_accounts(
                 f"{account.name}: {_format_stand_label(reservation, trainers)} — клиент не найден"
             )
             continue
+        jobs.append((reservation, account, client_record))
+
+    statuses: Dict[Any, str] = {
+        reservation.get("id"): f"⏳ {account.name}: {_format_client_short(client_record)}"
+        for reservation, account, client_record in jobs
+    }
+    semaphore = asyncio.Semaphore(WIZARD_APPLY_CONCURRENCY)
+    progress_lock = asyncio.Lock()
+    last_progress_at = 0.0
+
+    async def report_progress(force: bool = False) -> None:
+        nonlocal last_progress_at
+        async with progress_lock:
+            loop_now = asyncio.get_running_loop().time()
+            if not force and loop_now - last_progress_at < WIZARD_PROGRESS_INTERVAL_SECONDS:
+                return
+            last_progress_at = loop_now
+            await _edit_apply_progress(query, slot, statuses)
+
+    async def run_job(
+        reservation: Dict[str, Any], account: AccountConfig, client_record: Dict[str, Any]
+    ) -> None:
+        reservation_id = reservation.get("id")
+        client_id = reservation.get("client_id")
+        account_id = account.identifier
+        client_label = _format_client_short(client_record)
 
-        def worker() -> None:
-            apply_wattattack_profile(
+        def worker() -> Dict[str, bool]:
+            result = apply_wattattack_profile(
                 account_id=account_id,
                 account_label=account.name,
                 email=account.email,
@@ -971,26 +1008,40 @@ async def _apply_slot_accounts(
                 default_ftp=default_ftp,
             )
             record_account_assignment(reservation_id, account_id, client_id)
+            return result
 
-        try:
-            await asyncio.to_thread(worker)
-            successes.append(
-                f"{account.name}: {_format_client_short(client_record)} → {_format_stand_label(reservation, trainers)}"
-            )
-        except Exception as exc:  # noqa: BLE001
-            LOGGER.exception(
-                "Failed to apply client %s to account %s for slot %s", client_id, account_id, slot_id
-            )
-            failures.append(f"{account.name}: {_format_client_short(client_record)} — {exc}")
+        async with semaphore:
+            statuses[reservation_id] = f"🔄 {account.name}: {client_label}"
+            await report_progress()
+            try:
+                result = await asyncio.to_thread(worker)
+            except Exception as exc:  # noqa: BLE001
+                LOGGER.exception(
+                    "Failed to apply client %s to account %s for slot %s", client_id, account_id, slot_id
+                )
+                failures.append(f"{account.name}: {client_label} — {exc}")
+                statuses[reservation_id] = f"❌ {account.name}: {client_label}"
+            else:
+                unchanged = not any((result or {}).values())
+                note = " (без изменений)" if unchanged else ""
+                successes.append(
+                    f"{account.name}: {client_label} → {_format_stand_label(reservation, trainers)}{note}"
+                )
+                statuses[reservation_id] = f"✅ {account.name}: {client_label}"
+        await report_progress()
+
+    if jobs:
+        await report_progress(force=True)
+        await asyncio.gather(*(run_job(*job) for job in jobs))
 
     lines: List[str] = [f"🧙‍♂️ Посадка на {html.escape(_format_slot_summary(slot))}"]
     if successes:
         lines.append("✅ Успешно:")
-        lines.extend(html.escape(item) for item in successes)
+        lines.extend(html.escape(item) for item in sorted(successes))
     if failures:
         lines.append("")
         lines.append("❌ Ошибки:")
-        lines.extend(html.escape(item) for item in failures)
+        lines.extend(html.escape(item) for item in sorted(failures))
     if skipped:
         lines.append("")
         lines.append("ℹ️ Пропущено:")
@@ -1009,11 +1060,12 @@ async def _apply_slot_accounts(
         ]
     ]
 
-    await query.edit_message_text(
-        "\n".join(lines),
-        parse_mode=ParseMode.HTML,
-        reply_markup=InlineKeyboardMarkup(buttons),
-    )
+    async with progress_lock:
+        await query.edit_message_text(
+            "\n".join(lines),
+            parse_mode=ParseMode.HTML,
+            reply_markup=InlineKeyboardMarkup(buttons),
+        )
 
 
 async def handle_callback(
@@ -0,0 +1,153 @@
+"""Process-wide cache of available slots with their free place counts.
+
+The cache holds one snapshot of ``list_available_slots`` covering the next
+few weeks and answers any window inside it without touching the database.
+It is dropped when
+
+* this process writes the schedule (:func:`invalidate`),
+* any process writes the schedule: triggers advance ``schedule_cache_version_seq``,
+  which is polled at most every ``VERSION_CHECK_SECONDS``,
+* the snapshot is older than ``SNAPSHOT_TTL_SECONDS``.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+from zoneinfo import ZoneInfo
+
+from repositories import schedule_repository
+
+log = logging.getLogger(__name__)
+
+LOCAL_TZ = ZoneInfo("Europe/Moscow")
+
+SNAPSHOT_HORIZON_DAYS = int(os.environ.get("SLOT_CACHE_HORIZON_DAYS", "35"))
+SNAPSHOT_TTL_SECONDS = float(os.environ.get("SLOT_CACHE_TTL_SECONDS", "60"))
+VERSION_CHECK_SECONDS = float(os.environ.get("SLOT_CACHE_VERSION_CHECK_SECONDS", "2"))
+SNAPSHOT_LIMIT = 2000
+DEFAULT_LIMIT = 120
+
+
+def _slot_start(slot: Dict[str, Any]) -> Optional[datetime]:
+    slot_date = slot.get("slot_date")
+    start_time = slot.get("start_time")
+    if slot_date is None or start_time is None:
+        return None
+    return datetime.combine(slot_date, start_time)
+
+
+@dataclass
+class _Snapshot:
+    slots: List[Dict[str, Any]]
+    window_start: datetime
+    covered_until: datetime
+    version: Optional[int]
+    loaded_at: float
+    checked_at: float
+
+
+class SlotAvailabilityCache:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._snapshot: Optional[_Snapshot] = None
+        self._tracking_ready = False
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._snapshot = None
+
+    def _current_version(self) -> Optional[int]:
+        try:
+            if not self._tracking_ready:
+                schedule_repository.ensure_schedule_version_tracking()
+                self._tracking_ready = True
+            return schedule_repository.get_schedule_version()
+        except Exception:
+            log.debug("Schedule version tracking unavailable", exc_info=True)
+            return None
+
+    def _is_fresh(self, snapshot: _Snapshot) -> bool:
+        now = time.monotonic()
+        if now - snapshot.loaded_at > SNAPSHOT_TTL_SECONDS:
+            return False
+        if now - snapshot.checked_at < VERSION_CHECK_SECONDS:
+            return True
+        version = self._current_version()
+        if version is None or version != snapshot.version:
+            return False
+        snapshot.checked_at = now
+        return True
+
+    def _load(self, now_naive: datetime) -> _Snapshot:
+        version = self._current_version()
+        window_end = now_naive + timedelta(days=SNAPSHOT_HORIZON_DAYS)
+        slots = [dict(row) for row in schedule_repository.list_available_slots(now_naive, window_end, SNAPSHOT_LIMIT)]
+        covered_until = window_end
+        if len(slots) >= SNAPSHOT_LIMIT:
+            # Truncated by the limit: slots sharing the last start time may be
+            # cut off, so only trust the range strictly before it.
+            last_start = _slot_start(slots[-1]) or now_naive
+            slots = [slot for slot in slots if (_slot_start(slot) or now_naive) < last_start]
+            covered_until = last_start - timedelta(microseconds=1)
+        loaded_at = time.monotonic()
+        return _Snapshot(
+            slots=slots,
+            window_start=now_naive,
+            covered_until=covered_until,
+            version=version,
+            loaded_at=loaded_at,
+            checked_at=loaded_at,
+        )
+
+    def _current_snapshot(self, start: datetime) -> _Snapshot:
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None or not self._is_fresh(snapshot):
+                local_now = datetime.now(tz=LOCAL_TZ).replace(tzinfo=None, microsecond=0)
+                snapshot = self._load(min(start, local_now))
+                self._snapshot = snapshot
+            return snapshot
+
+    def available_slots(self, start: datetime, end: Optional[datetime] = None, limit: int = DEFAULT_LIMIT) -> List[Dict[str, Any]]:
+        """Drop-in for ``schedule_repository.list_available_slots`` (naive local datetimes).
+
+        Windows the snapshot does not fully cover go straight to the database.
+        """
+
+        if end is not None and end < start:
+            raise ValueError("end_datetime must not precede start_datetime")
+        snapshot = self._current_snapshot(start)
+        if start < snapshot.window_start:
+            return schedule_repository.list_available_slots(start, end, limit)
+
+        result: List[Dict[str, Any]] = []
+        for slot in snapshot.slots:
+            slot_start = _slot_start(slot)
+            if slot_start is None or slot_start <= start:
+                continue
+            if end is not None and slot_start > end:
+                break
+            result.append(dict(slot))
+            if len(result) >= limit:
+                return result
+        if end is None or end > snapshot.covered_until:
+            return schedule_repository.list_available_slots(start, end, limit)
+        return result
+
+
+_CACHE = SlotAvailabilityCache()
+
+
+def cached_available_slots(start: datetime, end: Optional[datetime] = None, limit: int = DEFAULT_LIMIT) -> List[Dict[str, Any]]:
+    return _CACHE.available_slots(start, end, limit)
+
+
+def invalidate() -> None:
+    """Forget the snapshot after this process changed slots or reservations."""
+
+    _CACHE.invalidate()
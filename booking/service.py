@@ -7,6 +7,7 @@ from datetime import date, datetime, time, timedelta
 from typing import Any, Dict, List, Optional, Tuple
 from zoneinfo import ZoneInfo
 
+from booking import availability_cache
 from repositories import schedule_repository
 
 log = logging.getLogger(__name__)
@@ -68,7 +69,7 @@ def list_bookable_slots_between(
     """Load available slots in a time window and filter by cutoff."""
     now = now or local_now()
     try:
-        slots_raw = schedule_repository.list_available_slots(
+        slots_raw = availability_cache.cached_available_slots(
             _to_local_naive(start),
             _to_local_naive(end),
         )
@@ -78,6 +79,11 @@ def list_bookable_slots_between(
     return _filter_bookable_slots(slots_raw, now=now, booking_cutoff=booking_cutoff)
 
 
+def invalidate_slot_cache() -> None:
+    """Drop cached availability after a slot or reservation was changed."""
+    availability_cache.invalidate()
+
+
 def list_bookable_slots_for_horizon(
     *,
     now: Optional[datetime] = None,
@@ -200,6 +206,7 @@ def book_slot(
         log.exception("Failed to book reservation %s for client %s", reservation["id"], client_id)
         raise BookingFailed()
 
+    invalidate_slot_cache()
     if not booked:
         raise BookingFailed()
 
@@ -51,6 +51,7 @@ from repositories.admin_repository import (
 from straver_client import StraverClient
 from clientbot import intervals
 from clientbot import self_service
+from clientbot.persistence import StateStorePersistence
 from repositories.intervals_link_repository import get_link as get_intervals_link
 from wattattack_profiles import apply_client_profile as apply_wattattack_profile
 
@@ -806,6 +807,7 @@ async def _handle_booking_slot(update: Update, context: ContextTypes.DEFAULT_TYP
     except Exception:
         LOGGER.exception("Failed to update reservation %s", reservation["id"])
         booked_row = None
+    booking_service.invalidate_slot_cache()
 
     if not booked_row:
         await query.answer("К сожалению, место только что заняли.", show_alert=True)
@@ -1276,6 +1278,7 @@ async def _handle_cancel_booking_callback(update: Update, context: ContextTypes.
         LOGGER.exception("Failed to cancel reservation %s", reservation_id)
         await _respond_to_callback(query, context, f"❌ Не удалось отменить запись: {exc}")
         return
+    booking_service.invalidate_slot_cache()
 
     if not cancelled_reservation:
         await _respond_to_callback(query, context, "❌ Не удалось отменить запись.")
@@ -3555,7 +3558,7 @@ def create_application(token: str, greeting: str = DEFAULT_GREETING) -> Applicat
     if not token:
         raise ValueError("Telegram bot token must be provided")
 
-    application = Application.builder().token(token).build()
+    application = Application.builder().token(token).persistence(StateStorePersistence()).build()
     application.bot_data[_GREETING_KEY] = greeting or DEFAULT_GREETING
 
     global _SELF_SERVICE_FLOW
@@ -3628,7 +3631,7 @@ def create_application(token: str, greeting: str = DEFAULT_GREETING) -> Applicat
             CommandHandler("start", _start_handler),
         ],
         name="client_authorization",
-        persistent=False,
+        persistent=True,
         allow_reentry=True,
     )
 
@@ -3652,7 +3655,7 @@ def create_application(token: str, greeting: str = DEFAULT_GREETING) -> Applicat
         },
         fallbacks=[CommandHandler("cancel", _booking_cancel_command)],
         name="schedule_booking",
-        persistent=False,
+        persistent=True,
         allow_reentry=True,
     )
     application.add_handler(booking_conversation)
@@ -3682,7 +3685,7 @@ def create_application(token: str, greeting: str = DEFAULT_GREETING) -> Applicat
         },
         fallbacks=[CommandHandler("cancel", _race_cancel_handler)],
         name="race_registration",
-        persistent=False,
+        persistent=True,
         allow_reentry=True,
     )
     application.add_handler(race_conversation)
@@ -0,0 +1,135 @@
+"""python-telegram-bot persistence backed by the shared conversation state store."""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import pickle
+from typing import Any, Dict, Optional, Tuple
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from conversation_state import ConversationStateStore
+
+LOGGER = logging.getLogger(__name__)
+
+PERSISTENCE_UPDATE_INTERVAL = float(os.environ.get("CLIENTBOT_PERSISTENCE_INTERVAL", "5"))
+
+
+def _digest(data: Any) -> Optional[str]:
+    try:
+        return hashlib.sha1(pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)).hexdigest()
+    except Exception:  # noqa: BLE001
+        return None
+
+
+class StateStorePersistence(BasePersistence):
+    """Keep ``user_data`` and conversation states in Postgres.
+
+    Only user data and conversations are stored: chat/bot/callback data are
+    not used by the client bot. ``refresh_user_data`` pulls changes written
+    by another worker, but never over local changes that are not flushed yet.
+    """
+
+    def __init__(self, namespace: str = "clientbot", *, update_interval: float = PERSISTENCE_UPDATE_INTERVAL) -> None:
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self._namespace = namespace
+        self._user_store = ConversationStateStore(f"{namespace}:user_data")
+        self._conversation_stores: Dict[str, ConversationStateStore] = {}
+        self._written: Dict[int, Optional[str]] = {}
+
+    def _conversation_store(self, name: str) -> ConversationStateStore:
+        store = self._conversation_stores.get(name)
+        if store is None:
+            store = ConversationStateStore(f"{self._namespace}:conversation:{name}")
+            self._conversation_stores[name] = store
+        return store
+
+    async def get_user_data(self) -> Dict[int, Dict[Any, Any]]:
+        stored = await asyncio.to_thread(self._user_store.load_all)
+        result: Dict[int, Dict[Any, Any]] = {}
+        for key, value in stored.items():
+            try:
+                user_id = int(key)
+            except ValueError:
+                continue
+            result[user_id] = value
+            self._written[user_id] = _digest(value)
+        return result
+
+    async def update_user_data(self, user_id: int, data: Dict[Any, Any]) -> None:
+        try:
+            await asyncio.to_thread(self._user_store.set, user_id, data)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            LOGGER.warning("user_data of %s is not picklable, keeping it in memory only", user_id, exc_info=True)
+            return
+        self._written[user_id] = _digest(data)
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict[Any, Any]) -> None:
+        if user_data and _digest(user_data) != self._written.get(user_id):
+            return  # local changes are newer than the store until the next flush
+        stored = await asyncio.to_thread(self._user_store.get, user_id, None)
+        if stored is None:
+            return
+        user_data.clear()
+        user_data.update(stored)
+        self._written[user_id] = _digest(stored)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        await asyncio.to_thread(self._user_store.delete, user_id)
+        self._written.pop(user_id, None)
+
+    async def get_conversations(self, name: str) -> Dict[Tuple[Any, ...], object]:
+        stored = await asyncio.to_thread(self._conversation_store(name).load_all)
+        conversations: Dict[Tuple[Any, ...], object] = {}
+        for key, wrapped in stored.items():
+            try:
+                conversations[tuple(json.loads(key))] = wrapped.get("state")
+            except (ValueError, TypeError, AttributeError):
+                continue
+        return conversations
+
+    async def update_conversation(self, name: str, key: Tuple[Any, ...], new_state: Optional[object]) -> None:
+        store = self._conversation_store(name)
+        store_key = json.dumps(list(key))
+        if new_state is None:
+            await asyncio.to_thread(store.delete, store_key)
+        else:
+            # Wrap so falsy states such as 0 are not mistaken for "no state".
+            await asyncio.to_thread(store.set, store_key, {"state": new_state})
+
+    async def get_chat_data(self) -> Dict[int, Dict[Any, Any]]:
+        return {}
+
+    async def update_chat_data(self, chat_id: int, data: Dict[Any, Any]) -> None:
+        return None
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict[Any, Any]) -> None:
+        return None
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        return None
+
+    async def get_bot_data(self) -> Dict[Any, Any]:
+        return {}
+
+    async def update_bot_data(self, data: Dict[Any, Any]) -> None:
+        return None
+
+    async def refresh_bot_data(self, bot_data: Dict[Any, Any]) -> None:
+        return None
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def update_callback_data(self, data: Any) -> None:
+        return None
+
+    async def flush(self) -> None:
+        # Every update is written through, nothing is buffered here.
+        return None
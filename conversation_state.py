@@ -0,0 +1,143 @@
+"""Conversation state shared by the VK and Telegram bots.
+
+State lives in Postgres (``bot_conversation_state``) so that a restart or a
+second worker sees in-flight bookings. Each process keeps a small LRU of the
+serialized payloads in front of the table; entries are trusted for
+``cache_seconds`` and then re-read, so workers converge quickly.
+"""
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from repositories import conversation_state_repository
+
+log = logging.getLogger(__name__)
+
+STATE_TTL_SECONDS = float(os.environ.get("CONVERSATION_STATE_TTL_SECONDS", str(24 * 3600)))
+STATE_CACHE_SIZE = max(16, int(os.environ.get("CONVERSATION_STATE_CACHE_SIZE", "2048")))
+STATE_CACHE_SECONDS = float(os.environ.get("CONVERSATION_STATE_CACHE_SECONDS", "5"))
+_PURGE_EVERY_SECONDS = 3600.0
+
+
+class ConversationStateStore:
+    """Key/value store of picklable conversation state for one bot namespace."""
+
+    def __init__(
+        self,
+        namespace: str,
+        *,
+        ttl_seconds: float = STATE_TTL_SECONDS,
+        cache_size: int = STATE_CACHE_SIZE,
+        cache_seconds: float = STATE_CACHE_SECONDS,
+    ) -> None:
+        self.namespace = namespace
+        self.ttl_seconds = ttl_seconds
+        self._cache_size = cache_size
+        self._cache_seconds = cache_seconds
+        # key -> (payload, digest, cached_at); payload None marks a known-empty key.
+        self._cache: "OrderedDict[str, Tuple[Optional[bytes], Optional[str], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._ready = False
+        self._last_purge = 0.0
+
+    def _ensure_ready(self) -> None:
+        if self._ready:
+            return
+        conversation_state_repository.ensure_table()
+        self._ready = True
+
+    def _remember(self, key: str, payload: Optional[bytes], digest: Optional[str]) -> None:
+        with self._lock:
+            self._cache[key] = (payload, digest, time.monotonic())
+            self._cache.move_to_end(key)
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+
+    def _cached(self, key: str) -> Optional[Tuple[Optional[bytes], Optional[str], float]]:
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            self._cache.move_to_end(key)
+            return entry
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        """Return a fresh copy of the state for *key* (mutating it does not change the store)."""
+
+        key = str(key)
+        entry = self._cached(key)
+        if entry is None or time.monotonic() - entry[2] > self._cache_seconds:
+            self._ensure_ready()
+            payload = conversation_state_repository.load_state(self.namespace, key)
+            digest = hashlib.sha1(payload).hexdigest() if payload is not None else None
+            self._remember(key, payload, digest)
+        else:
+            payload = entry[0]
+        if payload is None:
+            return default
+        try:
+            return pickle.loads(payload)
+        except Exception:  # pylint: disable=broad-except
+            log.warning("Dropping unreadable conversation state %s/%s", self.namespace, key)
+            self.delete(key)
+            return default
+
+    def set(self, key: Any, value: Any) -> None:
+        """Write *value* through to Postgres; unchanged values are not rewritten."""
+
+        key = str(key)
+        if not value:
+            self.delete(key)
+            return
+        payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        digest = hashlib.sha1(payload).hexdigest()
+        entry = self._cached(key)
+        if entry is not None and entry[1] == digest:
+            return
+        self._ensure_ready()
+        conversation_state_repository.save_state(self.namespace, key, payload, self.ttl_seconds)
+        self._remember(key, payload, digest)
+        self._maybe_purge()
+
+    def delete(self, key: Any) -> None:
+        key = str(key)
+        entry = self._cached(key)
+        if entry is not None and entry[0] is None:
+            return
+        self._ensure_ready()
+        conversation_state_repository.delete_state(self.namespace, key)
+        self._remember(key, None, None)
+
+    def load_all(self) -> Dict[str, Any]:
+        """Return every live state of the namespace (used to warm up on start)."""
+
+        self._ensure_ready()
+        result: Dict[str, Any] = {}
+        for key, payload in conversation_state_repository.load_namespace(self.namespace).items():
+            try:
+                result[key] = pickle.loads(payload)
+            except Exception:  # pylint: disable=broad-except
+                log.warning("Skipping unreadable conversation state %s/%s", self.namespace, key)
+                continue
+            self._remember(key, payload, hashlib.sha1(payload).hexdigest())
+        return result
+
+    def _maybe_purge(self) -> None:
+        now = time.monotonic()
+        if now - self._last_purge < _PURGE_EVERY_SECONDS:
+            return
+        self._last_purge = now
+        try:
+            deleted = conversation_state_repository.purge_expired()
+        except Exception:  # pylint: disable=broad-except
+            log.debug("Failed to purge expired conversation state", exc_info=True)
+            return
+        if deleted:
+            log.info("Purged %s expired conversation state row(s)", deleted)
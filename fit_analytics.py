@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""Power and heart-rate analytics of a recorded ride.
+
+Works on the columns produced by :mod:`fit_decoder`.  Samples are put on a
+1 Hz grid first (short recording gaps are held, longer pauses and clock jumps
+are cut out, counting as neither ride time nor zero power) so the rolling
+windows of NP and the mean-maximal curve are in seconds.
+Zones are the ones the workout library uses, relative to the client's FTP.
+"""
+from __future__ import annotations
+
+import math
+from bisect import bisect_right
+from itertools import accumulate
+from operator import sub
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from fit_decoder import FitRecords
+from wattattack_workouts import POWER_ZONES
+
+# Mean-maximal power is stored for these durations (seconds).
+POWER_CURVE_DURATIONS: Tuple[int, ...] = (1, 5, 10, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+MAX_HOLD_SECONDS = 5
+# Grid cap: nothing past a day of ride time is analysed.
+MAX_GRID_SECONDS = 24 * 3600
+NP_WINDOW_SECONDS = 30
+HR_DRIFT_MIN_SECONDS = 20 * 60
+HR_DRIFT_MIN_COVERAGE = 0.5
+FTP_FROM_20MIN = 0.95
+CP_MIN_SECONDS = 120
+CP_MAX_SECONDS = 1200
+
+_ZONE_EDGES = [zone["min"] for zone in POWER_ZONES]
+
+
+def _to_grid(timestamps: Sequence[float], values: Sequence[float]) -> List[Optional[float]]:
+    """Spread samples over whole seconds; missing values stay ``None``.
+
+    A jump of more than ``MAX_HOLD_SECONDS`` either way (pause, device clock
+    change, chained files) re-anchors the timeline right after the previous
+    sample, so the grid is never longer than the recorded samples allow.
+    """
+
+    points: List[Tuple[int, float]] = []
+    start: Optional[float] = None
+    last_second = -1
+    for timestamp, value in zip(timestamps, values):
+        if math.isnan(timestamp):
+            continue
+        if start is None:
+            start = timestamp
+        second = int(round(timestamp - start))
+        if abs(second - last_second) > MAX_HOLD_SECONDS:
+            start = timestamp - (last_second + 1)
+            second = last_second + 1
+        if second <= last_second:
+            continue
+        if second >= MAX_GRID_SECONDS:
+            break
+        points.append((second, value))
+        last_second = second
+    if not points:
+        return []
+
+    grid: List[Optional[float]] = [None] * (points[-1][0] + 1)
+    for index, (second, value) in enumerate(points):
+        if math.isnan(value):
+            continue
+        next_second = points[index + 1][0] if index + 1 < len(points) else second + 1
+        for filled in range(second, min(next_second, second + MAX_HOLD_SECONDS)):
+            grid[filled] = value
+    return grid
+
+
+def mean_max_power(power: Sequence[float], durations: Sequence[int] = POWER_CURVE_DURATIONS) -> List[int]:
+    """Best average power for each duration that fits into the ride."""
+
+    prefix = [0.0, *accumulate(power)]
+    curve: List[int] = []
+    for duration in durations:
+        if duration > len(power):
+            break
+        best = max(map(sub, prefix[duration:], prefix))
+        curve.append(int(round(best / duration)))
+    return curve
+
+
+def _normalized_power(prefix: List[float]) -> Optional[float]:
+    if len(prefix) - 1 < NP_WINDOW_SECONDS:
+        return None
+    rolling = [(total / NP_WINDOW_SECONDS) ** 4 for total in map(sub, prefix[NP_WINDOW_SECONDS:], prefix)]
+    return (sum(rolling) / len(rolling)) ** 0.25
+
+
+def _zone_seconds(power: Sequence[float], ftp: float) -> List[int]:
+    edges = [edge * ftp for edge in _ZONE_EDGES]
+    seconds = [0] * len(POWER_ZONES)
+    for value in power:
+        seconds[max(0, bisect_right(edges, value) - 1)] += 1
+    return seconds
+
+
+def _efficiency(power: Sequence[float], heart_rate: Sequence[Optional[float]]) -> Optional[float]:
+    pairs = [(p, hr) for p, hr in zip(power, heart_rate) if hr]
+    if len(pairs) < HR_DRIFT_MIN_COVERAGE * len(power):
+        return None
+    average_hr = sum(hr for _, hr in pairs) / len(pairs)
+    return sum(p for p, _ in pairs) / len(pairs) / average_hr if average_hr else None
+
+
+def hr_drift(power: Sequence[float], heart_rate: Sequence[Optional[float]]) -> Optional[float]:
+    """Aerobic decoupling in percent: drop of power/HR from the first to the second half."""
+
+    if len(power) < HR_DRIFT_MIN_SECONDS:
+        return None
+    half = len(power) // 2
+    first = _efficiency(power[:half], heart_rate[:half])
+    second = _efficiency(power[half:], heart_rate[half:])
+    if not first or second is None:
+        return None
+    return (first - second) / first * 100.0
+
+
+def analyze_records(records: FitRecords, ftp: Optional[float] = None) -> Optional[Dict[str, Any]]:
+    """Return ride metrics, or ``None`` when the file has no power data.
+
+    FTP-relative values (IF, TSS, zones) are ``None`` without a positive FTP.
+    """
+
+    power_grid = _to_grid(records.timestamp, records.power)
+    if not any(value for value in power_grid):
+        return None
+    power = [value or 0.0 for value in power_grid]
+    heart_grid = _to_grid(records.timestamp, records.heart_rate)
+    heart_rate = [value or None for value in heart_grid] + [None] * (len(power) - len(heart_grid))
+
+    duration = len(power)
+    prefix = [0.0, *accumulate(power)]
+    average_power = prefix[-1] / duration
+    normalized = _normalized_power(prefix)
+    heart_values = [value for value in heart_rate if value]
+
+    metrics: Dict[str, Any] = {
+        "duration_seconds": duration,
+        "average_power": round(average_power, 1),
+        "max_power": int(max(power)),
+        "normalized_power": round(normalized, 1) if normalized is not None else None,
+        "variability_index": round(normalized / average_power, 3) if normalized and average_power else None,
+        "work_kj": round(prefix[-1] / 1000.0, 1),
+        "average_heartrate": round(sum(heart_values) / len(heart_values), 1) if heart_values else None,
+        "max_heartrate": int(max(heart_values)) if heart_values else None,
+        "hr_drift_pct": None,
+        "power_curve_durations": list(POWER_CURVE_DURATIONS),
+        "power_curve": mean_max_power(power),
+        "ftp": None,
+        "intensity_factor": None,
+        "tss": None,
+        "zone_seconds": None,
+    }
+    drift = hr_drift(power, heart_rate)
+    if drift is not None:
+        metrics["hr_drift_pct"] = round(drift, 2)
+
+    if ftp and ftp > 0:
+        metrics["ftp"] = float(ftp)
+        metrics["zone_seconds"] = _zone_seconds(power, ftp)
+        if normalized is not None:
+            intensity = normalized / ftp
+            metrics["intensity_factor"] = round(intensity, 3)
+            metrics["tss"] = round(duration * normalized * intensity / (ftp * 3600.0) * 100.0, 1)
+    return metrics
+
+
+def critical_power(bests: Mapping[int, float]) -> Optional[Tuple[float, float]]:
+    """Fit the two-parameter CP model ``work = CP * t + W'`` to 2–20 min bests.
+
+    Returns ``(cp, w_prime)`` or ``None`` when the points do not give a
+    physiologically sensible fit.
+    """
+
+    points = sorted(
+        (duration, power * duration)
+        for duration, power in bests.items()
+        if power and CP_MIN_SECONDS <= duration <= CP_MAX_SECONDS
+    )
+    if len(points) < 2 or points[-1][0] < 300:
+        return None
+    count = len(points)
+    mean_t = sum(t for t, _ in points) / count
+    mean_w = sum(w for _, w in points) / count
+    spread = sum((t - mean_t) ** 2 for t, _ in points)
+    if not spread:
+        return None
+    cp = sum((t - mean_t) * (w - mean_w) for t, w in points) / spread
+    w_prime = mean_w - cp * mean_t
+    if cp <= 0 or w_prime <= 0:
+        return None
+    return cp, w_prime
+
+
+def estimate_ftp(bests: Mapping[int, float]) -> Optional[Dict[str, Any]]:
+    """Suggest an FTP from all-time best power per duration (seconds → watts).
+
+    95% of the 20-minute best when the client has one, otherwise critical
+    power fitted to the shorter efforts.
+    """
+
+    model = critical_power(bests)
+    estimate: Dict[str, Any] = {
+        "cp": round(model[0], 1) if model else None,
+        "w_prime": int(round(model[1])) if model else None,
+    }
+    twenty_minutes = bests.get(1200)
+    if twenty_minutes:
+        return {"ftp": int(round(twenty_minutes * FTP_FROM_20MIN)), "method": "20min", **estimate}
+    if model:
+        return {"ftp": int(round(model[0])), "method": "cp", **estimate}
+    return None
+
+
+__all__ = [
+    "POWER_CURVE_DURATIONS",
+    "analyze_records",
+    "critical_power",
+    "estimate_ftp",
+    "hr_drift",
+    "mean_max_power",
+]
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""Streaming decoder for the ``record`` messages of FIT activity files.
+
+The archive under ``ensure_fit_files_dir()`` only needs the per-second ride
+samples, so instead of building a message object per record this module walks
+the file once and unpacks each record straight from the buffer with a
+``struct.Struct`` compiled per local definition (``unpack_from`` on the
+memoryview, no slicing).  Fields nobody asked for are skipped as pad bytes.
+Samples land in ``array('d')`` columns that NumPy can wrap without a copy.
+"""
+from __future__ import annotations
+
+import math
+import struct
+from array import array
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+try:  # Columns are plain arrays; NumPy is only needed for ``as_numpy``.
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+FIT_EPOCH_OFFSET = 631065600  # 1989-12-31T00:00:00Z in Unix seconds
+RECORD_MESSAGE = 20
+TIMESTAMP_FIELD = 253
+
+COLUMNS = ("timestamp", "power", "heart_rate", "cadence", "speed", "distance")
+
+# record field number -> (column, scale)
+RECORD_FIELDS: Dict[int, Tuple[str, float]] = {
+    TIMESTAMP_FIELD: ("timestamp", 1.0),
+    7: ("power", 1.0),
+    3: ("heart_rate", 1.0),
+    4: ("cadence", 1.0),
+    6: ("speed", 1000.0),
+    73: ("speed", 1000.0),  # enhanced_speed, preferred over speed
+    5: ("distance", 100.0),
+}
+
+# base type number (low 5 bits) -> (struct code, size, invalid value)
+_BASE_TYPES: Dict[int, Tuple[str, int, int]] = {
+    0x00: ("B", 1, 0xFF),  # enum
+    0x01: ("b", 1, 0x7F),
+    0x02: ("B", 1, 0xFF),
+    0x03: ("h", 2, 0x7FFF),
+    0x04: ("H", 2, 0xFFFF),
+    0x05: ("i", 4, 0x7FFFFFFF),
+    0x06: ("I", 4, 0xFFFFFFFF),
+    0x0A: ("B", 1, 0x00),  # uint8z
+    0x0B: ("H", 2, 0x0000),  # uint16z
+    0x0C: ("I", 4, 0x00000000),  # uint32z
+}
+
+PathLike = Union[str, Path]
+
+
+class FitDecodeError(ValueError):
+    """The data is not a FIT file or its definitions are inconsistent."""
+
+
+@dataclass
+class FitRecords:
+    """Columnar ride samples; missing values are ``nan``.
+
+    ``timestamp`` is Unix seconds, ``speed`` m/s, ``distance`` metres.
+    """
+
+    timestamp: array = field(default_factory=lambda: array("d"))
+    power: array = field(default_factory=lambda: array("d"))
+    heart_rate: array = field(default_factory=lambda: array("d"))
+    cadence: array = field(default_factory=lambda: array("d"))
+    speed: array = field(default_factory=lambda: array("d"))
+    distance: array = field(default_factory=lambda: array("d"))
+    truncated: bool = False
+
+    def __len__(self) -> int:
+        return len(self.timestamp)
+
+    def columns(self) -> Dict[str, array]:
+        return {name: getattr(self, name) for name in COLUMNS}
+
+    def as_numpy(self) -> Dict[str, "np.ndarray"]:
+        """Zero-copy float64 views of the columns (requires NumPy)."""
+
+        if np is None:
+            raise RuntimeError("NumPy is not installed")
+        return {name: np.frombuffer(column, dtype=np.float64) for name, column in self.columns().items()}
+
+
+@dataclass
+class _Layout:
+    """Compiled form of one local message definition."""
+
+    size: int
+    unpacker: Optional[struct.Struct]
+    # (column index, scale, invalid) per unpacked value, in unpack order
+    targets: List[Tuple[int, float, int]]
+    timestamp_index: Optional[int]
+    is_record: bool
+
+
+def _compile_layout(global_num: int, fields: List[Tuple[int, int, int]], dev_size: int, big_endian: bool) -> _Layout:
+    is_record = global_num == RECORD_MESSAGE
+    field_numbers = {number for number, _, _ in fields}
+    codes: List[str] = ["<" if not big_endian else ">"]
+    targets: List[Tuple[int, float, int]] = []
+    timestamp_index: Optional[int] = None
+    pad = 0
+
+    for number, size, base_type in fields:
+        wanted = number == TIMESTAMP_FIELD or (is_record and number in RECORD_FIELDS)
+        if is_record and number == 6 and 73 in field_numbers:
+            wanted = False
+        spec = _BASE_TYPES.get(base_type & 0x1F)
+        if not wanted or spec is None or spec[1] != size:
+            pad += size
+            continue
+        if pad:
+            codes.append(f"{pad}x")
+            pad = 0
+        code, _, invalid = spec
+        codes.append(code)
+        if number == TIMESTAMP_FIELD:
+            timestamp_index = len(targets)
+        column, scale = RECORD_FIELDS[number] if is_record else ("timestamp", 1.0)
+        targets.append((COLUMNS.index(column), scale, invalid))
+
+    size = sum(size for _, size, _ in fields) + dev_size
+    unpacker = struct.Struct("".join(codes)) if targets else None
+    return _Layout(size, unpacker, targets, timestamp_index, is_record)
+
+
+def decode_records(data: Union[bytes, bytearray, memoryview]) -> FitRecords:
+    """Decode the ``record`` messages of one or more chained FIT files."""
+
+    buf = memoryview(data)
+    total = len(buf)
+    result = FitRecords()
+    columns = list(result.columns().values())
+    width = len(columns)
+    nan = math.nan
+    offset = 0
+
+    while offset < total:
+        if total - offset < 12:
+            if offset == 0:
+                raise FitDecodeError("File is too short for a FIT header")
+            break
+        header_size = buf[offset]
+        if header_size < 12 or bytes(buf[offset + 8:offset + 12]) != b".FIT":
+            if offset == 0:
+                raise FitDecodeError("Missing .FIT signature")
+            break
+        (data_size,) = struct.unpack_from("<I", buf, offset + 4)
+        pos = offset + header_size
+        end = pos + data_size
+        if end > total:
+            result.truncated = True
+            end = total
+
+        layouts: Dict[int, _Layout] = {}
+        last_timestamp: Optional[int] = None
+
+        while pos < end:
+            header = buf[pos]
+            pos += 1
+
+            if header & 0x80:  # compressed timestamp header
+                local = (header >> 5) & 0x03
+                if last_timestamp is not None:
+                    time_offset = header & 0x1F
+                    timestamp = (last_timestamp & ~0x1F) + time_offset
+                    if time_offset < (last_timestamp & 0x1F):
+                        timestamp += 0x20
+                    last_timestamp = timestamp
+                compressed_timestamp = last_timestamp
+            elif header & 0x40:  # definition message
+                local = header & 0x0F
+                if pos + 5 > end:
+                    result.truncated = True
+                    break
+                big_endian = buf[pos + 1] == 1
+                (global_num,) = struct.unpack_from(">H" if big_endian else "<H", buf, pos + 2)
+                count = buf[pos + 4]
+                pos += 5
+                if pos + count * 3 > end:
+                    result.truncated = True
+                    break
+                fields = [(buf[pos + i * 3], buf[pos + i * 3 + 1], buf[pos + i * 3 + 2]) for i in range(count)]
+                pos += count * 3
+                dev_size = 0
+                if header & 0x20:
+                    if pos + 1 > end:
+                        result.truncated = True
+                        break
+                    dev_count = buf[pos]
+                    pos += 1
+                    if pos + dev_count * 3 > end:
+                        result.truncated = True
+                        break
+                    dev_size = sum(buf[pos + i * 3 + 1] for i in range(dev_count))
+                    pos += dev_count * 3
+                layouts[local] = _compile_layout(global_num, fields, dev_size, big_endian)
+                continue
+            else:
+                local = header & 0x0F
+                compressed_timestamp = None
+
+            layout = layouts.get(local)
+            if layout is None:
+                raise FitDecodeError(f"Data message for undefined local type {local} at byte {pos - 1}")
+            if pos + layout.size > end:
+                result.truncated = True
+                break
+            if layout.unpacker is None:
+                if layout.is_record and compressed_timestamp is not None:
+                    columns[0].append(compressed_timestamp + FIT_EPOCH_OFFSET)
+                    for column in columns[1:]:
+                        column.append(nan)
+                pos += layout.size
+                continue
+
+            values = layout.unpacker.unpack_from(buf, pos)
+            pos += layout.size
+            if layout.timestamp_index is not None:
+                raw = values[layout.timestamp_index]
+                if raw != 0xFFFFFFFF:
+                    last_timestamp = raw
+            elif compressed_timestamp is not None:
+                last_timestamp = compressed_timestamp
+            if not layout.is_record:
+                continue
+
+            row = [nan] * width
+            for (index, scale, invalid), raw in zip(layout.targets, values):
+                if raw != invalid:
+                    row[index] = raw / scale
+            if layout.timestamp_index is None and last_timestamp is not None:
+                row[0] = last_timestamp
+            row[0] += FIT_EPOCH_OFFSET  # nan stays nan
+            for index in range(width):
+                columns[index].append(row[index])
+
+        offset = end + 2  # file CRC
+
+    return result
+
+
+def read_fit_records(path: PathLike) -> FitRecords:
+    """Read a FIT file from disk and decode its record messages."""
+
+    return decode_records(Path(path).read_bytes())
+
+
+__all__ = [
+    "COLUMNS",
+    "FitDecodeError",
+    "FitRecords",
+    "decode_records",
+    "read_fit_records",
+]
@@ -0,0 +1,587 @@
+"""Rate-limited delivery of webapp broadcasts from the persisted outbox."""
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+from uuid import uuid4
+
+import requests
+
+from repositories import broadcast_repository, client_link_repository
+
+log = logging.getLogger(__name__)
+
+TELEGRAM_API_URL = "https://api.telegram.org"
+VK_API_URL = "https://api.vk.com/method"
+
+# Telegram allows ~30 msg/s per bot and ~1 msg/s per chat; VK community tokens ~20 req/s.
+TELEGRAM_RATE_PER_SECOND = float(os.environ.get("BROADCAST_TELEGRAM_RATE", "25"))
+TELEGRAM_CHAT_INTERVAL_SECONDS = float(os.environ.get("BROADCAST_TELEGRAM_CHAT_INTERVAL", "1.0"))
+VK_RATE_PER_SECOND = float(os.environ.get("BROADCAST_VK_RATE", "15"))
+BROADCAST_WORKERS = max(1, int(os.environ.get("BROADCAST_WORKERS", "8")))
+BROADCAST_MAX_ATTEMPTS = max(1, int(os.environ.get("BROADCAST_MAX_ATTEMPTS", "5")))
+BROADCAST_BATCH_SIZE = 100
+# Images given by URL are cached by the URL, whose content may change.
+BROADCAST_URL_MEDIA_TTL_SECONDS = float(os.environ.get("BROADCAST_URL_MEDIA_TTL_SECONDS", "3600"))
+
+# VK error codes: 6 too many requests per second, 9 flood control, 10 internal error.
+VK_RETRY_ERRORS = {6: 1.0, 9: 60.0, 10: 5.0}
+VK_BLOCKED_ERRORS = {7, 900, 901, 902}
+
+
+@dataclass(frozen=True)
+class BroadcastCredentials:
+    telegram_token: Optional[str]
+    vk_token: Optional[str]
+    vk_api_version: str = "5.199"
+
+    @classmethod
+    def from_env(cls) -> "BroadcastCredentials":
+        return cls(
+            telegram_token=os.environ.get("KRUTILKAVN_BOT_TOKEN") or os.environ.get("TELEGRAM_BOT_TOKEN"),
+            vk_token=os.environ.get("VK_API_COMMUNITY_KEY"),
+            vk_api_version=os.environ.get("VK_API_VERSION") or "5.199",
+        )
+
+
+@dataclass
+class DeliveryResult:
+    ok: bool
+    error: Optional[str] = None
+    retry_after: Optional[float] = None
+    blocked: bool = False
+    permanent: bool = False
+
+
+class RateLimiter:
+    """Token bucket shared by all delivery threads of a channel."""
+
+    def __init__(self, rate_per_second: float) -> None:
+        self._interval = 1.0 / max(rate_per_second, 0.1)
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self._interval
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+
+    def pause(self, seconds: float) -> None:
+        """Push every future slot back, used when the API answers 429."""
+
+        with self._lock:
+            self._next_slot = max(self._next_slot, time.monotonic() + seconds)
+
+
+class KeyedThrottle:
+    """Enforce a minimum interval between calls for the same key (chat)."""
+
+    def __init__(self, interval_seconds: float) -> None:
+        self._interval = interval_seconds
+        self._next_slot: Dict[Any, float] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key: Any) -> None:
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(key, 0.0))
+            self._next_slot[key] = slot + self._interval
+            if len(self._next_slot) > 10000:
+                self._next_slot = {k: v for k, v in self._next_slot.items() if v > now}
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+_TELEGRAM_LIMITER = RateLimiter(TELEGRAM_RATE_PER_SECOND)
+_TELEGRAM_CHAT_THROTTLE = KeyedThrottle(TELEGRAM_CHAT_INTERVAL_SECONDS)
+_VK_LIMITER = RateLimiter(VK_RATE_PER_SECOND)
+
+
+def telegram_rate_limiter() -> RateLimiter:
+    """Return the bot-wide Telegram limiter so other senders in the process share it.
+
+    Broadcasts are delivered only by the scheduler process, so this limiter
+    covers the whole bot budget there.
+    """
+
+    return _TELEGRAM_LIMITER
+
+
+_MEDIA_OPTION_KEYS = {
+    broadcast_repository.CHANNEL_TELEGRAM: "telegram_file_id",
+    broadcast_repository.CHANNEL_VK: "vk_attachment",
+}
+_MEDIA_LOCK = threading.Lock()
+
+_thread_local = threading.local()
+_ACTIVE_JOBS: set[int] = set()
+_ACTIVE_LOCK = threading.Lock()
+
+
+def _http() -> requests.Session:
+    session = getattr(_thread_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        _thread_local.session = session
+    return session
+
+
+def _telegram_call(
+    credentials: BroadcastCredentials,
+    method: str,
+    chat_id: int,
+    *,
+    data: Dict[str, Any],
+    files: Optional[Dict[str, Any]] = None,
+    timeout: float = 20,
+) -> Tuple[DeliveryResult, Dict[str, Any]]:
+    _TELEGRAM_LIMITER.acquire()
+    _TELEGRAM_CHAT_THROTTLE.acquire(chat_id)
+    url = f"{TELEGRAM_API_URL}/bot{credentials.telegram_token}/{method}"
+    if files:
+        response = _http().post(url, data=data, files=files, timeout=timeout)
+    else:
+        response = _http().post(url, json=data, timeout=timeout)
+    try:
+        body = response.json()
+    except ValueError:
+        body = {}
+    if response.status_code == 200 and body.get("ok", True):
+        return DeliveryResult(ok=True), body
+
+    error = f"{method} {response.status_code}: {body.get('description') or response.text}"
+    if response.status_code == 429:
+        retry_after = float((body.get("parameters") or {}).get("retry_after") or 1)
+        _TELEGRAM_LIMITER.pause(retry_after)
+        return DeliveryResult(ok=False, error=error, retry_after=retry_after), body
+    if response.status_code == 403:
+        return DeliveryResult(ok=False, error=error, blocked=True), body
+    if response.status_code == 400:
+        return DeliveryResult(ok=False, error=error, permanent=True), body
+    return DeliveryResult(ok=False, error=error), body
+
+
+def _telegram_follow_up(
+    credentials: BroadcastCredentials, chat_id: int, data: Dict[str, Any]
+) -> DeliveryResult:
+    """Send a secondary message after the main one already went out.
+
+    The main message cannot be re-queued without duplicating it, so 429s are
+    waited out inline here.
+    """
+
+    result = DeliveryResult(ok=False)
+    for _ in range(3):
+        result, _body = _telegram_call(credentials, "sendMessage", chat_id, data=data, timeout=10)
+        if result.ok or result.retry_after is None:
+            return result
+        time.sleep(result.retry_after)
+    return result
+
+
+def _read_image(job: Dict[str, Any]) -> Optional[bytes]:
+    image_path = job.get("image_path")
+    if not image_path:
+        return None
+    try:
+        return Path(image_path).read_bytes()
+    except OSError:
+        log.warning("broadcast: image %s for job %s is missing", image_path, job.get("id"))
+        return None
+
+
+def _cached_media(job: Dict[str, Any], channel: str) -> Optional[str]:
+    """Reusable media reference for the job image; URL-keyed entries expire."""
+
+    image_hash = job.get("image_hash")
+    if not image_hash:
+        return None
+    max_age = None if job.get("image_path") else BROADCAST_URL_MEDIA_TTL_SECONDS
+    return broadcast_repository.get_cached_media(image_hash, channel, max_age_seconds=max_age)
+
+
+def _remember_media(job: Dict[str, Any], channel: str, media_ref: Optional[str]) -> None:
+    """Keep an uploaded media reference on the job and in the hash-keyed cache."""
+
+    option_key = _MEDIA_OPTION_KEYS[channel]
+    with _MEDIA_LOCK:
+        options = job.setdefault("options", {})
+        if options.get(option_key) == media_ref:
+            return
+        options[option_key] = media_ref
+        snapshot = dict(options)
+    image_hash = job.get("image_hash")
+    try:
+        broadcast_repository.update_job(job["id"], options=snapshot)
+        if image_hash and media_ref:
+            broadcast_repository.store_cached_media(image_hash, channel, media_ref)
+        elif image_hash:
+            broadcast_repository.forget_cached_media(image_hash, channel)
+    except Exception:  # pylint: disable=broad-except
+        log.exception("broadcast: failed to store %s media reference for job %s", channel, job.get("id"))
+
+
+def _photo_file_id(body: Dict[str, Any]) -> Optional[str]:
+    photos = (body.get("result") or {}).get("photo") or []
+    if not photos:
+        return None
+    # Sizes are ordered smallest first; the last one is the original.
+    return photos[-1].get("file_id")
+
+
+def _deliver_telegram(
+    job: Dict[str, Any], chat_id: int, credentials: BroadcastCredentials
+) -> DeliveryResult:
+    message_text = (job.get("message_text") or "").strip()
+    parse_mode = job.get("parse_mode") or "HTML"
+    image_url = job.get("image_url")
+    image_path = job.get("image_path")
+
+    if not (image_url or image_path):
+        return _telegram_call(
+            credentials,
+            "sendMessage",
+            chat_id,
+            data={
+                "chat_id": str(chat_id),
+                "text": message_text,
+                "parse_mode": parse_mode,
+                "disable_web_page_preview": True,
+            },
+            timeout=10,
+        )[0]
+
+    caption_allowed = bool(message_text) and len(message_text) <= 1024
+    photo_data: Dict[str, Any] = {"chat_id": str(chat_id)}
+    if caption_allowed:
+        photo_data["caption"] = message_text
+        photo_data["parse_mode"] = parse_mode
+
+    def can_fall_back(candidate: DeliveryResult) -> bool:
+        return not candidate.ok and candidate.retry_after is None and not candidate.blocked
+
+    result = DeliveryResult(ok=False, error="no image source")
+    file_id = (job.get("options") or {}).get("telegram_file_id")
+    if file_id:
+        result, _body = _telegram_call(credentials, "sendPhoto", chat_id, data={**photo_data, "photo": file_id})
+        if can_fall_back(result) and result.permanent:
+            log.warning("broadcast: cached Telegram file_id rejected for job %s: %s", job.get("id"), result.error)
+            _remember_media(job, broadcast_repository.CHANNEL_TELEGRAM, None)
+    if (not file_id or can_fall_back(result)) and image_url:
+        result, body = _telegram_call(credentials, "sendPhoto", chat_id, data={**photo_data, "photo": image_url})
+        if result.ok:
+            _remember_media(job, broadcast_repository.CHANNEL_TELEGRAM, _photo_file_id(body))
+    if can_fall_back(result):
+        image_bytes = _read_image(job)
+        if image_bytes is not None:
+            filename = Path(image_path).name if image_path else "image.jpg"
+            result, body = _telegram_call(
+                credentials,
+                "sendPhoto",
+                chat_id,
+                data=photo_data,
+                files={"photo": (filename, image_bytes)},
+                timeout=30,
+            )
+            if result.ok:
+                _remember_media(job, broadcast_repository.CHANNEL_TELEGRAM, _photo_file_id(body))
+    if not result.ok:
+        return result
+
+    if message_text and not caption_allowed:
+        follow_up = _telegram_follow_up(
+            credentials,
+            chat_id,
+            {
+                "chat_id": str(chat_id),
+                "text": message_text,
+                "parse_mode": parse_mode,
+                "disable_web_page_preview": True,
+            },
+        )
+        if not follow_up.ok:
+            follow_up.permanent = True
+            return follow_up
+    return result
+
+
+def _vk_message_text(job: Dict[str, Any], attachment: Optional[str]) -> str:
+    message_text = (job.get("message_text") or "").strip()
+    image_url = job.get("image_url")
+    if attachment is None and image_url and image_url not in message_text:
+        message_text = f"{message_text}\n\n{image_url}".strip()
+    if not message_text and attachment is None:
+        message_text = image_url or ""
+    return message_text
+
+
+def _deliver_vk(job: Dict[str, Any], vk_user_id: int, credentials: BroadcastCredentials) -> DeliveryResult:
+    attachment = (job.get("options") or {}).get("vk_attachment")
+    payload: Dict[str, Any] = {
+        "access_token": credentials.vk_token,
+        "v": credentials.vk_api_version,
+        "user_id": int(vk_user_id),
+        "random_id": uuid4().int & 0x7FFFFFFF,
+    }
+    message_text = _vk_message_text(job, attachment)
+    if message_text:
+        payload["message"] = message_text
+    if attachment:
+        payload["attachment"] = attachment
+
+    _VK_LIMITER.acquire()
+    response = _http().post(f"{VK_API_URL}/messages.send", data=payload, timeout=15)
+    try:
+        body = response.json()
+    except ValueError:
+        body = {}
+    if response.status_code == 200 and not body.get("error"):
+        return DeliveryResult(ok=True)
+
+    error = body.get("error") or {}
+    error_code = error.get("error_code") or response.status_code
+    error_text = f"vk {error_code}: {error.get('error_msg') or response.text}"
+    if error_code in VK_RETRY_ERRORS:
+        retry_after = VK_RETRY_ERRORS[error_code]
+        if error_code == 6:
+            _VK_LIMITER.pause(retry_after)
+        return DeliveryResult(ok=False, error=error_text, retry_after=retry_after)
+    if error_code in VK_BLOCKED_ERRORS:
+        return DeliveryResult(ok=False, error=error_text, permanent=True)
+    if isinstance(error_code, int) and error_code >= 500:
+        return DeliveryResult(ok=False, error=error_text)
+    return DeliveryResult(ok=False, error=error_text, permanent=True)
+
+
+def upload_vk_photo(credentials: BroadcastCredentials, image_bytes: bytes, filename: str) -> Optional[str]:
+    """Upload an image for community messages and return the attachment string."""
+
+    session = _http()
+    upload_server = session.get(
+        f"{VK_API_URL}/photos.getMessagesUploadServer",
+        params={"access_token": credentials.vk_token, "v": credentials.vk_api_version},
+        timeout=10,
+    ).json()
+    upload_url = (upload_server.get("response") or {}).get("upload_url")
+    if not upload_url:
+        return None
+    upload_response = session.post(
+        upload_url,
+        files={"photo": (filename or "image.jpg", image_bytes)},
+        timeout=30,
+    ).json()
+    saved = session.post(
+        f"{VK_API_URL}/photos.saveMessagesPhoto",
+        data={
+            "access_token": credentials.vk_token,
+            "v": credentials.vk_api_version,
+            "photo": upload_response.get("photo"),
+            "server": upload_response.get("server"),
+            "hash": upload_response.get("hash"),
+        },
+        timeout=10,
+    ).json()
+    items = saved.get("response") or []
+    if not items:
+        return None
+    item = items[0]
+    owner_id = item.get("owner_id")
+    media_id = item.get("id")
+    if not owner_id or not media_id:
+        return None
+    attachment = f"photo{owner_id}_{media_id}"
+    if item.get("access_key"):
+        attachment = f"{attachment}_{item['access_key']}"
+    return attachment
+
+
+def _prepare_vk_attachment(job: Dict[str, Any], credentials: BroadcastCredentials) -> Dict[str, Any]:
+    """Upload the job image to VK once and keep the attachment on the job."""
+
+    options = dict(job.get("options") or {})
+    if "vk_attachment" in options or not (job.get("image_url") or job.get("image_path")):
+        return job
+    progress = broadcast_repository.get_job_progress(job["id"]) or {}
+    if broadcast_repository.CHANNEL_VK not in (progress.get("counts") or {}):
+        return job
+
+    image_hash = job.get("image_hash")
+    cached = _cached_media(job, broadcast_repository.CHANNEL_VK)
+    if cached:
+        log.info("broadcast: reusing VK attachment %s for job %s", cached, job["id"])
+        options["vk_attachment"] = cached
+        broadcast_repository.update_job(job["id"], options=options)
+        return {**job, "options": options}
+
+    image_bytes = _read_image(job)
+    filename = Path(job["image_path"]).name if job.get("image_path") else "image.jpg"
+    if image_bytes is None and job.get("image_url"):
+        try:
+            response = _http().get(job["image_url"], timeout=15)
+            if response.status_code == 200:
+                image_bytes = response.content
+                filename = Path(job["image_url"]).name or filename
+            else:
+                log.warning("broadcast: failed to download image for VK, status %s", response.status_code)
+        except Exception:  # pylint: disable=broad-except
+            log.exception("broadcast: failed to download image for VK")
+
+    attachment: Optional[str] = None
+    if image_bytes:
+        try:
+            attachment = upload_vk_photo(credentials, image_bytes, filename)
+        except Exception:  # pylint: disable=broad-except
+            log.exception("broadcast: failed to upload image to VK, sending without attachment")
+    if not attachment:
+        log.warning("broadcast: VK photo upload failed for job %s, falling back to URL/text", job["id"])
+    elif image_hash:
+        broadcast_repository.store_cached_media(image_hash, broadcast_repository.CHANNEL_VK, attachment)
+    options["vk_attachment"] = attachment
+    broadcast_repository.update_job(job["id"], options=options)
+    return {**job, "options": options}
+
+
+def _prime_telegram_photo(job: Dict[str, Any], credentials: BroadcastCredentials) -> None:
+    """Resolve a reusable Telegram ``file_id`` before the parallel fan-out.
+
+    Either the hash cache already has one, or the first recipient gets the
+    photo on its own so every other send is a lightweight id reference.
+    """
+
+    if not (job.get("image_url") or job.get("image_path")):
+        return
+    options = job.setdefault("options", {})
+    if options.get("telegram_file_id"):
+        return
+    cached = _cached_media(job, broadcast_repository.CHANNEL_TELEGRAM)
+    if cached:
+        options["telegram_file_id"] = cached
+        return
+    for message in broadcast_repository.claim_due_messages(
+        job["id"], 1, channel=broadcast_repository.CHANNEL_TELEGRAM
+    ):
+        _deliver_message(job, message, credentials)
+
+
+def _retry_delay(message: Dict[str, Any], result: DeliveryResult) -> float:
+    if result.retry_after is not None:
+        return result.retry_after
+    return float(min(2 ** int(message.get("attempts") or 1), 300))
+
+
+def _deliver_message(job: Dict[str, Any], message: Dict[str, Any], credentials: BroadcastCredentials) -> None:
+    channel = message["channel"]
+    recipient_id = int(message["recipient_id"])
+    try:
+        if channel == broadcast_repository.CHANNEL_TELEGRAM:
+            result = _deliver_telegram(job, recipient_id, credentials)
+        elif channel == broadcast_repository.CHANNEL_VK:
+            result = _deliver_vk(job, recipient_id, credentials)
+        else:
+            result = DeliveryResult(ok=False, error=f"unknown channel {channel}", permanent=True)
+    except Exception as exc:  # pylint: disable=broad-except
+        log.warning("broadcast: %s delivery to %s failed: %s", channel, recipient_id, exc)
+        result = DeliveryResult(ok=False, error=str(exc))
+
+    try:
+        if result.ok:
+            broadcast_repository.mark_message_sent(message["id"])
+            if channel == broadcast_repository.CHANNEL_TELEGRAM:
+                client_link_repository.mark_link_active(recipient_id)
+            return
+
+        if result.blocked and channel == broadcast_repository.CHANNEL_TELEGRAM:
+            client_link_repository.mark_link_blocked(recipient_id)
+        attempts = int(message.get("attempts") or 1)
+        if result.blocked or result.permanent or attempts >= BROADCAST_MAX_ATTEMPTS:
+            log.warning("broadcast: giving up on %s %s: %s", channel, recipient_id, result.error)
+            broadcast_repository.mark_message_failed(message["id"], (result.error or "")[:500])
+        else:
+            broadcast_repository.reschedule_message(
+                message["id"], _retry_delay(message, result), (result.error or "")[:500]
+            )
+    except Exception:  # pylint: disable=broad-except
+        log.exception("broadcast: failed to record outcome for outbox message %s", message["id"])
+
+
+def run_broadcast_job(job_id: int, credentials: BroadcastCredentials) -> None:
+    """Deliver every queued message of a job, blocking until the outbox drains."""
+
+    with broadcast_repository.job_lock(job_id) as acquired:
+        if not acquired:
+            log.info("broadcast: job %s is already being delivered elsewhere", job_id)
+            return
+        job = broadcast_repository.get_job(job_id)
+        if not job or job.get("status") in {broadcast_repository.JOB_STATUS_DONE, broadcast_repository.JOB_STATUS_FAILED}:
+            return
+
+        try:
+            broadcast_repository.mark_job_started(job_id)
+            if credentials.vk_token:
+                job = _prepare_vk_attachment(job, credentials)
+            if credentials.telegram_token:
+                _prime_telegram_photo(job, credentials)
+            with ThreadPoolExecutor(max_workers=BROADCAST_WORKERS, thread_name_prefix=f"broadcast-{job_id}") as pool:
+                while True:
+                    batch = broadcast_repository.claim_due_messages(job_id, BROADCAST_BATCH_SIZE)
+                    if not batch:
+                        wait = broadcast_repository.seconds_until_next_due(job_id)
+                        if wait is None:
+                            break
+                        time.sleep(min(max(wait, 0.2), 5.0))
+                        continue
+                    list(pool.map(lambda message: _deliver_message(job, message, credentials), batch))
+        except Exception:  # pylint: disable=broad-except
+            log.exception("broadcast: job %s aborted", job_id)
+            broadcast_repository.mark_job_finished(job_id, broadcast_repository.JOB_STATUS_FAILED)
+            return
+        broadcast_repository.mark_job_finished(job_id)
+        log.info("broadcast: job %s delivered", job_id)
+
+
+def _run_in_background(job_id: int, credentials: BroadcastCredentials) -> None:
+    try:
+        run_broadcast_job(job_id, credentials)
+    finally:
+        with _ACTIVE_LOCK:
+            _ACTIVE_JOBS.discard(job_id)
+
+
+def start_broadcast_job(job_id: int, credentials: BroadcastCredentials) -> bool:
+    """Deliver a job on a daemon thread; returns ``False`` if it is already running here."""
+
+    with _ACTIVE_LOCK:
+        if job_id in _ACTIVE_JOBS:
+            return False
+        _ACTIVE_JOBS.add(job_id)
+    thread = threading.Thread(
+        target=_run_in_background,
+        args=(job_id, credentials),
+        name=f"broadcast-job-{job_id}",
+        daemon=True,
+    )
+    thread.start()
+    return True
+
+
+def resume_broadcast_jobs(credentials: BroadcastCredentials) -> int:
+    """Start delivery of queued jobs and of jobs interrupted by a restart."""
+
+    resumed = 0
+    for job in broadcast_repository.list_unfinished_jobs():
+        if start_broadcast_job(int(job["id"]), credentials):
+            resumed += 1
+    if resumed:
+        log.info("broadcast: started %s unfinished job(s)", resumed)
+    return resumed
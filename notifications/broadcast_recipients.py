@@ -0,0 +1,330 @@
+"""Parse broadcast recipient filters and resolve them to outbox rows in SQL.
+
+Shared by the webapp (immediate sends) and the scheduler (scheduled sends),
+so that filters stored with a scheduled job are evaluated at delivery time.
+"""
+from __future__ import annotations
+
+import json
+from dataclasses import asdict, dataclass, field
+from datetime import date, timedelta
+from typing import Any, Dict, List, Mapping, Optional, Set, Tuple
+
+from repositories import broadcast_repository, race_repository, schedule_repository
+
+FilterClientSet = Tuple[Set[int], str]
+Recipient = Tuple[str, int, Optional[int]]
+
+GENDER_VALUES = {"male", "female", "unknown"}
+
+
+class RecipientFilterError(Exception):
+    """Invalid broadcast filter payload."""
+
+
+class FilterTargetNotFound(RecipientFilterError):
+    """Race or slot referenced by a filter does not exist."""
+
+
+def parse_bool(value: object) -> bool:
+    if isinstance(value, bool):
+        return value
+    if value is None:
+        return False
+    if isinstance(value, str):
+        return value.strip().lower() in {"1", "true", "yes", "y", "on"}
+    try:
+        return bool(int(value))  # type: ignore[arg-type]
+    except Exception:
+        return bool(value)
+
+
+def _parse_id_list(raw_value: object, field_name: str) -> set[int] | None:
+    if raw_value is None:
+        return None
+
+    values: list[object]
+    if isinstance(raw_value, list):
+        values = list(raw_value)
+    elif isinstance(raw_value, str):
+        text = raw_value.strip()
+        if not text:
+            return set()
+        try:
+            parsed = json.loads(text)
+            if isinstance(parsed, list):
+                values = parsed
+            else:
+                values = [parsed]
+        except Exception:
+            values = [part for part in text.split(",") if part]
+    else:
+        values = [raw_value]
+
+    result: set[int] = set()
+    for value in values:
+        try:
+            int_value = int(value)
+        except (TypeError, ValueError) as exc:
+            raise RecipientFilterError(f"{field_name} must contain integers") from exc
+        if int_value <= 0:
+            raise RecipientFilterError(f"{field_name} must be positive integers")
+        result.add(int_value)
+
+    return result
+
+
+def _parse_positive_int(raw_value: object, field_name: str) -> int:
+    try:
+        value = int(raw_value)  # type: ignore[arg-type]
+    except (TypeError, ValueError) as exc:
+        raise RecipientFilterError(f"{field_name} must be an integer") from exc
+    if value <= 0:
+        raise RecipientFilterError(f"{field_name} must be positive")
+    return value
+
+
+def _parse_gender(raw_value: object) -> Optional[str]:
+    if raw_value is None:
+        return None
+    candidate = raw_value[0] if isinstance(raw_value, (list, tuple)) else raw_value
+    if candidate is None:
+        return None
+    if not isinstance(candidate, str):
+        raise RecipientFilterError("filterGender must be a string")
+    normalized = candidate.strip().lower()
+    if normalized in {"all", "any", ""}:
+        return None
+    if normalized not in GENDER_VALUES:
+        raise RecipientFilterError("filterGender must be one of male, female, unknown, or omitted")
+    return normalized
+
+
+@dataclass
+class RecipientFilters:
+    """Recipient selection of a broadcast, serializable into job options."""
+
+    send_telegram: bool = True
+    send_vk: bool = False
+    client_ids: Optional[List[int]] = None
+    race_id: Optional[int] = None
+    race_unpaid_only: bool = False
+    gender: Optional[str] = None
+    has_booking_today: bool = False
+    has_booking_tomorrow: bool = False
+    booking_date: Optional[str] = None
+    slot_id: Optional[int] = None
+    no_booking_today: bool = False
+    no_booking_tomorrow: bool = False
+
+    @classmethod
+    def from_request(cls, payload: Mapping[str, Any], *, default_send_vk: bool) -> "RecipientFilters":
+        """Build filters from the webapp broadcast payload (camelCase keys)."""
+
+        send_vk = default_send_vk
+        if "sendVk" in payload or "send_vk" in payload:
+            send_vk = parse_bool(payload.get("sendVk") or payload.get("send_vk"))
+        send_telegram = True
+        if "sendTelegram" in payload or "send_telegram" in payload:
+            send_telegram = parse_bool(payload.get("sendTelegram") or payload.get("send_telegram"))
+
+        client_ids: Optional[List[int]] = None
+        client_ids_raw = payload.get("clientIds") or payload.get("client_ids")
+        if client_ids_raw is not None:
+            parsed_ids = _parse_id_list(client_ids_raw, "clientIds")
+            if parsed_ids is not None and len(parsed_ids) == 0:
+                raise RecipientFilterError("clientIds cannot be empty")
+            client_ids = sorted(parsed_ids) if parsed_ids is not None else None
+
+        race_id_raw = payload.get("raceId") or payload.get("race_id")
+        race_id = _parse_positive_int(race_id_raw, "raceId") if race_id_raw is not None else None
+
+        booking_date: Optional[str] = None
+        booking_date_raw = payload.get("filterBookingDate")
+        if booking_date_raw:
+            try:
+                booking_date = date.fromisoformat(str(booking_date_raw)).isoformat()
+            except Exception as exc:  # pylint: disable=broad-except
+                raise RecipientFilterError("filterBookingDate must be YYYY-MM-DD") from exc
+
+        slot_id_raw = payload.get("filterSlotId") or payload.get("slotId")
+        slot_id = _parse_positive_int(slot_id_raw, "filterSlotId") if slot_id_raw else None
+
+        return cls(
+            send_telegram=send_telegram,
+            send_vk=send_vk,
+            client_ids=client_ids,
+            race_id=race_id,
+            race_unpaid_only=parse_bool(payload.get("filterRaceUnpaid") or payload.get("raceUnpaid")),
+            gender=_parse_gender(payload.get("filterGender")),
+            has_booking_today=parse_bool(payload.get("filterHasBookingToday")),
+            has_booking_tomorrow=parse_bool(payload.get("filterHasBookingTomorrow")),
+            booking_date=booking_date,
+            slot_id=slot_id,
+            no_booking_today=parse_bool(payload.get("filterNoBookingToday")),
+            no_booking_tomorrow=parse_bool(payload.get("filterNoBookingTomorrow")),
+        )
+
+    @classmethod
+    def from_options(cls, options: Mapping[str, Any]) -> "RecipientFilters":
+        """Restore filters stored with :meth:`to_options`."""
+
+        known = {name for name in cls.__dataclass_fields__}  # type: ignore[attr-defined]
+        return cls(**{key: value for key, value in dict(options).items() if key in known})
+
+    def to_options(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    def channels(self) -> List[str]:
+        channels: List[str] = []
+        if self.send_telegram:
+            channels.append(broadcast_repository.CHANNEL_TELEGRAM)
+        if self.send_vk:
+            channels.append(broadcast_repository.CHANNEL_VK)
+        return channels
+
+    def race_statuses(self) -> List[str]:
+        if self.race_unpaid_only:
+            return [race_repository.RACE_STATUS_PENDING]
+        return [race_repository.RACE_STATUS_APPROVED, race_repository.RACE_STATUS_PENDING]
+
+    def query_kwargs(self, today: Optional[date] = None) -> Dict[str, Any]:
+        """Keyword arguments for ``broadcast_repository.select_recipients``."""
+
+        today = today or date.today()
+        tomorrow = today + timedelta(days=1)
+        include_dates: List[date] = []
+        if self.has_booking_today:
+            include_dates.append(today)
+        if self.has_booking_tomorrow:
+            include_dates.append(tomorrow)
+        if self.booking_date:
+            include_dates.append(date.fromisoformat(self.booking_date))
+        exclude_dates: List[date] = []
+        if self.no_booking_today:
+            exclude_dates.append(today)
+        if self.no_booking_tomorrow:
+            exclude_dates.append(tomorrow)
+        return {
+            "channels": self.channels(),
+            "client_ids": self.client_ids,
+            "race_id": self.race_id,
+            "race_statuses": self.race_statuses(),
+            "gender": self.gender,
+            "include_dates": include_dates,
+            "include_slot_id": self.slot_id,
+            "exclude_dates": exclude_dates,
+        }
+
+
+@dataclass
+class RecipientResolution:
+    recipients: List[Recipient] = field(default_factory=list)
+    empty_reason: Optional[str] = None
+
+
+def collect_clients_with_bookings_on_date(target_date: date) -> FilterClientSet:
+    """Return client IDs that have bookings on a specific date."""
+
+    reservations = schedule_repository.list_reservations_by_date(target_date)
+    booked_ids = {int(res["client_id"]) for res in reservations or [] if res.get("client_id")}
+    note = f"Бронь на {target_date.isoformat()}"
+    if not booked_ids:
+        return set(), "Нет броней в расписании"
+    return booked_ids, note
+
+
+def collect_clients_without_bookings(target_date: date) -> FilterClientSet:
+    """Return client IDs that have bookings on a specific date (legacy exclude helper)."""
+
+    booked_ids, note = collect_clients_with_bookings_on_date(target_date)
+    return booked_ids, f"Исключены клиенты с {note.lower()}"
+
+
+def collect_clients_with_bookings_for_slot(slot_id: int) -> FilterClientSet:
+    """Return client IDs that have bookings for a specific slot."""
+
+    slot = schedule_repository.get_slot_with_reservations(slot_id)
+    if not slot:
+        raise FilterTargetNotFound("Slot not found")
+
+    reservations = slot.get("reservations") or []
+    booked_ids = {int(res["client_id"]) for res in reservations if res.get("client_id")}
+
+    label_parts = [str(slot.get("slot_date") or "")]
+    start_time = slot.get("start_time")
+    end_time = slot.get("end_time")
+    if start_time and end_time:
+        label_parts.append(f"{start_time}-{end_time}")
+    slot_label = " ".join(part for part in label_parts if part).strip() or "слот"
+    if slot.get("label"):
+        slot_label = f"{slot_label} · {slot['label']}"
+
+    note = f"Бронь в слоте {slot_label}"
+    return booked_ids, note
+
+
+def _collect_race_participants(race_id: int, unpaid_only: bool) -> set[int]:
+    registrations = race_repository.list_registrations(race_id)
+    allowed_statuses = {
+        race_repository.RACE_STATUS_APPROVED,
+        race_repository.RACE_STATUS_PENDING,
+    }
+    if unpaid_only:
+        allowed_statuses = {race_repository.RACE_STATUS_PENDING}
+    return {
+        int(reg["client_id"])
+        for reg in registrations or []
+        if reg.get("client_id") and str(reg.get("status") or "").lower() in allowed_statuses
+    }
+
+
+def check_filter_targets(filters: RecipientFilters) -> None:
+    """Raise :class:`FilterTargetNotFound` if a referenced race or slot is missing."""
+
+    if filters.race_id is not None and not race_repository.get_race(filters.race_id):
+        raise FilterTargetNotFound("Race not found")
+    if filters.slot_id is not None and not schedule_repository.get_slot(filters.slot_id):
+        raise FilterTargetNotFound("Slot not found")
+
+
+def resolve_recipients(filters: RecipientFilters, *, today: Optional[date] = None) -> RecipientResolution:
+    """Evaluate *filters* with a single SQL query over links, bookings and registrations.
+
+    Booking filters relative to "today"/"tomorrow" use *today* (defaults to the
+    current date), so a scheduled job picks its audience on the day it is sent.
+    """
+
+    check_filter_targets(filters)
+    recipients = broadcast_repository.select_recipients(**filters.query_kwargs(today))
+    if recipients:
+        return RecipientResolution(recipients=recipients)
+    return RecipientResolution(empty_reason=_empty_reason(filters))
+
+
+def preview_recipient_count(filters: RecipientFilters, *, today: Optional[date] = None) -> Dict[str, int]:
+    """Return recipient counts per channel without materialising the list."""
+
+    check_filter_targets(filters)
+    counts = broadcast_repository.count_recipients(**filters.query_kwargs(today))
+    return {channel: counts.get(channel, 0) for channel in filters.channels()}
+
+
+def _empty_reason(filters: RecipientFilters) -> str:
+    """Explain an empty audience; only runs on the (rare) empty path."""
+
+    if filters.race_id is not None and not _collect_race_participants(filters.race_id, filters.race_unpaid_only):
+        return "Не найдены участники выбранной гонки"
+    if broadcast_repository.count_links(filters.channels()) == 0:
+        if filters.send_vk and not filters.send_telegram:
+            return "Нет подключённых VK-пользователей"
+        return "Нет подключённых пользователей"
+    if filters.client_ids is not None:
+        return "Нет получателей среди выбранных клиентов"
+    if filters.race_id is not None:
+        return "Нет получателей среди участников гонки"
+    if filters.has_booking_today or filters.has_booking_tomorrow or filters.booking_date or filters.slot_id is not None:
+        return "Нет получателей с бронью по выбранным условиям"
+    if filters.no_booking_today or filters.no_booking_tomorrow:
+        return "Нет получателей без броней на выбранные дни"
+    return "Нет получателей по выбранным фильтрам"
@@ -19,4 +19,9 @@ __all__ = [
     "client_balance_repository",
     "wattattack_account_repository",
     "client_groups_repository",
+    "account_profile_state_repository",
+    "broadcast_repository",
+    "conversation_state_repository",
+    "activity_analytics_repository",
+    "fit_archive_repository",
 ]
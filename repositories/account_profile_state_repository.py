@@ -0,0 +1,67 @@
+"""Remember the last client profile applied to each WattAttack account."""
+from __future__ import annotations
+
+from typing import Any, Dict, Optional
+
+from psycopg2.extras import Json
+
+from .db_utils import db_connection, dict_cursor
+
+
+def ensure_table() -> None:
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS wattattack_profile_state (
+                account_id TEXT PRIMARY KEY,
+                state JSONB NOT NULL DEFAULT '{}'::jsonb,
+                state_hash TEXT NOT NULL,
+                applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            )
+            """
+        )
+        conn.commit()
+
+
+def get_profile_state(account_id: str) -> Optional[Dict[str, Any]]:
+    """Return ``{"state", "state_hash", "applied_at"}`` or ``None``."""
+
+    ensure_table()
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute(
+            """
+            SELECT account_id, state, state_hash, applied_at
+            FROM wattattack_profile_state
+            WHERE account_id = %s
+            """,
+            (account_id,),
+        )
+        row = cur.fetchone()
+    return dict(row) if row else None
+
+
+def save_profile_state(account_id: str, state: Dict[str, Any], state_hash: str) -> None:
+    ensure_table()
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute(
+            """
+            INSERT INTO wattattack_profile_state (account_id, state, state_hash, applied_at)
+            VALUES (%s, %s, %s, NOW())
+            ON CONFLICT (account_id) DO UPDATE SET
+                state = EXCLUDED.state,
+                state_hash = EXCLUDED.state_hash,
+                applied_at = NOW()
+            """,
+            (account_id, Json(state), state_hash),
+        )
+        conn.commit()
+
+
+def clear_profile_state(account_id: str) -> None:
+    ensure_table()
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute(
+            "DELETE FROM wattattack_profile_state WHERE account_id = %s",
+            (account_id,),
+        )
+        conn.commit()
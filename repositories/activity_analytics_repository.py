@@ -0,0 +1,630 @@
+"""Per-activity power analytics computed from archived FIT files.
+
+One row per ``(account_id, activity_id)`` of ``seen_activity_ids``; the
+mean-maximal curve and zone times are stored as integer arrays aligned with
+``power_curve_durations`` and the workout library's power zones.
+
+``client_power_bests`` keeps each client's all-time best power per duration
+and the ride it came from. New rides are merged with an element-wise max, so
+history is only rescanned when an activity is moved to another client.
+``client_ftp_estimates`` holds the FTP suggested from those bests.
+
+``client_ride_totals`` and ``client_monthly_load`` are per-client sums of the
+analysed rides, refreshed on ingest so the power leaderboards read one row
+per client instead of scanning rides.
+"""
+from __future__ import annotations
+
+import os
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Sequence
+from zoneinfo import ZoneInfo
+
+from psycopg2.extras import execute_values
+
+from .db_utils import db_connection, dict_cursor
+
+LOCAL_TIMEZONE_NAME = os.environ.get("WATTATTACK_LOCAL_TZ", "Europe/Moscow")
+
+# leaderboard metric -> (title, unit)
+POWER_LEADERBOARD_METRICS: Dict[str, tuple] = {
+    "wkg5": ("Лучшие 5 мин", "Вт/кг"),
+    "wkg20": ("Лучшие 20 мин", "Вт/кг"),
+    "kj": ("Работа", "кДж"),
+    "tss_month": ("TSS за месяц", "TSS"),
+    "longest": ("Самая длинная поездка", "мин"),
+}
+
+# The client a ride counts for (``a`` = analytics, ``s`` = seen_activity_ids,
+# LEFT JOINed): a manual choice wins over the matched client, the client given
+# at ingest is the last resort. Totals, bests and ride lists all use it.
+_RIDE_CLIENT_SQL = "COALESCE(s.manual_client_id, s.client_id, a.client_id)"
+
+ANALYTICS_COLUMNS = (
+    "client_id",
+    "ftp",
+    "duration_seconds",
+    "average_power",
+    "max_power",
+    "normalized_power",
+    "intensity_factor",
+    "tss",
+    "variability_index",
+    "work_kj",
+    "average_heartrate",
+    "max_heartrate",
+    "hr_drift_pct",
+    "power_curve_durations",
+    "power_curve",
+    "zone_seconds",
+)
+
+
+def ensure_table() -> None:
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS activity_power_analytics (
+                account_id TEXT NOT NULL,
+                activity_id TEXT NOT NULL,
+                client_id INTEGER,
+                ftp REAL,
+                duration_seconds INTEGER NOT NULL,
+                average_power REAL,
+                max_power INTEGER,
+                normalized_power REAL,
+                intensity_factor REAL,
+                tss REAL,
+                variability_index REAL,
+                work_kj REAL,
+                average_heartrate REAL,
+                max_heartrate INTEGER,
+                hr_drift_pct REAL,
+                power_curve_durations INTEGER[] NOT NULL,
+                power_curve INTEGER[] NOT NULL,
+                zone_seconds INTEGER[],
+                computed_at TIMESTAMPTZ DEFAULT NOW(),
+                PRIMARY KEY (account_id, activity_id)
+            )
+            """
+        )
+        cur.execute(
+            """
+            CREATE INDEX IF NOT EXISTS activity_power_analytics_client_idx
+            ON activity_power_analytics (client_id)
+            """
+        )
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS client_power_bests (
+                client_id INTEGER NOT NULL,
+                duration_seconds INTEGER NOT NULL,
+                power INTEGER NOT NULL,
+                account_id TEXT NOT NULL,
+                activity_id TEXT NOT NULL,
+                achieved_at TIMESTAMPTZ,
+                updated_at TIMESTAMPTZ DEFAULT NOW(),
+                PRIMARY KEY (client_id, duration_seconds)
+            )
+            """
+        )
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS client_ftp_estimates (
+                client_id INTEGER PRIMARY KEY,
+                estimated_ftp INTEGER NOT NULL,
+                method TEXT NOT NULL,
+                cp REAL,
+                w_prime INTEGER,
+                updated_at TIMESTAMPTZ DEFAULT NOW()
+            )
+            """
+        )
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS client_ride_totals (
+                client_id INTEGER PRIMARY KEY,
+                rides_analyzed INTEGER NOT NULL,
+                total_kj REAL NOT NULL,
+                total_tss REAL NOT NULL,
+                total_seconds INTEGER NOT NULL,
+                longest_ride_seconds INTEGER NOT NULL,
+                longest_account_id TEXT,
+                longest_activity_id TEXT,
+                last_activity_at TIMESTAMPTZ,
+                updated_at TIMESTAMPTZ DEFAULT NOW()
+            )
+            """
+        )
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS client_monthly_load (
+                client_id INTEGER NOT NULL,
+                month DATE NOT NULL,
+                rides INTEGER NOT NULL,
+                tss REAL NOT NULL,
+                work_kj REAL NOT NULL,
+                PRIMARY KEY (client_id, month)
+            )
+            """
+        )
+        cur.execute(
+            """
+            CREATE INDEX IF NOT EXISTS client_monthly_load_month_idx
+            ON client_monthly_load (month, tss DESC)
+            """
+        )
+        conn.commit()
+
+
+def save_activity_analytics(
+    account_id: str,
+    activity_id: str,
+    metrics: Dict[str, Any],
+    *,
+    client_id: Optional[int] = None,
+) -> None:
+    """Insert or replace analytics of one activity (``metrics`` from ``fit_analytics``)."""
+
+    ensure_table()
+    values = {column: metrics.get(column) for column in ANALYTICS_COLUMNS}
+    values.update(account_id=account_id, activity_id=activity_id, client_id=client_id)
+    columns = ", ".join(("account_id", "activity_id", *ANALYTICS_COLUMNS))
+    placeholders = ", ".join(f"%({column})s" for column in ("account_id", "activity_id", *ANALYTICS_COLUMNS))
+    updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in ANALYTICS_COLUMNS)
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute(
+            f"""
+            INSERT INTO activity_power_analytics ({columns}, computed_at)
+            VALUES ({placeholders}, NOW())
+            ON CONFLICT (account_id, activity_id) DO UPDATE SET
+                {updates},
+                computed_at = NOW()
+            """,
+            values,
+        )
+        conn.commit()
+
+
+def get_activity_analytics(account_id: str, activity_id: str) -> Optional[Dict[str, Any]]:
+    ensure_table()
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute(
+            """
+            SELECT * FROM activity_power_analytics
+            WHERE account_id = %s AND activity_id = %s
+            """,
+            (account_id, activity_id),
+        )
+        row = cur.fetchone()
+    return dict(row) if row else None
+
+
+def list_client_analytics(client_id: int, limit: int = 50) -> List[Dict[str, Any]]:
+    """Latest analysed rides of a client, newest activity first."""
+
+    ensure_table()
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute(
+            f"""
+            SELECT a.*, s.start_time
+            FROM activity_power_analytics AS a
+            LEFT JOIN seen_activity_ids AS s
+              ON s.account_id = a.account_id AND s.activity_id = a.activity_id
+            WHERE {_RIDE_CLIENT_SQL} = %s
+            ORDER BY s.start_time DESC NULLS LAST, a.computed_at DESC
+            LIMIT %s
+            """,
+            (client_id, limit),
+        )
+        rows = cur.fetchall()
+    return [dict(row) for row in rows]
+
+
+def list_activities_pending_analytics(*, include_analysed: bool = False) -> List[Dict[str, Any]]:
+    """Seen activities with an archived FIT and, by default, no analytics row yet."""
+
+    ensure_table()
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute(
+            """
+            SELECT s.account_id, s.activity_id, COALESCE(s.manual_client_id, s.client_id) AS client_id
+            FROM seen_activity_ids AS s
+            WHERE s.fit_path IS NOT NULL
+              AND (%s OR NOT EXISTS (
+                  SELECT 1 FROM activity_power_analytics AS a
+                  WHERE a.account_id = s.account_id AND a.activity_id = s.activity_id
+              ))
+            ORDER BY s.start_time NULLS LAST, s.account_id, s.activity_id
+            """,
+            (include_analysed,),
+        )
+        rows = cur.fetchall()
+    return [dict(row) for row in rows]
+
+
+def merge_client_power_bests(
+    client_id: int,
+    account_id: str,
+    activity_id: str,
+    durations: Sequence[int],
+    curve: Sequence[int],
+    achieved_at: Optional[datetime] = None,
+) -> int:
+    """Raise the client's bests to this ride's curve where it is higher.
+
+    Returns the number of durations where the ride set a new best.
+    """
+
+    rows = [
+        (client_id, int(duration), int(power), account_id, activity_id, achieved_at)
+        for duration, power in zip(durations, curve)
+        if power is not None
+    ]
+    if not rows:
+        return 0
+    ensure_table()
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        execute_values(
+            cur,
+            """
+            INSERT INTO client_power_bests (
+                client_id, duration_seconds, power, account_id, activity_id, achieved_at, updated_at
+            )
+            VALUES %s
+            ON CONFLICT (client_id, duration_seconds) DO UPDATE SET
+                power = EXCLUDED.power,
+                account_id = EXCLUDED.account_id,
+                activity_id = EXCLUDED.activity_id,
+                achieved_at = EXCLUDED.achieved_at,
+                updated_at = NOW()
+            WHERE EXCLUDED.power > client_power_bests.power
+            """,
+            rows,
+            template="(%s, %s, %s, %s, %s, %s, NOW())",
+        )
+        improved = cur.rowcount
+        conn.commit()
+    return max(0, improved)
+
+
+def get_client_power_bests(client_id: int) -> List[Dict[str, Any]]:
+    """All-time best power per duration, shortest duration first."""
+
+    ensure_table()
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute(
+            """
+            SELECT duration_seconds, power, account_id, activity_id, achieved_at, updated_at
+            FROM client_power_bests
+            WHERE client_id = %s
+            ORDER BY duration_seconds
+            """,
+            (client_id,),
+        )
+        rows = cur.fetchall()
+    return [dict(row) for row in rows]
+
+
+def rebuild_client_power_bests(client_id: int) -> None:
+    """Recompute a client's bests from the stored ride curves (no FIT decoding)."""
+
+    ensure_table()
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute("DELETE FROM client_power_bests WHERE client_id = %s", (client_id,))
+        cur.execute(
+            f"""
+            INSERT INTO client_power_bests (
+                client_id, duration_seconds, power, account_id, activity_id, achieved_at, updated_at
+            )
+            SELECT DISTINCT ON (curve.duration_seconds)
+                %(client_id)s, curve.duration_seconds, curve.power, a.account_id, a.activity_id, s.start_time, NOW()
+            FROM activity_power_analytics AS a
+            LEFT JOIN seen_activity_ids AS s
+              ON s.account_id = a.account_id AND s.activity_id = a.activity_id
+            CROSS JOIN LATERAL unnest(a.power_curve_durations, a.power_curve) AS curve(duration_seconds, power)
+            WHERE {_RIDE_CLIENT_SQL} = %(client_id)s
+              AND curve.power IS NOT NULL
+            ORDER BY curve.duration_seconds, curve.power DESC, s.start_time NULLS LAST
+            """,
+            {"client_id": client_id},
+        )
+        conn.commit()
+
+
+def reassign_activity_client(
+    account_id: str,
+    activity_id: str,
+    previous_client_id: Optional[int],
+    client_id: Optional[int],
+) -> None:
+    """Follow a manual client change of an activity in the analytics tables."""
+
+    ensure_table()
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute(
+            """
+            UPDATE activity_power_analytics SET client_id = %s
+            WHERE account_id = %s AND activity_id = %s
+            RETURNING power_curve_durations, power_curve
+            """,
+            (client_id, account_id, activity_id),
+        )
+        row = cur.fetchone()
+        conn.commit()
+    if not row or previous_client_id == client_id:
+        return
+    if previous_client_id:
+        rebuild_client_power_bests(previous_client_id)
+        refresh_client_ride_aggregates(previous_client_id)
+    if client_id:
+        refresh_client_ride_aggregates(client_id)
+        achieved_at = None
+        with db_connection() as conn, dict_cursor(conn) as cur:
+            cur.execute(
+                "SELECT start_time FROM seen_activity_ids WHERE account_id = %s AND activity_id = %s",
+                (account_id, activity_id),
+            )
+            seen = cur.fetchone()
+        if seen:
+            achieved_at = seen.get("start_time")
+        merge_client_power_bests(
+            client_id,
+            account_id,
+            activity_id,
+            row["power_curve_durations"],
+            row["power_curve"],
+            achieved_at,
+        )
+
+
+def rename_account(cur, old_account_id: str, new_account_id: str) -> int:
+    """Move analytics rows to a new account id inside the caller's transaction.
+
+    Must run together with the ``seen_activity_ids`` rename: the bests and
+    leaderboard sums join the two tables on ``account_id``. Rows already
+    present under the new id win, as in ``fit_archive_repository.rename_account``.
+    """
+
+    params = {"old": old_account_id, "new": new_account_id}
+    cur.execute(
+        """
+        UPDATE activity_power_analytics AS src
+        SET account_id = %(new)s
+        WHERE src.account_id = %(old)s
+          AND NOT EXISTS (
+              SELECT 1 FROM activity_power_analytics AS dst
+              WHERE dst.account_id = %(new)s AND dst.activity_id = src.activity_id
+          )
+        """,
+        params,
+    )
+    moved = cur.rowcount
+    cur.execute("DELETE FROM activity_power_analytics WHERE account_id = %(old)s", params)
+    cur.execute("UPDATE client_power_bests SET account_id = %(new)s WHERE account_id = %(old)s", params)
+    cur.execute(
+        "UPDATE client_ride_totals SET longest_account_id = %(new)s WHERE longest_account_id = %(old)s",
+        params,
+    )
+    return moved
+
+
+def save_client_ftp_estimate(client_id: int, estimate: Optional[Dict[str, Any]]) -> None:
+    """Store the suggested FTP of a client; ``None`` removes a stale one."""
+
+    ensure_table()
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        if not estimate:
+            cur.execute("DELETE FROM client_ftp_estimates WHERE client_id = %s", (client_id,))
+        else:
+            cur.execute(
+                """
+                INSERT INTO client_ftp_estimates (client_id, estimated_ftp, method, cp, w_prime, updated_at)
+                VALUES (%s, %s, %s, %s, %s, NOW())
+                ON CONFLICT (client_id) DO UPDATE SET
+                    estimated_ftp = EXCLUDED.estimated_ftp,
+                    method = EXCLUDED.method,
+                    cp = EXCLUDED.cp,
+                    w_prime = EXCLUDED.w_prime,
+                    updated_at = NOW()
+                """,
+                (
+                    client_id,
+                    estimate["ftp"],
+                    estimate["method"],
+                    estimate.get("cp"),
+                    estimate.get("w_prime"),
+                ),
+            )
+        conn.commit()
+
+
+def get_client_ftp_estimate(client_id: int) -> Optional[Dict[str, Any]]:
+    ensure_table()
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute(
+            "SELECT * FROM client_ftp_estimates WHERE client_id = %s",
+            (client_id,),
+        )
+        row = cur.fetchone()
+    return dict(row) if row else None
+
+
+def refresh_client_ride_aggregates(client_id: int) -> None:
+    """Recompute the leaderboard sums of one client from their analysed rides."""
+
+    ensure_table()
+    params = {"client_id": client_id, "tz": LOCAL_TIMEZONE_NAME}
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute("DELETE FROM client_ride_totals WHERE client_id = %(client_id)s", params)
+        cur.execute("DELETE FROM client_monthly_load WHERE client_id = %(client_id)s", params)
+        cur.execute(
+            f"""
+            WITH rides AS (
+                SELECT a.*, COALESCE(s.start_time, a.computed_at) AS ride_at
+                FROM activity_power_analytics AS a
+                LEFT JOIN seen_activity_ids AS s
+                  ON s.account_id = a.account_id AND s.activity_id = a.activity_id
+                WHERE {_RIDE_CLIENT_SQL} = %(client_id)s
+            ),
+            longest AS (
+                SELECT account_id, activity_id FROM rides
+                ORDER BY duration_seconds DESC, ride_at
+                LIMIT 1
+            )
+            INSERT INTO client_ride_totals (
+                client_id, rides_analyzed, total_kj, total_tss, total_seconds,
+                longest_ride_seconds, longest_account_id, longest_activity_id, last_activity_at, updated_at
+            )
+            SELECT
+                %(client_id)s,
+                COUNT(*),
+                COALESCE(SUM(work_kj), 0),
+                COALESCE(SUM(tss), 0),
+                COALESCE(SUM(duration_seconds), 0),
+                COALESCE(MAX(duration_seconds), 0),
+                (SELECT account_id FROM longest),
+                (SELECT activity_id FROM longest),
+                MAX(ride_at),
+                NOW()
+            FROM rides
+            HAVING COUNT(*) > 0
+            """,
+            params,
+        )
+        cur.execute(
+            f"""
+            INSERT INTO client_monthly_load (client_id, month, rides, tss, work_kj)
+            SELECT
+                %(client_id)s,
+                date_trunc('month', COALESCE(s.start_time, a.computed_at) AT TIME ZONE %(tz)s)::date,
+                COUNT(*),
+                COALESCE(SUM(a.tss), 0),
+                COALESCE(SUM(a.work_kj), 0)
+            FROM activity_power_analytics AS a
+            LEFT JOIN seen_activity_ids AS s
+              ON s.account_id = a.account_id AND s.activity_id = a.activity_id
+            WHERE {_RIDE_CLIENT_SQL} = %(client_id)s
+            GROUP BY 2
+            """,
+            params,
+        )
+        conn.commit()
+
+
+def _current_month() -> date:
+    return datetime.now(ZoneInfo(LOCAL_TIMEZONE_NAME)).date().replace(day=1)
+
+
+def get_power_leaderboard(
+    metric: str,
+    limit: int = 100,
+    *,
+    month: Optional[date] = None,
+    direction: str = "desc",
+) -> Dict[str, object]:
+    """Rank clients by a precomputed power metric (see ``POWER_LEADERBOARD_METRICS``).
+
+    Returns ``{"items": [...], "summary": {...}}`` like the distance
+    leaderboard; each item carries ``metric_value`` in the metric's unit.
+    ``direction="asc"`` ranks from the lowest value up.
+    """
+
+    if metric not in POWER_LEADERBOARD_METRICS:
+        raise ValueError(f"Unknown leaderboard metric: {metric}")
+    ensure_table()
+    safe_limit = max(1, min(limit, 500))
+    order_dir = "ASC" if str(direction).lower() == "asc" else "DESC"
+    target_month = (month or _current_month()).replace(day=1)
+    name_sql = """
+        COALESCE(
+            NULLIF(TRIM(c.full_name), ''),
+            CONCAT_WS(' ', NULLIF(TRIM(c.first_name), ''), NULLIF(TRIM(c.last_name), '')),
+            'Без имени'
+        )
+    """
+
+    if metric in ("wkg5", "wkg20"):
+        query = f"""
+            SELECT b.client_id, {name_sql} AS client_name,
+                   b.power::float / c.weight AS metric_value,
+                   b.power AS metric_watts,
+                   t.rides_analyzed, t.last_activity_at
+            FROM client_power_bests AS b
+            JOIN clients AS c ON c.id = b.client_id
+            LEFT JOIN client_ride_totals AS t ON t.client_id = b.client_id
+            WHERE b.duration_seconds = %(duration)s AND c.weight > 0
+            ORDER BY metric_value {order_dir}, client_name ASC
+            LIMIT %(limit)s
+        """
+    elif metric == "tss_month":
+        query = f"""
+            SELECT m.client_id, {name_sql} AS client_name,
+                   m.tss AS metric_value,
+                   m.rides AS rides_analyzed, t.last_activity_at
+            FROM client_monthly_load AS m
+            JOIN clients AS c ON c.id = m.client_id
+            LEFT JOIN client_ride_totals AS t ON t.client_id = m.client_id
+            WHERE m.month = %(month)s AND m.tss > 0
+            ORDER BY metric_value {order_dir}, client_name ASC
+            LIMIT %(limit)s
+        """
+    else:
+        column = "t.total_kj" if metric == "kj" else "t.longest_ride_seconds / 60.0"
+        query = f"""
+            SELECT t.client_id, {name_sql} AS client_name,
+                   {column} AS metric_value,
+                   t.rides_analyzed, t.last_activity_at
+            FROM client_ride_totals AS t
+            JOIN clients AS c ON c.id = t.client_id
+            WHERE {column} > 0
+            ORDER BY metric_value {order_dir}, client_name ASC
+            LIMIT %(limit)s
+        """
+
+    params = {
+        "duration": 300 if metric == "wkg5" else 1200,
+        "month": target_month,
+        "limit": safe_limit,
+    }
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute(query, params)
+        rows = cur.fetchall()
+        cur.execute(
+            """
+            SELECT
+                COUNT(*) AS athletes,
+                COALESCE(SUM(rides_analyzed), 0) AS rides_analyzed,
+                COALESCE(SUM(total_kj), 0) AS total_kj
+            FROM client_ride_totals
+            """
+        )
+        totals_row = cur.fetchone() or {}
+
+    items: List[Dict[str, object]] = []
+    for rank, row in enumerate(rows, start=1):
+        last_activity = row.get("last_activity_at")
+        item: Dict[str, object] = {
+            "rank": rank,
+            "client_id": row.get("client_id"),
+            "name": (row.get("client_name") or "").strip() or "Без имени",
+            "rides": int(row.get("rides_analyzed") or 0),
+            "metric": metric,
+            "metric_value": float(row.get("metric_value") or 0),
+            "last_activity_at": last_activity.isoformat() if hasattr(last_activity, "isoformat") else None,
+        }
+        if row.get("metric_watts") is not None:
+            item["metric_watts"] = int(row["metric_watts"])
+        items.append(item)
+
+    title, unit = POWER_LEADERBOARD_METRICS[metric]
+    summary = {
+        "metric": metric,
+        "metric_title": title,
+        "metric_unit": unit,
+        "month": target_month.isoformat() if metric == "tss_month" else None,
+        "athletes": int(totals_row.get("athletes") or 0),
+        "rides_analyzed": int(totals_row.get("rides_analyzed") or 0),
+        "total_kj": float(totals_row.get("total_kj") or 0),
+    }
+    return {"items": items, "summary": summary}
@@ -0,0 +1,546 @@
+"""Persisted outbox for webapp broadcast messages."""
+from __future__ import annotations
+
+from contextlib import contextmanager
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from psycopg2.extras import Json, execute_values
+
+from .client_link_repository import ensure_client_links_table
+from .db_utils import db_connection, dict_cursor
+from .race_repository import ensure_tables as ensure_race_tables
+from .schedule_repository import ensure_schedule_tables
+from .vk_client_link_repository import ensure_vk_client_links_table
+
+JOB_STATUS_SCHEDULED = "scheduled"
+JOB_STATUS_QUEUED = "queued"
+JOB_STATUS_RUNNING = "running"
+JOB_STATUS_DONE = "done"
+JOB_STATUS_FAILED = "failed"
+
+MESSAGE_STATUS_PENDING = "pending"
+MESSAGE_STATUS_SENDING = "sending"
+MESSAGE_STATUS_SENT = "sent"
+MESSAGE_STATUS_FAILED = "failed"
+
+CHANNEL_TELEGRAM = "telegram"
+CHANNEL_VK = "vk"
+
+_JOB_LOCK_NAMESPACE = 7301
+
+
+def ensure_broadcast_tables() -> None:
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS broadcast_jobs (
+                id SERIAL PRIMARY KEY,
+                status TEXT NOT NULL DEFAULT 'queued',
+                message_text TEXT NOT NULL DEFAULT '',
+                parse_mode TEXT NOT NULL DEFAULT 'HTML',
+                image_url TEXT,
+                image_path TEXT,
+                options JSONB NOT NULL DEFAULT '{}'::jsonb,
+                total INTEGER NOT NULL DEFAULT 0,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                started_at TIMESTAMPTZ,
+                finished_at TIMESTAMPTZ
+            )
+            """
+        )
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS broadcast_outbox (
+                id BIGSERIAL PRIMARY KEY,
+                job_id INTEGER NOT NULL REFERENCES broadcast_jobs(id) ON DELETE CASCADE,
+                channel TEXT NOT NULL,
+                recipient_id BIGINT NOT NULL,
+                client_id INTEGER,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                sent_at TIMESTAMPTZ,
+                UNIQUE (job_id, channel, recipient_id)
+            )
+            """
+        )
+        cur.execute(
+            "CREATE INDEX IF NOT EXISTS broadcast_outbox_due_idx "
+            "ON broadcast_outbox (job_id, status, next_attempt_at)"
+        )
+        cur.execute("ALTER TABLE broadcast_jobs ADD COLUMN IF NOT EXISTS image_hash TEXT")
+        cur.execute("ALTER TABLE broadcast_jobs ADD COLUMN IF NOT EXISTS send_at TIMESTAMPTZ")
+        cur.execute(
+            "CREATE INDEX IF NOT EXISTS broadcast_jobs_scheduled_idx "
+            "ON broadcast_jobs (send_at) WHERE status = 'scheduled'"
+        )
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS broadcast_media_cache (
+                image_hash TEXT NOT NULL,
+                channel TEXT NOT NULL,
+                media_ref TEXT NOT NULL,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                PRIMARY KEY (image_hash, channel)
+            )
+            """
+        )
+        conn.commit()
+
+
+def create_job(
+    *,
+    message_text: str,
+    parse_mode: str,
+    image_url: Optional[str],
+    image_path: Optional[str],
+    image_hash: Optional[str] = None,
+    options: Optional[Dict[str, Any]] = None,
+    send_at: Optional[datetime] = None,
+) -> Dict[str, Any]:
+    """Create a job; with *send_at* it waits as ``scheduled`` until the dispatcher picks it up."""
+
+    ensure_broadcast_tables()
+    status = JOB_STATUS_SCHEDULED if send_at is not None else JOB_STATUS_QUEUED
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute(
+            """
+            INSERT INTO broadcast_jobs (status, message_text, parse_mode, image_url, image_path, image_hash, options, send_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            RETURNING *
+            """,
+            (status, message_text, parse_mode, image_url, image_path, image_hash, Json(options or {}), send_at),
+        )
+        row = cur.fetchone()
+        conn.commit()
+    return dict(row)
+
+
+def enqueue_recipients(job_id: int, recipients: Iterable[Tuple[str, int, Optional[int]]]) -> int:
+    """Insert ``(channel, recipient_id, client_id)`` rows into the outbox."""
+
+    rows = [(job_id, channel, int(recipient_id), client_id) for channel, recipient_id, client_id in recipients]
+    if not rows:
+        return 0
+    ensure_broadcast_tables()
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        execute_values(
+            cur,
+            """
+            INSERT INTO broadcast_outbox (job_id, channel, recipient_id, client_id)
+            VALUES %s
+            ON CONFLICT (job_id, channel, recipient_id) DO NOTHING
+            """,
+            rows,
+            page_size=500,
+        )
+        cur.execute(
+            "UPDATE broadcast_jobs SET total = (SELECT COUNT(*) FROM broadcast_outbox WHERE job_id = %s) "
+            "WHERE id = %s RETURNING total",
+            (job_id, job_id),
+        )
+        row = cur.fetchone()
+        conn.commit()
+    return int(row["total"]) if row else 0
+
+
+def _compile_recipient_query(
+    *,
+    channels: Sequence[str],
+    client_ids: Optional[Sequence[int]] = None,
+    race_id: Optional[int] = None,
+    race_statuses: Sequence[str] = (),
+    gender: Optional[str] = None,
+    include_dates: Sequence[date] = (),
+    include_slot_id: Optional[int] = None,
+    exclude_dates: Sequence[date] = (),
+) -> Tuple[str, Dict[str, Any]]:
+    """Build ``(sql, params)`` selecting ``channel, recipient_id, client_id`` rows.
+
+    Booking inclusions (dates and slot) are OR-ed together, every other
+    filter narrows the result, mirroring the messaging page semantics.
+    """
+
+    sources: List[str] = []
+    if CHANNEL_TELEGRAM in channels:
+        sources.append(
+            "SELECT 'telegram' AS channel, tg_user_id AS recipient_id, client_id "
+            "FROM client_links WHERE tg_user_id IS NOT NULL"
+        )
+    if CHANNEL_VK in channels:
+        sources.append(
+            "SELECT 'vk' AS channel, vk_user_id AS recipient_id, client_id "
+            "FROM vk_client_links WHERE vk_user_id IS NOT NULL"
+        )
+    if not sources:
+        sources.append("SELECT NULL::text AS channel, NULL::bigint AS recipient_id, NULL::integer AS client_id WHERE FALSE")
+
+    conditions: List[str] = ["l.client_id > 0"]
+    params: Dict[str, Any] = {}
+    if client_ids is not None:
+        conditions.append("l.client_id = ANY(%(client_ids)s)")
+        params["client_ids"] = list(client_ids)
+    if race_id is not None:
+        conditions.append(
+            "EXISTS (SELECT 1 FROM race_registrations reg WHERE reg.client_id = l.client_id "
+            "AND reg.race_id = %(race_id)s AND LOWER(COALESCE(reg.status, '')) = ANY(%(race_statuses)s))"
+        )
+        params["race_id"] = race_id
+        params["race_statuses"] = list(race_statuses)
+    if gender == "unknown":
+        conditions.append("COALESCE(LOWER(TRIM(c.gender)), '') NOT IN ('male', 'female')")
+    elif gender:
+        conditions.append("LOWER(TRIM(c.gender)) = %(gender)s")
+        params["gender"] = gender
+
+    booking_terms: List[str] = []
+    if include_dates:
+        booking_terms.append("s.slot_date = ANY(%(include_dates)s)")
+        params["include_dates"] = list(include_dates)
+    if include_slot_id is not None:
+        booking_terms.append("r.slot_id = %(include_slot_id)s")
+        params["include_slot_id"] = include_slot_id
+    if booking_terms:
+        conditions.append(
+            "EXISTS (SELECT 1 FROM schedule_reservations r JOIN schedule_slots s ON s.id = r.slot_id "
+            f"WHERE r.client_id = l.client_id AND ({' OR '.join(booking_terms)}))"
+        )
+    if exclude_dates:
+        conditions.append(
+            "NOT EXISTS (SELECT 1 FROM schedule_reservations r JOIN schedule_slots s ON s.id = r.slot_id "
+            "WHERE r.client_id = l.client_id AND s.slot_date = ANY(%(exclude_dates)s))"
+        )
+        params["exclude_dates"] = list(exclude_dates)
+
+    query = f"""
+        WITH links AS ({' UNION ALL '.join(sources)})
+        SELECT l.channel, l.recipient_id, l.client_id
+        FROM links l
+        LEFT JOIN clients c ON c.id = l.client_id
+        WHERE {' AND '.join(conditions)}
+    """
+    return query, params
+
+
+def _prepare_recipient_query(filters: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+    channels = filters.get("channels") or ()
+    if CHANNEL_TELEGRAM in channels:
+        ensure_client_links_table()
+    if CHANNEL_VK in channels:
+        ensure_vk_client_links_table()
+    if filters.get("race_id") is not None:
+        ensure_race_tables()
+    if filters.get("include_dates") or filters.get("exclude_dates") or filters.get("include_slot_id") is not None:
+        ensure_schedule_tables()
+    return _compile_recipient_query(**filters)
+
+
+def select_recipients(**filters: Any) -> List[Tuple[str, int, Optional[int]]]:
+    """Return final ``(channel, recipient_id, client_id)`` rows for broadcast filters.
+
+    Accepts the keyword arguments of :func:`_compile_recipient_query`.
+    """
+
+    query, params = _prepare_recipient_query(filters)
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute(query + " ORDER BY l.channel, l.recipient_id", params)
+        rows = cur.fetchall()
+    return [(row["channel"], int(row["recipient_id"]), row["client_id"]) for row in rows]
+
+
+def count_recipients(**filters: Any) -> Dict[str, int]:
+    """Return recipient counts per channel for broadcast filters without fetching rows."""
+
+    query, params = _prepare_recipient_query(filters)
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute(f"SELECT channel, COUNT(*) AS cnt FROM ({query}) AS recipients GROUP BY channel", params)
+        rows = cur.fetchall()
+    return {row["channel"]: int(row["cnt"]) for row in rows}
+
+
+def count_links(channels: Sequence[str]) -> int:
+    """Return how many Telegram/VK links exist for the given channels."""
+
+    total = 0
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        if CHANNEL_TELEGRAM in channels:
+            ensure_client_links_table()
+            cur.execute("SELECT COUNT(*) AS cnt FROM client_links")
+            total += int(cur.fetchone()["cnt"])
+        if CHANNEL_VK in channels:
+            ensure_vk_client_links_table()
+            cur.execute("SELECT COUNT(*) AS cnt FROM vk_client_links")
+            total += int(cur.fetchone()["cnt"])
+    return total
+
+
+def get_job(job_id: int) -> Optional[Dict[str, Any]]:
+    ensure_broadcast_tables()
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute("SELECT * FROM broadcast_jobs WHERE id = %s", (job_id,))
+        row = cur.fetchone()
+    return dict(row) if row else None
+
+
+def update_job(job_id: int, **fields: Any) -> None:
+    allowed = {"status", "options", "started_at", "finished_at"}
+    assignments: List[str] = []
+    values: List[Any] = []
+    for key, value in fields.items():
+        if key not in allowed:
+            continue
+        assignments.append(f"{key} = %s")
+        values.append(Json(value) if key == "options" else value)
+    if not assignments:
+        return
+    values.append(job_id)
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute(f"UPDATE broadcast_jobs SET {', '.join(assignments)} WHERE id = %s", values)
+        conn.commit()
+
+
+def mark_job_started(job_id: int) -> None:
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute(
+            "UPDATE broadcast_jobs SET status = %s, started_at = COALESCE(started_at, NOW()) WHERE id = %s",
+            (JOB_STATUS_RUNNING, job_id),
+        )
+        # Messages left in-flight by a crashed worker go back to the queue.
+        cur.execute(
+            "UPDATE broadcast_outbox SET status = %s WHERE job_id = %s AND status = %s",
+            (MESSAGE_STATUS_PENDING, job_id, MESSAGE_STATUS_SENDING),
+        )
+        conn.commit()
+
+
+def mark_job_finished(job_id: int, status: str = JOB_STATUS_DONE) -> None:
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute(
+            "UPDATE broadcast_jobs SET status = %s, finished_at = NOW() WHERE id = %s",
+            (status, job_id),
+        )
+        conn.commit()
+
+
+def list_unfinished_jobs() -> List[Dict[str, Any]]:
+    ensure_broadcast_tables()
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute(
+            "SELECT * FROM broadcast_jobs WHERE status IN (%s, %s) ORDER BY id",
+            (JOB_STATUS_QUEUED, JOB_STATUS_RUNNING),
+        )
+        rows = cur.fetchall()
+    return [dict(row) for row in rows]
+
+
+def list_due_scheduled_jobs(limit: int = 20) -> List[Dict[str, Any]]:
+    """Return scheduled jobs whose ``send_at`` has passed, oldest first."""
+
+    ensure_broadcast_tables()
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute(
+            """
+            SELECT * FROM broadcast_jobs
+            WHERE status = %s AND send_at <= NOW()
+            ORDER BY send_at, id
+            LIMIT %s
+            """,
+            (JOB_STATUS_SCHEDULED, limit),
+        )
+        rows = cur.fetchall()
+    return [dict(row) for row in rows]
+
+
+def seconds_until_next_scheduled_job() -> Optional[float]:
+    """Return seconds until the earliest scheduled job is due, ``None`` if none wait."""
+
+    ensure_broadcast_tables()
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute(
+            """
+            SELECT GREATEST(EXTRACT(EPOCH FROM MIN(send_at) - NOW()), 0) AS wait
+            FROM broadcast_jobs
+            WHERE status = %s
+            """,
+            (JOB_STATUS_SCHEDULED,),
+        )
+        row = cur.fetchone()
+    if not row or row["wait"] is None:
+        return None
+    return float(row["wait"])
+
+
+def claim_due_messages(job_id: int, limit: int, *, channel: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Atomically move up to *limit* due messages to ``sending`` and return them."""
+
+    channel_clause = "AND channel = %s" if channel else ""
+    params: List[Any] = [MESSAGE_STATUS_SENDING, job_id, MESSAGE_STATUS_PENDING]
+    if channel:
+        params.append(channel)
+    params.append(limit)
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute(
+            f"""
+            UPDATE broadcast_outbox SET status = %s, attempts = attempts + 1
+            WHERE id IN (
+                SELECT id FROM broadcast_outbox
+                WHERE job_id = %s AND status = %s AND next_attempt_at <= NOW() {channel_clause}
+                ORDER BY id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING *
+            """,
+            params,
+        )
+        rows = cur.fetchall()
+        conn.commit()
+    return [dict(row) for row in rows]
+
+
+def seconds_until_next_due(job_id: int) -> Optional[float]:
+    """Return seconds until the next pending message is due, ``None`` if none left."""
+
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute(
+            """
+            SELECT GREATEST(EXTRACT(EPOCH FROM MIN(next_attempt_at) - NOW()), 0) AS wait
+            FROM broadcast_outbox
+            WHERE job_id = %s AND status IN (%s, %s)
+            """,
+            (job_id, MESSAGE_STATUS_PENDING, MESSAGE_STATUS_SENDING),
+        )
+        row = cur.fetchone()
+    if not row or row["wait"] is None:
+        return None
+    return float(row["wait"])
+
+
+def mark_message_sent(message_id: int) -> None:
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute(
+            "UPDATE broadcast_outbox SET status = %s, sent_at = NOW(), last_error = NULL WHERE id = %s",
+            (MESSAGE_STATUS_SENT, message_id),
+        )
+        conn.commit()
+
+
+def mark_message_failed(message_id: int, error: Optional[str]) -> None:
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute(
+            "UPDATE broadcast_outbox SET status = %s, last_error = %s WHERE id = %s",
+            (MESSAGE_STATUS_FAILED, error, message_id),
+        )
+        conn.commit()
+
+
+def reschedule_message(message_id: int, delay_seconds: float, error: Optional[str]) -> None:
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute(
+            """
+            UPDATE broadcast_outbox
+            SET status = %s, last_error = %s, next_attempt_at = NOW() + make_interval(secs => %s)
+            WHERE id = %s
+            """,
+            (MESSAGE_STATUS_PENDING, error, float(delay_seconds), message_id),
+        )
+        conn.commit()
+
+
+def get_job_progress(job_id: int) -> Optional[Dict[str, Any]]:
+    """Return the job row with per-channel delivery counters and sample errors."""
+
+    job = get_job(job_id)
+    if not job:
+        return None
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute(
+            """
+            SELECT channel, status, COUNT(*) AS cnt
+            FROM broadcast_outbox
+            WHERE job_id = %s
+            GROUP BY channel, status
+            """,
+            (job_id,),
+        )
+        counts = cur.fetchall()
+        cur.execute(
+            """
+            SELECT last_error FROM broadcast_outbox
+            WHERE job_id = %s AND status = %s AND last_error IS NOT NULL
+            ORDER BY id
+            LIMIT 5
+            """,
+            (job_id, MESSAGE_STATUS_FAILED),
+        )
+        errors = [row["last_error"] for row in cur.fetchall()]
+
+    by_channel: Dict[str, Dict[str, int]] = {}
+    for row in counts:
+        by_channel.setdefault(row["channel"], {})[row["status"]] = int(row["cnt"])
+    job["counts"] = by_channel
+    job["errors"] = errors
+    return job
+
+
+def get_cached_media(image_hash: str, channel: str, *, max_age_seconds: Optional[float] = None) -> Optional[str]:
+    """Return a previously uploaded media reference (file_id / attachment).
+
+    With *max_age_seconds*, references stored longer ago than that are ignored.
+    """
+
+    ensure_broadcast_tables()
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute(
+            """
+            SELECT media_ref FROM broadcast_media_cache
+            WHERE image_hash = %s AND channel = %s
+              AND (%s::double precision IS NULL OR created_at > NOW() - make_interval(secs => %s))
+            """,
+            (image_hash, channel, max_age_seconds, max_age_seconds),
+        )
+        row = cur.fetchone()
+    return row["media_ref"] if row else None
+
+
+def store_cached_media(image_hash: str, channel: str, media_ref: str) -> None:
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute(
+            """
+            INSERT INTO broadcast_media_cache (image_hash, channel, media_ref, created_at)
+            VALUES (%s, %s, %s, NOW())
+            ON CONFLICT (image_hash, channel) DO UPDATE SET
+                media_ref = EXCLUDED.media_ref,
+                created_at = NOW()
+            """,
+            (image_hash, channel, media_ref),
+        )
+        conn.commit()
+
+
+def forget_cached_media(image_hash: str, channel: str) -> None:
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute(
+            "DELETE FROM broadcast_media_cache WHERE image_hash = %s AND channel = %s",
+            (image_hash, channel),
+        )
+        conn.commit()
+
+
+@contextmanager
+def job_lock(job_id: int) -> Iterator[bool]:
+    """Hold a session advisory lock so only one worker delivers a job."""
+
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute("SELECT pg_try_advisory_lock(%s, %s) AS locked", (_JOB_LOCK_NAMESPACE, job_id))
+        row = cur.fetchone()
+        locked = bool(row and row["locked"])
+        conn.commit()
+        try:
+            yield locked
+        finally:
+            if locked:
+                cur.execute("SELECT pg_advisory_unlock(%s, %s)", (_JOB_LOCK_NAMESPACE, job_id))
+                conn.commit()
@@ -0,0 +1,92 @@
+"""Persist bot conversation state (VK peers, Telegram user_data) with expiry."""
+from __future__ import annotations
+
+from typing import Dict, Optional
+
+import psycopg2
+
+from .db_utils import db_connection, dict_cursor
+
+
+def ensure_table() -> None:
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS bot_conversation_state (
+                namespace TEXT NOT NULL,
+                state_key TEXT NOT NULL,
+                payload BYTEA NOT NULL,
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                expires_at TIMESTAMPTZ NOT NULL,
+                PRIMARY KEY (namespace, state_key)
+            )
+            """
+        )
+        cur.execute(
+            "CREATE INDEX IF NOT EXISTS bot_conversation_state_expires_idx "
+            "ON bot_conversation_state (expires_at)"
+        )
+        conn.commit()
+
+
+def load_state(namespace: str, state_key: str) -> Optional[bytes]:
+    """Return the stored payload unless it is missing or expired."""
+
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute(
+            """
+            SELECT payload FROM bot_conversation_state
+            WHERE namespace = %s AND state_key = %s AND expires_at > NOW()
+            """,
+            (namespace, state_key),
+        )
+        row = cur.fetchone()
+    return bytes(row["payload"]) if row else None
+
+
+def load_namespace(namespace: str) -> Dict[str, bytes]:
+    """Return every live payload of *namespace* keyed by ``state_key``."""
+
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute(
+            """
+            SELECT state_key, payload FROM bot_conversation_state
+            WHERE namespace = %s AND expires_at > NOW()
+            """,
+            (namespace,),
+        )
+        rows = cur.fetchall()
+    return {row["state_key"]: bytes(row["payload"]) for row in rows}
+
+
+def save_state(namespace: str, state_key: str, payload: bytes, ttl_seconds: float) -> None:
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute(
+            """
+            INSERT INTO bot_conversation_state (namespace, state_key, payload, updated_at, expires_at)
+            VALUES (%s, %s, %s, NOW(), NOW() + make_interval(secs => %s))
+            ON CONFLICT (namespace, state_key) DO UPDATE SET
+                payload = EXCLUDED.payload,
+                updated_at = NOW(),
+                expires_at = EXCLUDED.expires_at
+            """,
+            (namespace, state_key, psycopg2.Binary(payload), float(ttl_seconds)),
+        )
+        conn.commit()
+
+
+def delete_state(namespace: str, state_key: str) -> None:
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute(
+            "DELETE FROM bot_conversation_state WHERE namespace = %s AND state_key = %s",
+            (namespace, state_key),
+        )
+        conn.commit()
+
+
+def purge_expired() -> int:
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute("DELETE FROM bot_conversation_state WHERE expires_at <= NOW()")
+        deleted = cur.rowcount
+        conn.commit()
+    return deleted
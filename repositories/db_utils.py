@@ -35,3 +35,17 @@ def dict_cursor(conn: psycopg2.extensions.connection) -> Iterator[RealDictCursor
         yield cursor
     finally:
         cursor.close()
+
+
+@contextmanager
+def listen_connection(*channels: str) -> Iterator[psycopg2.extensions.connection]:
+    """Autocommit connection subscribed to *channels*; read ``conn.notifies`` after ``conn.poll()``."""
+    conn = psycopg2.connect(**_db_params())
+    try:
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cur:
+            for channel in channels:
+                cur.execute(f'LISTEN "{channel}"')
+        yield conn
+    finally:
+        conn.close()
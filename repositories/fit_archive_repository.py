@@ -0,0 +1,222 @@
+"""Compressed, content-addressed storage for archived FIT files.
+
+Files are gzip-compressed once and stored as
+``<FIT_FILES_DIR>/objects/<hh>/<sha256>.fit.gz`` where the hash is taken over
+the raw FIT bytes, so a file downloaded again by the backfill or the webapp
+sync is stored only once. ``fit_archive_index`` maps an activity to the hash
+of its file. Trees written before the archive existed keep working: readers
+fall back to ``<FIT_FILES_DIR>/<account>/<activity>.fit`` until
+``scripts/migrate_fit_archive.py`` has moved them into the object store.
+"""
+from __future__ import annotations
+
+import gzip
+import hashlib
+import os
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Union
+
+from .db_utils import db_connection, dict_cursor
+from .schedule_repository import ensure_fit_files_dir
+
+FIT_ARCHIVE_GZIP_LEVEL = int(os.environ.get("FIT_ARCHIVE_GZIP_LEVEL", "6"))
+OBJECTS_DIR_NAME = "objects"
+OBJECT_SUFFIX = ".fit.gz"
+
+
+def ensure_table() -> None:
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS fit_archive_index (
+                account_id TEXT NOT NULL,
+                activity_id TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                size_bytes INTEGER NOT NULL,
+                stored_bytes INTEGER NOT NULL,
+                created_at TIMESTAMPTZ DEFAULT NOW(),
+                PRIMARY KEY (account_id, activity_id)
+            )
+            """
+        )
+        cur.execute(
+            "CREATE INDEX IF NOT EXISTS fit_archive_index_hash_idx ON fit_archive_index (content_hash)"
+        )
+        conn.commit()
+
+
+def objects_dir() -> Path:
+    return ensure_fit_files_dir() / OBJECTS_DIR_NAME
+
+
+def object_path(content_hash: str) -> Path:
+    return objects_dir() / content_hash[:2] / f"{content_hash}{OBJECT_SUFFIX}"
+
+
+def legacy_fit_path(account_id: str, activity_id: str) -> Path:
+    """Uncompressed location used before the object store."""
+    return ensure_fit_files_dir() / str(account_id) / f"{activity_id}.fit"
+
+
+def _write_object(content_hash: str, data: bytes) -> int:
+    """Store *data* compressed under its hash unless present; return the stored size."""
+    target = object_path(content_hash)
+    if target.exists():
+        # Refresh the mtime so a concurrent prune sees the object as in use.
+        os.utime(target)
+        return target.stat().st_size
+    target.parent.mkdir(parents=True, exist_ok=True)
+    compressed = gzip.compress(data, compresslevel=FIT_ARCHIVE_GZIP_LEVEL, mtime=0)
+    fd, tmp_name = tempfile.mkstemp(dir=target.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as handle:
+            handle.write(compressed)
+        os.replace(tmp_name, target)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+    return len(compressed)
+
+
+def store_fit_bytes(account_id: str, activity_id: str, data: bytes) -> str:
+    """Archive the FIT bytes of an activity and return their content hash."""
+    content_hash = hashlib.sha256(data).hexdigest()
+    stored_bytes = _write_object(content_hash, data)
+    ensure_table()
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute(
+            """
+            INSERT INTO fit_archive_index (
+                account_id, activity_id, content_hash, size_bytes, stored_bytes
+            ) VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (account_id, activity_id) DO UPDATE SET
+                content_hash = EXCLUDED.content_hash,
+                size_bytes = EXCLUDED.size_bytes,
+                stored_bytes = EXCLUDED.stored_bytes
+            """,
+            (str(account_id), str(activity_id), content_hash, len(data), stored_bytes),
+        )
+        conn.commit()
+    return content_hash
+
+
+def store_fit_file(account_id: str, activity_id: str, source: Union[str, Path]) -> str:
+    """Archive a downloaded FIT file; the source file is left in place."""
+    return store_fit_bytes(account_id, activity_id, Path(source).read_bytes())
+
+
+def get_fit_entry(account_id: str, activity_id: str) -> Optional[Dict]:
+    ensure_table()
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute(
+            """
+            SELECT account_id, activity_id, content_hash, size_bytes, stored_bytes, created_at
+            FROM fit_archive_index
+            WHERE account_id = %s AND activity_id = %s
+            """,
+            (str(account_id), str(activity_id)),
+        )
+        return cur.fetchone()
+
+
+def find_fit_object(account_id: str, activity_id: str) -> Optional[Dict]:
+    """Return the index row plus ``path`` of the compressed object, if stored."""
+    entry = get_fit_entry(account_id, activity_id)
+    if not entry:
+        return None
+    path = object_path(entry["content_hash"])
+    if not path.exists():
+        return None
+    return {**entry, "path": path}
+
+
+def has_fit(account_id: str, activity_id: str) -> bool:
+    return find_fit_object(account_id, activity_id) is not None or legacy_fit_path(account_id, activity_id).exists()
+
+
+def read_fit_bytes(account_id: str, activity_id: str) -> Optional[bytes]:
+    """Return the raw FIT bytes of an activity from the archive or the legacy tree."""
+    stored = find_fit_object(account_id, activity_id)
+    if stored:
+        with gzip.open(stored["path"], "rb") as handle:
+            return handle.read()
+    legacy = legacy_fit_path(account_id, activity_id)
+    if legacy.exists():
+        return legacy.read_bytes()
+    return None
+
+
+def export_fit_file(account_id: str, activity_id: str, dest: Union[str, Path]) -> bool:
+    """Write the raw FIT bytes of an archived activity to *dest*; ``False`` if missing."""
+    data = read_fit_bytes(account_id, activity_id)
+    if data is None:
+        return False
+    Path(dest).write_bytes(data)
+    return True
+
+
+@contextmanager
+def materialized_fit(account_id: str, activity_id: str) -> Iterator[Optional[Path]]:
+    """Yield a temporary ``<activity>.fit`` with the raw bytes, or ``None``.
+
+    For uploads that need a real file (Telegram documents, Strava, Intervals);
+    the file is removed when the block exits.
+    """
+    with tempfile.TemporaryDirectory(prefix="fit-") as tmp_dir:
+        path = Path(tmp_dir) / f"{activity_id}.fit"
+        yield path if export_fit_file(account_id, activity_id, path) else None
+
+
+def rename_account(old_account_id: str, new_account_id: str) -> int:
+    """Move index rows to a new account id, keeping rows already present there."""
+    ensure_table()
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute(
+            """
+            UPDATE fit_archive_index AS src
+            SET account_id = %(new)s
+            WHERE src.account_id = %(old)s
+              AND NOT EXISTS (
+                  SELECT 1 FROM fit_archive_index AS dst
+                  WHERE dst.account_id = %(new)s AND dst.activity_id = src.activity_id
+              )
+            """,
+            {"old": old_account_id, "new": new_account_id},
+        )
+        moved = cur.rowcount
+        cur.execute("DELETE FROM fit_archive_index WHERE account_id = %s", (old_account_id,))
+        conn.commit()
+    return moved
+
+
+def list_referenced_hashes() -> set:
+    ensure_table()
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute("SELECT DISTINCT content_hash FROM fit_archive_index")
+        return {row["content_hash"] for row in cur.fetchall()}
+
+
+def get_archive_stats() -> Dict:
+    """Logical vs stored size of the indexed files."""
+    ensure_table()
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute(
+            """
+            SELECT
+                COUNT(*) AS files,
+                COUNT(DISTINCT content_hash) AS objects,
+                COALESCE(SUM(size_bytes), 0) AS size_bytes
+            FROM fit_archive_index
+            """
+        )
+        totals = cur.fetchone() or {}
+        cur.execute(
+            """
+            SELECT COALESCE(SUM(stored_bytes), 0) AS stored_bytes
+            FROM (SELECT DISTINCT ON (content_hash) stored_bytes FROM fit_archive_index) AS objects
+            """
+        )
+        stored = cur.fetchone() or {}
+    return {**totals, **stored}
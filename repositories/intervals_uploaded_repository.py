@@ -1,10 +1,19 @@
-"""Track Intervals.icu workouts uploaded to WattAttack per account."""
+"""Track Intervals.icu workouts uploaded to WattAttack per account.
+
+``intervals_uploaded`` is per user and event; ``intervals_workout_uploads``
+is keyed by the content hash of the parsed workout, so the same workout
+planned by several users is uploaded to each account only once.
+"""
 from __future__ import annotations
 
-from typing import Optional
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from psycopg2.extras import execute_values
 
 from .db_utils import db_connection, dict_cursor
 
+UPLOADED_STATUSES = ("success", "duplicate")
+
 
 def ensure_table() -> None:
     with db_connection() as conn, dict_cursor(conn) as cur:
@@ -30,6 +39,18 @@ def ensure_table() -> None:
         cur.execute(
             "ALTER TABLE intervals_uploaded ADD COLUMN IF NOT EXISTS uploaded_at TIMESTAMP DEFAULT NOW()"
         )
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS intervals_workout_uploads (
+                content_hash TEXT NOT NULL,
+                account_id TEXT NOT NULL,
+                status TEXT NOT NULL,
+                info TEXT,
+                uploaded_at TIMESTAMP DEFAULT NOW(),
+                PRIMARY KEY (content_hash, account_id)
+            )
+            """
+        )
         conn.commit()
 
 
@@ -48,6 +69,28 @@ def is_uploaded(tg_user_id: int, event_id: int, account_id: str) -> bool:
     return bool(row)
 
 
+def uploaded_accounts(tg_user_id: int, event_ids: Iterable[int]) -> Dict[int, Set[str]]:
+    """Return ``event_id -> account ids`` already recorded for the user's events."""
+
+    ids = list({int(event_id) for event_id in event_ids})
+    if not ids:
+        return {}
+    ensure_table()
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute(
+            """
+            SELECT intervals_event_id, account_id FROM intervals_uploaded
+            WHERE tg_user_id = %s AND intervals_event_id = ANY(%s)
+            """,
+            (tg_user_id, ids),
+        )
+        rows = cur.fetchall()
+    result: Dict[int, Set[str]] = {}
+    for row in rows:
+        result.setdefault(int(row["intervals_event_id"]), set()).add(row["account_id"])
+    return result
+
+
 def record_upload(
     tg_user_id: int,
     event_id: int,
@@ -71,3 +114,48 @@ def record_upload(
             (tg_user_id, event_id, account_id, status, info),
         )
         conn.commit()
+
+
+def uploaded_workouts(content_hashes: Iterable[str]) -> Dict[str, Dict[str, Optional[str]]]:
+    """Return ``content_hash -> {account_id: info}`` for workouts already in an account."""
+
+    hashes = list({value for value in content_hashes if value})
+    if not hashes:
+        return {}
+    ensure_table()
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute(
+            """
+            SELECT content_hash, account_id, info FROM intervals_workout_uploads
+            WHERE content_hash = ANY(%s) AND status = ANY(%s)
+            """,
+            (hashes, list(UPLOADED_STATUSES)),
+        )
+        rows = cur.fetchall()
+    result: Dict[str, Dict[str, Optional[str]]] = {}
+    for row in rows:
+        result.setdefault(row["content_hash"], {})[row["account_id"]] = row["info"]
+    return result
+
+
+def record_workout_uploads(results: List[Tuple[str, str, str, Optional[str]]]) -> None:
+    """Store ``(content_hash, account_id, status, info)`` upload results in one statement."""
+
+    if not results:
+        return
+    ensure_table()
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        execute_values(
+            cur,
+            """
+            INSERT INTO intervals_workout_uploads (content_hash, account_id, status, info, uploaded_at)
+            VALUES %s
+            ON CONFLICT (content_hash, account_id) DO UPDATE SET
+                status = EXCLUDED.status,
+                info = EXCLUDED.info,
+                uploaded_at = NOW()
+            """,
+            results,
+            template="(%s, %s, %s, %s, NOW())",
+        )
+        conn.commit()
@@ -8,8 +8,11 @@ from pathlib import Path
 import os
 
 import psycopg2
+from psycopg2.extras import execute_values
 from .db_utils import db_connection, dict_cursor
 from . import trainers_repository, instructors_repository, wattattack_account_repository
+from .client_link_repository import ensure_client_links_table
+from .activity_analytics_repository import POWER_LEADERBOARD_METRICS, get_power_leaderboard
 
 LOGGER = logging.getLogger(__name__)
 FIT_FILES_DIR = Path(os.environ.get("FIT_FILES_DIR", "data/fit_files")).resolve()
@@ -1059,6 +1062,176 @@ def list_available_slots(
     return rows
 
 
+_SCHEDULE_VERSION_TABLES = ("schedule_slots", "schedule_reservations", "schedule_instructors")
+
+
+def _missing_change_triggers(
+    cur, trigger_name: str, tables: Sequence[str], *, deferred: bool = False
+) -> List[str]:
+    """Tables lacking the row-level *trigger_name* or its ``_truncate`` companion.
+
+    With *deferred* the row trigger must also be a deferred constraint trigger.
+    """
+
+    cur.execute(
+        """
+        SELECT tgrelid::regclass::text AS table_name, tgname,
+               (tgtype & 1) = 1 AS row_level, tgconstraint <> 0 AND tginitdeferred AS deferred
+        FROM pg_trigger
+        WHERE tgname IN (%s, %s)
+        """,
+        (trigger_name, f"{trigger_name}_truncate"),
+    )
+    installed = {
+        (row["table_name"], row["tgname"])
+        for row in cur.fetchall()
+        if row["tgname"] != trigger_name or (row["row_level"] and row["deferred"] == deferred)
+    }
+    return [
+        table
+        for table in tables
+        if (table, trigger_name) not in installed or (table, f"{trigger_name}_truncate") not in installed
+    ]
+
+
+def _create_change_triggers(
+    cur, trigger_name: str, function_name: str, tables: Sequence[str], *, deferred: bool = False
+) -> None:
+    """Run *function_name* after writes that change rows of *tables*.
+
+    Row-level, so no-op statements (``INSERT ... ON CONFLICT DO NOTHING`` seeds,
+    updates matching nothing) do not fire it; TRUNCATE only has statement triggers.
+    With *deferred* the row trigger is a constraint trigger fired at commit.
+    """
+
+    for table in tables:
+        # Earlier versions installed a statement-level trigger under the same name.
+        cur.execute(f"DROP TRIGGER IF EXISTS {trigger_name} ON {table}")
+        if deferred:
+            cur.execute(
+                f"""
+                CREATE CONSTRAINT TRIGGER {trigger_name}
+                AFTER INSERT OR UPDATE OR DELETE ON {table}
+                DEFERRABLE INITIALLY DEFERRED
+                FOR EACH ROW EXECUTE FUNCTION {function_name}()
+                """
+            )
+        else:
+            cur.execute(
+                f"""
+                CREATE OR REPLACE TRIGGER {trigger_name}
+                AFTER INSERT OR UPDATE OR DELETE ON {table}
+                FOR EACH ROW EXECUTE FUNCTION {function_name}()
+                """
+            )
+        cur.execute(
+            f"""
+            CREATE OR REPLACE TRIGGER {trigger_name}_truncate
+            AFTER TRUNCATE ON {table}
+            FOR EACH STATEMENT EXECUTE FUNCTION {function_name}()
+            """
+        )
+
+
+def ensure_schedule_version_tracking() -> None:
+    """Install triggers that advance ``schedule_cache_version_seq`` when schedule rows change.
+
+    Caches of slot availability poll this counter instead of re-running the
+    aggregate query, and any process writing the schedule invalidates them.
+    Reads never advance it, even though they re-run the idempotent table setup.
+    A sequence takes no row lock, so concurrent schedule writers do not queue
+    (or deadlock) on a shared counter row; the row triggers are deferred to
+    commit so the new value shows up together with the committed rows.
+    """
+
+    ensure_schedule_tables()
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute("CREATE SEQUENCE IF NOT EXISTS schedule_cache_version_seq")
+        missing = _missing_change_triggers(
+            cur, "schedule_cache_version_bump", _SCHEDULE_VERSION_TABLES, deferred=True
+        )
+        if missing:
+            cur.execute(
+                """
+                CREATE OR REPLACE FUNCTION bump_schedule_cache_version() RETURNS trigger AS $$
+                BEGIN
+                    PERFORM nextval('schedule_cache_version_seq');
+                    RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql
+                """
+            )
+            _create_change_triggers(
+                cur, "schedule_cache_version_bump", "bump_schedule_cache_version", missing, deferred=True
+            )
+        conn.commit()
+
+
+def get_schedule_version() -> int:
+    """Return the schedule write counter maintained by the version triggers."""
+
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute("SELECT last_value, is_called FROM schedule_cache_version_seq")
+        row = cur.fetchone()
+    return int(row["last_value"]) if row and row["is_called"] else 0
+
+
+SCHEDULE_CHANGES_CHANNEL = "schedule_changes"
+_SCHEDULE_NOTIFY_TABLES = ("schedule_slots", "schedule_reservations")
+
+
+def ensure_schedule_change_notifications() -> None:
+    """Install triggers that ``pg_notify`` :data:`SCHEDULE_CHANGES_CHANNEL` when schedule rows change.
+
+    The payload is the table name; notifications of one transaction are sent
+    on commit (identical ones folded), so listeners only see committed changes.
+    """
+
+    ensure_schedule_tables()
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        missing = _missing_change_triggers(cur, "schedule_changes_notify", _SCHEDULE_NOTIFY_TABLES)
+        if missing:
+            cur.execute(
+                f"""
+                CREATE OR REPLACE FUNCTION notify_schedule_changes() RETURNS trigger AS $$
+                BEGIN
+                    PERFORM pg_notify('{SCHEDULE_CHANGES_CHANNEL}', TG_TABLE_NAME);
+                    RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql
+                """
+            )
+            _create_change_triggers(cur, "schedule_changes_notify", "notify_schedule_changes", missing)
+        conn.commit()
+
+
+def list_booked_slot_starts(since: datetime, until: datetime) -> List[Tuple[date, time]]:
+    """Distinct ``(slot_date, start_time)`` of slots with booked clients in ``[since, until]``."""
+
+    ensure_schedule_tables()
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute(
+            """
+            SELECT DISTINCT s.slot_date, s.start_time
+            FROM schedule_reservations AS r
+            JOIN schedule_slots AS s ON s.id = r.slot_id
+            WHERE r.client_id IS NOT NULL
+              AND r.status = 'booked'
+              AND (s.slot_date, s.start_time) >= (%(since_date)s, %(since_time)s)
+              AND (s.slot_date, s.start_time) <= (%(until_date)s, %(until_time)s)
+            ORDER BY s.slot_date, s.start_time
+            """,
+            {
+                "since_date": since.date(),
+                "since_time": since.time(),
+                "until_date": until.date(),
+                "until_time": until.time(),
+            },
+        )
+        rows = cur.fetchall()
+    return [(row["slot_date"], row["start_time"]) for row in rows]
+
+
 def get_slot_with_reservations(slot_id: int) -> Optional[Dict]:
     """Return slot row together with its reservations."""
 
@@ -1323,6 +1496,28 @@ def was_notification_sent(reservation_id: int, notification_type: str) -> bool:
         return cur.fetchone() is not None
 
 
+def record_notifications_sent(reservation_ids: Sequence[int], notification_type: str) -> int:
+    """Record a notification for many reservations at once; return the number of new rows."""
+    ids = sorted({int(reservation_id) for reservation_id in reservation_ids})
+    if not ids:
+        return 0
+    ensure_workout_notifications_table()
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        rows = execute_values(
+            cur,
+            """
+            INSERT INTO workout_notifications (reservation_id, notification_type)
+            VALUES %s
+            ON CONFLICT (reservation_id, notification_type) DO NOTHING
+            RETURNING id
+            """,
+            [(reservation_id, notification_type) for reservation_id in ids],
+            fetch=True,
+        )
+        conn.commit()
+    return len(rows)
+
+
 def list_workout_notifications(limit: int = 100, offset: int = 0) -> List[Dict]:
     """List all workout notifications with reservation and client details."""
     ensure_workout_notifications_table()
@@ -1599,6 +1794,9 @@ def ensure_activity_ids_table() -> None:
                 average_cadence DOUBLE PRECISION,
                 average_heartrate DOUBLE PRECISION,
                 fit_path TEXT,
+                fit_attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at TIMESTAMPTZ,
+                fit_last_error TEXT,
                 created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
                 UNIQUE(account_id, activity_id)
             )
@@ -1662,6 +1860,19 @@ def ensure_activity_ids_table() -> None:
             cur.execute("ALTER TABLE seen_activity_ids ADD COLUMN IF NOT EXISTS average_heartrate DOUBLE PRECISION")
         if "fit_path" not in existing:
             cur.execute("ALTER TABLE seen_activity_ids ADD COLUMN IF NOT EXISTS fit_path TEXT")
+        if "fit_attempts" not in existing:
+            cur.execute("ALTER TABLE seen_activity_ids ADD COLUMN IF NOT EXISTS fit_attempts INTEGER NOT NULL DEFAULT 0")
+        if "next_attempt_at" not in existing:
+            cur.execute("ALTER TABLE seen_activity_ids ADD COLUMN IF NOT EXISTS next_attempt_at TIMESTAMPTZ")
+        if "fit_last_error" not in existing:
+            cur.execute("ALTER TABLE seen_activity_ids ADD COLUMN IF NOT EXISTS fit_last_error TEXT")
+        cur.execute(
+            """
+            CREATE INDEX IF NOT EXISTS seen_activity_ids_missing_fit_idx
+            ON seen_activity_ids (account_id, next_attempt_at)
+            WHERE fit_path IS NULL
+            """
+        )
         conn.commit()
 
 
@@ -1781,6 +1992,22 @@ def was_activity_id_seen(account_id: str, activity_id: str) -> bool:
         return cur.fetchone() is not None
 
 
+def get_activity_client_id(account_id: str, activity_id: str) -> Optional[int]:
+    """Return the client a seen activity belongs to, a manual choice winning."""
+    ensure_activity_ids_table()
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute(
+            """
+            SELECT COALESCE(manual_client_id, client_id) AS client_id
+            FROM seen_activity_ids
+            WHERE account_id = %s AND activity_id = %s
+            """,
+            (account_id, activity_id),
+        )
+        row = cur.fetchone()
+    return row["client_id"] if row else None
+
+
 def get_seen_activity_ids_for_account(account_id: str, limit: int = 200) -> List[str]:
     """Get the most recent activity IDs seen for an account."""
     ensure_activity_ids_table()
@@ -1911,8 +2138,12 @@ def list_intervals_backfill_activities(client_id: int, limit: int = 200) -> List
     return [dict(row) for row in rows]
 
 
-def list_activities_missing_fit(account_id: str, limit: int = 200) -> List[Dict]:
-    """Return activities for account that do not have a recorded FIT file path."""
+def list_activities_missing_fit(account_id: str, limit: int = 200, *, due_only: bool = False) -> List[Dict]:
+    """Return activities for account that do not have a recorded FIT file path.
+
+    With ``due_only`` activities whose next download attempt is still in the
+    future (see :func:`record_fit_attempt_failure`) are skipped.
+    """
     ensure_activity_ids_table()
     safe_limit = max(1, min(limit, 1000))
     with db_connection() as conn, dict_cursor(conn) as cur:
@@ -1922,10 +2153,114 @@ def list_activities_missing_fit(account_id: str, limit: int = 200) -> List[Dict]
             FROM seen_activity_ids
             WHERE account_id = %s
               AND fit_path IS NULL
+              AND (NOT %s OR next_attempt_at IS NULL OR next_attempt_at <= NOW())
             ORDER BY COALESCE(start_time, created_at) DESC
             LIMIT %s
             """,
-            (account_id, safe_limit),
+            (account_id, due_only, safe_limit),
+        )
+        rows = cur.fetchall()
+    return [dict(row) for row in rows]
+
+
+def record_fit_attempt_failure(
+    account_id: str,
+    activity_id: str,
+    error: str,
+    *,
+    base_delay_seconds: int,
+    max_delay_seconds: int,
+    max_attempts: int,
+) -> Optional[datetime]:
+    """Count a failed FIT download and schedule the next one with exponential backoff.
+
+    The delay doubles from ``base_delay_seconds`` up to ``max_delay_seconds``;
+    after ``max_attempts`` failures the activity is not retried automatically
+    (``next_attempt_at`` becomes ``infinity``). Returns the next attempt time,
+    ``None`` once the activity is given up on.
+    """
+    ensure_activity_ids_table()
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute(
+            """
+            UPDATE seen_activity_ids
+            SET fit_attempts = fit_attempts + 1,
+                fit_last_error = %(error)s,
+                next_attempt_at = CASE
+                    WHEN fit_attempts + 1 >= %(max_attempts)s THEN 'infinity'::timestamptz
+                    ELSE NOW() + LEAST(
+                        %(base)s * POWER(2, LEAST(fit_attempts, 30)),
+                        %(max)s
+                    ) * INTERVAL '1 second'
+                END
+            WHERE account_id = %(account_id)s AND activity_id = %(activity_id)s
+            RETURNING CASE WHEN isfinite(next_attempt_at) THEN next_attempt_at END AS next_attempt_at
+            """,
+            {
+                "account_id": account_id,
+                "activity_id": activity_id,
+                "error": error[:500],
+                "base": base_delay_seconds,
+                "max": max_delay_seconds,
+                "max_attempts": max_attempts,
+            },
+        )
+        row = cur.fetchone()
+        conn.commit()
+    return row["next_attempt_at"] if row else None
+
+
+def normalize_person_name(name: Optional[str]) -> str:
+    """Lowercase, fold ё→е and collapse whitespace for name comparisons."""
+
+    if not name:
+        return ""
+    return " ".join(name.lower().replace("ё", "е").split())
+
+
+def person_name_tokens(name: Optional[str]) -> set[str]:
+    if not name:
+        return set()
+    normalized = normalize_person_name(name)
+    return {part for part in normalized.split(" ") if part}
+
+
+def list_client_reservations_for_day(target_date: date) -> List[Dict]:
+    """Return every reservation with a client on *target_date*, any status.
+
+    Rows carry the columns of ``find_reservation_for_activity`` and
+    ``find_reservation_by_client_name`` so both matches can run in memory.
+    """
+
+    ensure_schedule_tables()
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute(
+            """
+            SELECT
+                r.*,
+                s.slot_date,
+                s.start_time,
+                s.end_time,
+                s.label,
+                s.session_kind,
+                s.instructor_id,
+                i.full_name AS instructor_name,
+                t.code AS stand_code,
+                t.display_name AS stand_display_name,
+                t.title AS stand_title,
+                c.first_name AS client_first_name,
+                c.last_name AS client_last_name,
+                c.full_name AS client_full_name
+            FROM schedule_reservations AS r
+            JOIN schedule_slots AS s ON s.id = r.slot_id
+            LEFT JOIN schedule_instructors AS i ON i.id = s.instructor_id
+            LEFT JOIN trainers AS t ON t.id = r.stand_id
+            LEFT JOIN clients AS c ON c.id = r.client_id
+            WHERE r.client_id IS NOT NULL
+              AND s.slot_date = %s
+            ORDER BY s.start_time DESC NULLS LAST, r.id DESC
+            """,
+            (target_date,),
         )
         rows = cur.fetchall()
     return [dict(row) for row in rows]
@@ -2035,16 +2370,8 @@ def find_reservation_by_client_name(
     if not athlete_name:
         return None
 
-    def _normalize(name: Optional[str]) -> str:
-        if not name:
-            return ""
-        return " ".join(name.lower().replace("ё", "е").split())
-
-    def _tokens(name: Optional[str]) -> set[str]:
-        if not name:
-            return set()
-        normalized = _normalize(name)
-        return {part for part in normalized.split(" ") if part}
+    _normalize = normalize_person_name
+    _tokens = person_name_tokens
 
     ensure_schedule_tables()
     target_date = target_dt.date()
@@ -2181,7 +2508,15 @@ def get_distance_leaderboard(
     sort_by: str = "distance",
     direction: str = "desc",
 ) -> Dict[str, object]:
-    """Return clients ordered by aggregated ride stats for public leaderboard."""
+    """Return clients ordered by aggregated ride stats for public leaderboard.
+
+    Power dimensions (``POWER_LEADERBOARD_METRICS``) are served from the
+    per-client aggregates kept up to date by FIT ingest.
+    """
+
+    metric = str(sort_by).lower()
+    if metric in POWER_LEADERBOARD_METRICS:
+        return get_power_leaderboard(metric, limit, direction=direction)
 
     ensure_activity_ids_table()
     safe_limit = max(1, min(limit, 500))
@@ -2333,6 +2668,68 @@ def list_upcoming_reservations(since: datetime, until: datetime) -> List[Dict]:
     return rows
 
 
+def list_unsent_reminder_reservations(since: datetime, until: datetime, notification_type: str) -> List[Dict]:
+    """Return booked reservations in a window that have no *notification_type* yet.
+
+    Rows carry slot, stand and client details plus the client's Telegram
+    ``tg_user_id`` (NULL when the client is not linked).
+    """
+
+    ensure_schedule_tables()
+    ensure_client_links_table()
+    ensure_workout_notifications_table()
+    with db_connection() as conn, dict_cursor(conn) as cur:
+        cur.execute(
+            """
+            SELECT
+                r.*,
+                s.slot_date,
+                s.start_time,
+                s.end_time,
+                s.label,
+                s.session_kind,
+                s.instructor_id,
+                i.full_name AS instructor_name,
+                t.code AS stand_code,
+                t.display_name AS stand_display_name,
+                t.title AS stand_title,
+                c.first_name AS client_first_name,
+                c.last_name AS client_last_name,
+                c.full_name AS client_full_name,
+                cl.tg_user_id
+            FROM schedule_reservations AS r
+            JOIN schedule_slots AS s ON s.id = r.slot_id
+            JOIN clients AS c ON c.id = r.client_id
+            LEFT JOIN schedule_instructors AS i ON i.id = s.instructor_id
+            LEFT JOIN trainers AS t ON t.id = r.stand_id
+            LEFT JOIN client_links AS cl ON cl.client_id = r.client_id
+            WHERE r.status = 'booked'
+              AND (
+                    (s.slot_date > %(since_date)s)
+                    OR (s.slot_date = %(since_date)s AND s.start_time >= %(since_time)s)
+                  )
+              AND (
+                    (s.slot_date < %(until_date)s)
+                    OR (s.slot_date = %(until_date)s AND s.start_time <= %(until_time)s)
+                  )
+              AND NOT EXISTS (
+                    SELECT 1 FROM workout_notifications AS wn
+                    WHERE wn.reservation_id = r.id AND wn.notification_type = %(notification_type)s
+                  )
+            ORDER BY r.client_id, s.slot_date, s.start_time, r.id
+            """,
+            {
+                "since_date": since.date(),
+                "since_time": since.time(),
+                "until_date": until.date(),
+                "until_time": until.time(),
+                "notification_type": notification_type,
+            },
+        )
+        rows = cur.fetchall()
+    return rows
+
+
 def record_account_assignment(reservation_id: int, account_id: str, client_id: Optional[int]) -> None:
     """Store that a WattAttack account was updated for the reservation."""
 
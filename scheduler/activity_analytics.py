@@ -0,0 +1,114 @@
+"""Ingest stage: analyse an archived FIT file and store its power metrics."""
+from __future__ import annotations
+
+import logging
+import math
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+from fit_analytics import analyze_records, estimate_ftp
+from fit_decoder import FitDecodeError, decode_records
+from repositories.activity_analytics_repository import (
+    get_client_power_bests,
+    merge_client_power_bests,
+    refresh_client_ride_aggregates,
+    save_activity_analytics,
+    save_client_ftp_estimate,
+)
+from repositories.client_repository import get_client
+from repositories.fit_archive_repository import read_fit_bytes
+
+LOGGER = logging.getLogger(__name__)
+
+
+def _client_ftp(client_id: Optional[int]) -> Optional[float]:
+    if not client_id:
+        return None
+    try:
+        client = get_client(int(client_id))
+    except Exception:  # noqa: BLE001
+        LOGGER.warning("Failed to load FTP of client %s", client_id)
+        return None
+    ftp = (client or {}).get("ftp")
+    try:
+        return float(ftp) if ftp else None
+    except (TypeError, ValueError):
+        return None
+
+
+def refresh_client_ftp_estimate(client_id: int) -> Optional[Dict[str, Any]]:
+    """Re-derive the suggested FTP from the client's stored power bests."""
+
+    bests = {row["duration_seconds"]: row["power"] for row in get_client_power_bests(client_id)}
+    estimate = estimate_ftp(bests)
+    save_client_ftp_estimate(client_id, estimate)
+    return estimate
+
+
+def ingest_activity_fit(account_id: str, activity_id: str, client_id: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """Decode the activity's FIT file from the archive and save its analytics.
+
+    The ride's power curve is merged into the client's all-time bests and,
+    when it sets a new best, the client's suggested FTP is refreshed.
+    Returns the stored metrics, or ``None`` when there is no file or no power
+    data. Errors are logged and never propagate into the notifier loop.
+    """
+
+    try:
+        data = read_fit_bytes(account_id, activity_id)
+    except Exception:  # noqa: BLE001
+        LOGGER.exception("Failed to read archived FIT of %s %s", account_id, activity_id)
+        return None
+    if data is None:
+        return None
+    try:
+        records = decode_records(data)
+        metrics = analyze_records(records, _client_ftp(client_id))
+    except FitDecodeError as exc:
+        LOGGER.warning("Cannot decode FIT of %s %s: %s", account_id, activity_id, exc)
+        return None
+    except Exception:  # noqa: BLE001
+        LOGGER.exception("Failed to analyse FIT of %s %s", account_id, activity_id)
+        return None
+    if metrics is None:
+        LOGGER.debug("FIT of %s %s has no power data", account_id, activity_id)
+        return None
+    try:
+        save_activity_analytics(account_id, activity_id, metrics, client_id=client_id)
+    except Exception:  # noqa: BLE001
+        LOGGER.exception("Failed to store analytics for %s %s", account_id, activity_id)
+        return None
+    if client_id:
+        try:
+            refresh_client_ride_aggregates(int(client_id))
+        except Exception:  # noqa: BLE001
+            LOGGER.exception("Failed to refresh ride totals of client %s", client_id)
+        started = records.timestamp[0] if len(records) else math.nan
+        achieved_at = None if math.isnan(started) else datetime.fromtimestamp(started, tz=timezone.utc)
+        try:
+            improved = merge_client_power_bests(
+                int(client_id),
+                account_id,
+                activity_id,
+                metrics["power_curve_durations"],
+                metrics["power_curve"],
+                achieved_at,
+            )
+        except Exception:  # noqa: BLE001
+            LOGGER.exception("Failed to merge power bests of client %s", client_id)
+        else:
+            if improved:
+                LOGGER.info("Client %s: %d new power bests from %s", client_id, improved, activity_id)
+                try:
+                    refresh_client_ftp_estimate(int(client_id))
+                except Exception:  # noqa: BLE001
+                    LOGGER.exception("Failed to estimate FTP of client %s", client_id)
+    LOGGER.info(
+        "Analytics for %s %s: NP=%s IF=%s TSS=%s",
+        account_id,
+        activity_id,
+        metrics.get("normalized_power"),
+        metrics.get("intensity_factor"),
+        metrics.get("tss"),
+    )
+    return metrics
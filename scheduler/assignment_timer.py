@@ -0,0 +1,174 @@
+"""Apply booked clients to their stands exactly ``--assign-lead-minutes`` before each slot.
+
+The timer keeps the distinct start times of booked slots within
+``ASSIGN_TIMER_HORIZON_SECONDS`` in a heap ordered by fire time
+(``start - lead``) and sleeps until the earliest one, so a slot is handled on
+time no matter how wide the polling window used to be. Schedule writes
+``pg_notify`` on ``schedule_changes`` (see
+``schedule_repository.ensure_schedule_change_notifications``); the timer
+listens on that channel and reloads the heap, so new or moved bookings are
+picked up within a second. A periodic reload covers the rolling horizon and
+any notification lost while reconnecting.
+
+Applying is idempotent (``was_account_assignment_done``), so slots whose fire
+time passed but that have not started yet are simply fired again on reload.
+"""
+from __future__ import annotations
+
+import heapq
+import logging
+import os
+import select
+import threading
+import time
+from datetime import date, datetime, timedelta
+from datetime import time as dt_time
+from typing import Callable, List, Tuple
+
+from repositories.db_utils import listen_connection
+from repositories.schedule_repository import (
+    SCHEDULE_CHANGES_CHANNEL,
+    ensure_schedule_change_notifications,
+    list_booked_slot_starts,
+    list_upcoming_reservations,
+)
+
+from . import notifier
+
+LOGGER = logging.getLogger(__name__)
+
+ASSIGN_TIMER_HORIZON_SECONDS = int(os.environ.get("ASSIGN_TIMER_HORIZON_SECONDS", str(24 * 3600)))
+ASSIGN_TIMER_RELOAD_SECONDS = int(os.environ.get("ASSIGN_TIMER_RELOAD_SECONDS", str(10 * 60)))
+ASSIGN_TIMER_MAX_BACKOFF_SECONDS = 300
+
+
+class AssignmentTimer:
+    """Fire :func:`notifier.apply_reservation_assignments` at ``slot start - lead``."""
+
+    def __init__(
+        self,
+        ctx: notifier.NotifierContext,
+        stop_requested: Callable[[], bool],
+        *,
+        horizon_seconds: int = ASSIGN_TIMER_HORIZON_SECONDS,
+        reload_seconds: int = ASSIGN_TIMER_RELOAD_SECONDS,
+    ) -> None:
+        self._ctx = ctx
+        self._stop_requested = stop_requested
+        self._horizon = timedelta(seconds=horizon_seconds)
+        self._reload_interval = reload_seconds
+        self._heap: List[Tuple[datetime, datetime]] = []
+        self._next_reload = 0.0
+
+    @property
+    def lead(self) -> timedelta:
+        return timedelta(minutes=self._ctx.args.assign_lead_minutes)
+
+    def now(self) -> datetime:
+        return datetime.now(tz=notifier.LOCAL_TIMEZONE)
+
+    def _slot_start(self, slot_date: date, start_time: dt_time) -> datetime:
+        return datetime.combine(slot_date, start_time).replace(tzinfo=notifier.LOCAL_TIMEZONE)
+
+    def reload(self) -> None:
+        """Rebuild the heap from the booked slots that have not started yet."""
+
+        now = self.now()
+        starts = [
+            self._slot_start(slot_date, start_time)
+            for slot_date, start_time in list_booked_slot_starts(now, now + self._horizon)
+        ]
+        self._heap = [(max(start - self.lead, now), start) for start in starts if start > now]
+        heapq.heapify(self._heap)
+        self._next_reload = time.monotonic() + self._reload_interval
+        if self._heap:
+            LOGGER.debug(
+                "Assignment timer: %d slots, next at %s", len(self._heap), self._heap[0][0].isoformat(timespec="seconds")
+            )
+
+    def seconds_until_next(self) -> float:
+        reload_in = self._next_reload - time.monotonic()
+        if not self._heap:
+            return reload_in
+        return min((self._heap[0][0] - self.now()).total_seconds(), reload_in)
+
+    def fire_due(self) -> int:
+        """Apply every slot whose fire time has come; return their number."""
+
+        fired = 0
+        now = self.now()
+        while self._heap and self._heap[0][0] <= now and not self._stop_requested():
+            _, slot_start = heapq.heappop(self._heap)
+            fired += 1
+            try:
+                self._apply_slot(slot_start)
+            except Exception:  # noqa: BLE001
+                LOGGER.exception("Auto-assignment for slot %s failed", slot_start)
+            now = self.now()
+        return fired
+
+    def _apply_slot(self, slot_start: datetime) -> None:
+        reservations = list_upcoming_reservations(slot_start, slot_start)
+        if not reservations:
+            return
+        LOGGER.info("Applying %d reservations for slot %s", len(reservations), slot_start.isoformat(timespec="minutes"))
+        args = self._ctx.args
+        notifier.apply_reservation_assignments(
+            reservations,
+            accounts=self._ctx.accounts,
+            timeout=args.timeout,
+            dry_run=args.dry_run,
+            admin_ids=self._ctx.admin_ids,
+            bot_token=args.token,
+        )
+
+    def _serve(self) -> None:
+        ensure_schedule_change_notifications()
+        with listen_connection(SCHEDULE_CHANGES_CHANNEL) as conn:
+            self.reload()
+            LOGGER.info("Assignment timer listening on %s, lead=%s", SCHEDULE_CHANGES_CHANNEL, self.lead)
+            while not self._stop_requested():
+                self.fire_due()
+                # Short naps keep stop requests (signals, stop files) responsive.
+                wait = min(max(self.seconds_until_next(), 0.0), 1.0)
+                if select.select([conn], [], [], wait)[0]:
+                    conn.poll()
+                    if conn.notifies:
+                        LOGGER.debug("Schedule changed (%s), reloading", conn.notifies[-1].payload)
+                        conn.notifies.clear()
+                        self.reload()
+                        continue
+                if time.monotonic() >= self._next_reload:
+                    self.reload()
+
+    def run(self) -> None:
+        """Serve until stop is requested, reconnecting with backoff on errors."""
+
+        if self.lead <= timedelta(0):
+            LOGGER.info("Auto-assignment disabled (lead=%s), timer not started", self.lead)
+            return
+        backoff = 5.0
+        while not self._stop_requested():
+            started = time.monotonic()
+            try:
+                self._serve()
+            except Exception:  # noqa: BLE001
+                LOGGER.exception("Assignment timer failed, restarting in %.0fs", backoff)
+            if time.monotonic() - started > ASSIGN_TIMER_MAX_BACKOFF_SECONDS:
+                backoff = 5.0
+            deadline = time.monotonic() + backoff
+            while time.monotonic() < deadline and not self._stop_requested():
+                time.sleep(1.0)
+            backoff = min(backoff * 2, ASSIGN_TIMER_MAX_BACKOFF_SECONDS)
+
+
+def start_assignment_timer_thread(
+    ctx: notifier.NotifierContext, stop_requested: Callable[[], bool]
+) -> threading.Thread:
+    thread = threading.Thread(
+        target=AssignmentTimer(ctx, stop_requested).run,
+        name="assignment-timer",
+        daemon=True,
+    )
+    thread.start()
+    return thread
@@ -0,0 +1,113 @@
+"""Deliver webapp broadcasts from the outbox.
+
+The webapp only enqueues jobs; this dispatcher is the single process that
+sends them, so the per-process rate limiters in ``notifications.broadcast``
+hold the bot-wide Telegram/VK budgets. Queued jobs start on the next poll,
+scheduled ones once their ``send_at`` arrives.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Optional
+
+from zoneinfo import ZoneInfo
+
+from notifications.broadcast import BroadcastCredentials, resume_broadcast_jobs, start_broadcast_job
+from notifications.broadcast_recipients import RecipientFilters, RecipientFilterError, resolve_recipients
+from repositories import broadcast_repository
+
+LOGGER = logging.getLogger(__name__)
+
+DISPATCH_INTERVAL_SECONDS = max(1, int(os.environ.get("BROADCAST_DISPATCH_INTERVAL_SECONDS", "5")))
+LOCAL_TIMEZONE = ZoneInfo(os.environ.get("WATTATTACK_LOCAL_TZ", "Europe/Moscow"))
+
+
+def _activate_job(job: dict) -> bool:
+    """Resolve recipients of a due scheduled job and queue it; ``True`` if it has any."""
+
+    job_id = int(job["id"])
+    with broadcast_repository.job_lock(job_id) as acquired:
+        if not acquired:
+            return False
+        current = broadcast_repository.get_job(job_id)
+        if not current or current.get("status") != broadcast_repository.JOB_STATUS_SCHEDULED:
+            return False
+
+        options = dict(current.get("options") or {})
+        try:
+            filters = RecipientFilters.from_options(options.get("filters") or {})
+            resolution = resolve_recipients(filters, today=datetime.now(tz=LOCAL_TIMEZONE).date())
+        except RecipientFilterError as exc:
+            LOGGER.warning("Scheduled broadcast %s has invalid filters: %s", job_id, exc)
+            options["dispatch_note"] = str(exc)
+            broadcast_repository.update_job(job_id, options=options)
+            broadcast_repository.mark_job_finished(job_id, broadcast_repository.JOB_STATUS_FAILED)
+            return False
+
+        if not resolution.recipients:
+            LOGGER.info("Scheduled broadcast %s has no recipients: %s", job_id, resolution.empty_reason)
+            options["dispatch_note"] = resolution.empty_reason
+            broadcast_repository.update_job(job_id, options=options)
+            broadcast_repository.mark_job_finished(job_id)
+            return False
+
+        queued = broadcast_repository.enqueue_recipients(job_id, resolution.recipients)
+        broadcast_repository.update_job(job_id, status=broadcast_repository.JOB_STATUS_QUEUED)
+        LOGGER.info("Scheduled broadcast %s queued for %s recipients", job_id, queued)
+        return True
+
+
+def dispatch_due_broadcasts(credentials: BroadcastCredentials) -> int:
+    """Queue every due scheduled broadcast and start delivery of queued jobs; returns jobs started."""
+
+    started = resume_broadcast_jobs(credentials)
+    for job in broadcast_repository.list_due_scheduled_jobs():
+        try:
+            activated = _activate_job(job)
+        except Exception:  # noqa: BLE001
+            LOGGER.exception("Failed to dispatch scheduled broadcast %s", job.get("id"))
+            continue
+        # Delivery takes the job lock itself, so it starts only after _activate_job released it.
+        if activated and start_broadcast_job(int(job["id"]), credentials):
+            started += 1
+    return started
+
+
+def run_dispatcher(stop_requested: Callable[[], bool], *, interval: Optional[int] = None) -> None:
+    """Poll for queued and due scheduled broadcasts until *stop_requested* returns ``True``."""
+
+    interval = interval or DISPATCH_INTERVAL_SECONDS
+    credentials = BroadcastCredentials.from_env()
+    if not credentials.telegram_token and not credentials.vk_token:
+        LOGGER.info("No Telegram or VK token configured, scheduled broadcasts are disabled")
+        return
+
+    LOGGER.info("Broadcast dispatcher started: interval=%ss", interval)
+    while not stop_requested():
+        try:
+            dispatch_due_broadcasts(credentials)
+            wait = broadcast_repository.seconds_until_next_scheduled_job()
+        except Exception:  # noqa: BLE001
+            LOGGER.exception("Scheduled broadcast dispatch failed")
+            wait = None
+        sleep_for = interval if wait is None else min(max(wait, 1.0), interval)
+        waited = 0.0
+        while waited < sleep_for and not stop_requested():
+            step = min(1.0, sleep_for - waited)
+            time.sleep(step)
+            waited += step
+
+
+def start_dispatcher_thread(stop_requested: Callable[[], bool]) -> threading.Thread:
+    thread = threading.Thread(
+        target=run_dispatcher,
+        args=(stop_requested,),
+        name="broadcast-dispatcher",
+        daemon=True,
+    )
+    thread.start()
+    return thread
@@ -0,0 +1,259 @@
+"""Download FIT files for stored activities that are still missing one.
+
+Runs as a job of ``scheduler.scheduler``. Each pass logs in to every account
+with due activities, then downloads through a shared thread pool where every
+account gets at most ``FIT_BACKFILL_PER_ACCOUNT`` lanes, so one slow account
+cannot occupy all workers. Failed downloads (including
+activities WattAttack never produced a FIT for) are retried with exponential
+backoff via ``seen_activity_ids.next_attempt_at`` and given up on after
+``FIT_RETRY_MAX_ATTEMPTS``.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Optional
+
+from repositories.fit_archive_repository import export_fit_file, store_fit_file
+from repositories.schedule_repository import (
+    list_activities_missing_fit,
+    record_fit_attempt_failure,
+    record_seen_activity_id,
+)
+from scheduler.activity_analytics import ingest_activity_fit
+from scheduler.notifier_client import format_activity_meta, send_to_matching_clients
+from wattattack_activities import WattAttackClient
+
+LOGGER = logging.getLogger(__name__)
+
+KRUTILKAVN_BOT_TOKEN_ENV = "KRUTILKAVN_BOT_TOKEN"
+FIT_BACKFILL_INTERVAL_SECONDS = max(30, int(os.environ.get("FIT_BACKFILL_INTERVAL_SECONDS", "300")))
+FIT_BACKFILL_WORKERS = max(1, int(os.environ.get("FIT_BACKFILL_WORKERS", "4")))
+FIT_BACKFILL_PER_ACCOUNT = max(1, int(os.environ.get("FIT_BACKFILL_PER_ACCOUNT", "2")))
+FIT_BACKFILL_BATCH = int(os.environ.get("FIT_BACKFILL_BATCH", "200"))
+FIT_RETRY_BASE_SECONDS = int(os.environ.get("FIT_RETRY_BASE_SECONDS", str(30 * 60)))
+FIT_RETRY_MAX_SECONDS = int(os.environ.get("FIT_RETRY_MAX_SECONDS", str(7 * 24 * 3600)))
+FIT_RETRY_MAX_ATTEMPTS = int(os.environ.get("FIT_RETRY_MAX_ATTEMPTS", "10"))
+FEED_LIMIT = 2000
+
+
+@dataclass
+class _AccountJob:
+    account_id: str
+    account_name: str
+    client: WattAttackClient
+    profile: Dict[str, Any]
+    activities: Dict[str, Dict[str, Any]]
+    rows: Deque[Dict[str, Any]]
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def next_row(self) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            return self.rows.popleft() if self.rows else None
+
+
+@dataclass
+class BackfillStats:
+    downloaded: int = 0
+    failed: int = 0
+    accounts: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def add(self, *, downloaded: int = 0, failed: int = 0) -> None:
+        with self.lock:
+            self.downloaded += downloaded
+            self.failed += failed
+
+
+def _schedule_retry(account_id: str, activity_id: str, reason: str) -> None:
+    try:
+        next_attempt = record_fit_attempt_failure(
+            account_id,
+            activity_id,
+            reason,
+            base_delay_seconds=FIT_RETRY_BASE_SECONDS,
+            max_delay_seconds=FIT_RETRY_MAX_SECONDS,
+            max_attempts=FIT_RETRY_MAX_ATTEMPTS,
+        )
+    except Exception:  # noqa: BLE001
+        LOGGER.exception("%s: не удалось запланировать повтор для %s", account_id, activity_id)
+        return
+    if next_attempt is None:
+        LOGGER.info("%s: FIT для %s не появился, больше не пытаемся (%s)", account_id, activity_id, reason)
+    else:
+        LOGGER.info("%s: FIT для %s — %s, повтор после %s", account_id, activity_id, reason, next_attempt)
+
+
+def _prepare_account(
+    account_id: str, account: Dict[str, Any], *, timeout: float, batch: int
+) -> Optional[_AccountJob]:
+    """Log in and load the feed for an account with due activities; ``None`` if nothing to do."""
+
+    missing = list_activities_missing_fit(account_id, limit=batch, due_only=True)
+    if not missing:
+        return None
+
+    client = WattAttackClient(account["base_url"])
+    client.login(account["email"], account["password"], timeout=timeout)
+    try:
+        profile = client.fetch_profile(timeout=timeout)
+        if not isinstance(profile, dict):
+            profile = {}
+    except Exception as exc:  # noqa: BLE001
+        LOGGER.warning("Failed to fetch profile for %s: %s", account_id, exc)
+        profile = {}
+    feed, _ = client.fetch_activity_feed(limit=FEED_LIMIT, timeout=timeout)
+    activities = {str(item.get("id")): item for item in feed if isinstance(item, dict) and item.get("id") is not None}
+
+    LOGGER.info("%s: ищем FIT для %d активностей без файла", account_id, len(missing))
+    return _AccountJob(
+        account_id=account_id,
+        account_name=account.get("name", account_id),
+        client=client,
+        profile=profile,
+        activities=activities,
+        rows=deque(missing),
+    )
+
+
+def _backfill_row(
+    job: _AccountJob, row: Dict[str, Any], work_dir: Path, *, timeout: float, clientbot_token: Optional[str]
+) -> bool:
+    """Archive the FIT of one activity and deliver it if that never happened; ``True`` on download."""
+
+    account_id = job.account_id
+    activity_id = str(row.get("activity_id"))
+    scheduled_client_id = row.get("manual_client_id") or row.get("client_id")
+    scheduled_client_name = row.get("manual_client_name") or row.get("scheduled_name")
+    activity = job.activities.get(activity_id)
+    if not activity:
+        _schedule_retry(account_id, activity_id, "нет в ленте")
+        return False
+    fit_id = activity.get("fitFileId")
+    if not fit_id:
+        _schedule_retry(account_id, activity_id, "нет fitFileId")
+        return False
+
+    dest_file = work_dir / f"{activity_id}.fit"
+    if not export_fit_file(account_id, activity_id, dest_file):
+        try:
+            job.client.download_fit_file(str(fit_id), dest_file, timeout=timeout)
+            store_fit_file(account_id, activity_id, dest_file)
+        except Exception as exc:  # noqa: BLE001
+            dest_file.unlink(missing_ok=True)
+            _schedule_retry(account_id, activity_id, f"ошибка скачивания: {exc}")
+            return False
+
+    fit_path = f"/fitfiles/{account_id}/{activity_id}.fit"
+    record_seen_activity_id(account_id, activity_id, fit_path=fit_path)
+
+    needs_delivery = not row.get("sent_clientbot") or not row.get("sent_strava") or not row.get("sent_intervals")
+    if not needs_delivery:
+        ingest_activity_fit(account_id, activity_id, scheduled_client_id)
+        return True
+
+    caption = format_activity_meta(activity, job.account_name, job.profile, scheduled_client_name)
+    try:
+        sent_clientbot, sent_strava, sent_intervals, resolved_client_id, resolved_client_name = (
+            send_to_matching_clients(
+                activity,
+                job.profile,
+                caption,
+                clientbot_token or "",
+                timeout,
+                dest_file,
+                job.account_name,
+                scheduled_client_id,
+                scheduled_client_name,
+            )
+        )
+    except Exception:  # noqa: BLE001
+        LOGGER.exception("%s: не удалось отправить восстановленную активность %s", account_id, activity_id)
+        ingest_activity_fit(account_id, activity_id, scheduled_client_id)
+        return True
+
+    record_seen_activity_id(
+        account_id,
+        activity_id,
+        client_id=resolved_client_id or scheduled_client_id,
+        scheduled_name=resolved_client_name or scheduled_client_name,
+        fit_path=fit_path,
+        sent_clientbot=sent_clientbot,
+        sent_strava=sent_strava,
+        sent_intervals=sent_intervals,
+        start_time=row.get("start_time"),
+        profile_name=row.get("profile_name"),
+    )
+    # Delivery may match another client; credit the ride to the one just stored.
+    ingest_activity_fit(
+        account_id, activity_id, row.get("manual_client_id") or resolved_client_id or scheduled_client_id
+    )
+    return True
+
+
+def _run_lane(job: _AccountJob, stats: BackfillStats, *, timeout: float, clientbot_token: Optional[str]) -> None:
+    # Archived files are compressed; uploads need a plain copy next to them.
+    with tempfile.TemporaryDirectory(prefix="fit-backfill-") as tmp_dir:
+        work_dir = Path(tmp_dir)
+        while True:
+            row = job.next_row()
+            if row is None:
+                return
+            try:
+                downloaded = _backfill_row(job, row, work_dir, timeout=timeout, clientbot_token=clientbot_token)
+            except Exception:  # noqa: BLE001
+                LOGGER.exception("%s: сбой восстановления FIT %s", job.account_id, row.get("activity_id"))
+                downloaded = False
+            stats.add(downloaded=int(downloaded), failed=int(not downloaded))
+
+
+def run_backfill_pass(
+    accounts: Dict[str, Dict[str, Any]],
+    *,
+    timeout: float,
+    clientbot_token: Optional[str] = None,
+    workers: int = FIT_BACKFILL_WORKERS,
+    per_account: int = FIT_BACKFILL_PER_ACCOUNT,
+    batch: int = FIT_BACKFILL_BATCH,
+) -> BackfillStats:
+    """Backfill due activities of all accounts concurrently and return the totals."""
+
+    stats = BackfillStats()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fit-backfill") as executor:
+        prepared = {
+            account_id: executor.submit(_prepare_account, account_id, account, timeout=timeout, batch=batch)
+            for account_id, account in accounts.items()
+        }
+        jobs: List[_AccountJob] = []
+        for account_id, future in prepared.items():
+            try:
+                job = future.result()
+            except Exception:  # noqa: BLE001
+                LOGGER.exception("%s: не удалось подготовить восстановление FIT", account_id)
+                continue
+            if job:
+                jobs.append(job)
+
+        stats.accounts = len(jobs)
+        lanes = [
+            executor.submit(_run_lane, job, stats, timeout=timeout, clientbot_token=clientbot_token)
+            for job in jobs
+            for _ in range(min(per_account, len(job.rows)))
+        ]
+        for lane in lanes:
+            lane.result()
+
+    if stats.accounts:
+        LOGGER.info(
+            "FIT backfill: %d accounts, %d downloaded, %d postponed",
+            stats.accounts,
+            stats.downloaded,
+            stats.failed,
+        )
+    return stats
@@ -4,8 +4,10 @@ from __future__ import annotations
 import hashlib
 import json
 import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, timedelta
-from typing import Dict, List
+from typing import Callable, Dict, List
 
 from intervals_client import IntervalsClient
 from repositories.intervals_link_repository import list_links
@@ -13,6 +15,8 @@ from repositories import intervals_plan_repository as plan_repo
 
 LOGGER = logging.getLogger(__name__)
 
+INTERVALS_FETCH_WORKERS = max(1, int(os.environ.get("INTERVALS_FETCH_WORKERS", "4")))
+
 
 def _format_duration(seconds: int | float | None) -> str:
     if seconds is None:
@@ -75,8 +79,68 @@ def _hash_events(events: List[Dict]) -> str:
     return hashlib.sha256(payload.encode("utf-8")).hexdigest()
 
 
+def _notify_link(
+    link: Dict,
+    *,
+    bot_token: str,
+    oldest: str,
+    newest: str,
+    timeout: float,
+    send_message: Callable[..., None],
+) -> None:
+    tg_user_id = link.get("tg_user_id")
+    api_key = link.get("intervals_api_key")
+    athlete_id = link.get("intervals_athlete_id") or "0"
+    if not tg_user_id or not api_key:
+        return
+
+    try:
+        client = IntervalsClient(api_key=api_key, athlete_id=athlete_id, timeout=timeout)
+        events: List[Dict] = client.fetch_events(
+            category="WORKOUT",
+            oldest=oldest,
+            newest=newest,
+            resolve=True,
+        )
+        if not events:
+            LOGGER.debug("No planned workouts for user %s in next 7 days", tg_user_id)
+            return
+        events = _sorted_events(events)
+
+        plan_hash = _hash_events(events)
+        previous_hash = plan_repo.get_plan_hash(int(tg_user_id))
+        if previous_hash == plan_hash:
+            LOGGER.debug("Intervals plan unchanged for user %s, skipping notification", tg_user_id)
+            return
+
+        lines = [
+            "📅 План на неделю (Intervals.icu):",
+            *[_format_event_line(ev) for ev in events],
+        ]
+        try:
+            plan_repo.upsert_plan_hash(int(tg_user_id), plan_hash)
+        except Exception:  # noqa: BLE001
+            LOGGER.exception("Failed to persist Intervals plan hash for user %s; skipping send", tg_user_id)
+            return
+
+        text = "\n".join(lines)
+        send_message(
+            bot_token,
+            str(tg_user_id),
+            text,
+            timeout=timeout,
+            parse_mode="HTML",
+        )
+        LOGGER.info("Sent Intervals plan to user %s (%d items)", tg_user_id, len(events))
+    except Exception:  # noqa: BLE001
+        LOGGER.exception("Failed to send Intervals plan to user %s", tg_user_id)
+
+
 def notify_week_plan(*, bot_token: str, timeout: float) -> None:
-    """Fetch planned workouts for the next 7 days and send to linked users."""
+    """Fetch planned workouts for the next 7 days and send to linked users.
+
+    Users are handled concurrently on ``INTERVALS_FETCH_WORKERS`` threads.
+    """
     if not bot_token:
         LOGGER.debug("KRUTILKAVN_BOT_TOKEN is not set; skipping Intervals plan notifications")
         return
@@ -90,53 +154,15 @@ def notify_week_plan(*, bot_token: str, timeout: float) -> None:
 
     oldest = date.today()
     newest = oldest + timedelta(days=7)
-    oldest_str = oldest.isoformat()
-    newest_str = newest.isoformat()
-
-    for link in links:
-        tg_user_id = link.get("tg_user_id")
-        api_key = link.get("intervals_api_key")
-        athlete_id = link.get("intervals_athlete_id") or "0"
-        if not tg_user_id or not api_key:
-            continue
 
-        try:
-            client = IntervalsClient(api_key=api_key, athlete_id=athlete_id, timeout=timeout)
-            events: List[Dict] = client.fetch_events(
-                category="WORKOUT",
-                oldest=oldest_str,
-                newest=newest_str,
-                resolve=True,
-            )
-            if not events:
-                LOGGER.debug("No planned workouts for user %s in next 7 days", tg_user_id)
-                continue
-            events = _sorted_events(events)
-
-            plan_hash = _hash_events(events)
-            previous_hash = plan_repo.get_plan_hash(int(tg_user_id))
-            if previous_hash == plan_hash:
-                LOGGER.debug("Intervals plan unchanged for user %s, skipping notification", tg_user_id)
-                continue
-
-            lines = [
-                "📅 План на неделю (Intervals.icu):",
-                *[_format_event_line(ev) for ev in events],
-            ]
-            try:
-                plan_repo.upsert_plan_hash(int(tg_user_id), plan_hash)
-            except Exception:  # noqa: BLE001
-                LOGGER.exception("Failed to persist Intervals plan hash for user %s; skipping send", tg_user_id)
-                continue
-
-            text = "\n".join(lines)
-            telegram_send_message(
-                bot_token,
-                str(tg_user_id),
-                text,
+    with ThreadPoolExecutor(max_workers=INTERVALS_FETCH_WORKERS, thread_name_prefix="intervals-plan") as pool:
+        for link in links:
+            pool.submit(
+                _notify_link,
+                link,
+                bot_token=bot_token,
+                oldest=oldest.isoformat(),
+                newest=newest.isoformat(),
                 timeout=timeout,
-                parse_mode="HTML",
+                send_message=telegram_send_message,
             )
-            LOGGER.info("Sent Intervals plan to user %s (%d items)", tg_user_id, len(events))
-        except Exception:  # noqa: BLE001
-            LOGGER.exception("Failed to send Intervals plan to user %s", tg_user_id)
@@ -1,9 +1,14 @@
 """Download Intervals.icu workouts for the week and upload to WattAttack accounts."""
 from __future__ import annotations
 
+import hashlib
 import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from datetime import date, timedelta
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 import requests
 
@@ -11,15 +16,19 @@ from intervals_client import IntervalsClient
 from repositories.intervals_link_repository import list_links
 from repositories import intervals_uploaded_repository as uploaded_repo
 from wattattack_workouts import (
+    analyze_workout,
     build_workout_payload,
-    calculate_workout_metrics,
     parse_zwo_workout,
+    workout_content_hash,
     zwo_to_chart_data,
 )
-from wattattack_activities import WattAttackClient
+from wattattack_profiles import account_ftp, account_session
 
 LOGGER = logging.getLogger(__name__)
 
+INTERVALS_FETCH_WORKERS = max(1, int(os.environ.get("INTERVALS_FETCH_WORKERS", "4")))
+INTERVALS_UPLOAD_WORKERS = max(1, int(os.environ.get("INTERVALS_UPLOAD_WORKERS", "4")))
+
 
 def _decode_zwo(raw_bytes: bytes) -> str:
     text = None
@@ -34,16 +43,30 @@ def _decode_zwo(raw_bytes: bytes) -> str:
     return text
 
 
-def _fetch_ftp(client: WattAttackClient, timeout: float) -> float | None:
-    try:
-        profile = client.fetch_profile(timeout=timeout)
-        ftp_raw = profile.get("ftp") if isinstance(profile, dict) else None
-        if ftp_raw in (None, "", "—"):
-            return None
-        ftp_value = float(ftp_raw)
-        return ftp_value if ftp_value > 0 else None
-    except Exception:  # noqa: BLE001
-        return None
+class _ParsedWorkouts:
+    """Parse each distinct ZWO body once per sync pass, whichever user planned it."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._parsed: Dict[str, Tuple[Dict[str, Any], List[Dict[str, Any]], str] | Exception] = {}
+
+    def get(self, zwo_bytes: bytes) -> Tuple[Dict[str, Any], List[Dict[str, Any]], str]:
+        """Return ``(workout, chart_data, content_hash)``; parse errors are re-raised."""
+
+        key = hashlib.sha256(zwo_bytes).hexdigest()
+        with self._lock:
+            cached = self._parsed.get(key)
+        if cached is None:
+            try:
+                workout = parse_zwo_workout(_decode_zwo(zwo_bytes))
+                cached = (workout, zwo_to_chart_data(workout), workout_content_hash(workout))
+            except Exception as exc:  # noqa: BLE001
+                cached = exc
+            with self._lock:
+                self._parsed[key] = cached
+        if isinstance(cached, Exception):
+            raise cached
+        return cached
 
 
 def _notify_user(bot_token: str, tg_user_id: int, text: str, timeout: float) -> None:
@@ -60,23 +83,53 @@ def _notify_user(bot_token: str, tg_user_id: int, text: str, timeout: float) ->
 
 
 def _upload_to_account(
+    account_id: str,
     account: Dict[str, Any],
     workout: Dict[str, Any],
     chart_data: List[Dict[str, Any]],
     *,
     timeout: float,
+    login_errors: Dict[str, str],
 ) -> Tuple[bool, str]:
-    def worker():
-        client = WattAttackClient(account["base_url"])
-        client.login(account["email"], account["password"], timeout=timeout)
-        ftp = _fetch_ftp(client, timeout)
-        metrics = calculate_workout_metrics(workout, ftp)
-        payload = build_workout_payload(workout, chart_data, metrics)
-        return client.upload_workout(payload, timeout=timeout)
+    """Upload through the shared per-account session of ``wattattack_profiles``.
+
+    Uploads into the same account are serialized by the session; different
+    accounts upload in parallel. A failed login is remembered in
+    *login_errors* so the rest of the pass does not retry it for every event.
+    """
+
+    if account_id in login_errors:
+        return False, login_errors[account_id]
+
+    logged_in = False
+
+    def upload(force_login: bool = False) -> Any:
+        nonlocal logged_in
+        logged_in = False
+        with account_session(
+            account_id=account_id,
+            email=account["email"],
+            password=account["password"],
+            base_url=account.get("base_url"),
+            timeout=timeout,
+            force_login=force_login,
+        ) as client:
+            logged_in = True
+            metrics = analyze_workout(workout).metrics(account_ftp(client, timeout=timeout))
+            payload = build_workout_payload(workout, chart_data, metrics)
+            return client.upload_workout(payload, timeout=timeout)
 
     try:
-        resp = worker()
+        try:
+            resp = upload()
+        except RuntimeError as exc:
+            # The cached session may have expired server-side; 401 means nothing was created.
+            if not logged_in or "(401)" not in str(exc):
+                raise
+            resp = upload(force_login=True)
     except Exception as exc:  # noqa: BLE001
+        if not logged_in:
+            login_errors[account_id] = str(exc)
         return False, str(exc)
 
     if isinstance(resp, dict):
@@ -93,13 +146,131 @@ def _upload_to_account(
     return True, msg
 
 
+@dataclass
+class _PendingEvent:
+    tg_user_id: int
+    event_id: int
+    name: str
+    date_str: Optional[str]
+    workout: Dict[str, Any]
+    chart_data: List[Dict[str, Any]]
+    content_hash: str
+    missing_accounts: List[str]
+    per_account_status: Dict[str, bool] = field(default_factory=dict)
+
+
+def _collect_user_events(
+    link: Dict[str, Any],
+    account_ids: List[str],
+    parsed: _ParsedWorkouts,
+    *,
+    oldest: str,
+    newest: str,
+    timeout: float,
+) -> List[_PendingEvent]:
+    """Fetch a user's planned workouts and parse those some account still lacks."""
+
+    tg_user_id = link.get("tg_user_id")
+    api_key = link.get("intervals_api_key")
+    athlete_id = link.get("intervals_athlete_id") or "0"
+    if not tg_user_id or not api_key:
+        return []
+
+    try:
+        client = IntervalsClient(api_key=api_key, athlete_id=athlete_id, timeout=timeout)
+        events = client.fetch_events(
+            category="WORKOUT",
+            oldest=oldest,
+            newest=newest,
+            resolve=True,
+        )
+    except Exception:  # noqa: BLE001
+        LOGGER.exception("Failed to fetch Intervals events for user %s", tg_user_id)
+        return []
+
+    by_id: Dict[int, Dict[str, Any]] = {}
+    for ev in events:
+        try:
+            by_id[int(ev.get("id"))] = ev
+        except (TypeError, ValueError):
+            continue
+    if not by_id:
+        return []
+
+    recorded = uploaded_repo.uploaded_accounts(tg_user_id, by_id.keys())
+    pending: List[_PendingEvent] = []
+    for event_id_int, ev in by_id.items():
+        done = recorded.get(event_id_int, set())
+        missing = [account_id for account_id in account_ids if account_id not in done]
+        if not missing:
+            continue
+
+        date_str = (ev.get("start_date_local") or "")[:10] or None
+        # Download ZWO once per event
+        zwo_bytes = None
+        try:
+            if date_str:
+                zwo_bytes = client.download_event_zwo(oldest=date_str, newest=date_str)
+            if not zwo_bytes:
+                workout_obj = ev.get("workout_doc") or ev
+                if workout_obj:
+                    zwo_bytes = client.download_workout_as_zwo(workout_obj)
+        except Exception:  # noqa: BLE001
+            LOGGER.exception("Failed to download ZWO for event %s (user %s)", event_id_int, tg_user_id)
+            continue
+
+        if not zwo_bytes:
+            LOGGER.warning("No ZWO data for event %s (user %s)", event_id_int, tg_user_id)
+            continue
+
+        try:
+            workout_obj, chart_data, content_hash = parsed.get(zwo_bytes)
+        except Exception as exc:  # noqa: BLE001
+            msg = str(exc)
+            if "at least one segment" in msg.lower():
+                # Skip empty/placeholder workouts and mark as skipped to avoid retries
+                for account_id in missing:
+                    uploaded_repo.record_upload(
+                        tg_user_id=tg_user_id,
+                        event_id=event_id_int,
+                        account_id=account_id,
+                        status="skipped_empty",
+                        info=msg,
+                    )
+                LOGGER.info("Skipped empty workout event %s for user %s (no segments)", event_id_int, tg_user_id)
+                continue
+            LOGGER.exception("Failed to parse ZWO for event %s (user %s)", event_id_int, tg_user_id)
+            continue
+
+        pending.append(
+            _PendingEvent(
+                tg_user_id=tg_user_id,
+                event_id=event_id_int,
+                name=ev.get("name") or "Без названия",
+                date_str=date_str,
+                workout=workout_obj,
+                chart_data=chart_data,
+                content_hash=content_hash,
+                missing_accounts=missing,
+                per_account_status={account_id: True for account_id in account_ids if account_id in done},
+            )
+        )
+    return pending
+
+
 def sync_intervals_workouts(
     *,
     accounts: Dict[str, Dict[str, Any]],
     bot_token: str,
     timeout: float,
 ) -> None:
-    """Download planned workouts for next 7 days and upload to all WattAttack accounts."""
+    """Download planned workouts for next 7 days and upload to all WattAttack accounts.
+
+    Users' plans are fetched in parallel. Identical workouts (same content
+    hash of the parsed ZWO) are parsed once and uploaded to each account once,
+    whoever planned them; the uploads run on a bounded pool through the cached
+    per-account sessions of ``wattattack_profiles``.
+    """
     links = list_links()
     if not links:
         LOGGER.debug("No Intervals.icu links found; skipping sync")
@@ -109,116 +280,103 @@ def sync_intervals_workouts(
     end_date = start_date + timedelta(days=7)
     oldest = start_date.isoformat()
     newest = end_date.isoformat()
+    account_ids = list(accounts.keys())
+    parsed = _ParsedWorkouts()
 
-    for link in links:
-        tg_user_id = link.get("tg_user_id")
-        api_key = link.get("intervals_api_key")
-        athlete_id = link.get("intervals_athlete_id") or "0"
-        if not tg_user_id or not api_key:
-            continue
+    pending: List[_PendingEvent] = []
+    with ThreadPoolExecutor(max_workers=INTERVALS_FETCH_WORKERS, thread_name_prefix="intervals-fetch") as pool:
+        futures = [
+            pool.submit(_collect_user_events, link, account_ids, parsed, oldest=oldest, newest=newest, timeout=timeout)
+            for link in links
+        ]
+        for future in futures:
+            try:
+                pending.extend(future.result())
+            except Exception:  # noqa: BLE001
+                LOGGER.exception("Failed to collect Intervals events")
 
-        try:
-            client = IntervalsClient(api_key=api_key, athlete_id=athlete_id, timeout=timeout)
-            events = client.fetch_events(
-                category="WORKOUT",
-                oldest=oldest,
-                newest=newest,
-                resolve=True,
-            )
-        except Exception as exc:  # noqa: BLE001
-            LOGGER.exception("Failed to fetch Intervals events for user %s", tg_user_id)
-            continue
+    if not pending or not accounts:
+        return
 
-        for ev in events:
-            event_id = ev.get("id")
-            if event_id is None:
-                continue
-            try:
-                event_id_int = int(event_id)
-            except (TypeError, ValueError):
-                continue
+    try:
+        already_uploaded = uploaded_repo.uploaded_workouts(event.content_hash for event in pending)
+    except Exception:  # noqa: BLE001
+        LOGGER.exception("Failed to load Intervals workout upload cache")
+        already_uploaded = {}
 
-            date_str = (ev.get("start_date_local") or "")[:10] or None
-            name = ev.get("name") or "Без названия"
-            per_account_status: Dict[str, bool] = {}
-            event_had_new_records = False
+    # One upload per distinct (workout, account); every event sharing it gets the result.
+    results: Dict[Tuple[str, str], Tuple[bool, str]] = {}
+    jobs: Dict[Tuple[str, str], _PendingEvent] = {}
+    for event in pending:
+        for account_id in event.missing_accounts:
+            key = (event.content_hash, account_id)
+            if account_id in already_uploaded.get(event.content_hash, {}):
+                results[key] = (True, "duplicate: уже загружена в аккаунт")
+            else:
+                jobs.setdefault(key, event)
 
-            # Download ZWO once per event
-            zwo_bytes = None
-            try:
-                if date_str:
-                    zwo_bytes = client.download_event_zwo(oldest=date_str, newest=date_str)
-                if not zwo_bytes:
-                    workout_obj = ev.get("workout_doc") or ev
-                    if workout_obj:
-                        zwo_bytes = client.download_workout_as_zwo(workout_obj)
-            except Exception as exc:  # noqa: BLE001
-                LOGGER.exception("Failed to download ZWO for event %s (user %s)", event_id, tg_user_id)
-                continue
+    login_errors: Dict[str, str] = {}
+    with ThreadPoolExecutor(max_workers=INTERVALS_UPLOAD_WORKERS, thread_name_prefix="intervals-upload") as pool:
+        # Jobs are in event-major order, so the head of the queue hits different accounts.
+        futures_by_key = {
+            key: pool.submit(
+                _upload_to_account,
+                key[1],
+                accounts[key[1]],
+                event.workout,
+                event.chart_data,
+                timeout=timeout,
+                login_errors=login_errors,
+            )
+            for key, event in jobs.items()
+        }
+        for key, future in futures_by_key.items():
+            results[key] = future.result()
 
-            if not zwo_bytes:
-                LOGGER.warning("No ZWO data for event %s (user %s)", event_id, tg_user_id)
-                continue
+    cache_rows: List[Tuple[str, str, str, Optional[str]]] = []
+    for (content_hash, account_id) in jobs:
+        success, info = results[(content_hash, account_id)]
+        status = "success" if success else ("duplicate" if "duplicate" in info.lower() else "error")
+        cache_rows.append((content_hash, account_id, status, info))
+    try:
+        uploaded_repo.record_workout_uploads(cache_rows)
+    except Exception:  # noqa: BLE001
+        LOGGER.exception("Failed to store Intervals workout upload cache")
 
+    for event in pending:
+        for account_id in event.missing_accounts:
+            success, info = results[(event.content_hash, account_id)]
+            status = "success" if success else "error"
+            # Treat duplicate errors as success to avoid retries
+            if "duplicate" in info.lower():
+                status = "duplicate"
+                success = True
             try:
-                workout_text = _decode_zwo(zwo_bytes)
-                workout_obj = parse_zwo_workout(workout_text)
-                chart_data = zwo_to_chart_data(workout_obj)
-            except Exception as exc:  # noqa: BLE001
-                msg = str(exc)
-                if "at least one segment" in msg.lower():
-                    # Skip empty/placeholder workouts and mark as skipped to avoid retries
-                    for account_id in accounts.keys():
-                        uploaded_repo.record_upload(
-                            tg_user_id=tg_user_id,
-                            event_id=event_id_int,
-                            account_id=account_id,
-                            status="skipped_empty",
-                            info=msg,
-                        )
-                    LOGGER.info("Skipped empty workout event %s for user %s (no segments)", event_id, tg_user_id)
-                    continue
-                LOGGER.exception("Failed to parse ZWO for event %s (user %s)", event_id, tg_user_id)
-                continue
-
-            for account_id, account in accounts.items():
-                if uploaded_repo.is_uploaded(tg_user_id, event_id_int, account_id):
-                    per_account_status[account_id] = True
-                    continue
-                success, info = _upload_to_account(account, workout_obj, chart_data, timeout=timeout)
-                status = "success" if success else "error"
-                # Treat duplicate errors as success to avoid retries
-                if not success and "duplicate" in info.lower():
-                    status = "duplicate"
-                    success = True
                 uploaded_repo.record_upload(
-                    tg_user_id=tg_user_id,
-                    event_id=event_id_int,
+                    tg_user_id=event.tg_user_id,
+                    event_id=event.event_id,
                     account_id=account_id,
                     status=status,
                     info=info,
                 )
-                event_had_new_records = True
-                per_account_status[account_id] = success
-                LOGGER.info(
-                    "Intervals upload %s for user %s to account %s: %s",
-                    event_id,
-                    tg_user_id,
-                    account_id,
-                    "OK" if success else "FAIL",
-                )
-
-            if bot_token and accounts:
-                # Avoid spamming the user if nothing new happened for this event
-                if not event_had_new_records:
-                    continue
-                total_accounts = len(accounts)
-                ok_count = sum(1 for v in per_account_status.values() if v)
-                if ok_count == total_accounts:
-                    text = f"✅ Загрузили \"{name}\" ({date_str or 'дата ?'}) во все аккаунты ({ok_count}/{total_accounts})."
-                    _notify_user(bot_token, tg_user_id, text, timeout)
-                else:
-                    text = (
-                        f"⚠️ Загрузка \"{name}\" ({date_str or 'дата ?'}): {ok_count}/{total_accounts} аккаунтов успешно."
-                    )
-                    _notify_user(bot_token, tg_user_id, text, timeout)
+            except Exception:  # noqa: BLE001
+                LOGGER.exception("Failed to record Intervals upload %s for account %s", event.event_id, account_id)
+            event.per_account_status[account_id] = success
+            LOGGER.info(
+                "Intervals upload %s for user %s to account %s: %s",
+                event.event_id,
+                event.tg_user_id,
+                account_id,
+                "OK" if success else "FAIL",
+            )
+    if not bot_token:
+        return
+    total_accounts = len(accounts)
+    for event in pending:
+        ok_count = sum(1 for v in event.per_account_status.values() if v)
+        date_label = event.date_str or "дата ?"
+        if ok_count == total_accounts:
+            text = f"✅ Загрузили \"{event.name}\" ({date_label}) во все аккаунты ({ok_count}/{total_accounts})."
+        else:
+            text = f"⚠️ Загрузка \"{event.name}\" ({date_label}): {ok_count}/{total_accounts} аккаунтов успешно."
+        _notify_user(bot_token, event.tg_user_id, text, timeout)
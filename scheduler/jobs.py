@@ -0,0 +1,297 @@
+"""A small in-process job scheduler with independent cadences.
+
+Jobs run on an ``interval`` (seconds) or a five-field ``cron`` expression in
+the local timezone. Due times live in a heap; the loop sleeps until the
+earliest one and starts the job on its own thread. A job never overlaps
+itself: while a run is in progress its next due time is skipped and counted.
+Python threads cannot be killed, so ``timeout`` only reports a run as hung
+(log + metric) and the overlap guard keeps it from piling up. After
+:meth:`JobScheduler.run` returns, :meth:`JobScheduler.join` waits for the runs
+still in progress so a stop does not cut them off mid-write.
+"""
+from __future__ import annotations
+
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, tzinfo
+from typing import Callable, Dict, FrozenSet, List, Optional, Tuple
+
+LOGGER = logging.getLogger(__name__)
+
+_CRON_FIELDS: Tuple[Tuple[str, int, int], ...] = (
+    ("minute", 0, 59),
+    ("hour", 0, 23),
+    ("day", 1, 31),
+    ("month", 1, 12),
+    ("weekday", 0, 7),
+)
+
+
+class CronError(ValueError):
+    """The cron expression cannot be parsed."""
+
+
+@dataclass(frozen=True)
+class CronSchedule:
+    """Parsed ``minute hour day month weekday`` expression (weekday 0/7 = Sunday)."""
+
+    minutes: FrozenSet[int]
+    hours: FrozenSet[int]
+    days: FrozenSet[int]
+    months: FrozenSet[int]
+    weekdays: FrozenSet[int]
+    day_restricted: bool
+    weekday_restricted: bool
+
+    @classmethod
+    def parse(cls, expression: str) -> "CronSchedule":
+        parts = expression.split()
+        if len(parts) != len(_CRON_FIELDS):
+            raise CronError(f"Expected 5 cron fields, got {len(parts)}: {expression!r}")
+        values = [_parse_cron_field(part, *spec) for part, spec in zip(parts, _CRON_FIELDS)]
+        weekdays = frozenset(0 if value == 7 else value for value in values[4])
+        return cls(
+            minutes=values[0],
+            hours=values[1],
+            days=values[2],
+            months=values[3],
+            weekdays=weekdays,
+            day_restricted=parts[2] != "*",
+            weekday_restricted=parts[4] != "*",
+        )
+
+    def _day_matches(self, moment: datetime) -> bool:
+        day_ok = moment.day in self.days
+        weekday_ok = (moment.weekday() + 1) % 7 in self.weekdays
+        if self.day_restricted and self.weekday_restricted:
+            return day_ok or weekday_ok
+        return day_ok and weekday_ok
+
+    def next_after(self, moment: datetime) -> datetime:
+        """First matching minute strictly after *moment* (keeps its tzinfo)."""
+
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = candidate + timedelta(days=366 * 5)
+        while candidate < limit:
+            if candidate.month not in self.months:
+                year = candidate.year + candidate.month // 12
+                candidate = candidate.replace(year=year, month=candidate.month % 12 + 1, day=1, hour=0, minute=0)
+                continue
+            if not self._day_matches(candidate):
+                candidate = candidate.replace(hour=0, minute=0) + timedelta(days=1)
+                continue
+            if candidate.hour not in self.hours:
+                candidate = candidate.replace(minute=0) + timedelta(hours=1)
+                continue
+            if candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+                continue
+            return candidate
+        raise CronError("Cron expression never matches")
+
+
+def _parse_cron_field(text: str, name: str, low: int, high: int) -> FrozenSet[int]:
+    values = set()
+    for item in text.split(","):
+        base, _, step_text = item.partition("/")
+        try:
+            step = int(step_text) if step_text else 1
+            if base == "*":
+                start, end = low, high
+            elif "-" in base:
+                start_text, end_text = base.split("-", 1)
+                start, end = int(start_text), int(end_text)
+            else:
+                start = int(base)
+                end = high if step_text else start
+        except ValueError as exc:
+            raise CronError(f"Invalid cron {name} field: {text!r}") from exc
+        if step < 1 or start < low or end > high or start > end:
+            raise CronError(f"Cron {name} field out of range: {text!r}")
+        values.update(range(start, end + 1, step))
+    return frozenset(values)
+
+
+@dataclass
+class JobMetrics:
+    runs: int = 0
+    failures: int = 0
+    timeouts: int = 0
+    skipped_overlaps: int = 0
+    running: bool = False
+    last_started_at: Optional[datetime] = None
+    last_finished_at: Optional[datetime] = None
+    last_duration: Optional[float] = None
+    max_duration: float = 0.0
+    last_error: Optional[str] = None
+    next_run_at: Optional[datetime] = None
+
+    def as_dict(self) -> Dict[str, object]:
+        return {
+            key: value.isoformat() if isinstance(value, datetime) else value
+            for key, value in self.__dict__.items()
+        }
+
+
+@dataclass
+class Job:
+    """A scheduled callable; exactly one of ``interval`` and ``cron`` is set."""
+
+    name: str
+    func: Callable[[], object]
+    interval: Optional[float] = None
+    cron: Optional[str] = None
+    jitter: float = 0.0
+    timeout: Optional[float] = None
+    run_on_start: bool = True
+    metrics: JobMetrics = field(default_factory=JobMetrics)
+    _schedule: Optional[CronSchedule] = field(default=None, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def __post_init__(self) -> None:
+        if (self.interval is None) == (self.cron is None):
+            raise ValueError(f"Job {self.name}: set either interval or cron")
+        if self.interval is not None and self.interval <= 0:
+            raise ValueError(f"Job {self.name}: interval must be positive")
+        if self.cron is not None:
+            self._schedule = CronSchedule.parse(self.cron)
+
+    def next_run(self, now: datetime) -> datetime:
+        if self._schedule is not None:
+            due = self._schedule.next_after(now)
+        else:
+            due = now + timedelta(seconds=self.interval)
+        if self.jitter > 0:
+            due += timedelta(seconds=random.uniform(0, self.jitter))
+        return due
+
+
+class JobScheduler:
+    """Run registered jobs at their own cadence until :meth:`stop` or *stop_requested*."""
+
+    def __init__(self, tz: tzinfo, *, stop_requested: Optional[Callable[[], bool]] = None) -> None:
+        self._tz = tz
+        self._jobs: Dict[str, Job] = {}
+        self._heap: List[Tuple[datetime, int, str]] = []
+        self._counter = itertools.count()
+        self._stop_requested = stop_requested or (lambda: False)
+        self._stopped = threading.Event()
+        self._metrics_lock = threading.Lock()
+        self._threads: Dict[str, threading.Thread] = {}
+
+    def now(self) -> datetime:
+        return datetime.now(tz=self._tz)
+
+    def add(self, job: Job) -> Job:
+        if job.name in self._jobs:
+            raise ValueError(f"Job {job.name} is already registered")
+        self._jobs[job.name] = job
+        now = self.now()
+        first = now + timedelta(seconds=random.uniform(0, job.jitter)) if job.run_on_start else job.next_run(now)
+        self._push(job, first)
+        LOGGER.info(
+            "Job %s scheduled (%s, jitter=%ss, timeout=%ss), first run at %s",
+            job.name,
+            f"cron {job.cron!r}" if job.cron else f"every {job.interval}s",
+            job.jitter,
+            job.timeout,
+            first.isoformat(timespec="seconds"),
+        )
+        return job
+
+    def _push(self, job: Job, due: datetime) -> None:
+        job.metrics.next_run_at = due
+        heapq.heappush(self._heap, (due, next(self._counter), job.name))
+
+    def metrics(self) -> Dict[str, Dict[str, object]]:
+        with self._metrics_lock:
+            return {name: job.metrics.as_dict() for name, job in self._jobs.items()}
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def _should_stop(self) -> bool:
+        return self._stopped.is_set() or self._stop_requested()
+
+    def _execute(self, job: Job) -> None:
+        started = time.monotonic()
+        error: Optional[str] = None
+        try:
+            job.func()
+        except Exception as exc:  # noqa: BLE001
+            LOGGER.exception("Job %s failed", job.name)
+            error = f"{type(exc).__name__}: {exc}"
+        finally:
+            duration = time.monotonic() - started
+            with self._metrics_lock:
+                metrics = job.metrics
+                metrics.running = False
+                metrics.last_finished_at = self.now()
+                metrics.last_duration = round(duration, 3)
+                metrics.max_duration = round(max(metrics.max_duration, duration), 3)
+                metrics.last_error = error
+                if error:
+                    metrics.failures += 1
+            job._lock.release()
+            LOGGER.debug("Job %s finished in %.1fs", job.name, duration)
+
+    def _watch_timeout(self, job: Job, thread: threading.Thread) -> None:
+        thread.join(job.timeout)
+        if thread.is_alive():
+            with self._metrics_lock:
+                job.metrics.timeouts += 1
+            LOGGER.warning("Job %s is still running after its %ss timeout", job.name, job.timeout)
+
+    def _start(self, job: Job) -> None:
+        if not job._lock.acquire(blocking=False):
+            with self._metrics_lock:
+                job.metrics.skipped_overlaps += 1
+            LOGGER.warning("Job %s is still running, skipping this run", job.name)
+            return
+        with self._metrics_lock:
+            job.metrics.runs += 1
+            job.metrics.running = True
+            job.metrics.last_started_at = self.now()
+        thread = threading.Thread(target=self._execute, args=(job,), name=f"job-{job.name}", daemon=True)
+        self._threads[job.name] = thread
+        thread.start()
+        if job.timeout:
+            threading.Thread(
+                target=self._watch_timeout, args=(job, thread), name=f"job-{job.name}-watch", daemon=True
+            ).start()
+
+    def run(self) -> None:
+        """Block and dispatch due jobs; returns once stop is requested."""
+
+        while not self._should_stop():
+            if not self._heap:
+                self._stopped.wait(1.0)
+                continue
+            due, _, name = self._heap[0]
+            wait = (due - self.now()).total_seconds()
+            if wait > 0:
+                # Short naps keep stop requests (signals, stop files) responsive.
+                self._stopped.wait(min(wait, 1.0))
+                continue
+            heapq.heappop(self._heap)
+            job = self._jobs[name]
+            self._start(job)
+            self._push(job, job.next_run(max(due, self.now())))
+
+    def join(self, timeout: float) -> List[str]:
+        """Wait up to *timeout* seconds in total for running jobs; return those still running."""
+
+        deadline = time.monotonic() + timeout
+        for name, thread in list(self._threads.items()):
+            if thread.is_alive():
+                LOGGER.info("Waiting for job %s to finish", name)
+                thread.join(max(deadline - time.monotonic(), 0.0))
+        return [name for name, thread in self._threads.items() if thread.is_alive()]
+
+
+__all__ = ["CronError", "CronSchedule", "Job", "JobMetrics", "JobScheduler"]
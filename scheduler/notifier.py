@@ -6,8 +6,8 @@ import argparse
 import json
 import logging
 import os
-import shutil
 import tempfile
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta, date, time, timezone
 from pathlib import Path
 from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
@@ -32,9 +32,8 @@ from repositories.schedule_repository import (
     record_assignment_notification,
     was_assignment_notification_sent,
     find_reservation_by_client_name,
-    ensure_fit_files_dir,
-    list_activities_missing_fit,
 )
+from repositories.fit_archive_repository import store_fit_file
 from repositories.client_repository import get_client, search_clients
 
 # Import the send_to_matching_clients function from notifier_client
@@ -49,7 +48,10 @@ from scheduler.notifier_client import (
 from scheduler import reminders
 from scheduler import intervals_plan
 from scheduler import intervals_upload
+from scheduler import fit_backfill
 from scheduler import accounts as accounts_utils
+from scheduler.reservation_index import ReservationMatcher
+from scheduler.activity_analytics import ingest_activity_fit
 from wattattack_profiles import apply_client_profile as apply_wattattack_profile
 
 LOGGER = logging.getLogger(__name__)
@@ -377,21 +379,7 @@ def assign_clients_to_accounts(
         LOGGER.debug("Auto-assignment disabled (lead=%s, window=%s)", lead_minutes, window_minutes)
         return
 
-    notification_status_default = "observed" if dry_run or not ASSIGN_ENABLE else "applied"
-
-    stand_accounts: Dict[int, Dict[str, Any]] = {}
-    for account_id, account in accounts.items():
-        for stand_id in account.get("stand_ids") or []:
-            if stand_id in stand_accounts:
-                LOGGER.warning(
-                    "Stand %s already mapped to %s, overriding with %s",
-                    stand_id,
-                    stand_accounts[stand_id]["id"],
-                    account_id,
-                )
-            stand_accounts[stand_id] = {**account, "id": account_id}
-
-    if not stand_accounts:
+    if not stand_accounts_map(accounts):
         LOGGER.debug("No stand mappings in accounts file, skipping auto-assignment")
         return
 
@@ -413,6 +401,49 @@ def assign_clients_to_accounts(
         )
         return
 
+    apply_reservation_assignments(
+        reservations,
+        accounts=accounts,
+        timeout=timeout,
+        dry_run=dry_run,
+        admin_ids=admin_ids,
+        bot_token=bot_token,
+    )
+
+
+def stand_accounts_map(accounts: Dict[str, Dict[str, Any]]) -> Dict[int, Dict[str, Any]]:
+    """Map stand id -> account (with ``id``) from the accounts' ``stand_ids``."""
+
+    stand_accounts: Dict[int, Dict[str, Any]] = {}
+    for account_id, account in accounts.items():
+        for stand_id in account.get("stand_ids") or []:
+            if stand_id in stand_accounts:
+                LOGGER.warning(
+                    "Stand %s already mapped to %s, overriding with %s",
+                    stand_id,
+                    stand_accounts[stand_id]["id"],
+                    account_id,
+                )
+            stand_accounts[stand_id] = {**account, "id": account_id}
+    return stand_accounts
+
+
+def apply_reservation_assignments(
+    reservations: Sequence[Dict[str, Any]],
+    *,
+    accounts: Dict[str, Dict[str, Any]],
+    timeout: float,
+    dry_run: bool,
+    admin_ids: Sequence[int],
+    bot_token: str,
+) -> None:
+    """Apply the clients of *reservations* to their stands' accounts and notify admins."""
+
+    notification_status_default = "observed" if dry_run or not ASSIGN_ENABLE else "applied"
+    stand_accounts = stand_accounts_map(accounts)
+    if not stand_accounts:
+        return
+
     notifications: List[Dict[str, Any]] = []
     applied = 0
     for reservation in reservations:
@@ -594,9 +625,10 @@ def send_activity_fit(
     token: str,
     admin_ids: Sequence[int],
     timeout: float,
+    matcher: Optional[ReservationMatcher] = None,
 ) -> Tuple[bool, Optional[int], Optional[str], Optional[datetime], Optional[str], bool, bool, bool, Optional[str]]:
     fit_id = activity.get("fitFileId")
-    scheduled_match = resolve_scheduled_client(account, activity, profile)
+    scheduled_match = resolve_scheduled_client(account, activity, profile, matcher=matcher)
     matched_client_id = scheduled_match.get("client_id") if scheduled_match else None
     matched_client_name = scheduled_match.get("client_name") if scheduled_match else None
     start_dt = parse_activity_start_dt(activity)
@@ -685,13 +717,8 @@ def send_activity_fit(
         client.download_fit_file(str(fit_id), temp_file, timeout=timeout)
         filename = f"activity_{activity.get('id')}.fit"
         try:
-            dest_dir = ensure_fit_files_dir() / account_id
-            dest_dir.mkdir(parents=True, exist_ok=True)
-            dest_file = dest_dir / f"{activity.get('id')}.fit"
-            if not dest_file.exists():
-                shutil.copy2(temp_file, dest_file)
-            if dest_file.exists():
-                fit_path = f"/fitfiles/{account_id}/{activity.get('id')}.fit"
+            store_fit_file(account_id, str(activity.get("id")), temp_file)
+            fit_path = f"/fitfiles/{account_id}/{activity.get('id')}.fit"
         except Exception:
             LOGGER.exception("Failed to archive FIT file for %s %s", account_id, activity.get("id"))
         
@@ -776,161 +803,62 @@ def send_activity_fit(
     )
 
 
-def backfill_missing_fit_files(
-    *,
-    account_id: str,
-    client: WattAttackClient,
-    activities: Sequence[Dict[str, Any]],
-    account_name: Optional[str],
-    profile: Dict[str, Any],
-    clientbot_token: Optional[str],
-    timeout: float,
-    max_missing: int = 200,
-) -> int:
-    """
-    Attempt to download FIT files for activities that are already stored but missing fit_path.
+@dataclass
+class NotifierContext:
+    """Options, admins and accounts shared by the notifier jobs.
 
-    Returns the number of FIT files successfully downloaded or linked.
+    :func:`prepare_context` does the one-time setup; the long-running
+    scheduler keeps the context and only calls :func:`refresh_context`
+    to pick up admin and account changes.
     """
 
-    missing = list_activities_missing_fit(account_id, limit=max_missing)
-    if not missing:
-        return 0
-
-    LOGGER.info("%s: ищем FIT для %d активностей без файла", account_id, len(missing))
+    args: argparse.Namespace
+    admin_ids: List[int] = field(default_factory=list)
+    accounts: Dict[str, Dict[str, Any]] = field(default_factory=dict)
 
-    activity_map = {
-        str(item.get("id")): item for item in activities if isinstance(item, dict) and item.get("id") is not None
-    }
 
-    if any(str(item.get("activity_id")) not in activity_map for item in missing):
-        try:
-            extra_activities, _ = client.fetch_activity_feed(limit=2000, timeout=timeout)
-            for item in extra_activities:
-                key = item.get("id")
-                if key is not None:
-                    activity_map[str(key)] = item
-        except Exception:  # noqa: BLE001
-            LOGGER.warning("%s: не удалось обновить ленту для поиска FIT", account_id)
-
-    downloaded = 0
-    base_dir = ensure_fit_files_dir()
-
-    for row in missing:
-        activity_id = str(row.get("activity_id"))
-        scheduled_client_id = row.get("manual_client_id") or row.get("client_id")
-        scheduled_client_name = row.get("manual_client_name") or row.get("scheduled_name")
-        activity = activity_map.get(activity_id)
-        if not activity:
-            LOGGER.info("%s: активность %s не найдена в ленте, пропускаем", account_id, activity_id)
-            continue
-
-        fit_id = activity.get("fitFileId")
-        if not fit_id:
-            LOGGER.info("%s: у активности %s нет fitFileId, пропускаем", account_id, activity_id)
-            continue
+def refresh_context(ctx: NotifierContext) -> bool:
+    """Reload admins and accounts; on failure the previous values are kept."""
 
-        dest_dir = base_dir / account_id
-        dest_dir.mkdir(parents=True, exist_ok=True)
-        dest_file = dest_dir / f"{activity_id}.fit"
-
-        if not dest_file.exists():
-            try:
-                client.download_fit_file(str(fit_id), dest_file, timeout=timeout)
-            except Exception:  # noqa: BLE001
-                LOGGER.warning("%s: ошибка скачивания FIT %s для активности %s", account_id, fit_id, activity_id)
-                dest_file.unlink(missing_ok=True)
-                continue
-
-        fit_path = None
-        if dest_file.exists():
-            fit_path = f"/fitfiles/{account_id}/{activity_id}.fit"
-            record_seen_activity_id(account_id, activity_id, fit_path=fit_path)
-            downloaded += 1
-
-        needs_delivery = (
-            not row.get("sent_clientbot")
-            or not row.get("sent_strava")
-            or not row.get("sent_intervals")
-        )
-        if not needs_delivery or not dest_file.exists():
-            continue
-
-        caption = format_activity_meta(activity, account_name, profile, scheduled_client_name)
-        try:
-            sent_clientbot, sent_strava, sent_intervals, resolved_client_id, resolved_client_name = (
-                send_to_matching_clients(
-                    activity,
-                    profile,
-                    caption,
-                    clientbot_token or "",
-                    timeout,
-                    dest_file,
-                    account_name,
-                    scheduled_client_id,
-                    scheduled_client_name,
-                )
-            )
-        except Exception:  # noqa: BLE001
-            LOGGER.exception("%s: не удалось отправить восстановленную активность %s", account_id, activity_id)
-            continue
-
-        final_client_id = resolved_client_id or scheduled_client_id
-        final_client_name = resolved_client_name or scheduled_client_name
-
-        record_seen_activity_id(
-            account_id,
-            activity_id,
-            client_id=final_client_id,
-            scheduled_name=final_client_name,
-            fit_path=fit_path,
-            sent_clientbot=sent_clientbot,
-            sent_strava=sent_strava,
-            sent_intervals=sent_intervals,
-            start_time=row.get("start_time"),
-            profile_name=row.get("profile_name"),
+    admin_ids = get_admin_ids()
+    if not admin_ids:
+        LOGGER.error(
+            "Администраторы не настроены. Добавьте их через /addadmin или переменную TELEGRAM_ADMIN_IDS."
         )
+        return False
+    try:
+        accounts = accounts_utils.load_accounts(ctx.args.accounts)
+    except Exception as exc:  # noqa: BLE001
+        LOGGER.error("Failed to load accounts: %s", exc)
+        return False
+    ctx.admin_ids = admin_ids
+    ctx.accounts = accounts
+    return True
 
-    if downloaded:
-        LOGGER.info("%s: скачано %d FIT-файлов из пропущенных", account_id, downloaded)
-    else:
-        LOGGER.info("%s: нет скачанных FIT-файлов из пропущенных", account_id)
-
-    return downloaded
-
-
-def main(argv: Optional[Sequence[str]] = None) -> int:
-    args = parse_args(argv)
 
+def prepare_context(args: argparse.Namespace) -> Optional[NotifierContext]:
     if not args.token:
         LOGGER.error(
             "Telegram bot token not provided (set KRUTILKAFIT_BOT_TOKEN or --token)",
         )
-        return 2
+        return None
 
     ensure_admin_table()
     ensure_activity_ids_table()  # Ensure our activity IDs table exists
     seed_admins_from_env(args.admins)
-    admin_ids = get_admin_ids()
-    if not admin_ids:
-        LOGGER.error(
-            "Администраторы не настроены. Добавьте их через /addadmin или переменную TELEGRAM_ADMIN_IDS."
-        )
-        return 2
+    ctx = NotifierContext(args=args)
+    return ctx if refresh_context(ctx) else None
 
-    try:
-        accounts = accounts_utils.load_accounts(args.accounts)
-    except Exception as exc:  # noqa: BLE001
-        LOGGER.error("Failed to load accounts: %s", exc)
-        return 2
 
-    # Note: We're not using the state file anymore, but keeping it for backward compatibility
-    # state = load_state(args.state)
-    # state.setdefault("accounts", {})
+def poll_activities(ctx: NotifierContext) -> None:
+    """Fetch new activities of every account, deliver their FIT files and store them."""
 
+    args = ctx.args
+    admin_ids = ctx.admin_ids
     any_changes = False
+    reservation_matcher = ReservationMatcher()
 
-    for account_id, account in accounts.items():
+    for account_id, account in ctx.accounts.items():
         LOGGER.info("Checking account %s", account.get("name", account_id))
         
         # Get known activity IDs from database instead of JSON file
@@ -1006,6 +934,7 @@ def main(argv: Optional[Sequence[str]] = None) -> int:
                         token=args.token,
                         admin_ids=admin_ids,
                         timeout=args.timeout,
+                        matcher=reservation_matcher,
                     )
                     if processed:
                         distance = activity.get("distance")
@@ -1032,6 +961,8 @@ def main(argv: Optional[Sequence[str]] = None) -> int:
                             average_cadence=average_cadence,
                             average_heartrate=average_heartrate,
                         )
+                        if fit_path:
+                            ingest_activity_fit(account_id, str(activity.get("id")), matched_client_id)
                     else:
                         LOGGER.info(
                             "Deferring activity %s for account %s until FIT appears",
@@ -1041,65 +972,96 @@ def main(argv: Optional[Sequence[str]] = None) -> int:
         else:
             LOGGER.info("No new activities for %s", account_id)
 
-        if not args.dry_run:
-            try:
-                recovered = backfill_missing_fit_files(
-                    account_id=account_id,
-                    client=client,
-                    activities=activities,
-                    account_name=account.get("name", account_id),
-                    profile=profile,
-                    clientbot_token=os.environ.get(KRUTILKAVN_BOT_TOKEN_ENV),
-                    timeout=args.timeout,
-                )
-                if recovered:
-                    any_changes = True
-            except Exception:  # noqa: BLE001
-                LOGGER.exception("Failed to backfill FIT files for %s", account_id)
+
+def run_assignments(ctx: NotifierContext) -> None:
+    args = ctx.args
+    assign_clients_to_accounts(
+        accounts=ctx.accounts,
+        lead_minutes=args.assign_lead_minutes,
+        window_minutes=args.assign_window_minutes,
+        timeout=args.timeout,
+        dry_run=args.dry_run,
+        admin_ids=ctx.admin_ids,
+        bot_token=args.token,
+    )
+
+
+def run_backfill(ctx: NotifierContext) -> None:
+    """Download FIT files still missing for already seen activities."""
+    if ctx.args.dry_run:
+        return
+    fit_backfill.run_backfill_pass(
+        ctx.accounts,
+        timeout=ctx.args.timeout,
+        clientbot_token=os.environ.get(KRUTILKAVN_BOT_TOKEN_ENV),
+    )
+
+
+def run_reminders(ctx: NotifierContext) -> None:
+    """Send workout reminders to clients."""
+    if ctx.args.dry_run:
+        return
+    reminders.send_workout_reminders(
+        timeout=ctx.args.timeout,
+        reminder_hours=ctx.args.reminder_hours,
+        clientbot_token=os.environ.get(KRUTILKAVN_BOT_TOKEN_ENV),
+    )
+
+
+def run_week_plan(ctx: NotifierContext) -> None:
+    """Send the Intervals.icu plan for the next 7 days to linked users via client bot."""
+    if ctx.args.dry_run:
+        return
+    intervals_plan.notify_week_plan(
+        bot_token=os.environ.get(KRUTILKAVN_BOT_TOKEN_ENV) or "",
+        timeout=ctx.args.timeout,
+    )
+
+
+def run_intervals_upload(ctx: NotifierContext) -> None:
+    """Upload Intervals.icu planned workouts to WattAttack accounts."""
+    if ctx.args.dry_run:
+        return
+    intervals_upload.sync_intervals_workouts(
+        accounts=ctx.accounts,
+        bot_token=ctx.args.token,
+        timeout=ctx.args.timeout,
+    )
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    """Run every notifier job once, in order."""
+    args = parse_args(argv)
+    ctx = prepare_context(args)
+    if ctx is None:
+        return 2
+
+    poll_activities(ctx)
 
     try:
-        assign_clients_to_accounts(
-            accounts=accounts,
-            lead_minutes=args.assign_lead_minutes,
-            window_minutes=args.assign_window_minutes,
-            timeout=args.timeout,
-            dry_run=args.dry_run,
-            admin_ids=admin_ids,
-            bot_token=args.token,
-        )
+        run_backfill(ctx)
+    except Exception:  # noqa: BLE001
+        LOGGER.exception("Failed to backfill missing FIT files")
+
+    try:
+        run_assignments(ctx)
     except Exception:
         LOGGER.exception("Failed to process automatic WattAttack account assignments")
 
-    # Send workout reminders to clients
-    if not args.dry_run:
-        try:
-            reminders.send_workout_reminders(
-                timeout=args.timeout,
-                reminder_hours=args.reminder_hours,
-                clientbot_token=os.environ.get(KRUTILKAVN_BOT_TOKEN_ENV),
-            )
-        except Exception:
-            LOGGER.exception("Failed to send workout reminders")
+    try:
+        run_reminders(ctx)
+    except Exception:
+        LOGGER.exception("Failed to send workout reminders")
 
-        # Send Intervals.icu plan for the next 7 days to linked users via client bot
-        krutilkavn_token = os.environ.get(KRUTILKAVN_BOT_TOKEN_ENV)
-        try:
-            intervals_plan.notify_week_plan(
-                bot_token=krutilkavn_token or "",
-                timeout=args.timeout,
-            )
-        except Exception:  # noqa: BLE001
-            LOGGER.exception("Failed to send Intervals.icu weekly plan notifications")
+    try:
+        run_week_plan(ctx)
+    except Exception:  # noqa: BLE001
+        LOGGER.exception("Failed to send Intervals.icu weekly plan notifications")
 
-        # Upload Intervals.icu planned workouts to WattAttack accounts
-        try:
-            intervals_upload.sync_intervals_workouts(
-                accounts=accounts,
-                bot_token=args.token,
-                timeout=args.timeout,
-            )
-        except Exception:  # noqa: BLE001
-            LOGGER.exception("Failed to sync Intervals.icu workouts to WattAttack")
+    try:
+        run_intervals_upload(ctx)
+    except Exception:  # noqa: BLE001
+        LOGGER.exception("Failed to sync Intervals.icu workouts to WattAttack")
 
     return 0
 
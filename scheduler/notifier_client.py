@@ -7,7 +7,6 @@ import json
 import logging
 import os
 import tempfile
-import shutil
 import time as time_module
 from datetime import datetime, timedelta, date, time as dt_time, timezone
 from pathlib import Path
@@ -17,6 +16,7 @@ import requests
 from zoneinfo import ZoneInfo
 from straver_client import StraverClient
 from scheduler import intervals_sync
+from scheduler.reservation_index import ReservationMatcher
 
 from wattattack_activities import DEFAULT_BASE_URL, WattAttackClient
 from repositories.admin_repository import (
@@ -33,10 +33,8 @@ from repositories.schedule_repository import (
     was_activity_id_seen,
     record_seen_activity_id,
     get_seen_activity_ids_for_account,
-    find_reservation_for_activity,
-    find_reservation_by_client_name,
-    ensure_fit_files_dir,
 )
+from repositories.fit_archive_repository import store_fit_file
 from repositories.client_link_repository import get_link_by_client
 from repositories.intervals_link_repository import get_link as get_intervals_link
 from repositories.client_repository import get_client, search_clients
@@ -520,10 +518,15 @@ def resolve_scheduled_client(
     account: Optional[Dict[str, Any]],
     activity: Dict[str, Any],
     profile: Optional[Dict[str, Any]] = None,
+    *,
+    matcher: Optional[ReservationMatcher] = None,
 ) -> Optional[Dict[str, Any]]:
     """
     Resolve which client was scheduled on the account's stand at the activity time.
 
+    Pass a shared ``matcher`` when resolving many activities so each day's
+    reservations are loaded once instead of queried per activity.
+
     Returns dict with keys client_id, client_name if found, otherwise None.
     """
 
@@ -539,9 +542,10 @@ def resolve_scheduled_client(
 
     start_local = start_dt.astimezone(LOCAL_TIMEZONE)
     athlete_name = extract_athlete_name(profile or {})
+    lookup = matcher or ReservationMatcher()
 
     try:
-        reservation = find_reservation_for_activity(
+        reservation = lookup.find_reservation_for_activity(
             stand_ids,
             start_local,
             grace_minutes=MATCH_GRACE_MINUTES,
@@ -553,7 +557,7 @@ def resolve_scheduled_client(
     fallback_reservation = None
     if athlete_name:
         try:
-            fallback_reservation = find_reservation_by_client_name(
+            fallback_reservation = lookup.find_reservation_by_client_name(
                 start_local,
                 athlete_name,
                 grace_minutes=MATCH_GRACE_MINUTES,
@@ -825,9 +829,10 @@ def send_activity_fit(
     token: str,
     admin_ids: Sequence[int],
     timeout: float,
+    matcher: Optional[ReservationMatcher] = None,
 ) -> Tuple[bool, Optional[int], Optional[str], Optional[datetime], Optional[str], bool, bool, bool, Optional[str]]:
     fit_id = activity.get("fitFileId")
-    scheduled_match = resolve_scheduled_client(account, activity, profile)
+    scheduled_match = resolve_scheduled_client(account, activity, profile, matcher=matcher)
     matched_client_id = scheduled_match.get("client_id") if scheduled_match else None
     matched_client_name = scheduled_match.get("client_name") if scheduled_match else None
     start_dt = parse_activity_start_dt(activity)
@@ -898,13 +903,8 @@ def send_activity_fit(
         client.download_fit_file(str(fit_id), temp_file, timeout=timeout)
         filename = f"activity_{activity.get('id')}.fit"
         try:
-            dest_dir = ensure_fit_files_dir() / account_id
-            dest_dir.mkdir(parents=True, exist_ok=True)
-            dest_file = dest_dir / f"{activity.get('id')}.fit"
-            if not dest_file.exists():
-                shutil.copy2(temp_file, dest_file)
-            if dest_file.exists():
-                fit_path = f"/fitfiles/{account_id}/{activity.get('id')}.fit"
+            store_fit_file(account_id, str(activity.get("id")), temp_file)
+            fit_path = f"/fitfiles/{account_id}/{activity.get('id')}.fit"
         except Exception:
             LOGGER.exception("Failed to archive FIT file for %s %s", account_id, activity.get("id"))
         # Send to admins
@@ -1328,6 +1328,7 @@ def main(argv: Optional[Sequence[str]] = None) -> int:
     # state.setdefault("accounts", {})
 
     any_changes = False
+    reservation_matcher = ReservationMatcher()
 
     for account_id, account in accounts.items():
         LOGGER.info("Checking account %s", account.get("name", account_id))
@@ -1404,6 +1405,7 @@ def main(argv: Optional[Sequence[str]] = None) -> int:
                         token=args.token,
                         admin_ids=admin_ids,
                         timeout=args.timeout,
+                        matcher=reservation_matcher,
                     )
                     if processed:
                         distance = activity.get("distance")
@@ -2,119 +2,144 @@ from __future__ import annotations
 
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import date, datetime, time, timedelta
 from typing import Any, Dict, List, Optional
 
 import requests
 from zoneinfo import ZoneInfo
 
+from notifications.broadcast import telegram_rate_limiter
 from repositories.schedule_repository import (
-    ensure_workout_notifications_table,
-    list_upcoming_reservations,
-    record_notification_sent,
-    was_notification_sent,
+    list_unsent_reminder_reservations,
+    record_notifications_sent,
 )
-from repositories.client_link_repository import get_link_by_client
-from repositories.client_repository import get_client
 from scheduler.notifier_client import telegram_send_message
 
 LOGGER = logging.getLogger(__name__)
 
 CLIENTBOT_TOKEN_ENV = "KRUTILKAVN_BOT_TOKEN"
 DEFAULT_REMINDER_HOURS = int(os.environ.get("WORKOUT_REMINDER_HOURS", "4"))
+REMINDER_WORKERS = max(1, int(os.environ.get("WORKOUT_REMINDER_WORKERS", "4")))
 LOCAL_TIMEZONE = ZoneInfo(os.environ.get("WATTATTACK_LOCAL_TZ", "Europe/Moscow"))
 
 
+def _group_by_client(reservations: List[Dict[str, Any]]) -> Dict[int, List[Dict[str, Any]]]:
+    client_reservations: Dict[int, List[Dict[str, Any]]] = {}
+    for reservation in reservations:
+        client_id = reservation.get("client_id")
+        if client_id and reservation.get("id"):
+            client_reservations.setdefault(client_id, []).append(reservation)
+    return client_reservations
+
+
+def _send_client_reminder(
+    token: str,
+    client_id: int,
+    reservations_for_client: List[Dict[str, Any]],
+    *,
+    reminder_hours: int,
+    timeout: float,
+) -> List[int]:
+    """Send one reminder and return the reservation ids it covered (empty on failure)."""
+
+    first = reservations_for_client[0]
+    tg_user_id = first.get("tg_user_id")
+    client = {
+        "first_name": first.get("client_first_name") or "",
+        "last_name": first.get("client_last_name") or "",
+        "full_name": first.get("client_full_name") or "",
+    }
+    message = format_workout_reminder(client, reservations_for_client, reminder_hours)
+    telegram_rate_limiter().acquire()
+    try:
+        telegram_send_message(
+            token,
+            str(tg_user_id),
+            message,
+            timeout=timeout,
+            parse_mode="HTML",
+        )
+    except requests.RequestException as exc:
+        LOGGER.warning("Failed to send workout reminder to client %s: %s", client_id, exc)
+        return []
+    except Exception as exc:  # noqa: BLE001
+        LOGGER.exception("Error processing workout reminder for client %s: %s", client_id, exc)
+        return []
+    LOGGER.info("Sent workout reminder to client %s (Telegram user %s)", client_id, tg_user_id)
+    return [reservation["id"] for reservation in reservations_for_client]
+
+
 def send_workout_reminders(
     *,
     timeout: float,
     reminder_hours: int = DEFAULT_REMINDER_HOURS,
     clientbot_token: Optional[str] = None,
 ) -> None:
-    """Send workout reminders to clients via clientbot."""
+    """Send workout reminders to clients via clientbot.
+
+    Unsent reservations come from a single query and messages go out on a
+    small thread pool under the shared Telegram rate limit. Each client's sent
+    markers are written as soon as their message is delivered, so a run
+    interrupted midway does not send those reminders again.
+    """
     token = clientbot_token or os.environ.get(CLIENTBOT_TOKEN_ENV)
     if not token:
         LOGGER.info("%s not set, skipping workout reminders", CLIENTBOT_TOKEN_ENV)
         return
 
-    try:
-        ensure_workout_notifications_table()
-    except Exception:
-        LOGGER.exception("Failed to ensure workout notifications table")
-        return
-
     now = datetime.now(tz=LOCAL_TIMEZONE)
     since = now + timedelta(hours=reminder_hours - 1)
     until = now + timedelta(hours=reminder_hours + 1)
+    notification_type = f"reminder_{reminder_hours}h"
 
     try:
-        reservations = list_upcoming_reservations(since, until)
-        LOGGER.info("Found %d upcoming reservations for workout reminders", len(reservations))
+        reservations = list_unsent_reminder_reservations(since, until, notification_type)
     except Exception as exc:  # noqa: BLE001
         LOGGER.exception("Failed to fetch upcoming reservations: %s", exc)
         return
 
-    notification_type = f"reminder_{reminder_hours}h"
-    unsent_reservations = []
-    for reservation in reservations:
-        reservation_id = reservation.get("id")
-        if reservation_id and not was_notification_sent(reservation_id, notification_type):
-            unsent_reservations.append(reservation)
-        else:
-            LOGGER.debug("Skipping reservation %s - notification already sent", reservation_id)
-
-    if not unsent_reservations:
+    client_reservations = _group_by_client(reservations)
+    LOGGER.info(
+        "Found %d unsent workout reminders for %d clients",
+        len(reservations),
+        len(client_reservations),
+    )
+    linked = {
+        client_id: items
+        for client_id, items in client_reservations.items()
+        if items[0].get("tg_user_id")
+    }
+    for client_id in client_reservations.keys() - linked.keys():
+        LOGGER.debug("Client %s is not linked to Telegram", client_id)
+    if not linked:
         LOGGER.info("No new workout reminders to send")
         return
 
-    client_reservations: Dict[int, List[Dict[str, object]]] = {}
-    for reservation in unsent_reservations:
-        client_id = reservation.get("client_id")
-        if client_id:
-            client_reservations.setdefault(client_id, []).append(reservation)
-
-    sent_count = 0
-    for client_id, reservations_for_client in client_reservations.items():
-        try:
-            client = get_client(client_id)
-            if not client:
-                LOGGER.warning("Client %s not found", client_id)
-                continue
-
-            link = get_link_by_client(client_id)
-            if not link:
-                LOGGER.debug("Client %s is not linked to Telegram", client_id)
-                continue
-
-            tg_user_id = link.get("tg_user_id")
-            if not tg_user_id:
-                LOGGER.debug("Client %s has no Telegram user ID", client_id)
+    sent = 0
+    with ThreadPoolExecutor(max_workers=min(REMINDER_WORKERS, len(linked)), thread_name_prefix="reminders") as pool:
+        futures = [
+            pool.submit(
+                _send_client_reminder,
+                token,
+                client_id,
+                items,
+                reminder_hours=reminder_hours,
+                timeout=timeout,
+            )
+            for client_id, items in linked.items()
+        ]
+        for future in as_completed(futures):
+            sent_ids = future.result()
+            if not sent_ids:
                 continue
-
-            message = format_workout_reminder(client, reservations_for_client, reminder_hours)
-
+            sent += len(sent_ids)
             try:
-                telegram_send_message(
-                    token,
-                    str(tg_user_id),
-                    message,
-                    timeout=timeout,
-                    parse_mode="HTML",
-                )
-
-                for reservation in reservations_for_client:
-                    reservation_id = reservation.get("id")
-                    if reservation_id:
-                        record_notification_sent(reservation_id, notification_type)
-
-                LOGGER.info("Sent workout reminder to client %s (Telegram user %s)", client_id, tg_user_id)
-                sent_count += len(reservations_for_client)
-            except requests.HTTPError as exc:  # noqa: PERF203
-                LOGGER.warning("Failed to send workout reminder to client %s: %s", client_id, exc)
-        except Exception as exc:  # noqa: BLE001
-            LOGGER.exception("Error processing workout reminder for client %s: %s", client_id, exc)
-
-    LOGGER.info("Sent %d workout reminders", sent_count)
+                record_notifications_sent(sent_ids, notification_type)
+            except Exception:  # noqa: BLE001
+                LOGGER.exception("Failed to record sent workout reminders %s", sent_ids)
+
+    LOGGER.info("Sent %d workout reminders", sent)
 
 
 def format_workout_reminder(client: Dict[str, Any], reservations: List[Dict[str, Any]], reminder_hours: int) -> str:
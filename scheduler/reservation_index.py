@@ -0,0 +1,166 @@
+"""In-memory index of one day's reservations for activity → client matching.
+
+``find_reservation_for_activity`` and ``find_reservation_by_client_name`` each
+run a query per activity.  A notifier pass or a re-sync matches many
+activities of the same few days, so :class:`ReservationMatcher` loads every
+reservation of a day once and answers both lookups from memory with the same
+window, distance and tie-breaking rules as the repository functions.
+"""
+from __future__ import annotations
+
+import threading
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from repositories.schedule_repository import (
+    list_client_reservations_for_day,
+    person_name_tokens,
+)
+
+Row = Dict[str, Any]
+
+
+def _slot_bounds(row: Row, target_date: date) -> Tuple[datetime, datetime]:
+    slot_date = row.get("slot_date") or target_date
+    return (
+        datetime.combine(slot_date, row.get("start_time") or time.min),
+        datetime.combine(slot_date, row.get("end_time") or time.max),
+    )
+
+
+def _candidate_token_sets(row: Row) -> List[frozenset]:
+    # Tokens of the first or last name alone are subsets of "first last", so
+    # these two sets decide every match the repository function would find.
+    first_last = " ".join(
+        part for part in [row.get("client_first_name"), row.get("client_last_name")] if part
+    )
+    result = []
+    for name in (row.get("client_full_name"), first_last):
+        tokens = frozenset(person_name_tokens(name))
+        if tokens and tokens not in result:
+            result.append(tokens)
+    return result
+
+
+class DayReservationIndex:
+    """Reservations of one day, grouped by stand and by client name token."""
+
+    def __init__(self, target_date: date, rows: Iterable[Row]) -> None:
+        self.target_date = target_date
+        self._rows: List[Row] = []
+        self._bounds: List[Tuple[datetime, datetime]] = []
+        self._by_stand: Dict[int, List[int]] = defaultdict(list)
+        self._token_sets: List[List[frozenset]] = []
+        self._by_token: Dict[str, List[int]] = defaultdict(list)
+
+        # Rows keep the repository order (start time DESC, id DESC) so the
+        # first of equally distant reservations wins, as in the SQL versions.
+        for position, row in enumerate(rows):
+            self._rows.append(row)
+            self._bounds.append(_slot_bounds(row, target_date))
+            stand_id = row.get("stand_id")
+            if stand_id is not None and row.get("status") == "booked":
+                self._by_stand[stand_id].append(position)
+            token_sets = _candidate_token_sets(row)
+            self._token_sets.append(token_sets)
+            for token in set().union(*token_sets) if token_sets else ():
+                self._by_token[token].append(position)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def _closest(self, positions: Iterable[int], target_dt: datetime, grace: timedelta) -> Optional[Row]:
+        matched: Optional[Row] = None
+        best_distance = timedelta.max
+        for position in positions:
+            slot_start, slot_end = self._bounds[position]
+            if target_dt.tzinfo:
+                slot_start = slot_start.replace(tzinfo=target_dt.tzinfo)
+                slot_end = slot_end.replace(tzinfo=target_dt.tzinfo)
+            if slot_start - grace <= target_dt <= slot_end + grace:
+                distance = abs(target_dt - slot_start)
+                if distance < best_distance:
+                    best_distance = distance
+                    matched = self._rows[position]
+        return matched
+
+    def match_stand(self, stand_ids: Sequence[int], target_dt: datetime, grace: timedelta) -> Optional[Row]:
+        positions = sorted(
+            position for stand_id in set(stand_ids) for position in self._by_stand.get(stand_id, ())
+        )
+        return self._closest(positions, target_dt, grace)
+
+    def match_name(
+        self,
+        athlete_name: str,
+        target_dt: datetime,
+        grace: timedelta,
+        statuses: Sequence[str],
+    ) -> Optional[Row]:
+        athlete_tokens = frozenset(person_name_tokens(athlete_name))
+        if not athlete_tokens:
+            return None
+        postings = [self._by_token.get(token, []) for token in athlete_tokens]
+        rarest = min(postings, key=len)
+        if not rarest:
+            return None
+        allowed = set(statuses)
+        positions = [
+            position
+            for position in rarest
+            if self._rows[position].get("status") in allowed
+            and any(athlete_tokens <= tokens for tokens in self._token_sets[position])
+        ]
+        return self._closest(positions, target_dt, grace)
+
+
+class ReservationMatcher:
+    """Lazily loads :class:`DayReservationIndex` per day and keeps them.
+
+    Create one per pass over activities; reservations written during the
+    pass are not seen unless the day is dropped with :meth:`forget`.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._days: Dict[date, DayReservationIndex] = {}
+
+    def day(self, target_date: date) -> DayReservationIndex:
+        with self._lock:
+            index = self._days.get(target_date)
+            if index is None:
+                index = DayReservationIndex(target_date, list_client_reservations_for_day(target_date))
+                self._days[target_date] = index
+            return index
+
+    def forget(self, target_date: date) -> None:
+        with self._lock:
+            self._days.pop(target_date, None)
+
+    def find_reservation_for_activity(
+        self,
+        stand_ids: Sequence[int],
+        target_dt: datetime,
+        *,
+        grace_minutes: int = 30,
+    ) -> Optional[Row]:
+        if not stand_ids:
+            return None
+        grace = timedelta(minutes=max(0, grace_minutes))
+        return self.day(target_dt.date()).match_stand(stand_ids, target_dt, grace)
+
+    def find_reservation_by_client_name(
+        self,
+        target_dt: datetime,
+        athlete_name: str,
+        *,
+        grace_minutes: int = 30,
+        statuses: Sequence[str] | None = None,
+    ) -> Optional[Row]:
+        if not athlete_name:
+            return None
+        grace = timedelta(minutes=max(0, grace_minutes))
+        return self.day(target_dt.date()).match_name(
+            athlete_name, target_dt, grace, list(statuses) if statuses else ["booked"]
+        )
@@ -1,22 +1,42 @@
 #!/usr/bin/env python3
-"""Run WattAttack notifier in a loop, checking for new activities every interval."""
+"""Run the WattAttack notifier jobs in one long-lived process.
+
+Activity polling, FIT backfill, automatic account assignment, reminders and
+the Intervals.icu jobs each run at their own cadence (see the settings
+below) instead of all of them once per notifier pass. The one-time notifier
+setup (tables, admin seed, accounts) happens once at start; admins and
+accounts are then refreshed by a job of their own.
+"""
 from __future__ import annotations
 
 import argparse
+import json
 import logging
 import os
 import signal
-import sys
 import time
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Iterable
+from typing import Callable, Iterable
 
 from zoneinfo import ZoneInfo
 
-from .notifier import main as notifier_main
+from . import notifier
+from .assignment_timer import start_assignment_timer_thread
+from .broadcasts import start_dispatcher_thread
+from .fit_backfill import FIT_BACKFILL_INTERVAL_SECONDS
+from .jobs import Job, JobScheduler
 
 DEFAULT_INTERVAL = int(os.environ.get("WATTATTACK_INTERVAL_SECONDS", str(30 * 60)))
+ASSIGN_INTERVAL = int(os.environ.get("WATTATTACK_ASSIGN_INTERVAL_SECONDS", "60"))
+ASSIGN_TRIGGER = os.environ.get("WATTATTACK_ASSIGN_TRIGGER", "timer")
+REMINDER_INTERVAL = int(os.environ.get("WATTATTACK_REMINDER_INTERVAL_SECONDS", str(5 * 60)))
+WEEK_PLAN_CRON = os.environ.get("WATTATTACK_WEEK_PLAN_CRON", "0 * * * *")
+INTERVALS_SYNC_INTERVAL = int(os.environ.get("WATTATTACK_INTERVALS_SYNC_INTERVAL_SECONDS", str(30 * 60)))
+CONTEXT_REFRESH_INTERVAL = int(os.environ.get("WATTATTACK_CONTEXT_REFRESH_SECONDS", str(10 * 60)))
+METRICS_LOG_INTERVAL = int(os.environ.get("WATTATTACK_METRICS_LOG_SECONDS", str(15 * 60)))
+JOB_TIMEOUT = int(os.environ.get("WATTATTACK_JOB_TIMEOUT_SECONDS", str(20 * 60)))
+STOP_GRACE_SECONDS = int(os.environ.get("WATTATTACK_STOP_GRACE_SECONDS", "120"))
 LOCAL_TIMEZONE = ZoneInfo(os.environ.get("WATTATTACK_LOCAL_TZ", "Europe/Moscow"))
 
 STOP_REQUESTED = False
@@ -31,7 +51,25 @@ def parse_args(argv: Iterable[str] | None = None) -> argparse.Namespace:
         "--interval",
         type=int,
         default=DEFAULT_INTERVAL,
-        help="Interval between checks in seconds",
+        help="Interval between activity checks in seconds",
+    )
+    parser.add_argument(
+        "--assign-interval",
+        type=int,
+        default=ASSIGN_INTERVAL,
+        help="Interval between automatic account assignment runs in seconds (--assign-trigger interval)",
+    )
+    parser.add_argument(
+        "--assign-trigger",
+        choices=("timer", "interval"),
+        default=ASSIGN_TRIGGER,
+        help="Apply bookings exactly lead minutes before each slot (timer) or scan a window periodically (interval)",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        type=Path,
+        default=os.environ.get("WATTATTACK_METRICS_FILE") or None,
+        help="Optional JSON file the job metrics are written to",
     )
     parser.add_argument(
         "--stop-file",
@@ -80,8 +118,78 @@ def request_stop(*_args) -> None:
     STOP_REQUESTED = True
 
 
+def _jitter(interval: float) -> float:
+    """Spread runs by up to 10% of the interval, at most a minute."""
+    return min(interval * 0.1, 60.0)
+
+
+def build_jobs(ctx: notifier.NotifierContext, args: argparse.Namespace) -> list[Job]:
+    def refresh() -> None:
+        if not notifier.refresh_context(ctx):
+            raise RuntimeError("Failed to refresh admins/accounts, keeping previous ones")
+
+    jobs = [
+        Job("context", refresh, interval=CONTEXT_REFRESH_INTERVAL, run_on_start=False),
+        Job(
+            "activities",
+            lambda: notifier.poll_activities(ctx),
+            interval=args.interval,
+            jitter=_jitter(args.interval),
+            timeout=JOB_TIMEOUT,
+        ),
+        Job(
+            "fit_backfill",
+            lambda: notifier.run_backfill(ctx),
+            interval=FIT_BACKFILL_INTERVAL_SECONDS,
+            jitter=_jitter(FIT_BACKFILL_INTERVAL_SECONDS),
+            timeout=JOB_TIMEOUT,
+        ),
+        Job("reminders", lambda: notifier.run_reminders(ctx), interval=REMINDER_INTERVAL, timeout=JOB_TIMEOUT),
+        Job("week_plan", lambda: notifier.run_week_plan(ctx), cron=WEEK_PLAN_CRON, timeout=JOB_TIMEOUT),
+        Job(
+            "intervals_upload",
+            lambda: notifier.run_intervals_upload(ctx),
+            interval=INTERVALS_SYNC_INTERVAL,
+            jitter=_jitter(INTERVALS_SYNC_INTERVAL),
+            timeout=JOB_TIMEOUT,
+        ),
+    ]
+    if args.assign_trigger == "interval" and args.assign_interval > 0:
+        # No jitter: the assignment window is measured from slot start times.
+        jobs.append(
+            Job(
+                "assignments",
+                lambda: notifier.run_assignments(ctx),
+                interval=args.assign_interval,
+                timeout=max(args.assign_interval * 5, 300),
+            )
+        )
+    return jobs
+
+
+def _metrics_job(scheduler: JobScheduler, metrics_file: Path | None) -> Callable[[], None]:
+    def report() -> None:
+        metrics = scheduler.metrics()
+        for name, item in sorted(metrics.items()):
+            logging.getLogger("scheduler").info(
+                "Job %s: runs=%s failures=%s timeouts=%s overlaps=%s last=%ss max=%ss",
+                name,
+                item["runs"],
+                item["failures"],
+                item["timeouts"],
+                item["skipped_overlaps"],
+                item["last_duration"],
+                item["max_duration"],
+            )
+        if metrics_file:
+            tmp_path = metrics_file.with_suffix(metrics_file.suffix + ".tmp")
+            tmp_path.write_text(json.dumps(metrics, ensure_ascii=False, indent=2), encoding="utf-8")
+            tmp_path.replace(metrics_file)
+
+    return report
+
+
 def main(argv: Iterable[str] | None = None) -> int:
-    global STOP_REQUESTED
     args = parse_args(argv)
     setup_logging(args.verbose)
 
@@ -90,46 +198,52 @@ def main(argv: Iterable[str] | None = None) -> int:
 
     log = logging.getLogger("scheduler")
     log.info(
-        "Starting WattAttack scheduler: interval=%ss, notifier_args=%s",
+        "Starting WattAttack scheduler: interval=%ss, assign_trigger=%s, assign_interval=%ss, notifier_args=%s",
         args.interval,
+        args.assign_trigger,
+        args.assign_interval,
         args.notifier_args,
     )
 
-    iteration = 0
-    while not STOP_REQUESTED:
-        iteration += 1
-        log.info("Iteration %d: invoking notifier", iteration)
-        try:
-            notifier_exit = notifier_main(args.notifier_args or [])
-        except SystemExit as exit_info:
-            notifier_exit = exit_info.code if isinstance(exit_info.code, int) else 1
-        except Exception:
-            log.exception("Notifier raised an unexpected exception")
-            notifier_exit = 1
-
-        if notifier_exit != 0:
-            log.warning("Notifier exit code %s", notifier_exit)
-
-        if args.stop_file and args.stop_file.exists():
+    def stop_requested() -> bool:
+        global STOP_REQUESTED
+        if not STOP_REQUESTED and args.stop_file and args.stop_file.exists():
             log.info("Stop file detected: %s", args.stop_file)
-            break
-
-        if STOP_REQUESTED:
-            break
+            STOP_REQUESTED = True
+        return STOP_REQUESTED
+
+    try:
+        ctx = notifier.prepare_context(notifier.parse_args(args.notifier_args or []))
+    except SystemExit as exit_info:
+        return exit_info.code if isinstance(exit_info.code, int) else 2
+    if ctx is None:
+        log.error("Notifier setup failed, scheduler is not started")
+        return 2
+
+    # Scheduled broadcasts need minute precision, so they run beside the notifier loop.
+    side_threads = [start_dispatcher_thread(stop_requested)]
+    if args.assign_trigger == "timer":
+        side_threads.append(start_assignment_timer_thread(ctx, stop_requested))
+
+    scheduler = JobScheduler(LOCAL_TIMEZONE, stop_requested=stop_requested)
+    for job in build_jobs(ctx, args):
+        scheduler.add(job)
+    scheduler.add(
+        Job("metrics", _metrics_job(scheduler, args.metrics_file), interval=METRICS_LOG_INTERVAL, run_on_start=False)
+    )
+    scheduler.run()
 
-        log.debug("Sleeping for %s seconds", args.interval)
-        for _ in range(args.interval):
-            if STOP_REQUESTED:
-                break
-            if args.stop_file and args.stop_file.exists():
-                log.info("Stop file detected during sleep: %s", args.stop_file)
-                STOP_REQUESTED = True
-                break
-            time.sleep(1)
+    # Job threads are daemons: let the runs in progress finish before exiting.
+    deadline = time.monotonic() + STOP_GRACE_SECONDS
+    unfinished = scheduler.join(STOP_GRACE_SECONDS)
+    for thread in side_threads:
+        thread.join(max(deadline - time.monotonic(), 0.0))
+    unfinished += [thread.name for thread in side_threads if thread.is_alive()]
+    if unfinished:
+        log.warning("Stopping with unfinished jobs after %ss: %s", STOP_GRACE_SECONDS, ", ".join(unfinished))
 
     log.info("Scheduler stopped")
     return 0
 
-
 if __name__ == "__main__":
     raise SystemExit(main())
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""Decode every archived FIT file and report the decoder throughput."""
+
+import argparse
+import gzip
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+
+# Add the parent directory to the path so we can import repositories
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from fit_decoder import FitDecodeError, decode_records
+from repositories.fit_archive_repository import OBJECT_SUFFIX, OBJECTS_DIR_NAME
+from repositories.schedule_repository import ensure_fit_files_dir
+
+LOGGER = logging.getLogger(__name__)
+
+
+def benchmark(root: Path, limit: int | None = None, repeat: int = 1) -> int:
+    """Decode the compressed objects and legacy ``<account>/<activity>.fit`` files under *root*.
+
+    Returns the number of failures; decompression is not counted as decode time.
+    """
+    paths = sorted(root.glob(f"{OBJECTS_DIR_NAME}/*/*{OBJECT_SUFFIX}")) + sorted(root.glob("*/*.fit"))
+    if limit:
+        paths = paths[:limit]
+    if not paths:
+        LOGGER.info("No FIT files under %s", root)
+        return 0
+
+    total_bytes = 0
+    total_records = 0
+    truncated = 0
+    failures = 0
+    decode_seconds = 0.0
+
+    for path in paths:
+        data = gzip.decompress(path.read_bytes()) if path.name.endswith(OBJECT_SUFFIX) else path.read_bytes()
+        try:
+            started = time.perf_counter()
+            for _ in range(repeat):
+                records = decode_records(data)
+            decode_seconds += (time.perf_counter() - started) / repeat
+        except FitDecodeError as exc:
+            failures += 1
+            LOGGER.warning("%s: %s", path, exc)
+            continue
+        total_bytes += len(data)
+        total_records += len(records)
+        truncated += int(records.truncated)
+
+    decoded = len(paths) - failures
+    LOGGER.info("Files: %d decoded, %d failed, %d truncated", decoded, failures, truncated)
+    LOGGER.info("Records: %d, data: %.1f MiB", total_records, total_bytes / 1024 / 1024)
+    if decode_seconds > 0:
+        LOGGER.info(
+            "Decode time: %.3f s (%.1f MiB/s, %.0f records/s, %.2f ms/file)",
+            decode_seconds,
+            total_bytes / 1024 / 1024 / decode_seconds,
+            total_records / decode_seconds,
+            decode_seconds * 1000 / max(decoded, 1),
+        )
+    return failures
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    parser = argparse.ArgumentParser(description="Benchmark the FIT decoder over the activity archive")
+    parser.add_argument(
+        "--dir",
+        type=Path,
+        default=None,
+        help="Archive root (default: ensure_fit_files_dir())"
+    )
+    parser.add_argument("--limit", type=int, default=None, help="Decode at most N files")
+    parser.add_argument("--repeat", type=int, default=1, help="Decode each file N times and average")
+
+    args = parser.parse_args()
+    root = args.dir or ensure_fit_files_dir()
+    failures = benchmark(root, args.limit, max(1, args.repeat))
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    exit(main())
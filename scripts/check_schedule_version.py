@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""Check that reading the schedule does not bump ``schedule_cache_version_seq``.
+
+The slot availability cache is only useful while reads leave the version
+alone; run this after changing schedule triggers or ``ensure_*`` helpers.
+"""
+
+import logging
+import os
+import sys
+from datetime import datetime, timedelta
+
+# Add the parent directory to the path so we can import repositories
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from repositories.schedule_repository import (
+    ensure_schedule_version_tracking,
+    get_schedule_version,
+    list_available_slots,
+)
+
+LOGGER = logging.getLogger(__name__)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    try:
+        ensure_schedule_version_tracking()
+        before = get_schedule_version()
+        start = datetime.now().replace(microsecond=0)
+        list_available_slots(start, start + timedelta(days=35))
+        list_available_slots(start, start + timedelta(days=35))
+        after = get_schedule_version()
+    except Exception as exc:
+        LOGGER.error("Failed to check schedule version: %s", exc)
+        return 1
+
+    if after != before:
+        LOGGER.error("Read-only list_available_slots() bumped the schedule version: %s -> %s", before, after)
+        return 1
+    LOGGER.info("Schedule version unchanged by reads (%s)", after)
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""Analyse archived FIT files that have no power analytics yet.
+
+Rides archived before the analytics stage existed (or by paths that did not
+run it) are missing from power bests, FTP estimates and the power
+leaderboards; run this once to fill them in.
+"""
+
+import argparse
+import logging
+import os
+import sys
+
+# Add the parent directory to the path so we can import repositories
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from repositories.activity_analytics_repository import list_activities_pending_analytics
+from scheduler.activity_analytics import ingest_activity_fit
+
+LOGGER = logging.getLogger(__name__)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    parser = argparse.ArgumentParser(description="Compute power analytics for archived FIT files")
+    parser.add_argument("--all", action="store_true", help="Also re-analyse rides that already have analytics")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be done")
+
+    args = parser.parse_args()
+
+    try:
+        pending = list_activities_pending_analytics(include_analysed=args.all)
+    except Exception as exc:
+        LOGGER.error("Failed to list activities: %s", exc)
+        return 1
+
+    LOGGER.info("Found %d activities to analyse", len(pending))
+    analysed = 0
+    for row in pending:
+        if args.dry_run:
+            LOGGER.info("Would analyse %s/%s (client %s)", row["account_id"], row["activity_id"], row["client_id"])
+            continue
+        # Errors are logged by the ingest stage itself.
+        if ingest_activity_fit(row["account_id"], row["activity_id"], row["client_id"]) is not None:
+            analysed += 1
+
+    LOGGER.info("Analysed %d of %d activities", analysed, len(pending))
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
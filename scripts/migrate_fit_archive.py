@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""Move ``<account>/<activity>.fit`` files into the compressed FIT archive."""
+
+import argparse
+import gzip
+import hashlib
+import logging
+import os
+import sys
+import time
+
+# Add the parent directory to the path so we can import repositories
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from repositories.fit_archive_repository import (
+    OBJECT_SUFFIX,
+    get_archive_stats,
+    list_referenced_hashes,
+    object_path,
+    objects_dir,
+    store_fit_file,
+)
+from repositories.schedule_repository import ensure_fit_files_dir
+
+LOGGER = logging.getLogger(__name__)
+
+PRUNE_GRACE_SECONDS = 3600
+
+
+def migrate_tree(keep: bool = False, dry_run: bool = False) -> int:
+    """Archive every legacy FIT file, return the number of failures.
+
+    A file is removed only after its compressed object was read back and
+    matched the original hash.
+    """
+    root = ensure_fit_files_dir()
+    paths = sorted(root.glob("*/*.fit"))
+    LOGGER.info("Found %d legacy FIT files under %s", len(paths), root)
+
+    migrated = 0
+    failures = 0
+    for path in paths:
+        account_id = path.parent.name
+        activity_id = path.stem
+        if dry_run:
+            LOGGER.info("Would archive %s/%s", account_id, activity_id)
+            continue
+        try:
+            content_hash = store_fit_file(account_id, activity_id, path)
+            with gzip.open(object_path(content_hash), "rb") as handle:
+                if hashlib.sha256(handle.read()).hexdigest() != content_hash:
+                    raise ValueError("archived object does not match the source")
+        except Exception as exc:  # noqa: BLE001
+            failures += 1
+            LOGGER.warning("Failed to archive %s: %s", path, exc)
+            continue
+        migrated += 1
+        if not keep:
+            path.unlink()
+
+    if not keep and not dry_run:
+        for account_dir in root.iterdir():
+            if account_dir.is_dir() and account_dir.name != objects_dir().name:
+                try:
+                    account_dir.rmdir()
+                except OSError:
+                    pass
+
+    LOGGER.info("Archived %d files, %d failed", migrated, failures)
+    return failures
+
+
+def prune_objects(dry_run: bool = False, grace_seconds: float = PRUNE_GRACE_SECONDS) -> int:
+    """Remove objects no activity refers to any more, return their number.
+
+    Objects are written before their index row commits, so ones younger than
+    *grace_seconds* are kept: they may belong to a store still in progress.
+    """
+    cutoff = time.time() - grace_seconds
+    referenced = list_referenced_hashes()
+    removed = 0
+    for path in objects_dir().glob(f"*/*{OBJECT_SUFFIX}"):
+        content_hash = path.name[: -len(OBJECT_SUFFIX)]
+        if content_hash in referenced:
+            continue
+        try:
+            if path.stat().st_mtime > cutoff:
+                continue
+        except FileNotFoundError:
+            continue
+        removed += 1
+        if dry_run:
+            LOGGER.info("Would remove %s", path)
+        else:
+            path.unlink(missing_ok=True)
+    LOGGER.info("Unreferenced objects: %d", removed)
+    return removed
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    parser = argparse.ArgumentParser(description="Migrate archived FIT files into the compressed object store")
+    parser.add_argument("--keep", action="store_true", help="Keep the uncompressed files after archiving")
+    parser.add_argument("--prune", action="store_true", help="Also remove objects no activity refers to")
+    parser.add_argument(
+        "--prune-grace",
+        type=float,
+        default=PRUNE_GRACE_SECONDS,
+        help="Keep unreferenced objects younger than this many seconds (writes may be in progress)",
+    )
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be done")
+
+    args = parser.parse_args()
+
+    try:
+        failures = migrate_tree(keep=args.keep, dry_run=args.dry_run)
+        if args.prune:
+            prune_objects(dry_run=args.dry_run, grace_seconds=args.prune_grace)
+        stats = get_archive_stats()
+    except Exception as exc:
+        LOGGER.error("Failed to migrate FIT archive: %s", exc)
+        return 1
+
+    LOGGER.info(
+        "Archive: %s files, %s objects, %.1f MiB raw, %.1f MiB stored",
+        stats.get("files"),
+        stats.get("objects"),
+        (stats.get("size_bytes") or 0) / 1024 / 1024,
+        (stats.get("stored_bytes") or 0) / 1024 / 1024,
+    )
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    exit(main())
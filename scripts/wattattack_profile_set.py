@@ -7,6 +7,7 @@ import json
 from pathlib import Path
 from typing import Any, Dict, Iterable, List
 
+from repositories.account_profile_state_repository import clear_profile_state
 from wattattack_activities import DEFAULT_BASE_URL, WattAttackClient
 
 
@@ -149,6 +150,13 @@ def main(argv: Iterable[str] | None = None) -> int:
             profile_response = client.update_profile(athletic_payload, timeout=args.timeout)
             print("Athlete update response:", profile_response)
 
+        if user_payload or athletic_payload:
+            # Manual edits invalidate the last applied client state.
+            try:
+                clear_profile_state(account_id)
+            except Exception as exc:  # noqa: BLE001
+                print(f"Failed to reset cached profile state: {exc}")
+
         if args.show:
             after = client.fetch_profile(timeout=args.timeout)
             show_profile("After", after)
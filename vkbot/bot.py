@@ -3,8 +3,10 @@ from __future__ import annotations
 
 import json
 import logging
+import os
+from contextlib import contextmanager
 from datetime import date, datetime, time
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, Iterator, List, Optional
 
 import vk_api
 from vk_api.bot_longpoll import VkBotEventType, VkBotLongPoll
@@ -13,9 +15,11 @@ from vk_api.utils import get_random_id
 
 from booking import notifications as booking_notifications
 from booking import service as booking_service
+from conversation_state import ConversationStateStore
 from notifications import admin as admin_notifications
 from repositories import client_repository, schedule_repository
 from repositories.vk_client_link_repository import get_link_by_vk_user, link_vk_user_to_client
+from .dispatcher import BackgroundNotifier, KeyedExecutor
 from .formatting import (
     format_client_name,
     format_day_display,
@@ -43,7 +47,10 @@ WHAT_TO_BRING_TEXT = (
 HOW_TO_GET_ATTACHMENT = "video-232708853_456239017"
 _LOCAL_TZ = booking_service.LOCAL_TZ
 _BOOKING_CUTOFF = booking_service.BOOKING_CUTOFF
+# Working copy of the peers currently being handled; the durable copy lives in _STATE_STORE.
 _STATE: Dict[int, Dict[str, Any]] = {}
+_STATE_STORE = ConversationStateStore("vkbot")
+VK_BOT_WORKERS = max(1, int(os.environ.get("VK_BOT_WORKERS", "8")))
 _NEW_CLIENT_STEPS: List[Dict[str, str]] = [
     {"key": "weight", "prompt": "Введите ваш вес в кг (например, 72.5)."},
     {"key": "height", "prompt": "Введите ваш рост в см (например, 178)."},
@@ -72,46 +79,62 @@ def run_bot(
     if api_version:
         session_args["api_version"] = api_version
 
-    vk_session = vk_api.VkApi(**session_args)
+    # Community tokens allow ~20 requests/s instead of the 3/s VkApi assumes. VkApi still sends
+    # one request at a time under its lock, so parallel workers overlap DB and handler work only.
+    vk_session = vk_api.VkApiGroup(**session_args)
     vk = vk_session.get_api()
     longpoll = VkBotLongPoll(vk_session, group_id)
 
-    log.info("VK bot is listening on group %s with long poll", group_id)
+    log.info("VK bot is listening on group %s with long poll (%s workers)", group_id, VK_BOT_WORKERS)
     inline_keyboard = build_inline_keyboard()
-    for event in longpoll.listen():
-        if event.type == VkBotEventType.MESSAGE_EVENT:
-            _handle_message_event(event, vk, greeting)
-            continue
+    # Events of one peer are handled in order; different peers run in parallel.
+    executor = KeyedExecutor(VK_BOT_WORKERS, thread_name_prefix="vkbot-peer")
+    try:
+        for event in longpoll.listen():
+            if event.type == VkBotEventType.MESSAGE_EVENT:
+                event_peer = getattr(event.object, "peer_id", None)
+                executor.submit(event_peer, _with_peer_state, event_peer, _handle_message_event, event, vk, greeting)
+                continue
+
+            if event.type != VkBotEventType.MESSAGE_NEW:
+                continue
+
+            message = getattr(event, "message", None)
+            if not message:
+                continue
+
+            peer_id = message.get("peer_id")
+            if peer_id is None:
+                log.debug("Received message without peer_id: %s", message)
+                continue
+            executor.submit(
+                peer_id, _with_peer_state, peer_id, _handle_new_message, message, vk, greeting, inline_keyboard
+            )
+    finally:
+        executor.shutdown(wait=True)
+        _ADMIN_NOTIFIER.stop(timeout=10)
 
-        if event.type != VkBotEventType.MESSAGE_NEW:
-            continue
 
-        message = getattr(event, "message", None)
-        if not message:
-            continue
+def _handle_new_message(message: Dict[str, Any], vk, greeting: str, inline_keyboard: str) -> None:
+    peer_id = message.get("peer_id")
+    user_id = message.get("from_id")
+    text = message.get("text", "")
+    payload = message.get("payload")
 
-        peer_id = message.get("peer_id")
-        user_id = message.get("from_id")
-        text = message.get("text", "")
-        payload = message.get("payload")
-        if peer_id is None:
-            log.debug("Received message without peer_id: %s", message)
-            continue
-
-        log.info("Incoming message from peer %s: %s", peer_id, text)
-        handled = _handle_stateful_message(peer_id, user_id, text.strip(), vk, payload=payload)
-        if handled:
-            continue
+    log.info("Incoming message from peer %s: %s", peer_id, text)
+    handled = _handle_stateful_message(peer_id, user_id, text.strip(), vk, payload=payload)
+    if handled:
+        return
 
-        try:
-            vk.messages.send(
-                peer_id=peer_id,
-                random_id=get_random_id(),
-                message=greeting,
-                keyboard=inline_keyboard,
-            )
-        except Exception:
-            log.exception("Failed to send greeting to peer_id %s", peer_id)
+    try:
+        vk.messages.send(
+            peer_id=peer_id,
+            random_id=get_random_id(),
+            message=greeting,
+            keyboard=inline_keyboard,
+        )
+    except Exception:
+        log.exception("Failed to send greeting to peer_id %s", peer_id)
 
 
 def _handle_message_event(event, vk, greeting: str) -> None:
@@ -200,6 +223,32 @@ def _handle_message_event(event, vk, greeting: str) -> None:
         log.debug("Failed to send snackbar for %s", action, exc_info=True)
 
 
+@contextmanager
+def _peer_state(peer_id: Optional[int]) -> Iterator[None]:
+    """Load the peer's conversation state before a handler and persist it afterwards."""
+
+    if peer_id is None:
+        yield
+        return
+    try:
+        _STATE[peer_id] = _STATE_STORE.get(peer_id, {}) or {}
+    except Exception:
+        log.exception("Failed to load conversation state for peer %s", peer_id)
+    try:
+        yield
+    finally:
+        state = _STATE.pop(peer_id, None)
+        try:
+            _STATE_STORE.set(peer_id, state or {})
+        except Exception:
+            log.exception("Failed to save conversation state for peer %s", peer_id)
+
+
+def _with_peer_state(peer_id: Optional[int], handler: Callable[..., None], *args: Any) -> None:
+    with _peer_state(peer_id):
+        handler(*args)
+
+
 def _get_state(peer_id: int) -> Dict[str, Any]:
     return _STATE.setdefault(peer_id, {})
 
@@ -1035,6 +1084,7 @@ def _cancel_reservation(peer_id: int, user_id: int, reservation_id: int, vk) ->
         log.exception("Failed to cancel reservation %s", reservation_id)
         _send_text(vk, peer_id, "Не удалось отменить запись.")
         return
+    booking_service.invalidate_slot_cache()
 
     if not updated:
         _send_text(vk, peer_id, "Не удалось отменить запись.")
@@ -1127,6 +1177,11 @@ def _show_booking_details(peer_id: int, user_id: int, reservation_id: int, vk) -
     keyboard.add_button("Закрыть", color=VkKeyboardColor.SECONDARY, payload={"action": "close"})
     _send_text(vk, peer_id, details, keyboard=keyboard.get_keyboard())
 def _fanout_telegram_notification(*, text: str, instructor_id: Optional[int]) -> None:
+    """Queue notification text for Telegram admins; delivery happens off the handler thread."""
+    _ADMIN_NOTIFIER.submit(text=text, instructor_id=instructor_id)
+
+
+def _deliver_telegram_notification(*, text: str, instructor_id: Optional[int]) -> None:
     """Send notification text to Telegram admins respecting instructor filtering."""
     admin_ids = admin_notifications.resolve_admin_chat_ids(instructor_id=instructor_id)
     if not admin_ids:
@@ -1135,3 +1190,6 @@ def _fanout_telegram_notification(*, text: str, instructor_id: Optional[int]) ->
     for admin_id in admin_ids:
         if admin_id not in delivered:
             log.debug("Failed to send admin notification to %s", admin_id)
+
+
+_ADMIN_NOTIFIER = BackgroundNotifier(_deliver_telegram_notification)
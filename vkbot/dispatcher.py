@@ -0,0 +1,99 @@
+"""Worker pools for the VK bot: per-peer ordered handlers and background admin fan-out."""
+from __future__ import annotations
+
+import logging
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, Hashable, Optional
+
+log = logging.getLogger(__name__)
+
+
+class KeyedExecutor:
+    """Run tasks on a thread pool while keeping tasks with the same key in order.
+
+    Each key has its own FIFO; at most one task per key runs at a time, so a
+    slow conversation only delays itself and never the other peers.
+    """
+
+    def __init__(self, max_workers: int, *, thread_name_prefix: str = "vkbot") -> None:
+        self._pool = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix=thread_name_prefix)
+        self._queues: Dict[Hashable, Deque[Callable[[], Any]]] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key: Hashable, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> None:
+        task = lambda: fn(*args, **kwargs)  # noqa: E731
+        with self._lock:
+            pending = self._queues.get(key)
+            if pending is not None:
+                pending.append(task)
+                return
+            self._queues[key] = deque([task])
+        self._pool.submit(self._drain, key)
+
+    def _drain(self, key: Hashable) -> None:
+        while True:
+            with self._lock:
+                pending = self._queues[key]
+                if not pending:
+                    del self._queues[key]
+                    return
+                task = pending.popleft()
+            try:
+                task()
+            except Exception:  # pylint: disable=broad-except
+                log.exception("VK handler failed for peer %s", key)
+
+    def pending_keys(self) -> int:
+        with self._lock:
+            return len(self._queues)
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._pool.shutdown(wait=wait)
+
+
+class BackgroundNotifier:
+    """Deliver admin notifications from a queue so handlers never wait on Telegram."""
+
+    _STOP = object()
+
+    def __init__(self, deliver: Callable[..., Any], *, name: str = "vkbot-admin-notify") -> None:
+        self._deliver = deliver
+        self._queue: "queue.Queue[Any]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._name = name
+        self._lock = threading.Lock()
+
+    def _ensure_started(self) -> None:
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+            self._thread.start()
+
+    def submit(self, **kwargs: Any) -> None:
+        self._ensure_started()
+        self._queue.put(kwargs)
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            try:
+                if item is self._STOP:
+                    return
+                self._deliver(**item)
+            except Exception:  # pylint: disable=broad-except
+                log.exception("Failed to deliver admin notification")
+            finally:
+                self._queue.task_done()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Flush queued notifications and stop the worker thread."""
+
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        self._queue.put(self._STOP)
+        thread.join(timeout)
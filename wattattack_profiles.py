@@ -1,64 +1,166 @@
 """Utilities for applying client data to WattAttack accounts."""
 from __future__ import annotations
 
+import hashlib
+import json
 import logging
 import os
-from typing import Any, Dict, Optional, Tuple
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, Optional, Tuple
 
+from repositories.account_profile_state_repository import get_profile_state, save_profile_state
+from repositories.activity_analytics_repository import get_client_ftp_estimate
 from wattattack_activities import DEFAULT_BASE_URL, WattAttackClient
 
 LOGGER = logging.getLogger(__name__)
 
 DEFAULT_TIMEOUT = float(os.environ.get("WATTATTACK_HTTP_TIMEOUT", "30"))
 DEFAULT_CLIENT_FTP = int(os.environ.get("WATTATTACK_DEFAULT_FTP", "150"))
+SESSION_TTL_SECONDS = float(os.environ.get("WATTATTACK_SESSION_TTL_SECONDS", "1800"))
+# About one slot: a stored state older than that is not trusted when the profile cannot be fetched.
+PROFILE_STATE_TTL_SECONDS = float(os.environ.get("WATTATTACK_PROFILE_STATE_TTL_SECONDS", "7200"))
 
+USER_FIELDS = ("firstName", "lastName")
+# Sent with every athlete update, otherwise the API rejects the payload.
+REQUIRED_PROFILE_FIELDS = ("birthDate", "gender")
 
-def split_full_name(full_name: str) -> Tuple[Optional[str], Optional[str]]:
-    """Split a full name into first/last parts."""
 
-    if not full_name:
-        return None, None
-    parts = full_name.strip().split()
-    if not parts:
-        return None, None
-    first = parts[0]
-    last = " ".join(parts[1:]) or None
-    return first, last
+@dataclass
+class _CachedSession:
+    client: WattAttackClient
+    logged_in_at: float = 0.0
+    lock: threading.Lock = field(default_factory=threading.Lock)
+    # Account FTP as last read through this client; dropped with the client on re-login.
+    ftp: Optional[float] = None
+    ftp_loaded: bool = False
 
 
-def apply_client_profile(
+_SESSIONS: Dict[Tuple[str, str, str], _CachedSession] = {}
+_SESSIONS_LOCK = threading.Lock()
+_SESSION_BY_CLIENT: Dict[int, _CachedSession] = {}
+
+
+def _session_key(account_id: str, email: str, base_url: str) -> Tuple[str, str, str]:
+    return (str(account_id), str(email or "").lower(), base_url)
+
+
+@contextmanager
+def account_session(
     *,
     account_id: str,
-    account_label: str,
     email: str,
     password: str,
     base_url: Optional[str],
-    client_record: Dict[str, Any],
     timeout: Optional[float] = None,
-    default_ftp: Optional[int] = None,
-) -> None:
-    """Apply up-to-date client data to the given WattAttack account."""
+    force_login: bool = False,
+) -> Iterator[WattAttackClient]:
+    """Yield a logged-in client for the account, reusing a cached session.
+
+    Calls for the same account are serialized so that parallel jobs never share
+    a ``requests.Session`` concurrently; different accounts run independently.
+    """
 
     target_timeout = timeout if timeout is not None else DEFAULT_TIMEOUT
-    ftp_fallback = int(default_ftp if default_ftp is not None else DEFAULT_CLIENT_FTP)
     base_url = base_url or DEFAULT_BASE_URL
-    account_label = account_label or account_id
+    key = _session_key(account_id, email, base_url)
+    with _SESSIONS_LOCK:
+        cached = _SESSIONS.get(key)
+        if cached is None:
+            cached = _CachedSession(client=WattAttackClient(base_url))
+            _SESSIONS[key] = cached
 
-    client = WattAttackClient(base_url)
-    client.login(email, password, timeout=target_timeout)
+    with cached.lock:
+        expired = time.monotonic() - cached.logged_in_at > SESSION_TTL_SECONDS
+        if force_login or not cached.logged_in_at or expired:
+            with _SESSIONS_LOCK:
+                _SESSION_BY_CLIENT.pop(id(cached.client), None)
+            cached.client = WattAttackClient(base_url)
+            cached.logged_in_at = 0.0
+            cached.ftp, cached.ftp_loaded = None, False
+            cached.client.login(email, password, timeout=target_timeout)
+            cached.logged_in_at = time.monotonic()
+            with _SESSIONS_LOCK:
+                _SESSION_BY_CLIENT[id(cached.client)] = cached
+        yield cached.client
+
+
+def invalidate_session(account_id: str, email: str, base_url: Optional[str]) -> None:
+    """Drop the cached session so the next call logs in again."""
+
+    key = _session_key(account_id, email, base_url or DEFAULT_BASE_URL)
+    with _SESSIONS_LOCK:
+        cached = _SESSIONS.pop(key, None)
+        if cached is not None:
+            _SESSION_BY_CLIENT.pop(id(cached.client), None)
+
+
+def fetch_account_ftp(client: WattAttackClient, *, timeout: Optional[float] = None) -> Optional[float]:
+    """Read the account FTP from its profile; ``None`` when unset or unavailable."""
 
-    existing_profile: Dict[str, Any] = {}
     try:
-        existing_profile = client.fetch_profile(timeout=target_timeout)
-        if not isinstance(existing_profile, dict):
-            existing_profile = {}
+        profile = client.fetch_profile(timeout=timeout if timeout is not None else DEFAULT_TIMEOUT)
     except Exception as exc:  # noqa: BLE001
-        LOGGER.warning("Failed to fetch current profile for %s: %s", account_id, exc)
-        existing_profile = {}
+        LOGGER.warning("Failed to fetch FTP: %s", exc)
+        return None
+    containers = [profile.get("athlete"), profile.get("user"), profile] if isinstance(profile, dict) else []
+    for container in containers:
+        if not isinstance(container, dict) or container.get("ftp") in (None, "", "—"):
+            continue
+        try:
+            ftp = float(container["ftp"])
+        except (TypeError, ValueError):
+            return None
+        return ftp if ftp > 0 else None
+    return None
 
-    athlete_section = existing_profile.get("athlete") if isinstance(existing_profile, dict) else {}
-    if not isinstance(athlete_section, dict):
-        athlete_section = {}
+
+def account_ftp(client: WattAttackClient, *, timeout: Optional[float] = None) -> Optional[float]:
+    """FTP of the account behind a client from :func:`account_session`, read once per login.
+
+    Call it inside the ``account_session`` block; profile updates made through
+    :func:`apply_client_profile` refresh it.
+    """
+
+    with _SESSIONS_LOCK:
+        cached = _SESSION_BY_CLIENT.get(id(client))
+    if cached is None or cached.client is not client:
+        return fetch_account_ftp(client, timeout=timeout)
+    if not cached.ftp_loaded:
+        cached.ftp = fetch_account_ftp(client, timeout=timeout)
+        cached.ftp_loaded = cached.ftp is not None
+    return cached.ftp
+
+
+def _forget_account_ftp(client: WattAttackClient) -> None:
+    with _SESSIONS_LOCK:
+        cached = _SESSION_BY_CLIENT.get(id(client))
+    if cached is not None and cached.client is client:
+        cached.ftp, cached.ftp_loaded = None, False
+
+
+def split_full_name(full_name: str) -> Tuple[Optional[str], Optional[str]]:
+    """Split a full name into first/last parts."""
+
+    if not full_name:
+        return None, None
+    parts = full_name.strip().split()
+    if not parts:
+        return None, None
+    first = parts[0]
+    last = " ".join(parts[1:]) or None
+    return first, last
+
+
+def build_profile_payloads(
+    client_record: Dict[str, Any],
+    athlete_section: Dict[str, Any],
+    ftp_fallback: int,
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Return ``(user_payload, profile_payload)`` for the client record."""
 
     first = client_record.get("first_name") or None
     last = client_record.get("last_name") or None
@@ -113,11 +215,243 @@ def apply_client_profile(
     if not profile_payload.get("birthDate"):
         profile_payload["birthDate"] = "2000-01-01"
 
-    if user_payload:
-        LOGGER.info("Updating WattAttack user %s (%s) user data", account_id, account_label)
-        client.update_user(user_payload, timeout=target_timeout)
+    return user_payload, profile_payload
+
+
+def _values_match(current: Any, desired: Any) -> bool:
+    if current is None:
+        return False
+    if isinstance(desired, (int, float)) and not isinstance(desired, bool):
+        try:
+            return abs(float(current) - float(desired)) < 0.01
+        except (TypeError, ValueError):
+            return False
+    return str(current).strip().lower() == str(desired).strip().lower()
+
+
+def _changed_fields(
+    payload: Dict[str, Any],
+    current: Dict[str, Any],
+    known_state: Dict[str, Any],
+) -> Dict[str, Any]:
+    """Return payload entries that differ from the account's current values.
+
+    Values missing from the fetched profile are compared against the last
+    applied state instead, so a partial API response does not force a write.
+    """
+
+    changed: Dict[str, Any] = {}
+    for key, value in payload.items():
+        current_value = current.get(key)
+        if current_value is None:
+            current_value = known_state.get(key)
+        if not _values_match(current_value, value):
+            changed[key] = value
+    return changed
+
+
+def _user_section(existing_profile: Dict[str, Any], athlete_section: Dict[str, Any]) -> Dict[str, Any]:
+    user_section = existing_profile.get("user")
+    if isinstance(user_section, dict) and any(key in user_section for key in USER_FIELDS):
+        return user_section
+    if any(key in athlete_section for key in USER_FIELDS):
+        return athlete_section
+    return {}
+
+
+def desired_profile_state(client_record: Dict[str, Any], ftp_fallback: int) -> Dict[str, Any]:
+    """Return the account state a client record asks for, without API defaults."""
+
+    user_payload, profile_payload = build_profile_payloads(client_record, {}, ftp_fallback)
+    profile_payload.pop("birthDate", None)
+    return {**user_payload, **profile_payload}
+
+
+def profile_state_hash(state: Dict[str, Any]) -> str:
+    serialized = json.dumps(state, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+def _load_stored_state(account_id: str) -> Optional[Dict[str, Any]]:
+    try:
+        return get_profile_state(account_id)
+    except Exception:  # noqa: BLE001
+        LOGGER.warning("Failed to load cached profile state for %s", account_id, exc_info=True)
+        return None
+
+
+def _stored_state_is_fresh(stored: Dict[str, Any], state_hash: str) -> bool:
+    if stored.get("state_hash") != state_hash:
+        return False
+    applied_at = stored.get("applied_at")
+    if not isinstance(applied_at, datetime):
+        return False
+    if applied_at.tzinfo is None:
+        applied_at = applied_at.replace(tzinfo=timezone.utc)
+    age = (datetime.now(timezone.utc) - applied_at).total_seconds()
+    return age < PROFILE_STATE_TTL_SECONDS
+
+
+def _apply_with_client(
+    client: WattAttackClient,
+    *,
+    account_id: str,
+    account_label: str,
+    client_record: Dict[str, Any],
+    timeout: float,
+    ftp_fallback: int,
+    known_state: Dict[str, Any],
+    state_current: bool,
+) -> Tuple[Dict[str, bool], bool]:
+    """Send the fields that differ; return the update flags and whether the profile was fetched."""
+
+    existing_profile: Dict[str, Any] = {}
+    fetched = False
+    try:
+        existing_profile = client.fetch_profile(timeout=timeout)
+        if not isinstance(existing_profile, dict):
+            existing_profile = {}
+        fetched = True
+    except Exception as exc:  # noqa: BLE001
+        if _is_auth_error(exc):
+            raise
+        LOGGER.warning("Failed to fetch current profile for %s: %s", account_id, exc)
+        existing_profile = {}
+        if state_current:
+            LOGGER.info(
+                "WattAttack account %s (%s) was recently set to this client profile, skipping update",
+                account_id,
+                account_label,
+            )
+            return {"user_updated": False, "profile_updated": False}, False
+        # The last applied state is too old to vouch for the account: send everything.
+        known_state = {}
+
+    athlete_section = existing_profile.get("athlete") if isinstance(existing_profile, dict) else {}
+    if not isinstance(athlete_section, dict):
+        athlete_section = {}
+
+    user_payload, profile_payload = build_profile_payloads(client_record, athlete_section, ftp_fallback)
+
+    user_changes = _changed_fields(
+        user_payload, _user_section(existing_profile, athlete_section), known_state
+    )
+    profile_changes = _changed_fields(
+        {key: value for key, value in profile_payload.items() if key != "birthDate"},
+        athlete_section,
+        known_state,
+    )
+    if profile_changes:
+        for key in REQUIRED_PROFILE_FIELDS:
+            if key in profile_payload:
+                profile_changes.setdefault(key, profile_payload[key])
+
+    result = {"user_updated": False, "profile_updated": False}
+    if user_changes:
+        LOGGER.info(
+            "Updating WattAttack user %s (%s) fields: %s", account_id, account_label, sorted(user_changes)
+        )
+        client.update_user(user_changes, timeout=timeout)
         LOGGER.info("User update for %s completed", account_id)
-    if profile_payload:
-        LOGGER.info("Updating WattAttack athlete %s (%s) profile payload: %s", account_id, account_label, profile_payload)
-        response = client.update_profile(profile_payload, timeout=target_timeout)
+        result["user_updated"] = True
+    elif user_payload:
+        LOGGER.info("WattAttack user %s (%s) already has requested name, skipping", account_id, account_label)
+    if profile_changes:
+        LOGGER.info("Updating WattAttack athlete %s (%s) profile payload: %s", account_id, account_label, profile_changes)
+        response = client.update_profile(profile_changes, timeout=timeout)
+        _forget_account_ftp(client)
         LOGGER.debug("Profile update response for %s: %s", account_id, response)
+        result["profile_updated"] = True
+    else:
+        LOGGER.info("WattAttack athlete %s (%s) profile already up to date, skipping", account_id, account_label)
+    return result, fetched
+
+
+def _is_auth_error(exc: Exception) -> bool:
+    """True for a failed login or a request rejected because the session is gone."""
+
+    message = str(exc)
+    return message.startswith("Login failed") or "(401)" in message or "(403)" in message
+
+
+def _estimated_ftp(client_record: Dict[str, Any]) -> Optional[int]:
+    """FTP suggested from the client's rides, used when no FTP was entered."""
+
+    if client_record.get("ftp") not in (None, "") or not client_record.get("id"):
+        return None
+    try:
+        estimate = get_client_ftp_estimate(int(client_record["id"]))
+    except Exception:  # noqa: BLE001
+        LOGGER.warning("Failed to load FTP estimate for client %s", client_record.get("id"))
+        return None
+    return int(estimate["estimated_ftp"]) if estimate else None
+
+
+def apply_client_profile(
+    *,
+    account_id: str,
+    account_label: str,
+    email: str,
+    password: str,
+    base_url: Optional[str],
+    client_record: Dict[str, Any],
+    timeout: Optional[float] = None,
+    default_ftp: Optional[int] = None,
+) -> Dict[str, bool]:
+    """Apply up-to-date client data to the given WattAttack account.
+
+    The current profile is always fetched and only fields that differ from it
+    are sent, so edits made on the stand are corrected. The last applied state
+    stands in for fields the API omits and, when it matches the desired hash
+    and is younger than ``PROFILE_STATE_TTL_SECONDS``, lets a failed fetch skip
+    the write; an older one makes a failed fetch send the full payload. Only
+    auth errors are retried with a fresh login. Returns flags telling which of
+    ``update_user``/``update_profile`` were sent.
+    """
+
+    target_timeout = timeout if timeout is not None else DEFAULT_TIMEOUT
+    ftp_fallback = _estimated_ftp(client_record) or int(
+        default_ftp if default_ftp is not None else DEFAULT_CLIENT_FTP
+    )
+    account_label = account_label or account_id
+
+    desired_state = desired_profile_state(client_record, ftp_fallback)
+    desired_hash = profile_state_hash(desired_state)
+    stored = _load_stored_state(account_id)
+    known_state = stored.get("state") if stored else None
+    session_kwargs = {
+        "account_id": account_id,
+        "email": email,
+        "password": password,
+        "base_url": base_url,
+        "timeout": target_timeout,
+    }
+    apply_kwargs = {
+        "account_id": account_id,
+        "account_label": account_label,
+        "client_record": client_record,
+        "timeout": target_timeout,
+        "ftp_fallback": ftp_fallback,
+        "known_state": known_state if isinstance(known_state, dict) else {},
+        "state_current": bool(stored and _stored_state_is_fresh(stored, desired_hash)),
+    }
+
+    try:
+        with account_session(**session_kwargs) as client:
+            result, fetched = _apply_with_client(client, **apply_kwargs)
+    except Exception as exc:  # noqa: BLE001
+        # A cached session may have expired server-side; retry once with a fresh login.
+        # Other errors may come after a write was sent and must not replay it.
+        if not _is_auth_error(exc):
+            raise
+        LOGGER.info("Retrying profile apply for %s with a fresh session: %s", account_id, exc)
+        with account_session(**session_kwargs, force_login=True) as client:
+            result, fetched = _apply_with_client(client, **apply_kwargs)
+
+    # A skipped write after a failed fetch proves nothing, so it must not renew the state.
+    if fetched or result["user_updated"] or result["profile_updated"]:
+        try:
+            save_profile_state(account_id, desired_state, desired_hash)
+        except Exception:  # noqa: BLE001
+            LOGGER.warning("Failed to store profile state for %s", account_id, exc_info=True)
+    return result
@@ -2,10 +2,20 @@
 """Helpers for parsing ZWO workouts and preparing WattAttack payloads."""
 from __future__ import annotations
 
+import hashlib
+import itertools
+import json
 import math
-from typing import Any, Dict, List, Optional
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 import xml.etree.ElementTree as ET
 
+try:  # NumPy speeds up metrics of long workouts; the pure Python path stays as fallback.
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
 MAX_SEGMENTS = 1000
 MAX_DURATION = 36000  # 10 hours
 MAX_POWER = 10.0  # 1000% FTP
@@ -402,6 +412,13 @@ def parse_zwo_workout(xml_text: str) -> Dict[str, Any]:
     return result
 
 
+def workout_content_hash(workout: Dict[str, Any]) -> str:
+    """Return a stable hash of a parsed workout, independent of the ZWO formatting."""
+
+    canonical = json.dumps(workout, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
 def _get_zone(zone_id: int) -> Optional[Dict[str, Any]]:
     for zone in POWER_ZONES:
         if zone["id"] == zone_id:
@@ -577,21 +594,180 @@ def _calculate_tss(normalized_power: float, ftp: float, duration: int) -> float:
     return max(0.0, raw_tss)
 
 
-def _calculate_zone_breakdown(second_by_second: List[float], ftp: float) -> Dict[str, int]:
-    zones = {f"zone{zone['id']}": 0 for zone in POWER_ZONES}
-    for power in second_by_second:
-        intensity = power / ftp if ftp else 0.0
-        zone_id = POWER_ZONES[-1]["id"]
-        for zone in POWER_ZONES:
-            if intensity >= zone["min"] and intensity < zone["max"]:
-                zone_id = zone["id"]
-                break
-        zones[f"zone{zone_id}"] += 1
-    return zones
+def _segment_power_array(segment: Dict[str, Any], ftp: float) -> "np.ndarray":
+    """Vectorized ``_generate_segment_seconds``: same values, built with ramps and ``np.repeat``."""
 
+    attrs = segment.get("attributes", {})
+    seg_type = str(segment.get("type", "")).lower()
 
-def calculate_workout_metrics(workout: Dict[str, Any], ftp: Optional[float] = None) -> Dict[str, Any]:
-    segments: List[Dict[str, Any]] = list(workout.get("workout", []))
+    def ramp(duration: int, low: float, high: float) -> "np.ndarray":
+        progress = np.arange(duration, dtype=np.float64) / max(duration - 1, 1)
+        return low + (high - low) * progress
+
+    if seg_type in {"warmup", "cooldown"}:
+        duration = max(int(round(attrs.get("Duration", 0) or 0)), 0)
+        if duration <= 1:
+            ratio = ((attrs.get("PowerLow") or 0.0) + (attrs.get("PowerHigh") or 0.0)) / 2
+            return np.full(duration, ratio * ftp)
+        low = float(attrs.get("PowerLow") or 0.0) * ftp
+        high = float(attrs.get("PowerHigh") or attrs.get("Power") or 0.0) * ftp
+        return ramp(duration, low, high)
+    if seg_type == "ramp":
+        duration = max(int(round(attrs.get("Duration", 0) or 0)), 0)
+        low = float(attrs.get("PowerLow") or attrs.get("Power") or 0.0) * ftp
+        high = float(attrs.get("PowerHigh") or attrs.get("Power") or 0.0) * ftp
+        return ramp(duration, low, high)
+    if seg_type == "intervalst":
+        repeat = max(int(round(attrs.get("Repeat", 1) or 1)), 0)
+        on_duration = max(int(round(attrs.get("OnDuration", 0) or 0)), 0)
+        off_duration = max(int(round(attrs.get("OffDuration", 0) or 0)), 0)
+        on_power = float(attrs.get("OnPower") or 0.0) * ftp
+        off_power = float(attrs.get("OffPower") or 0.0) * ftp
+        cycle = np.repeat(np.array([on_power, off_power]), [on_duration, off_duration])
+        return np.tile(cycle, repeat)
+    duration = max(int(round(attrs.get("Duration", 0) or 0)), 0)
+    return np.full(duration, float(attrs.get("Power") or 0.0) * ftp)
+
+
+def _normalized_power_array(power: "np.ndarray") -> float:
+    """``_calculate_normalized_power`` on an array, rounded identically.
+
+    ``np.cumsum`` accumulates left to right like the Python loop (``np.sum``
+    is pairwise), and the fourth powers go through Python's ``pow`` because
+    NumPy's differs in the last bit for a few percent of inputs.
+    """
+
+    if power.size == 0:
+        return 0.0
+    running = np.cumsum(power)
+    if power.size < 30:
+        return float(running[-1]) / power.size
+    window = np.cumsum(np.concatenate((running[29:30], power[30:] - power[:-30])))
+    rolling = (window / 30.0).tolist()
+    return (sum(map(pow, rolling, itertools.repeat(4))) / len(rolling)) ** 0.25
+
+
+def _segment_pieces(segment: Dict[str, Any], ftp: float) -> List[Tuple[int, int, float, float]]:
+    """Describe a segment as ``(repeat, duration, start_w, end_w)`` linear pieces.
+
+    Sample ``i`` of a piece is ``start + (end - start) * (i / max(duration - 1, 1))``,
+    exactly as ``_generate_segment_seconds`` computes it; constant parts have
+    ``start == end``.
+    """
+
+    attrs = segment.get("attributes", {})
+    seg_type = str(segment.get("type", "")).lower()
+
+    if seg_type in {"warmup", "cooldown"}:
+        duration = max(int(round(attrs.get("Duration", 0) or 0)), 0)
+        if duration <= 1:
+            value = ((attrs.get("PowerLow") or 0.0) + (attrs.get("PowerHigh") or 0.0)) / 2 * ftp
+            return [(1, duration, value, value)]
+        low = float(attrs.get("PowerLow") or 0.0) * ftp
+        high = float(attrs.get("PowerHigh") or attrs.get("Power") or 0.0) * ftp
+        return [(1, duration, low, high)]
+    if seg_type == "ramp":
+        duration = max(int(round(attrs.get("Duration", 0) or 0)), 0)
+        low = float(attrs.get("PowerLow") or attrs.get("Power") or 0.0) * ftp
+        high = float(attrs.get("PowerHigh") or attrs.get("Power") or 0.0) * ftp
+        return [(1, duration, low, high)]
+    if seg_type == "intervalst":
+        repeat = max(int(round(attrs.get("Repeat", 1) or 1)), 0)
+        on_duration = max(int(round(attrs.get("OnDuration", 0) or 0)), 0)
+        off_duration = max(int(round(attrs.get("OffDuration", 0) or 0)), 0)
+        on_power = float(attrs.get("OnPower") or 0.0) * ftp
+        off_power = float(attrs.get("OffPower") or 0.0) * ftp
+        return [(repeat, on_duration, on_power, on_power), (repeat, off_duration, off_power, off_power)]
+    duration = max(int(round(attrs.get("Duration", 0) or 0)), 0)
+    value = float(attrs.get("Power") or 0.0) * ftp
+    return [(1, duration, value, value)]
+
+
+def _count_at_least(duration: int, start: float, end: float, ftp: float, threshold: float) -> int:
+    """Number of piece samples whose intensity is ``>= threshold``, without expanding them.
+
+    Samples are monotonic in ``i`` (correctly rounded arithmetic preserves
+    order), so the crossing point is found by bisection on the exact
+    per-sample formula and the count matches a per-second scan.
+    """
+
+    if duration <= 0:
+        return 0
+    span = end - start
+    step_base = max(duration - 1, 1)
+
+    def reaches(index: int) -> bool:
+        return (start + span * (index / step_base)) / ftp >= threshold
+
+    rising = span >= 0
+    lo, hi = 0, duration
+    while lo < hi:
+        mid = (lo + hi) // 2
+        # Rising piece: find the first sample that reaches; falling: the first that does not.
+        if reaches(mid) == rising:
+            hi = mid
+        else:
+            lo = mid + 1
+    return duration - lo if rising else lo
+
+
+_ZONE_EDGES = [zone["min"] for zone in POWER_ZONES]
+
+
+def _analytic_power_totals(segments: List[Dict[str, Any]], ftp: float) -> Tuple[int, Dict[str, int]]:
+    """Return sample count and zone seconds in O(segments)."""
+
+    samples = 0
+    zone_seconds = [0] * len(POWER_ZONES)
+    for segment in segments:
+        if not isinstance(segment, dict):
+            continue
+        for repeat, duration, start, end in _segment_pieces(segment, ftp):
+            if repeat <= 0 or duration <= 0:
+                continue
+            samples += repeat * duration
+            at_least = [_count_at_least(duration, start, end, ftp, edge) for edge in _ZONE_EDGES]
+            for idx in range(len(POWER_ZONES)):
+                upper = at_least[idx + 1] if idx + 1 < len(POWER_ZONES) else 0
+                zone_seconds[idx] += repeat * (at_least[idx] - upper)
+            # Negative intensities match no zone and are counted in the last one, as before.
+            zone_seconds[-1] += repeat * (duration - at_least[0])
+    zones = {f"zone{zone['id']}": zone_seconds[idx] for idx, zone in enumerate(POWER_ZONES)}
+    return samples, zones
+
+
+def _power_metrics(segments: List[Dict[str, Any]], ftp: float) -> Optional[Dict[str, float | Dict[str, int]]]:
+    """Return average/normalized power, total joules and zones, or ``None`` for an empty profile.
+
+    Zones are counted per segment. NP needs the per-second profile anyway, so
+    the total is summed from it left to right: a closed-form per-segment total
+    is rounded differently and flipped a few rounded averages/kJ.
+    """
+
+    samples, zones = _analytic_power_totals(segments, ftp)
+    if samples == 0:
+        return None
+    if np is not None:
+        parts = [_segment_power_array(segment, ftp) for segment in segments if isinstance(segment, dict)]
+        profile = np.concatenate(parts)
+        total = float(np.cumsum(profile)[-1])
+        normalized = _normalized_power_array(profile)
+    else:
+        seconds: List[float] = []
+        for segment in segments:
+            if isinstance(segment, dict):
+                seconds.extend(_generate_segment_seconds(segment, ftp))
+        total = sum(seconds)
+        normalized = _calculate_normalized_power(seconds)
+    return {
+        "average": total / samples,
+        "normalized": normalized,
+        "total_joules": total,
+        "zones": zones,
+    }
+
+
+def _base_metrics(segments: List[Dict[str, Any]]) -> Dict[str, Any]:
     total_duration = 0
     has_power = False
     has_cadence = False
@@ -613,41 +789,108 @@ def calculate_workout_metrics(workout: Dict[str, Any], ftp: Optional[float] = No
         has_power = has_power or _segment_has_power(attrs)
         has_cadence = has_cadence or _segment_has_cadence(attrs)
 
-    metrics: Dict[str, Any] = {
+    return {
         "totalDuration": int(round(total_duration)),
         "totalWorkSegments": len(segments),
         "hasPowerData": bool(has_power),
         "hasCadenceData": bool(has_cadence),
     }
 
-    if ftp and ftp > 0 and has_power:
-        seconds: List[float] = []
-        for segment in segments:
-            if not isinstance(segment, dict):
-                continue
-            seconds.extend(_generate_segment_seconds(segment, ftp))
-        if seconds:
-            average_power = sum(seconds) / len(seconds)
-            normalized_power = _calculate_normalized_power(seconds)
-            variability_index = normalized_power / average_power if average_power else 1.0
-            intensity_factor = normalized_power / ftp if ftp else 0.0
-            tss = _calculate_tss(normalized_power, ftp, metrics["totalDuration"])
-            total_kj = sum(seconds) / 1000.0
-            metrics.update(
-                {
-                    "averagePower": int(round(average_power)) or None,
-                    "normalizedPower": int(round(normalized_power)) or None,
-                    "intensityFactor": round(intensity_factor, 2) or None,
-                    "trainingStressScore": int(round(tss)) or None,
-                    "variabilityIndex": round(variability_index, 2) or None,
-                    "totalKj": int(round(total_kj)) or None,
-                    "intensityZoneBreakdown": _calculate_zone_breakdown(seconds, ftp),
-                }
-            )
 
+def _with_power_metrics(metrics: Dict[str, Any], power: Dict[str, Any], ftp: float) -> Dict[str, Any]:
+    average_power = power["average"]
+    normalized_power = power["normalized"]
+    variability_index = normalized_power / average_power if average_power else 1.0
+    intensity_factor = normalized_power / ftp if ftp else 0.0
+    tss = _calculate_tss(normalized_power, ftp, metrics["totalDuration"])
+    total_kj = power["total_joules"] / 1000.0
+    metrics.update(
+        {
+            "averagePower": int(round(average_power)) or None,
+            "normalizedPower": int(round(normalized_power)) or None,
+            "intensityFactor": round(intensity_factor, 2) or None,
+            "trainingStressScore": int(round(tss)) or None,
+            "variabilityIndex": round(variability_index, 2) or None,
+            "totalKj": int(round(total_kj)) or None,
+            "intensityZoneBreakdown": dict(power["zones"]),
+        }
+    )
+    return metrics
+
+
+def calculate_workout_metrics(workout: Dict[str, Any], ftp: Optional[float] = None) -> Dict[str, Any]:
+    segments: List[Dict[str, Any]] = list(workout.get("workout", []))
+    metrics = _base_metrics(segments)
+    if ftp and ftp > 0 and metrics["hasPowerData"]:
+        power = _power_metrics(segments, ftp)
+        if power is not None:
+            _with_power_metrics(metrics, power, ftp)
     return metrics
 
 
+class WorkoutAnalysis:
+    """FTP-independent analysis of a parsed workout.
+
+    The power profile is linear in FTP, so the expensive part (the per-second
+    profile behind NP) is analysed once in FTP units and :meth:`metrics`
+    scales it to any account's FTP. Zone times are recounted per FTP in
+    O(segments) so boundary seconds land exactly where a direct calculation
+    puts them.
+
+    Scaling is not bit-exact: ``relative * ftp`` rounds differently from the
+    per-second ``ratio * ftp`` samples, so before rounding the values agree to
+    about 1e-12 relative. After rounding, ``averagePower``, ``normalizedPower``,
+    ``intensityFactor`` and ``totalKj`` (and derived TSS/VI) can be one unit off
+    in the last kept digit when the value sits on a rounding boundary, which
+    hit up to ~0.5% of random workouts in comparisons. Use
+    :func:`calculate_workout_metrics` where exact agreement matters.
+    """
+
+    def __init__(self, workout: Dict[str, Any]) -> None:
+        self.content_hash = workout_content_hash(workout)
+        self._segments: List[Dict[str, Any]] = list(workout.get("workout", []))
+        self._base = _base_metrics(self._segments)
+        # Power in FTP units (ftp=1.0): average/NP are intensities, total is FTP-seconds.
+        self._relative = _power_metrics(self._segments, 1.0) if self._base["hasPowerData"] else None
+
+    def metrics(self, ftp: Optional[float] = None) -> Dict[str, Any]:
+        """Return ``calculate_workout_metrics(workout, ftp)`` up to the rounding noted above."""
+
+        metrics = dict(self._base)
+        if ftp and ftp > 0 and self._relative is not None:
+            _, zones = _analytic_power_totals(self._segments, ftp)
+            power = {
+                "average": self._relative["average"] * ftp,
+                "normalized": self._relative["normalized"] * ftp,
+                "total_joules": self._relative["total_joules"] * ftp,
+                "zones": zones,
+            }
+            _with_power_metrics(metrics, power, ftp)
+        return metrics
+
+
+_ANALYSIS_CACHE_SIZE = 256
+_analysis_cache: "OrderedDict[str, WorkoutAnalysis]" = OrderedDict()
+_analysis_lock = threading.Lock()
+
+
+def analyze_workout(workout: Dict[str, Any]) -> WorkoutAnalysis:
+    """Return the (memoized by content hash) analysis of a parsed workout."""
+
+    key = workout_content_hash(workout)
+    with _analysis_lock:
+        analysis = _analysis_cache.get(key)
+        if analysis is not None:
+            _analysis_cache.move_to_end(key)
+            return analysis
+    analysis = WorkoutAnalysis(workout)
+    with _analysis_lock:
+        _analysis_cache[key] = analysis
+        while len(_analysis_cache) > _ANALYSIS_CACHE_SIZE:
+            _analysis_cache.popitem(last=False)
+    return analysis
+
+
 def build_workout_payload(
     workout: Dict[str, Any],
     chart_data: List[Dict[str, Any]],
@@ -674,7 +917,10 @@ def build_workout_payload(
 __all__ = [
     "POWER_ZONES",
     "parse_zwo_workout",
+    "workout_content_hash",
     "zwo_to_chart_data",
     "calculate_workout_metrics",
+    "WorkoutAnalysis",
+    "analyze_workout",
     "build_workout_payload",
 ]
@@ -35,6 +35,8 @@ export interface ClientRow {
   weight?: number | null;
   height?: number | null;
   ftp?: number | null;
+  suggested_ftp?: number | null;
+  suggested_ftp_method?: "20min" | "cp" | null;
   pedals?: string | null;
   goal?: string | null;
   saddle_height?: string | null;
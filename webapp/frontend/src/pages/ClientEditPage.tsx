@@ -669,6 +669,12 @@ export default function ClientEditPage() {
               <label>
                 FTP
                 <input type="number" step="1" name="ftp" defaultValue={client.ftp ?? ""} />
+                {client.suggested_ftp ? (
+                  <span className="meta-hint">
+                    По заездам: {client.suggested_ftp} Вт (
+                    {client.suggested_ftp_method === "cp" ? "модель CP" : "95% лучших 20 мин"})
+                  </span>
+                ) : null}
               </label>
               <label>
                 Рост (см)
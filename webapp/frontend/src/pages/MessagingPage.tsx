@@ -14,8 +14,14 @@ import type {
 import "../styles/messaging.css";
 
 interface BroadcastResponse {
+  jobId?: number;
+  status?: string;
+  finished?: boolean;
+  scheduled?: boolean;
+  sendAt?: string;
   sent: number;
   failed: number;
+  pending?: number;
   total: number;
   message: string;
   errors?: string[];
@@ -39,6 +45,12 @@ interface MessagingFilters {
   filterSlotId?: number;
 }
 
+interface BroadcastPreviewResponse {
+  total: number;
+  telegram: number;
+  vk: number;
+}
+
 interface BookingFilterResponse {
   todayIds: number[];
   tomorrowIds: number[];
@@ -81,6 +93,7 @@ export default function MessagingPage() {
   const [scheduledTime, setScheduledTime] = useState("");
   const [isSending, setIsSending] = useState(false);
   const [sendResult, setSendResult] = useState<BroadcastResponse | null>(null);
+  const [broadcastJobId, setBroadcastJobId] = useState<number | null>(null);
   const [sendError, setSendError] = useState<string | null>(null);
   const [selectedClientIds, setSelectedClientIds] = useState<number[]>([]);
   const [clientSearch, setClientSearch] = useState("");
@@ -152,6 +165,22 @@ export default function MessagingPage() {
     staleTime: 60000
   });
 
+  const broadcastProgressQuery = useQuery({
+    queryKey: ["broadcast-progress", broadcastJobId],
+    queryFn: () => apiFetch<BroadcastResponse>(`/api/messages/broadcast/${broadcastJobId}`),
+    enabled: broadcastJobId !== null,
+    refetchInterval: (query) => {
+      if (query.state.data?.finished) return false;
+      return query.state.data?.status === "scheduled" ? 30000 : 2000;
+    }
+  });
+
+  useEffect(() => {
+    if (broadcastProgressQuery.data) {
+      setSendResult(broadcastProgressQuery.data);
+    }
+  }, [broadcastProgressQuery.data]);
+
   const bookingSlotsQuery = useQuery({
     queryKey: ["booking-slots"],
     queryFn: () => apiFetch<{ items: BookingSlotOption[] }>("/api/messages/booking-slots"),
@@ -170,6 +199,7 @@ export default function MessagingPage() {
       }),
     onSuccess: (data) => {
       setSendResult(data);
+      setBroadcastJobId(data.jobId ?? null);
       setSendError(null);
       setMessage("");
       setImageFile(null);
@@ -184,35 +214,12 @@ export default function MessagingPage() {
     }
   });
 
-  function handleSubmit(event: FormEvent<HTMLFormElement>) {
-    event.preventDefault();
-
-    const hasText = Boolean(message.trim());
-    const hasImage = Boolean(imageFile) || Boolean(imageUrl.trim());
-    if (!hasText && !hasImage) {
-      setSendError("Добавьте текст сообщения или изображение");
-      return;
-    }
-
-    if (!sendTelegram && !sendVkActive) {
-      setSendError("Выберите хотя бы один канал отправки");
-      return;
-    }
-
-    setIsSending(true);
-    setSendResult(null);
-    setSendError(null);
-
-    const data: MessagingFilters & { message: string; sendTelegram: boolean; sendVk: boolean } = {
-      message: message.trim(),
+  function buildRecipientFilters(): MessagingFilters & { sendTelegram: boolean; sendVk: boolean } {
+    const data: MessagingFilters & { sendTelegram: boolean; sendVk: boolean } = {
       sendTelegram,
       sendVk: sendVkActive
     };
 
-    if (isScheduled && scheduledTime) {
-      data.sendAt = new Date(scheduledTime).toISOString();
-    }
-
     if (selectedClientIds.length > 0) {
       data.clientIds = selectedClientIds;
     }
@@ -243,12 +250,43 @@ export default function MessagingPage() {
     if (bookingIncludeMode === "slot" && bookingSlotId) {
       data.filterSlotId = bookingSlotId;
     }
-    if (useMarkdownV2) {
-      data.useMarkdownV2 = true;
-    }
     if (genderFilter !== "all") {
       data.filterGender = genderFilter;
     }
+    return data;
+  }
+
+  function handleSubmit(event: FormEvent<HTMLFormElement>) {
+    event.preventDefault();
+
+    const hasText = Boolean(message.trim());
+    const hasImage = Boolean(imageFile) || Boolean(imageUrl.trim());
+    if (!hasText && !hasImage) {
+      setSendError("Добавьте текст сообщения или изображение");
+      return;
+    }
+
+    if (!sendTelegram && !sendVkActive) {
+      setSendError("Выберите хотя бы один канал отправки");
+      return;
+    }
+
+    setIsSending(true);
+    setSendResult(null);
+    setBroadcastJobId(null);
+    setSendError(null);
+
+    const data: MessagingFilters & { message: string; sendTelegram: boolean; sendVk: boolean } = {
+      message: message.trim(),
+      ...buildRecipientFilters()
+    };
+
+    if (isScheduled && scheduledTime) {
+      data.sendAt = new Date(scheduledTime).toISOString();
+    }
+    if (useMarkdownV2) {
+      data.useMarkdownV2 = true;
+    }
     if (includeBlocked) {
       // backend still attempts sends; UI filter controls inclusion
     }
@@ -652,6 +690,19 @@ export default function MessagingPage() {
   );
 
   const linkedUsersCount = deliverableRecipients.length;
+
+  const previewFilters = buildRecipientFilters();
+  const previewKey = JSON.stringify(previewFilters);
+  const recipientPreviewQuery = useQuery({
+    queryKey: ["broadcast-preview", previewKey],
+    queryFn: () =>
+      apiFetch<BroadcastPreviewResponse>("/api/messages/broadcast/preview", {
+        method: "POST",
+        body: previewFilters
+      }),
+    enabled: (sendTelegram || sendVkActive) && !(bookingIncludeMode === "slot" && !bookingSlotId),
+    staleTime: 30000
+  });
   const selectedCount = selectedClientIds.length > 0 ? selectedClientIds.length : deliverableRecipients.length;
 
   const activeRecipientFilters = useMemo(() => {
@@ -729,7 +780,11 @@ export default function MessagingPage() {
           <div className="stat-card">
             <div className="stat-label">Получатели по фильтрам</div>
             <div className="stat-value">{linkedUsersCount}</div>
-            <div className="stat-hint form-hint">С учетом выбранных каналов</div>
+            <div className="stat-hint form-hint">
+              {recipientPreviewQuery.data
+                ? `Будет отправлено сообщений: ${recipientPreviewQuery.data.total}`
+                : "С учетом выбранных каналов"}
+            </div>
           </div>
           <div className="stat-card">
             <div className="stat-label">Telegram</div>
@@ -1242,7 +1297,7 @@ export default function MessagingPage() {
             <ul>
             <li>Сообщения отправляются через бота для записи в Крутилку и в VK (при включенной опции)</li>
             <li>Получатели берутся из связок клиента с Telegram/VK; фильтры и выбор применяются одинаково</li>
-            <li>Отправка по расписанию будет реализована в следующих версиях</li>
+            <li>Отправка по расписанию: получатели выбираются по фильтрам в момент отправки, а не при создании рассылки</li>
             </ul>
           </div>
         </div>
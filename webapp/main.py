@@ -11,7 +11,7 @@ from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, File
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from itsdangerous import URLSafeTimedSerializer
-from repositories import instructors_repository, message_repository, schedule_repository
+from repositories import instructors_repository, message_repository
 from starlette.middleware.sessions import SessionMiddleware
 
 from .config import get_settings
@@ -25,7 +25,11 @@ from .routes.bikes import router as bikes_router
 from .routes.admins import router as admins_router
 from .routes.core import api_router as core_router, public_router as public_core_router
 from .routes.clients import router as clients_router
-from .routes.messaging import ensure_uploads_dir, router as messaging_router, UPLOADS_DIR as MESSAGING_UPLOADS_DIR
+from .routes.messaging import (
+    ensure_uploads_dir,
+    router as messaging_router,
+    UPLOADS_DIR as MESSAGING_UPLOADS_DIR,
+)
 from .routes.client_links import router as client_links_router
 from .routes.vk_client_links import router as vk_client_links_router
 from .routes.intervals_links import router as intervals_links_router
@@ -36,6 +40,7 @@ from .routes.strava import router as strava_router
 from .routes.leaderboard import router as leaderboard_router
 from .routes.public_leaderboard import router as public_leaderboard_router
 from .routes.sync import router as sync_router
+from .routes.fitfiles import router as fitfiles_router
 from .routes.schedule import router as schedule_router, public_router as public_schedule_router
 from .routes.schedule_slots import router as schedule_slots_router
 from .routes.backup import router as backup_router
@@ -121,6 +126,7 @@ def create_app() -> FastAPI:
     app.include_router(public_races_router)
     app.include_router(public_core_router)
     app.include_router(public_leaderboard_router)
+    app.include_router(fitfiles_router)
 
     @app.on_event("startup")
     def _startup_seed_instructors() -> None:
@@ -154,12 +160,6 @@ def create_app() -> FastAPI:
 
     if MESSAGING_UPLOADS_DIR.exists():
         app.mount("/uploads", StaticFiles(directory=str(MESSAGING_UPLOADS_DIR), html=False), name="uploads")
-    try:
-        fit_dir = schedule_repository.ensure_fit_files_dir()
-        if fit_dir.exists():
-            app.mount("/fitfiles", StaticFiles(directory=str(fit_dir), html=False), name="fitfiles")
-    except Exception:
-        log.exception("Failed to mount FIT files directory")
 
     index_file = dist_root / "index.html"
 
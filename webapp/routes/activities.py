@@ -6,10 +6,18 @@ from pathlib import Path
 from typing import Optional
 
 from fastapi import APIRouter, Depends, HTTPException, status
-
-from repositories import client_link_repository, schedule_repository, intervals_link_repository, client_repository
+from fastapi.encoders import jsonable_encoder
+
+from repositories import (
+    activity_analytics_repository,
+    client_link_repository,
+    schedule_repository,
+    intervals_link_repository,
+    client_repository,
+)
 from ..dependencies import require_admin
 from scheduler import intervals_sync
+from scheduler.activity_analytics import ingest_activity_fit, refresh_client_ftp_estimate
 from scheduler.notifier_client import (
     format_activity_meta,
     format_strava_activity_description,
@@ -19,7 +27,7 @@ from scheduler.notifier_client import (
 )
 from straver_client import StraverClient
 from wattattack_activities import DEFAULT_BASE_URL, WattAttackClient
-from .sync import _build_strava_payload, _fit_storage_path, _resolve_fit_file_path
+from .sync import _build_strava_payload, _download_fit_to_archive, _has_fit_file, _materialized_fit
 
 log = logging.getLogger(__name__)
 
@@ -170,6 +178,15 @@ def api_get_activity_id(
         ) from exc
 
 
+@router.get("/{account_id}/{activity_id}/analytics")
+def api_get_activity_analytics(account_id: str, activity_id: str):
+    """Return the power metrics computed from the activity's FIT file."""
+    row = activity_analytics_repository.get_activity_analytics(account_id, activity_id)
+    if not row:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Activity has no power analytics")
+    return {"item": jsonable_encoder(row)}
+
+
 def _load_activity_row(account_id: str, activity_id: str) -> dict:
     schedule_repository.ensure_activity_ids_table()
     with schedule_repository.db_connection() as conn, schedule_repository.dict_cursor(conn) as cur:
@@ -215,8 +232,7 @@ def api_download_fit_file(account_id: str, activity_id: str):
     """Download a missing FIT file for an activity directly from WattAttack."""
     try:
         activity_row = _load_activity_row(account_id, activity_id)
-        existing_path = _resolve_fit_file_path(activity_row)
-        if existing_path:
+        if _has_fit_file(activity_row):
             fit_path = activity_row.get("fit_path") or f"/fitfiles/{account_id}/{activity_id}.fit"
             if not activity_row.get("fit_path"):
                 schedule_repository.record_seen_activity_id(str(account_id), str(activity_id), fit_path=fit_path)
@@ -256,11 +272,9 @@ def api_download_fit_file(account_id: str, activity_id: str):
         if not fit_id:
             raise HTTPException(status.HTTP_404_NOT_FOUND, "У активности нет FIT-файла в WattAttack")
 
-        dest_file = _fit_storage_path(str(account_id), str(activity_id))
         try:
-            client.download_fit_file(str(fit_id), dest_file, timeout=timeout)
+            _download_fit_to_archive(client, str(fit_id), str(account_id), str(activity_id), timeout)
         except Exception as exc:  # noqa: BLE001
-            dest_file.unlink(missing_ok=True)
             raise HTTPException(status.HTTP_502_BAD_GATEWAY, f"Не удалось скачать FIT-файл: {exc}") from exc
 
         fit_path = f"/fitfiles/{account_id}/{activity_id}.fit"
@@ -269,6 +283,11 @@ def api_download_fit_file(account_id: str, activity_id: str):
             str(activity_id),
             fit_path=fit_path,
         )
+        ingest_activity_fit(
+            str(account_id),
+            str(activity_id),
+            activity_row.get("manual_client_id") or activity_row.get("client_id"),
+        )
 
         return {"status": "downloaded", "message": "FIT-файл скачан", "fit_path": fit_path}
     except HTTPException:
@@ -307,21 +326,21 @@ def api_upload_activity_to_strava(
         if not status_row or not status_row.get("connected"):
             raise HTTPException(status.HTTP_400_BAD_REQUEST, "Strava не привязана у пользователя")
 
-        file_path = _resolve_fit_file_path(activity_row)
-        if not file_path:
-            raise HTTPException(status.HTTP_400_BAD_REQUEST, "FIT-файл не найден, загрузка невозможна")
+        with _materialized_fit(activity_row) as file_path:
+            if not file_path:
+                raise HTTPException(status.HTTP_400_BAD_REQUEST, "FIT-файл не найден, загрузка невозможна")
 
-        upload_name, description = _build_strava_payload(activity_row)
-        try:
-            straver.upload_activity(
-                tg_user_id=int(tg_user_id),
-                file_path=file_path,
-                name=upload_name,
-                description=description,
-            )
-        except Exception as exc:  # noqa: BLE001
-            log.exception("Failed to upload activity %s/%s to Strava", account_id, activity_id)
-            raise HTTPException(status.HTTP_502_BAD_GATEWAY, f"Не удалось загрузить в Strava: {exc}") from exc
+            upload_name, description = _build_strava_payload(activity_row)
+            try:
+                straver.upload_activity(
+                    tg_user_id=int(tg_user_id),
+                    file_path=file_path,
+                    name=upload_name,
+                    description=description,
+                )
+            except Exception as exc:  # noqa: BLE001
+                log.exception("Failed to upload activity %s/%s to Strava", account_id, activity_id)
+                raise HTTPException(status.HTTP_502_BAD_GATEWAY, f"Не удалось загрузить в Strava: {exc}") from exc
 
         schedule_repository.record_seen_activity_id(
             str(account_id),
@@ -360,24 +379,24 @@ def api_send_activity_to_clientbot(
         if not token:
             raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE, "KRUTILKAVN_BOT_TOKEN не настроен")
 
-        file_path = _resolve_fit_file_path(activity_row)
-        if not file_path:
-            raise HTTPException(status.HTTP_400_BAD_REQUEST, "FIT-файл не найден, отправка в бота невозможна")
-        activity_payload = _build_activity_payload(activity_row)
-        caption = format_activity_meta(
-            activity_payload,
-            account_id,
-            profile=None,
-            scheduled_name=activity_row.get("scheduled_name"),
-        )
-        telegram_send_document(
-            token=token,
-            chat_id=str(tg_user_id),
-            file_path=file_path,
-            filename=file_path.name,
-            caption=caption,
-            timeout=30,
-        )
+        with _materialized_fit(activity_row) as file_path:
+            if not file_path:
+                raise HTTPException(status.HTTP_400_BAD_REQUEST, "FIT-файл не найден, отправка в бота невозможна")
+            activity_payload = _build_activity_payload(activity_row)
+            caption = format_activity_meta(
+                activity_payload,
+                account_id,
+                profile=None,
+                scheduled_name=activity_row.get("scheduled_name"),
+            )
+            telegram_send_document(
+                token=token,
+                chat_id=str(tg_user_id),
+                file_path=file_path,
+                filename=file_path.name,
+                caption=caption,
+                timeout=30,
+            )
 
         schedule_repository.record_seen_activity_id(
             str(account_id),
@@ -415,28 +434,28 @@ def api_send_activity_to_intervals(
         if not intervals_link or not intervals_link.get("intervals_api_key"):
             raise HTTPException(status.HTTP_400_BAD_REQUEST, "Intervals не привязан у пользователя")
 
-        file_path = _resolve_fit_file_path(activity_row)
-        if not file_path:
-            raise HTTPException(status.HTTP_400_BAD_REQUEST, "FIT-файл не найден, загрузка невозможна")
+        with _materialized_fit(activity_row) as file_path:
+            if not file_path:
+                raise HTTPException(status.HTTP_400_BAD_REQUEST, "FIT-файл не найден, загрузка невозможна")
 
-        activity_payload = _build_activity_payload(activity_row)
-        description = format_strava_activity_description(
-            activity_payload,
-            account_id,
-            profile=None,
-            scheduled_name=activity_row.get("scheduled_name"),
-        )
+            activity_payload = _build_activity_payload(activity_row)
+            description = format_strava_activity_description(
+                activity_payload,
+                account_id,
+                profile=None,
+                scheduled_name=activity_row.get("scheduled_name"),
+            )
 
-        uploaded = intervals_sync.upload_activity(
-            tg_user_id=int(tg_user_id),
-            temp_file=file_path,
-            description=description,
-            activity_id=activity_id,
-            timeout=30.0,
-            activity_name=activity_payload.get("name") or "Крутилка",
-        )
-        if not uploaded:
-            raise HTTPException(status.HTTP_502_BAD_GATEWAY, "Не удалось загрузить в Intervals")
+            uploaded = intervals_sync.upload_activity(
+                tg_user_id=int(tg_user_id),
+                temp_file=file_path,
+                description=description,
+                activity_id=activity_id,
+                timeout=30.0,
+                activity_name=activity_payload.get("name") or "Крутилка",
+            )
+            if not uploaded:
+                raise HTTPException(status.HTTP_502_BAD_GATEWAY, "Не удалось загрузить в Intervals")
 
         schedule_repository.record_seen_activity_id(
             str(account_id),
@@ -496,6 +515,16 @@ async def api_update_activity_client(account_id: str, activity_id: str, payload:
         if not updated:
             raise HTTPException(status.HTTP_404_NOT_FOUND, "Activity not found")
 
+        previous_client_id = activity_row.get("manual_client_id") or activity_row.get("client_id")
+        try:
+            activity_analytics_repository.reassign_activity_client(
+                account_id, activity_id, previous_client_id, new_client_id
+            )
+            for affected_client_id in {previous_client_id, new_client_id} - {None}:
+                refresh_client_ftp_estimate(affected_client_id)
+        except Exception:  # noqa: BLE001
+            log.exception("Failed to move power bests of activity %s/%s", account_id, activity_id)
+
         return {"item": _serialize_activity_id_enriched(updated)}
     except HTTPException:
         raise
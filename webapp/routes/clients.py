@@ -9,6 +9,7 @@ from fastapi import APIRouter, Depends, HTTPException, Request, status
 from fastapi.encoders import jsonable_encoder
 
 from repositories import (
+    activity_analytics_repository,
     client_link_repository,
     client_repository,
     schedule_repository,
@@ -116,7 +117,24 @@ def api_get_client(client_id: int):
     record = client_repository.get_client(client_id)
     if not record:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "Client not found")
-    return {"item": jsonable_encoder(record)}
+    item = dict(record)
+    try:
+        estimate = activity_analytics_repository.get_client_ftp_estimate(client_id)
+    except psycopg2.Error:
+        estimate = None
+    item["suggested_ftp"] = estimate.get("estimated_ftp") if estimate else None
+    item["suggested_ftp_method"] = estimate.get("method") if estimate else None
+    return {"item": jsonable_encoder(item)}
+
+
+@router.get("/{client_id}/analytics", dependencies=[Depends(require_admin)])
+def api_get_client_analytics(client_id: int, limit: int = 50):
+    """Per-ride power metrics (NP, IF, TSS, curve) of the client's latest rides."""
+    record = client_repository.get_client(client_id)
+    if not record:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Client not found")
+    rows = activity_analytics_repository.list_client_analytics(client_id, limit=min(max(limit, 1), 500))
+    return {"items": jsonable_encoder(rows)}
 
 
 @router.get("/{client_id}/groups", dependencies=[Depends(require_admin)])
@@ -0,0 +1,75 @@
+"""Serve archived FIT files at their historical ``/fitfiles/<account>/<activity>.fit`` URLs."""
+from __future__ import annotations
+
+import gzip
+import logging
+import re
+
+from fastapi import APIRouter, HTTPException, Request, Response, status
+from fastapi.responses import FileResponse
+
+from repositories import fit_archive_repository
+
+router = APIRouter(prefix="/fitfiles", tags=["fitfiles"])
+log = logging.getLogger(__name__)
+
+FIT_MEDIA_TYPE = "application/vnd.ant.fit"
+_PATH_PART_RE = re.compile(r"^[A-Za-z0-9_-][A-Za-z0-9_.-]*$")
+
+
+def _accepts_gzip(request: Request) -> bool:
+    """True when ``Accept-Encoding`` allows gzip; ``q=0`` refuses it, ``gzip`` overrides ``*``."""
+    weights = {}
+    for item in request.headers.get("accept-encoding", "").split(","):
+        coding, *params = [part.strip() for part in item.split(";")]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding:
+            weights[coding.lower()] = quality
+    return weights.get("gzip", weights.get("*", 0.0)) > 0
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match", "")
+    return any(tag.strip() in {etag, f"W/{etag}", "*"} for tag in header.split(","))
+
+
+@router.get("/{account_id}/{filename}")
+def get_fit_file(account_id: str, filename: str, request: Request):
+    """Stream the compressed object as-is when the client takes gzip, else decompress it."""
+    activity_id = filename[: -len(".fit")] if filename.endswith(".fit") else ""
+    if not _PATH_PART_RE.match(account_id) or not _PATH_PART_RE.match(activity_id):
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Not Found")
+
+    try:
+        stored = fit_archive_repository.find_fit_object(account_id, activity_id)
+    except Exception:  # noqa: BLE001
+        log.exception("Failed to look up archived FIT %s/%s", account_id, activity_id)
+        raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE, "FIT archive unavailable")
+
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"', "Vary": "Accept-Encoding"}
+    if stored:
+        # Each encoding is a different representation and needs its own strong tag
+        use_gzip = _accepts_gzip(request)
+        etag = f'"{stored["content_hash"]}-gz"' if use_gzip else f'"{stored["content_hash"]}"'
+        if _etag_matches(request, etag):
+            return Response(
+                status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag, "Vary": "Accept-Encoding"}
+            )
+        headers["ETag"] = etag
+        if use_gzip:
+            headers["Content-Encoding"] = "gzip"
+            return FileResponse(stored["path"], media_type=FIT_MEDIA_TYPE, headers=headers)
+        with gzip.open(stored["path"], "rb") as handle:
+            return Response(handle.read(), media_type=FIT_MEDIA_TYPE, headers=headers)
+
+    legacy = fit_archive_repository.legacy_fit_path(account_id, activity_id)
+    if legacy.is_file():
+        return FileResponse(legacy, media_type=FIT_MEDIA_TYPE, headers=headers)
+    raise HTTPException(status.HTTP_404_NOT_FOUND, "Not Found")
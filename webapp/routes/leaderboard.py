@@ -8,10 +8,18 @@ router = APIRouter(prefix="/leaderboard", tags=["leaderboard"])
 
 
 @router.get("")
-def api_public_leaderboard(limit: int = Query(100, ge=1, le=500)):
-    """Expose leaderboard for public pages without authentication."""
+def api_public_leaderboard(
+    limit: int = Query(100, ge=1, le=500),
+    sort_by: str = Query("distance"),
+    direction: str = Query("desc"),
+):
+    """Expose leaderboard for public pages without authentication.
+
+    ``sort_by`` is ``distance``, ``elevation`` or one of the power metrics
+    ``wkg5``, ``wkg20``, ``kj``, ``tss_month``, ``longest``.
+    """
 
     try:
-        return schedule_repository.get_distance_leaderboard(limit=limit)
+        return schedule_repository.get_distance_leaderboard(limit=limit, sort_by=sort_by, direction=direction)
     except Exception as exc:  # noqa: BLE001
         raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR, "Failed to load leaderboard") from exc
@@ -1,18 +1,32 @@
 """Messaging endpoints (broadcast, history)."""
 from __future__ import annotations
 
-import json
+import asyncio
+import hashlib
 import logging
-from datetime import date, timedelta
+import os
+from datetime import date, datetime, timedelta, timezone
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Set, Tuple
-from uuid import uuid4
+from typing import Any, Optional
+from zoneinfo import ZoneInfo
 
 from fastapi import APIRouter, Depends, HTTPException, Request, UploadFile, status
 from fastapi.encoders import jsonable_encoder
 from fastapi.responses import HTMLResponse, JSONResponse
 
-from repositories import client_link_repository, message_repository, race_repository, schedule_repository, vk_client_link_repository
+from notifications.broadcast_recipients import (
+    FilterTargetNotFound,
+    RecipientFilterError,
+    RecipientFilters,
+    check_filter_targets,
+    collect_clients_with_bookings_for_slot,
+    collect_clients_with_bookings_on_date,
+    collect_clients_without_bookings,
+    parse_bool,
+    preview_recipient_count,
+    resolve_recipients,
+)
+from repositories import broadcast_repository, message_repository, schedule_repository
 
 from ..config import get_settings
 from ..dependencies import require_admin
@@ -24,7 +38,7 @@ router = APIRouter(prefix="/messages", tags=["messages"], dependencies=[Depends(
 BASE_DIR = Path(__file__).resolve().parent.parent
 UPLOADS_DIR = BASE_DIR / "uploads"
 
-FilterClientSet = Tuple[Set[int], str]
+LOCAL_TZ = ZoneInfo(os.environ.get("WATTATTACK_LOCAL_TZ", "Europe/Moscow"))
 
 
 def ensure_uploads_dir() -> None:
@@ -68,141 +82,29 @@ async def _parse_broadcast_payload(request: Request) -> tuple[dict, UploadFile |
     return payload, image_upload
 
 
-def _parse_id_list(raw_value: object, field_name: str) -> set[int] | None:
-    if raw_value is None:
-        return None
+def _filter_error(exc: RecipientFilterError) -> HTTPException:
+    if isinstance(exc, FilterTargetNotFound):
+        return HTTPException(status.HTTP_404_NOT_FOUND, str(exc))
+    return HTTPException(status.HTTP_400_BAD_REQUEST, str(exc))
 
-    values: list[object]
-    if isinstance(raw_value, list):
-        values = list(raw_value)
-    elif isinstance(raw_value, str):
-        text = raw_value.strip()
-        if not text:
-            return set()
-        try:
-            parsed = json.loads(text)
-            if isinstance(parsed, list):
-                values = parsed
-            else:
-                values = [parsed]
-        except Exception:
-            values = [part for part in text.split(",") if part]
-    else:
-        values = [raw_value]
 
-    result: set[int] = set()
-    for value in values:
-        try:
-            int_value = int(value)
-        except (TypeError, ValueError) as exc:
-            raise HTTPException(status.HTTP_400_BAD_REQUEST, f"{field_name} must contain integers") from exc
-        if int_value <= 0:
-            raise HTTPException(status.HTTP_400_BAD_REQUEST, f"{field_name} must be positive integers")
-        result.add(int_value)
-
-    return result
-
-
-def _normalize_gender(value: object | None) -> str:
-    if value is None:
-        return ""
-    if isinstance(value, str):
-        return value.strip().lower()
-    return str(value).strip().lower()
-
-
-def _gender_matches(filter_gender: str, candidate: object | None) -> bool:
-    normalized = _normalize_gender(candidate)
-    if filter_gender == "unknown":
-        return normalized not in {"male", "female"}
-    return normalized == filter_gender
-
-
-def _parse_bool(value: object) -> bool:
-    if isinstance(value, bool):
-        return value
-    if value is None:
-        return False
-    if isinstance(value, str):
-        return value.strip().lower() in {"1", "true", "yes", "y", "on"}
+def _parse_send_at(raw_value: object) -> datetime | None:
+    """Parse ``sendAt``; naive values are local studio time. Past times mean "now"."""
+
+    if raw_value is None or (isinstance(raw_value, str) and not raw_value.strip()):
+        return None
+    text = str(raw_value).strip()
+    if text.endswith("Z"):
+        text = f"{text[:-1]}+00:00"
     try:
-        return bool(int(value))  # type: ignore[arg-type]
-    except Exception:
-        return bool(value)
-
-
-def _collect_clients_with_bookings_on_date(target_date: date) -> FilterClientSet:
-    """Return client IDs that have bookings on a specific date."""
-
-    reservations = schedule_repository.list_reservations_by_date(target_date)
-    booked_ids = {int(res["client_id"]) for res in reservations or [] if res.get("client_id")}
-    note = f"Бронь на {target_date.isoformat()}"
-    if not booked_ids:
-        return set(), "Нет броней в расписании"
-    return booked_ids, note
-
-
-def _collect_clients_without_bookings(target_date: date) -> FilterClientSet:
-    """Return client IDs that have bookings on a specific date (legacy exclude helper)."""
-
-    booked_ids, note = _collect_clients_with_bookings_on_date(target_date)
-    return booked_ids, f"Исключены клиенты с {note.lower()}"
-
-
-def _collect_clients_with_bookings_for_slot(slot_id: int) -> FilterClientSet:
-    """Return client IDs that have bookings for a specific slot."""
-
-    slot = schedule_repository.get_slot_with_reservations(slot_id)
-    if not slot:
-        raise HTTPException(status.HTTP_404_NOT_FOUND, "Slot not found")
-
-    reservations = slot.get("reservations") or []
-    booked_ids = {int(res["client_id"]) for res in reservations if res.get("client_id")}
-
-    label_parts = [str(slot.get("slot_date") or "")]
-    start_time = slot.get("start_time")
-    end_time = slot.get("end_time")
-    if start_time and end_time:
-        label_parts.append(f"{start_time}-{end_time}")
-    slot_label = " ".join(part for part in label_parts if part).strip() or "слот"
-    if slot.get("label"):
-        slot_label = f"{slot_label} · {slot['label']}"
-
-    note = f"Бронь в слоте {slot_label}"
-    return booked_ids, note
-
-
-def _filter_links(
-    links: list[dict],
-    *,
-    client_id_filter: set[int] | None,
-    race_client_ids: set[int] | None,
-    normalized_gender: str | None,
-    inclusion_ids: set[int] | None,
-    exclusion_ids: set[int],
-    include_blocked: bool = True,
-) -> list[dict]:
-    """Apply recipient filters to provided link rows."""
-
-    filtered: list[dict] = []
-    for link in links:
-        client_id = int(link.get("client_id") or 0)
-        if client_id <= 0:
-            continue
-        if client_id_filter is not None and client_id not in client_id_filter:
-            continue
-        if race_client_ids is not None and client_id not in race_client_ids:
-            continue
-        if normalized_gender and not _gender_matches(normalized_gender, link.get("gender")):
-            continue
-        if inclusion_ids is not None and client_id not in inclusion_ids:
-            continue
-        if exclusion_ids and client_id in exclusion_ids:
-            continue
-        if not include_blocked and link.get("is_blocked"):
-            continue
-        filtered.append(link)
-    return filtered
+        parsed = datetime.fromisoformat(text)
+    except ValueError as exc:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "sendAt must be an ISO datetime") from exc
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=LOCAL_TZ)
+    if parsed <= datetime.now(tz=timezone.utc):
+        return None
+    return parsed
 
 
 @router.get("/booking-filters")
@@ -211,8 +113,8 @@ def api_booking_filters(filter_date: Optional[date] = None, slot_id: Optional[in
 
     today = date.today()
     tomorrow = today + timedelta(days=1)
-    today_ids, _ = _collect_clients_without_bookings(today)
-    tomorrow_ids, _ = _collect_clients_without_bookings(tomorrow)
+    today_ids, _ = collect_clients_without_bookings(today)
+    tomorrow_ids, _ = collect_clients_without_bookings(tomorrow)
 
     payload: dict[str, object] = {
         "todayIds": sorted(today_ids),
@@ -220,7 +122,7 @@ def api_booking_filters(filter_date: Optional[date] = None, slot_id: Optional[in
     }
 
     if filter_date is not None:
-        date_ids, _ = _collect_clients_with_bookings_on_date(filter_date)
+        date_ids, _ = collect_clients_with_bookings_on_date(filter_date)
         payload.update(
             {
                 "dateIds": sorted(date_ids),
@@ -229,7 +131,10 @@ def api_booking_filters(filter_date: Optional[date] = None, slot_id: Optional[in
         )
 
     if slot_id is not None:
-        slot_ids, note = _collect_clients_with_bookings_for_slot(slot_id)
+        try:
+            slot_ids, note = collect_clients_with_bookings_for_slot(slot_id)
+        except RecipientFilterError as exc:
+            raise _filter_error(exc) from exc
         payload.update(
             {
                 "slotIds": sorted(slot_ids),
@@ -268,25 +173,101 @@ def api_booking_slots(limit: int = 80):
     return {"items": [_serialize_slot(slot) for slot in slots]}
 
 
-def _store_uploaded_image(image_upload: UploadFile, *, request: Request, image_bytes: bytes) -> str:
-    """Persist uploaded image and return absolute URL for Telegram."""
+def _image_hash(*, image_bytes: bytes | None = None, image_url: str | None = None) -> str | None:
+    """Content hash used to reuse uploaded Telegram/VK media across broadcasts."""
+    if image_bytes:
+        return hashlib.sha256(image_bytes).hexdigest()
+    if image_url:
+        return hashlib.sha256(f"url:{image_url.strip()}".encode("utf-8")).hexdigest()
+    return None
+
+
+def _store_uploaded_image(
+    image_upload: UploadFile, *, request: Request, image_bytes: bytes, image_hash: str
+) -> tuple[str, Path]:
+    """Persist uploaded image under its content hash and return its URL and local path."""
     target_dir = UPLOADS_DIR / "messaging"
     target_dir.mkdir(parents=True, exist_ok=True)
 
     original_suffix = Path(image_upload.filename or "").suffix.lower()
     safe_suffix = original_suffix if original_suffix in {".jpg", ".jpeg", ".png", ".gif", ".webp"} else ".jpg"
-    filename = f"{uuid4().hex}{safe_suffix}"
+    filename = f"{image_hash[:32]}{safe_suffix}"
     destination = target_dir / filename
-    destination.write_bytes(image_bytes)
+    if not destination.exists():
+        destination.write_bytes(image_bytes)
 
     public_url = f"{_build_base_url(request)}/uploads/messaging/{filename}"
     log.info("messaging: stored image %s (%s bytes) -> %s", destination, len(image_bytes), public_url)
-    return public_url
+    return public_url, destination
+
+
+def _serialize_broadcast_progress(job: dict) -> dict:
+    counts = job.get("counts") or {}
+    tg_counts = counts.get(broadcast_repository.CHANNEL_TELEGRAM) or {}
+    vk_counts = counts.get(broadcast_repository.CHANNEL_VK) or {}
+    sent_tg = tg_counts.get(broadcast_repository.MESSAGE_STATUS_SENT, 0)
+    sent_vk = vk_counts.get(broadcast_repository.MESSAGE_STATUS_SENT, 0)
+    failed = tg_counts.get(broadcast_repository.MESSAGE_STATUS_FAILED, 0) + vk_counts.get(
+        broadcast_repository.MESSAGE_STATUS_FAILED, 0
+    )
+    total = int(job.get("total") or 0)
+    sent_total = sent_tg + sent_vk
+    status_value = job.get("status")
+    finished = status_value in {broadcast_repository.JOB_STATUS_DONE, broadcast_repository.JOB_STATUS_FAILED}
+
+    options = job.get("options") or {}
+    if status_value == broadcast_repository.JOB_STATUS_SCHEDULED:
+        send_at = job.get("send_at")
+        when = send_at.astimezone(LOCAL_TZ).strftime("%d.%m.%Y %H:%M") if isinstance(send_at, datetime) else send_at
+        return {
+            "jobId": job.get("id"),
+            "status": status_value,
+            "finished": False,
+            "scheduled": True,
+            "sendAt": send_at.isoformat() if isinstance(send_at, datetime) else send_at,
+            "sent": 0,
+            "failed": 0,
+            "pending": 0,
+            "total": 0,
+            "sentTelegram": 0,
+            "sentVk": 0,
+            "message": f"Рассылка запланирована на {when}. Получатели будут выбраны по фильтрам в момент отправки",
+            "errors": [],
+        }
+
+    prefix = "Отправлено" if finished else "Отправляется:"
+    detail_message = f"{prefix} {sent_total} из {total} пользователей, ошибок: {failed}"
+    if finished and total == 0 and options.get("dispatch_note"):
+        detail_message = str(options["dispatch_note"])
+    channel_details: list[str] = []
+    if tg_counts:
+        channel_details.append(f"TG {sent_tg}/{sum(tg_counts.values())}")
+    if vk_counts:
+        channel_details.append(f"VK {sent_vk}/{sum(vk_counts.values())}")
+    if channel_details:
+        detail_message += f" ({', '.join(channel_details)})"
+    errors = job.get("errors") or []
+    if errors:
+        detail_message += f". Пример ошибки: {errors[0][:240]}"
+
+    return {
+        "jobId": job.get("id"),
+        "status": status_value,
+        "finished": finished,
+        "sent": sent_total,
+        "failed": failed,
+        "pending": max(total - sent_total - failed, 0),
+        "total": total,
+        "sentTelegram": sent_tg,
+        "sentVk": sent_vk,
+        "message": detail_message,
+        "errors": errors,
+    }
 
 
 @router.post("/broadcast")
 async def api_broadcast_message(request: Request):
-    """Broadcast a message to linked users (Telegram and VK)."""
+    """Queue a broadcast to linked users (Telegram and VK) and return its job id."""
     try:
         log.info(
             "broadcast: incoming content-type=%s length=%s",
@@ -317,34 +298,25 @@ async def api_broadcast_message(request: Request):
                     message_text = body_bytes.decode(errors="ignore").strip()
             except Exception:  # pylint: disable=broad-except
                 message_text = message_text
-        send_at = payload.get("sendAt") or payload.get("send_at")  # ISO datetime string or None for immediate
-        client_ids_raw = payload.get("clientIds") or payload.get("client_ids")
-        race_id_raw = payload.get("raceId") or payload.get("race_id")
-        filter_no_booking_today = payload.get("filterNoBookingToday")
-        filter_no_booking_tomorrow = payload.get("filterNoBookingTomorrow")
-        filter_has_booking_today = payload.get("filterHasBookingToday")
-        filter_has_booking_tomorrow = payload.get("filterHasBookingTomorrow")
-        filter_booking_date_raw = payload.get("filterBookingDate")
-        filter_slot_id_raw = payload.get("filterSlotId") or payload.get("slotId")
-        filter_race_unpaid_raw = payload.get("filterRaceUnpaid") or payload.get("raceUnpaid")
-        filter_gender_raw = payload.get("filterGender")
+        send_at_raw = payload.get("sendAt") or payload.get("send_at")  # ISO datetime string or None for immediate
         parse_mode_raw = payload.get("parseMode")
         markdown_v2_raw = payload.get("markdownV2") or payload.get("useMarkdownV2")
         image_url = payload.get("imageUrl") or payload.get("image_url")
-        send_vk_default = bool(settings.vk_community_key)
-        send_vk = send_vk_default
-        if "sendVk" in payload or "send_vk" in payload:
-            send_vk = _parse_bool(payload.get("sendVk") or payload.get("send_vk"))
-        send_telegram = True
-        if "sendTelegram" in payload or "send_telegram" in payload:
-            send_telegram = _parse_bool(payload.get("sendTelegram") or payload.get("send_telegram"))
+        try:
+            filters = RecipientFilters.from_request(payload, default_send_vk=bool(settings.vk_community_key))
+        except RecipientFilterError as exc:
+            raise _filter_error(exc) from exc
+        send_vk = filters.send_vk
+        send_telegram = filters.send_telegram
+        send_at = _parse_send_at(send_at_raw)
         log.info(
-            "broadcast: parsed message_len=%s image_upload=%s image_url=%s send_vk=%s send_tg=%s",
+            "broadcast: parsed message_len=%s image_upload=%s image_url=%s send_vk=%s send_tg=%s send_at=%s",
             len(message_text),
             bool(image_upload),
             bool(image_url),
             send_vk,
             send_telegram,
+            send_at,
         )
 
         if not send_telegram and not send_vk:
@@ -356,81 +328,6 @@ async def api_broadcast_message(request: Request):
                 "Добавьте текст сообщения или изображение",
             )
 
-        client_id_filter: set[int] | None = None
-        if client_ids_raw is not None:
-            client_id_filter = _parse_id_list(client_ids_raw, "clientIds")
-            if client_id_filter is not None and len(client_id_filter) == 0:
-                raise HTTPException(status.HTTP_400_BAD_REQUEST, "clientIds cannot be empty")
-
-        race_client_ids: set[int] | None = None
-        if race_id_raw is not None:
-            try:
-                race_id = int(race_id_raw)
-            except (TypeError, ValueError) as exc:
-                raise HTTPException(status.HTTP_400_BAD_REQUEST, "raceId must be an integer") from exc
-            if race_id <= 0:
-                raise HTTPException(status.HTTP_400_BAD_REQUEST, "raceId must be positive")
-
-            race = race_repository.get_race(race_id)
-            if not race:
-                raise HTTPException(status.HTTP_404_NOT_FOUND, "Race not found")
-
-            registrations = race_repository.list_registrations(race_id)
-            allowed_statuses = {
-                race_repository.RACE_STATUS_APPROVED,
-                race_repository.RACE_STATUS_PENDING,
-            }
-            unpaid_only = _parse_bool(filter_race_unpaid_raw)
-            if unpaid_only:
-                allowed_statuses = {race_repository.RACE_STATUS_PENDING}
-            race_client_ids = {
-                int(reg["client_id"])
-                for reg in registrations or []
-                if reg.get("client_id") and str(reg.get("status") or "").lower() in allowed_statuses
-            }
-
-            if not race_client_ids:
-                return {"sent": 0, "message": "Не найдены участники выбранной гонки"}
-
-        if send_at is not None:
-            log.warning("Scheduled messaging not yet implemented, sending immediately")
-
-        try:
-            tg_links = client_link_repository.list_links() if send_telegram else []
-            vk_links = vk_client_link_repository.list_links() if send_vk else []
-        except Exception as exc:  # pylint: disable=broad-except
-            log.exception("Failed to fetch client links")
-            raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR, "Failed to fetch client links") from exc
-
-        if send_telegram and send_vk:
-            if not tg_links and not vk_links:
-                return {"sent": 0, "message": "Нет подключённых пользователей"}
-        elif send_telegram and not tg_links:
-            return {"sent": 0, "message": "Нет подключённых пользователей"}
-        elif send_vk and not vk_links:
-            return {"sent": 0, "message": "Нет подключённых VK-пользователей"}
-
-        normalized_gender = None
-        if filter_gender_raw is not None:
-            if isinstance(filter_gender_raw, (list, tuple)):
-                candidate = filter_gender_raw[0]
-            else:
-                candidate = filter_gender_raw
-
-            if candidate is None:
-                normalized_gender = None
-            elif not isinstance(candidate, str):
-                raise HTTPException(status.HTTP_400_BAD_REQUEST, "filterGender must be a string")
-            else:
-                normalized_gender = candidate.strip().lower()
-                if normalized_gender in {"all", "any", ""}:
-                    normalized_gender = None
-                elif normalized_gender not in {"male", "female", "unknown"}:
-                    raise HTTPException(
-                        status.HTTP_400_BAD_REQUEST,
-                        "filterGender must be one of male, female, unknown, or omitted",
-                    )
-
         parse_mode = "HTML"
         if isinstance(parse_mode_raw, str):
             normalized_mode = parse_mode_raw.strip().lower()
@@ -443,95 +340,37 @@ async def api_broadcast_message(request: Request):
                     status.HTTP_400_BAD_REQUEST,
                     "parseMode must be HTML or MarkdownV2",
                 )
-        elif _parse_bool(markdown_v2_raw):
+        elif parse_bool(markdown_v2_raw):
             parse_mode = "MarkdownV2"
 
-        inclusion_ids: set[int] | None = None
-
-        if filter_has_booking_today:
-            today_ids, _ = _collect_clients_with_bookings_on_date(date.today())
-            inclusion_ids = today_ids if inclusion_ids is None else inclusion_ids | today_ids
-
-        if filter_has_booking_tomorrow:
-            tomorrow_ids, _ = _collect_clients_with_bookings_on_date(date.today() + timedelta(days=1))
-            inclusion_ids = tomorrow_ids if inclusion_ids is None else inclusion_ids | tomorrow_ids
-
-        if filter_booking_date_raw:
-            try:
-                parsed_date = date.fromisoformat(str(filter_booking_date_raw))
-            except Exception as exc:  # pylint: disable=broad-except
-                raise HTTPException(status.HTTP_400_BAD_REQUEST, "filterBookingDate must be YYYY-MM-DD") from exc
-            date_ids, _ = _collect_clients_with_bookings_on_date(parsed_date)
-            inclusion_ids = date_ids if inclusion_ids is None else inclusion_ids | date_ids
-
-        if filter_slot_id_raw:
-            try:
-                slot_id = int(filter_slot_id_raw)
-            except (TypeError, ValueError) as exc:
-                raise HTTPException(status.HTTP_400_BAD_REQUEST, "filterSlotId must be an integer") from exc
-            slot_ids, _ = _collect_clients_with_bookings_for_slot(slot_id)
-            inclusion_ids = slot_ids if inclusion_ids is None else inclusion_ids | slot_ids
-
-        # Exclude clients who already have bookings on the selected dates
-        exclusion_ids: set[int] = set()
-        exclusion_notes: list[str] = []
-
-        if filter_no_booking_today:
-            today_ids, note = _collect_clients_without_bookings(date.today())
-            exclusion_ids.update(today_ids)
-            exclusion_notes.append(note)
-
-        if filter_no_booking_tomorrow:
-            tomorrow_ids, note = _collect_clients_without_bookings(date.today() + timedelta(days=1))
-            exclusion_ids.update(tomorrow_ids)
-            exclusion_notes.append(note)
-
-        no_recipient_reason = "Нет получателей по выбранным фильтрам"
-        if client_id_filter is not None:
-            no_recipient_reason = "Нет получателей среди выбранных клиентов"
-        elif race_client_ids is not None:
-            no_recipient_reason = "Нет получателей среди участников гонки"
-        elif inclusion_ids is not None:
-            no_recipient_reason = "Нет получателей с бронью по выбранным условиям"
-        elif exclusion_ids:
-            no_recipient_reason = "Нет получателей без броней на выбранные дни"
-
-        tg_recipients = _filter_links(
-            tg_links,
-            client_id_filter=client_id_filter,
-            race_client_ids=race_client_ids,
-            normalized_gender=normalized_gender,
-            inclusion_ids=inclusion_ids,
-            exclusion_ids=exclusion_ids,
-        ) if send_telegram else []
-        vk_recipients = _filter_links(
-            vk_links,
-            client_id_filter=client_id_filter,
-            race_client_ids=race_client_ids,
-            normalized_gender=normalized_gender,
-            inclusion_ids=inclusion_ids,
-            exclusion_ids=exclusion_ids,
-        ) if send_vk else []
-
-        total_recipients = len(tg_recipients) + len(vk_recipients)
-        if total_recipients == 0:
-            if send_vk and not send_telegram and not vk_links:
-                return {"sent": 0, "message": "Нет подключённых VK-пользователей"}
-            if send_telegram and not send_vk and not tg_links:
-                return {"sent": 0, "message": "Нет подключённых пользователей"}
-            return {"sent": 0, "message": no_recipient_reason}
+        recipients: list[tuple[str, int, int | None]] = []
+        try:
+            if send_at is None:
+                # Immediate sends resolve the audience now; scheduled ones when they fire.
+                resolution = await asyncio.to_thread(resolve_recipients, filters)
+                if not resolution.recipients:
+                    return {"sent": 0, "message": resolution.empty_reason}
+                recipients = resolution.recipients
+            else:
+                await asyncio.to_thread(check_filter_targets, filters)
+        except RecipientFilterError as exc:
+            raise _filter_error(exc) from exc
+        except Exception as exc:  # pylint: disable=broad-except
+            log.exception("Failed to fetch client links")
+            raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR, "Failed to fetch client links") from exc
 
         bot_token = settings.krutilkavn_bot_token
         if send_telegram and not bot_token:
             raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR, "KRUTILKAVN_BOT_TOKEN not configured")
 
-        image_bytes: bytes | None = None
-        image_filename = "image.jpg"
+        if send_vk and not settings.vk_community_key:
+            raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR, "VK_API_COMMUNITY_KEY not configured")
+
+        image_path: str | None = None
+        image_hash = _image_hash(image_url=image_url) if image_url else None
         if image_upload is not None:
             try:
                 image_bytes = await image_upload.read()
-                if image_upload.filename:
-                    image_filename = image_upload.filename
                 if not image_bytes:
                     raise HTTPException(status.HTTP_400_BAD_REQUEST, "Uploaded image is empty")
             except Exception as exc:  # pylint: disable=broad-except
@@ -539,276 +378,54 @@ async def api_broadcast_message(request: Request):
                 raise HTTPException(status.HTTP_400_BAD_REQUEST, "Failed to read uploaded image") from exc
 
             try:
-                image_url = _store_uploaded_image(image_upload, request=request, image_bytes=image_bytes)
+                image_hash = _image_hash(image_bytes=image_bytes)
+                image_url, stored_path = _store_uploaded_image(
+                    image_upload, request=request, image_bytes=image_bytes, image_hash=image_hash
+                )
+                image_path = str(stored_path)
             except HTTPException:
                 raise
             except Exception as exc:  # pylint: disable=broad-except
                 log.exception("Failed to store uploaded image")
                 raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR, "Failed to store uploaded image") from exc
 
-        sent_tg = 0
-        failed_tg = 0
-        sent_vk = 0
-        failed_vk = 0
-        error_reasons: list[str] = []
-
-        if send_telegram:
-            for link in tg_recipients:
-                tg_user_id = link.get("tg_user_id")
-                if not tg_user_id:
-                    continue
-
-                try:
-                    import requests
-
-                    if image_bytes is not None or image_url:
-                        photo_url = f"https://api.telegram.org/bot{bot_token}/sendPhoto"
-                        caption = message_text.strip() if isinstance(message_text, str) else ""
-                        caption_allowed = bool(caption) and len(caption) <= 1024
-
-                        photo_sent = False
-                        last_status = None
-                        last_text = None
-
-                        if image_url:
-                            payload = {
-                                "chat_id": str(tg_user_id),
-                                "photo": image_url,
-                            }
-                            if caption_allowed:
-                                payload["caption"] = caption
-                                payload["parse_mode"] = parse_mode
-                            response = requests.post(photo_url, data=payload, timeout=20)
-                            last_status = response.status_code
-                            last_text = response.text
-                            if response.status_code == 200:
-                                photo_sent = True
-
-                        if not photo_sent and image_bytes is not None:
-                            files = {"photo": (image_filename or "image.jpg", image_bytes)}
-                            data = {"chat_id": str(tg_user_id)}
-                            if caption_allowed:
-                                data["caption"] = caption
-                                data["parse_mode"] = parse_mode
-                            response = requests.post(photo_url, data=data, files=files, timeout=30)
-                            last_status = response.status_code
-                            last_text = response.text
-                            if response.status_code == 200:
-                                photo_sent = True
-
-                        if not photo_sent:
-                            log.warning(
-                                "Failed to send photo to user %s: %s %s",
-                                tg_user_id,
-                                last_status,
-                                last_text,
-                            )
-                            if last_status:
-                                error_reasons.append(f"sendPhoto {last_status}: {last_text}")
-                                if int(last_status) == 403:
-                                    client_link_repository.mark_link_blocked(int(tg_user_id))
-                            failed_tg += 1
-                            continue
-
-                        sent_tg += 1
-                        client_link_repository.mark_link_active(int(tg_user_id))
-
-                        if caption and not caption_allowed:
-                            follow_data = {
-                                "chat_id": str(tg_user_id),
-                                "text": caption,
-                                "parse_mode": parse_mode,
-                                "disable_web_page_preview": True,
-                            }
-                            response = requests.post(
-                                f"https://api.telegram.org/bot{bot_token}/sendMessage", json=follow_data, timeout=10
-                            )
-                            if response.status_code != 200:
-                                log.warning(
-                                    "Failed to send caption message to user %s: %s %s",
-                                    tg_user_id,
-                                    response.status_code,
-                                    response.text,
-                                )
-                                error_reasons.append(f"caption {response.status_code}: {response.text}")
-                                if response.status_code == 403:
-                                    client_link_repository.mark_link_blocked(int(tg_user_id))
-                                failed_tg += 1
-                        continue
-
-                    url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-                    data = {
-                        "chat_id": str(tg_user_id),
-                        "text": message_text,
-                        "parse_mode": parse_mode,
-                        "disable_web_page_preview": True,
-                    }
-
-                    response = requests.post(url, json=data, timeout=10)
-
-                    if response.status_code == 200:
-                        sent_tg += 1
-                        client_link_repository.mark_link_active(int(tg_user_id))
-                    else:
-                        log.warning(
-                            "Failed to send message to user %s: %s %s",
-                            tg_user_id,
-                            response.status_code,
-                            response.text,
-                        )
-                        error_reasons.append(f"sendMessage {response.status_code}: {response.text}")
-                        if response.status_code == 403:
-                            client_link_repository.mark_link_blocked(int(tg_user_id))
-                        failed_tg += 1
-
-                except Exception as exc:
-                    log.exception("Failed to send message to user %s", tg_user_id)
-                    error_reasons.append(str(exc))
-                    failed_tg += 1
-
-        if send_vk:
-            vk_token = settings.vk_community_key
-            vk_version = settings.vk_api_version or "5.199"
-            if not vk_token:
-                raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR, "VK_API_COMMUNITY_KEY not configured")
-
-            import requests
-
-            vk_attachment: str | None = None
-            vk_upload_bytes = image_bytes
-            vk_upload_name = image_filename
-
-            if vk_upload_bytes is None and image_url:
-                try:
-                    response = requests.get(image_url, timeout=15)
-                    if response.status_code == 200:
-                        vk_upload_bytes = response.content
-                        candidate_name = Path(image_url).name
-                        if candidate_name:
-                            vk_upload_name = candidate_name
-                    else:
-                        log.warning("Failed to download image for VK, status %s", response.status_code)
-                except Exception:
-                    log.exception("Failed to download image for VK")
-                    vk_upload_bytes = None
-
-            if vk_upload_bytes:
-                try:
-                    upload_server = requests.get(
-                        "https://api.vk.com/method/photos.getMessagesUploadServer",
-                        params={"access_token": vk_token, "v": vk_version},
-                        timeout=10,
-                    ).json()
-                    upload_url = (upload_server.get("response") or {}).get("upload_url")
-                    if upload_url:
-                        upload_response = requests.post(
-                            upload_url,
-                            files={"photo": (vk_upload_name or "image.jpg", vk_upload_bytes)},
-                            timeout=30,
-                        ).json()
-                        saved = requests.post(
-                            "https://api.vk.com/method/photos.saveMessagesPhoto",
-                            data={
-                                "access_token": vk_token,
-                                "v": vk_version,
-                                "photo": upload_response.get("photo"),
-                                "server": upload_response.get("server"),
-                                "hash": upload_response.get("hash"),
-                            },
-                            timeout=10,
-                        ).json()
-                        items = saved.get("response") or []
-                        if items:
-                            item = items[0]
-                            owner_id = item.get("owner_id")
-                            media_id = item.get("id")
-                            access_key = item.get("access_key")
-                            if owner_id and media_id:
-                                vk_attachment = f"photo{owner_id}_{media_id}"
-                                if access_key:
-                                    vk_attachment = f"{vk_attachment}_{access_key}"
-                    if not vk_attachment:
-                        log.warning("VK photo upload failed, falling back to URL/text")
-                except Exception:
-                    log.exception("Failed to upload image to VK, sending without attachment")
-
-            for link in vk_recipients:
-                vk_user_id = link.get("vk_user_id")
-                if not vk_user_id:
-                    continue
-
-                message_for_vk = message_text.strip() if isinstance(message_text, str) else ""
-                if vk_attachment is None and image_url and image_url not in message_for_vk:
-                    message_for_vk = f"{message_for_vk}\n\n{image_url}".strip()
-                if not message_for_vk and vk_attachment is None:
-                    message_for_vk = image_url or ""
-
-                payload = {
-                    "access_token": vk_token,
-                    "v": vk_version,
-                    "user_id": int(vk_user_id),
-                    "random_id": uuid4().int & 0x7FFFFFFF,
-                }
-                if message_for_vk:
-                    payload["message"] = message_for_vk
-                if vk_attachment:
-                    payload["attachment"] = vk_attachment
-
-                try:
-                    response = requests.post("https://api.vk.com/method/messages.send", data=payload, timeout=15)
-                    status_ok = False
-                    error_msg = None
-                    error_code = None
-
-                    try:
-                        response_json = response.json()
-                    except Exception:
-                        response_json = {}
-
-                    if response.status_code == 200 and not response_json.get("error"):
-                        status_ok = True
-                    else:
-                        error = response_json.get("error") or {}
-                        error_code = error.get("error_code") or response.status_code
-                        error_msg = error.get("error_msg") or response.text
-
-                    if status_ok:
-                        sent_vk += 1
-                    else:
-                        failed_vk += 1
-                        error_reasons.append(f"vk {error_code}: {error_msg}")
-                        log.warning(
-                            "Failed to send VK message to user %s: %s %s",
-                            vk_user_id,
-                            error_code,
-                            error_msg,
-                        )
-                except Exception as exc:
-                    failed_vk += 1
-                    error_reasons.append(str(exc))
-                    log.exception("Failed to send VK message to user %s", vk_user_id)
-
-        sent_total = sent_tg + sent_vk
-        failed_total = failed_tg + failed_vk
-        detail_message = f"Отправлено {sent_total} из {total_recipients} пользователей, ошибок: {failed_total}"
-        channel_details: list[str] = []
-        if send_telegram:
-            channel_details.append(f"TG {sent_tg}/{len(tg_recipients)}")
-        if send_vk:
-            channel_details.append(f"VK {sent_vk}/{len(vk_recipients)}")
-        if channel_details:
-            detail_message += f" ({', '.join(channel_details)})"
-        if error_reasons:
-            detail_message += f". Пример ошибки: {error_reasons[0][:240]}"
+        def _enqueue() -> tuple[dict, int]:
+            job = broadcast_repository.create_job(
+                message_text=message_text,
+                parse_mode=parse_mode,
+                image_url=image_url or None,
+                image_path=image_path,
+                image_hash=image_hash,
+                options={"filters": filters.to_options()} if send_at is not None else None,
+                send_at=send_at,
+            )
+            if send_at is not None:
+                return job, 0
+            return job, broadcast_repository.enqueue_recipients(job["id"], recipients)
+
+        try:
+            job, queued = await asyncio.to_thread(_enqueue)
+        except Exception as exc:  # pylint: disable=broad-except
+            log.exception("Failed to enqueue broadcast")
+            raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR, "Failed to enqueue broadcast") from exc
+
+        if send_at is not None:
+            log.info("broadcast: scheduled job %s for %s", job["id"], send_at.isoformat())
+            return _serialize_broadcast_progress({**job, "counts": {}, "errors": []})
+
+        # Delivery happens in the scheduler service, the only process sending broadcasts.
+        log.info("broadcast: queued job %s for %s recipients", job["id"], queued)
 
         return {
-            "sent": sent_total,
-            "failed": failed_total,
-            "total": total_recipients,
-            "sentTelegram": sent_tg,
-            "sentVk": sent_vk,
-            "message": detail_message,
-            "errors": error_reasons[:5],
+            "jobId": job["id"],
+            "status": job.get("status"),
+            "sent": 0,
+            "failed": 0,
+            "total": queued,
+            "sentTelegram": 0,
+            "sentVk": 0,
+            "message": f"Рассылка поставлена в очередь: {queued} получателей",
+            "errors": [],
         }
 
     except HTTPException:
@@ -818,6 +435,38 @@ async def api_broadcast_message(request: Request):
         raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR, "Failed to broadcast message") from exc
 
 
+@router.post("/broadcast/preview")
+async def api_broadcast_preview(request: Request):
+    """Return how many messages a broadcast with these filters would send right now."""
+
+    payload, _ = await _parse_broadcast_payload(request)
+    settings = get_settings()
+    try:
+        filters = RecipientFilters.from_request(payload, default_send_vk=bool(settings.vk_community_key))
+        counts = await asyncio.to_thread(preview_recipient_count, filters)
+    except RecipientFilterError as exc:
+        raise _filter_error(exc) from exc
+    except Exception as exc:  # pylint: disable=broad-except
+        log.exception("Failed to preview broadcast recipients")
+        raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR, "Failed to preview recipients") from exc
+
+    return {
+        "total": sum(counts.values()),
+        "telegram": counts.get(broadcast_repository.CHANNEL_TELEGRAM, 0),
+        "vk": counts.get(broadcast_repository.CHANNEL_VK, 0),
+    }
+
+
+@router.get("/broadcast/{job_id}")
+def api_broadcast_progress(job_id: int):
+    """Return live delivery progress of a broadcast job."""
+
+    job = broadcast_repository.get_job_progress(job_id)
+    if not job:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Broadcast job not found")
+    return _serialize_broadcast_progress(job)
+
+
 @router.get("")
 def api_list_messages(page: int = 1, page_size: int = 50):
     """Return paginated list of user messages."""
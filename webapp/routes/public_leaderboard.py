@@ -10,6 +10,7 @@ from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
 
 from repositories import schedule_repository
+from repositories.activity_analytics_repository import POWER_LEADERBOARD_METRICS
 
 
 log = logging.getLogger(__name__)
@@ -20,6 +21,15 @@ templates = Jinja2Templates(directory=str(TEMPLATES_DIR))
 
 router = APIRouter()
 
+LEADERBOARD_TABS: List[Tuple[str, str]] = [
+    ("distance", "Километры"),
+    ("wkg5", "5 мин, Вт/кг"),
+    ("wkg20", "20 мин, Вт/кг"),
+    ("kj", "Работа, кДж"),
+    ("tss_month", "TSS за месяц"),
+    ("longest", "Самая длинная"),
+]
+
 
 def _decorate_leaderboard_items(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     decorated: List[Dict[str, Any]] = []
@@ -50,6 +60,36 @@ def _decorate_leaderboard_items(items: List[Dict[str, Any]]) -> List[Dict[str, A
     return decorated
 
 
+def _format_metric(metric: str, value: float) -> str:
+    if metric in ("wkg5", "wkg20"):
+        return f"{value:.2f} Вт/кг"
+    if metric == "longest":
+        minutes = int(round(value))
+        return f"{minutes // 60}:{minutes % 60:02d} ч"
+    unit = POWER_LEADERBOARD_METRICS[metric][1]
+    return f"{value:,.0f}".replace(",", " ") + f" {unit}"
+
+
+def _decorate_power_items(items: List[Dict[str, Any]], metric: str) -> List[Dict[str, Any]]:
+    decorated = _decorate_leaderboard_items(items)
+    for item in decorated:
+        item["metric_label"] = _format_metric(metric, float(item.get("metric_value") or 0))
+        watts = item.get("metric_watts")
+        item["metric_extra_label"] = f"{watts} Вт" if watts else "—"
+    return decorated
+
+
+def _build_power_summary(summary_raw: Dict[str, Any]) -> Dict[str, Any]:
+    total_kj = float(summary_raw.get("total_kj") or 0)
+    return {
+        "athletes": int(summary_raw.get("athletes") or 0),
+        "rides_analyzed": int(summary_raw.get("rides_analyzed") or 0),
+        "total_kj_label": f"{total_kj:,.0f}".replace(",", " "),
+        "metric_title": summary_raw.get("metric_title"),
+        "month": summary_raw.get("month"),
+    }
+
+
 def _build_summary(summary_raw: Dict[str, Any]) -> Dict[str, Any]:
     total_distance_value = float(summary_raw.get("total_distance_km") or summary_raw.get("total_distance") or 0)
     total_elevation_value = float(summary_raw.get("total_elevation_m") or summary_raw.get("total_elevation") or 0)
@@ -64,12 +104,16 @@ def _build_summary(summary_raw: Dict[str, Any]) -> Dict[str, Any]:
 
 
 def _clean_sort_params(request: Request) -> Tuple[str, str]:
-    return "distance", "desc"
+    sort_by = (request.query_params.get("sort") or "distance").lower()
+    if sort_by not in dict(LEADERBOARD_TABS):
+        sort_by = "distance"
+    return sort_by, "desc"
 
 
 @router.get("/leaderboard", response_class=HTMLResponse)
 def public_leaderboard_page(request: Request, limit: int = 100):
     sort_by, sort_dir = _clean_sort_params(request)
+    power_mode = sort_by in POWER_LEADERBOARD_METRICS
 
     try:
         data = schedule_repository.get_distance_leaderboard(limit=limit, sort_by=sort_by, direction=sort_dir)
@@ -88,14 +132,21 @@ def public_leaderboard_page(request: Request, limit: int = 100):
                     "rides_with_distance": 0,
                 },
                 "error_message": "Не удалось загрузить лидерборд. Попробуйте обновить страницу позже.",
+                "tabs": LEADERBOARD_TABS,
+                "sort_by": sort_by,
+                "power_mode": False,
             },
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
         )
         response.headers["Cache-Control"] = "no-store"
         return response
 
-    decorated_items = _decorate_leaderboard_items(items)
-    summary_payload = _build_summary(summary_raw)
+    if power_mode:
+        decorated_items = _decorate_power_items(items, sort_by)
+        summary_payload = _build_power_summary(summary_raw)
+    else:
+        decorated_items = _decorate_leaderboard_items(items)
+        summary_payload = _build_summary(summary_raw)
 
     top_entry = decorated_items[0] if decorated_items else None
     context = {
@@ -106,6 +157,8 @@ def public_leaderboard_page(request: Request, limit: int = 100):
         "error_message": None,
         "sort_by": sort_by,
         "sort_dir": sort_dir,
+        "tabs": LEADERBOARD_TABS,
+        "power_mode": power_mode,
     }
 
     response = templates.TemplateResponse("public_leaderboard.html", context)
@@ -4,10 +4,12 @@ import json
 import logging
 import os
 import re
+import tempfile
 import threading
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Dict, List, Optional, Sequence
+from typing import Dict, Iterator, List, Optional, Sequence
 
 from fastapi import APIRouter, Body, Depends, File, HTTPException, UploadFile, status
 from zoneinfo import ZoneInfo
@@ -20,8 +22,17 @@ from scheduler.notifier_client import (  # type: ignore
     format_strava_activity_description,
 )
 from wattattack_activities import WattAttackClient, DEFAULT_BASE_URL
-from repositories import client_link_repository, schedule_repository, client_repository, intervals_link_repository
+from repositories import (
+    activity_analytics_repository,
+    client_link_repository,
+    client_repository,
+    fit_archive_repository,
+    intervals_link_repository,
+    schedule_repository,
+)
 from scheduler import intervals_sync
+from scheduler.activity_analytics import ingest_activity_fit
+from scheduler.reservation_index import ReservationMatcher
 from straver_client import StraverClient
 from ..dependencies import require_admin
 
@@ -228,11 +239,14 @@ class IntervalsBackfillState:
 INTERVALS_STATE = IntervalsBackfillState()
 
 
-def _fit_storage_path(account_id: str, activity_id: str) -> Path:
-    base = schedule_repository.ensure_fit_files_dir()
-    dest = base / account_id
-    dest.mkdir(parents=True, exist_ok=True)
-    return dest / f"{activity_id}.fit"
+def _download_fit_to_archive(
+    client: WattAttackClient, fit_id: str, account_id: str, activity_id: str, timeout: float
+) -> None:
+    """Download a FIT file from WattAttack straight into the compressed archive."""
+    with tempfile.TemporaryDirectory(prefix="fit-") as tmp_dir:
+        dest_file = Path(tmp_dir) / f"{activity_id}.fit"
+        client.download_fit_file(str(fit_id), dest_file, timeout=timeout)
+        fit_archive_repository.store_fit_file(account_id, activity_id, dest_file)
 
 
 def _normalize_account_id_value(raw: Optional[str]) -> Optional[str]:
@@ -479,6 +493,7 @@ def _import_legacy_payload(payload: Dict | List[Dict]) -> Dict[str, object]:
     log_lines: List[str] = []
     max_log = 400
     created_reservations = 0
+    reservation_matcher = ReservationMatcher()
 
     for message in items:
         if isinstance(payload, list):
@@ -500,7 +515,7 @@ def _import_legacy_payload(payload: Dict | List[Dict]) -> Dict[str, object]:
         match_row = None
         if start_time and athlete_name:
             try:
-                match_row = schedule_repository.find_reservation_by_client_name(
+                match_row = reservation_matcher.find_reservation_by_client_name(
                     start_time,
                     athlete_name,
                     statuses=("booked", "legacy", "pending", "waitlist"),
@@ -519,6 +534,7 @@ def _import_legacy_payload(payload: Dict | List[Dict]) -> Dict[str, object]:
             else:
                 # Create synthetic slot/reservation so запись попала в расписание
                 reservation = _ensure_legacy_slot(start_time, athlete_name, scheduled_name)
+                reservation_matcher.forget(start_time.date())
                 if reservation and athlete_name:
                     try:
                         matches = client_repository.search_clients(athlete_name, limit=10)
@@ -593,6 +609,7 @@ def _normalize_seen_activity_accounts() -> Dict[str, object]:
     """Rename legacy account_ids in seen_activity_ids and move FIT files."""
 
     schedule_repository.ensure_activity_ids_table()
+    activity_analytics_repository.ensure_table()
     with schedule_repository.db_connection() as conn, schedule_repository.dict_cursor(conn) as cur:
         cur.execute(
             """
@@ -672,13 +689,21 @@ def _normalize_seen_activity_accounts() -> Dict[str, object]:
                 )
                 cur.execute("DELETE FROM seen_activity_ids WHERE account_id = %s", (old_id,))
                 migrated += cur.rowcount
+                # Same transaction: analytics rows only count while they join seen_activity_ids
+                activity_analytics_repository.rename_account(cur, old_id, new_id)
                 conn.commit()
         except Exception as exc:  # noqa: BLE001
             log.exception("Failed to migrate account_id %s -> %s", old_id, new_id)
             errors.append(f"{old_id}: {exc}")
             continue
 
-        # Move FIT files on disk
+        # Archived FIT objects are content-addressed; only their index moves
+        try:
+            moved_files += fit_archive_repository.rename_account(old_id, new_id)
+        except Exception as exc:  # noqa: BLE001
+            log.warning("Failed to move archived FIT index %s -> %s (%s)", old_id, new_id, exc)
+
+        # Move legacy (not yet migrated) FIT files on disk
         base_dir = schedule_repository.ensure_fit_files_dir()
         src_dir = base_dir / old_id
         dst_dir = base_dir / new_id
@@ -720,6 +745,7 @@ def _process_accounts(accounts_path: Path, timeout: float) -> None:
         return
 
     SYNC_STATE.start(len(accounts))
+    reservation_matcher = ReservationMatcher()
 
     for account_id, account in accounts.items():
         SYNC_STATE.current_account = account_id
@@ -775,7 +801,7 @@ def _process_accounts(accounts_path: Path, timeout: float) -> None:
             )
 
             start_dt = parse_activity_start_dt(activity)
-            scheduled_match = resolve_scheduled_client(account, activity)
+            scheduled_match = resolve_scheduled_client(account, activity, matcher=reservation_matcher)
             scheduled_client_id: Optional[int] = None
             scheduled_name: Optional[str] = None
             if scheduled_match:
@@ -783,16 +809,18 @@ def _process_accounts(accounts_path: Path, timeout: float) -> None:
                 scheduled_name = scheduled_match.get("client_name")
 
             fit_path: Optional[str] = None
+            fit_downloaded = False
             fit_id = activity.get("fitFileId")
             if fit_id:
-                dest_file = _fit_storage_path(account_id, activity_id)
-                if not dest_file.exists():
+                stored = fit_archive_repository.has_fit(account_id, activity_id)
+                if not stored:
                     try:
-                        client.download_fit_file(str(fit_id), dest_file, timeout=timeout)
+                        _download_fit_to_archive(client, str(fit_id), account_id, activity_id, timeout)
                         SYNC_STATE.fit_downloaded += 1
+                        stored = fit_downloaded = True
                     except Exception:
-                        dest_file.unlink(missing_ok=True)
-                if dest_file.exists():
+                        log.warning("Failed to archive FIT %s for %s/%s", fit_id, account_id, activity_id)
+                if stored:
                     fit_path = f"/fitfiles/{account_id}/{activity_id}.fit"
 
             stored = schedule_repository.record_seen_activity_id(
@@ -810,6 +838,12 @@ def _process_accounts(accounts_path: Path, timeout: float) -> None:
                 average_heartrate=activity.get("averageHeartrate"),
                 fit_path=fit_path,
             )
+            if fit_downloaded:
+                ingest_activity_fit(
+                    account_id,
+                    activity_id,
+                    schedule_repository.get_activity_client_id(account_id, activity_id) or scheduled_client_id,
+                )
             if stored:
                 account_updated += 1
                 SYNC_STATE.updated += 1
@@ -825,27 +859,29 @@ def _process_accounts(accounts_path: Path, timeout: float) -> None:
     SYNC_STATE.finish()
 
 
-def _resolve_fit_file_path(activity_row: dict) -> Optional[Path]:
-    """Return a local path to the archived FIT file if it exists."""
-    base_dir = schedule_repository.ensure_fit_files_dir()
-    candidates: List[Path] = []
-
-    raw_fit_path = activity_row.get("fit_path")
-    if isinstance(raw_fit_path, str) and raw_fit_path:
-        trimmed = raw_fit_path.lstrip("/")
-        if trimmed.startswith("fitfiles/"):
-            trimmed = trimmed[len("fitfiles/") :]
-        candidates.append(base_dir / trimmed)
+def _fit_key(activity_row: dict) -> Optional[tuple[str, str]]:
     account_id = activity_row.get("account_id")
     activity_id = activity_row.get("activity_id")
-    if account_id and activity_id:
-        candidates.append(base_dir / str(account_id) / f"{activity_id}.fit")
+    if not account_id or not activity_id:
+        return None
+    return str(account_id), str(activity_id)
 
-    for candidate in candidates:
-        path = candidate.with_suffix(".fit") if not candidate.suffix else candidate
-        if path.exists():
-            return path
-    return None
+
+def _has_fit_file(activity_row: dict) -> bool:
+    """Return True when the activity's FIT file is in the archive."""
+    key = _fit_key(activity_row)
+    return bool(key) and fit_archive_repository.has_fit(*key)
+
+
+@contextmanager
+def _materialized_fit(activity_row: dict) -> Iterator[Optional[Path]]:
+    """Yield a temporary plain copy of the archived FIT file, or ``None``."""
+    key = _fit_key(activity_row)
+    if not key:
+        yield None
+        return
+    with fit_archive_repository.materialized_fit(*key) as path:
+        yield path
 
 
 def _build_strava_payload(activity_row: dict) -> tuple[str, str]:
@@ -932,41 +968,41 @@ def _backfill_strava(tg_user_ids: Sequence[int], max_per_user: int) -> None:
         STRAVA_STATE.append_log(f"{tg_user_id}: найдено {len(activities)} активностей для загрузки")
 
         for activity in activities:
-            file_path = _resolve_fit_file_path(activity)
-            if not file_path:
-                STRAVA_STATE.append_log(
-                    f"{tg_user_id}: {activity.get('activity_id')} — нет FIT-файла, пропускаем"
-                )
-                skipped += 1
-                STRAVA_STATE.skipped += 1
-                continue
+            with _materialized_fit(activity) as file_path:
+                if not file_path:
+                    STRAVA_STATE.append_log(
+                        f"{tg_user_id}: {activity.get('activity_id')} — нет FIT-файла, пропускаем"
+                    )
+                    skipped += 1
+                    STRAVA_STATE.skipped += 1
+                    continue
 
-            upload_name, description = _build_strava_payload(activity)
-            try:
-                straver.upload_activity(
-                    tg_user_id=int(tg_user_id),
-                    file_path=file_path,
-                    name=upload_name,
-                    description=description,
-                )
-                account_id = activity.get("account_id")
-                activity_id = activity.get("activity_id")
-                if account_id and activity_id:
-                    schedule_repository.record_seen_activity_id(
-                        str(account_id),
-                        str(activity_id),
-                        sent_strava=True,
+                upload_name, description = _build_strava_payload(activity)
+                try:
+                    straver.upload_activity(
+                        tg_user_id=int(tg_user_id),
+                        file_path=file_path,
+                        name=upload_name,
+                        description=description,
                     )
-                uploaded += 1
-                STRAVA_STATE.uploaded += 1
-                STRAVA_STATE.append_log(f"{tg_user_id}: загружено {activity.get('activity_id')}")
-            except Exception as exc:  # noqa: BLE001
-                log.exception("Failed to upload activity %s for user %s", activity.get("activity_id"), tg_user_id)
-                STRAVA_STATE.append_log(
-                    f"{tg_user_id}: ошибка загрузки {activity.get('activity_id')} ({exc})"
-                )
-                skipped += 1
-                STRAVA_STATE.skipped += 1
+                    account_id = activity.get("account_id")
+                    activity_id = activity.get("activity_id")
+                    if account_id and activity_id:
+                        schedule_repository.record_seen_activity_id(
+                            str(account_id),
+                            str(activity_id),
+                            sent_strava=True,
+                        )
+                    uploaded += 1
+                    STRAVA_STATE.uploaded += 1
+                    STRAVA_STATE.append_log(f"{tg_user_id}: загружено {activity.get('activity_id')}")
+                except Exception as exc:  # noqa: BLE001
+                    log.exception("Failed to upload activity %s for user %s", activity.get("activity_id"), tg_user_id)
+                    STRAVA_STATE.append_log(
+                        f"{tg_user_id}: ошибка загрузки {activity.get('activity_id')} ({exc})"
+                    )
+                    skipped += 1
+                    STRAVA_STATE.skipped += 1
 
         STRAVA_STATE.summary[summary_key] = {
             "pending": len(activities),
@@ -1018,43 +1054,43 @@ def _backfill_intervals(tg_user_ids: Sequence[int], max_per_user: int) -> None:
         INTERVALS_STATE.append_log(f"{tg_user_id}: найдено {len(activities)} активностей для загрузки")
 
         for activity in activities:
-            file_path = _resolve_fit_file_path(activity)
-            if not file_path:
-                INTERVALS_STATE.append_log(
-                    f"{tg_user_id}: {activity.get('activity_id')} — нет FIT-файла, пропускаем"
-                )
-                skipped += 1
-                INTERVALS_STATE.skipped += 1
-                continue
+            with _materialized_fit(activity) as file_path:
+                if not file_path:
+                    INTERVALS_STATE.append_log(
+                        f"{tg_user_id}: {activity.get('activity_id')} — нет FIT-файла, пропускаем"
+                    )
+                    skipped += 1
+                    INTERVALS_STATE.skipped += 1
+                    continue
 
-            upload_name, description = _build_strava_payload(activity)
-            try:
-                intervals_sync.upload_activity(
-                    tg_user_id=int(tg_user_id),
-                    temp_file=file_path,
-                    description=description,
-                    activity_id=activity.get("activity_id"),
-                    timeout=STRAVER_HTTP_TIMEOUT,
-                    activity_name=upload_name,
-                )
-                account_id = activity.get("account_id")
-                activity_id = activity.get("activity_id")
-                if account_id and activity_id:
-                    schedule_repository.record_seen_activity_id(
-                        str(account_id),
-                        str(activity_id),
-                        sent_intervals=True,
+                upload_name, description = _build_strava_payload(activity)
+                try:
+                    intervals_sync.upload_activity(
+                        tg_user_id=int(tg_user_id),
+                        temp_file=file_path,
+                        description=description,
+                        activity_id=activity.get("activity_id"),
+                        timeout=STRAVER_HTTP_TIMEOUT,
+                        activity_name=upload_name,
                     )
-                uploaded += 1
-                INTERVALS_STATE.uploaded += 1
-                INTERVALS_STATE.append_log(f"{tg_user_id}: загружено {activity.get('activity_id')}")
-            except Exception as exc:  # noqa: BLE001
-                log.exception("Failed to upload activity %s for user %s to Intervals", activity.get("activity_id"), tg_user_id)
-                INTERVALS_STATE.append_log(
-                    f"{tg_user_id}: ошибка загрузки {activity.get('activity_id')} ({exc})"
-                )
-                skipped += 1
-                INTERVALS_STATE.skipped += 1
+                    account_id = activity.get("account_id")
+                    activity_id = activity.get("activity_id")
+                    if account_id and activity_id:
+                        schedule_repository.record_seen_activity_id(
+                            str(account_id),
+                            str(activity_id),
+                            sent_intervals=True,
+                        )
+                    uploaded += 1
+                    INTERVALS_STATE.uploaded += 1
+                    INTERVALS_STATE.append_log(f"{tg_user_id}: загружено {activity.get('activity_id')}")
+                except Exception as exc:  # noqa: BLE001
+                    log.exception("Failed to upload activity %s for user %s to Intervals", activity.get("activity_id"), tg_user_id)
+                    INTERVALS_STATE.append_log(
+                        f"{tg_user_id}: ошибка загрузки {activity.get('activity_id')} ({exc})"
+                    )
+                    skipped += 1
+                    INTERVALS_STATE.skipped += 1
 
         INTERVALS_STATE.summary[summary_key] = {
             "pending": len(activities),